@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""
+Stream bytes and encode / decode time of the ``bank_account`` records, NDJSON
+versus the Avro binary encoding of :mod:`kds_example.schema_registry`, with
+and without the gzip compression of :mod:`kds_example.codec`. The binary
+decoder is pure python unless ``fastavro`` is installed.
+
+Usage::
+
+    python benchmark/bench_binary_encoding.py
+"""
+
+import json
+import time
+
+from kds_example import avro, codec
+from kds_example.schema_registry import get_default_registry, loads
+from kds_example.load_test.corpus import faker_record_maker
+
+n_records = 20000
+make_record = faker_record_maker(seed=0)
+records = [make_record() for _ in range(n_records)]
+for i, record in enumerate(records):
+    record["balance"] = i
+
+schema = get_default_registry().get("bank_account")
+print(f"schema {schema.name} v{schema.version}, fastavro: {avro.fastavro is not None}\n")
+
+
+def dumps_json(record: dict) -> bytes:
+    return (json.dumps(record) + "\n").encode("utf-8")
+
+
+def run(name: str, dumps):
+    st = time.perf_counter()
+    payloads = [dumps(record) for record in records]
+    encode_seconds = time.perf_counter() - st
+    st = time.perf_counter()
+    decoded = [loads(codec.decompress(payload)) for payload in payloads]
+    decode_seconds = time.perf_counter() - st
+    assert decoded == records
+    size = sum(len(payload) for payload in payloads)
+    return name, size, encode_seconds, decode_seconds
+
+
+results = [
+    run("json", dumps_json),
+    run("binary", schema.encode),
+    run("json + gzip", lambda record: codec.compress(dumps_json(record))),
+    run("binary + gzip", lambda record: codec.compress(schema.encode(record))),
+]
+json_size = results[0][1]
+for name, size, encode_seconds, decode_seconds in results:
+    print(
+        f"{name:<14} {size / n_records:>6.1f} bytes / record ({(1 - size / json_size) * 100:>5.1f} % less), "
+        f"encode {encode_seconds / n_records * 1000000:>5.1f} us, "
+        f"decode {decode_seconds / n_records * 1000000:>5.1f} us"
+    )
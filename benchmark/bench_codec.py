@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compression ratio versus CPU of the record codecs on the ``bank_account``
+records, per record and for micro-batches of :func:`kds_example.codec.pack_records`.
+Also shows the kinesis PUT payload units (25 KB) and the shard write
+bandwidth (1 MiB/s) the encoded records take per 10,000 records.
+
+Usage::
+
+    python benchmark/bench_codec.py
+"""
+
+import json
+import math
+import time
+
+from kds_example import codec
+from kds_example.load_test.corpus import faker_record_maker
+
+n_records = 10000
+make_record = faker_record_maker(seed=0)
+lines = [(json.dumps(make_record()) + "\n").encode("utf-8") for _ in range(n_records)]
+raw_size = sum(len(line) for line in lines)
+
+codecs = [codec.GZIP]
+if codec.zstandard is not None:
+    codecs.append(codec.ZSTD)
+else:
+    print("zstandard is not installed, skip zstd\n")
+
+
+def report(name: str, payloads, encode_seconds: float):
+    st = time.perf_counter()
+    n_decoded = sum(len(codec.unpack_records(payload)) for payload in payloads)
+    decode_seconds = time.perf_counter() - st
+    assert n_decoded == n_records
+    size = sum(len(payload) for payload in payloads)
+    units = sum(math.ceil(len(payload) / (25 * 1024)) for payload in payloads)
+    print(
+        f"{name:<28} ratio {raw_size / size:>5.2f}, "
+        f"{size / 1024 / 1024:>6.2f} MiB ({size / 1024 / 1024:>5.2f} shard-sec), "
+        f"{units:>6} PUT units, "
+        f"encode {encode_seconds / n_records * 1000000:>6.1f} us/record, "
+        f"decode {decode_seconds / n_records * 1000000:>6.1f} us/record"
+    )
+
+
+report("plain", lines, 0.0)
+for name in codecs:
+    for level in ([1, 6, 9] if name == codec.GZIP else [1, 3, 9]):
+        st = time.perf_counter()
+        payloads = [codec.compress(line, codec=name, level=level) for line in lines]
+        report(f"{name} level {level} per record", payloads, time.perf_counter() - st)
+    for batch_size in [10, 100, 500]:
+        st = time.perf_counter()
+        payloads = [
+            codec.pack_records(lines[i:i + batch_size], codec=name)
+            for i in range(0, n_records, batch_size)
+        ]
+        report(f"{name} batch of {batch_size}", payloads, time.perf_counter() - st)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compare the cost of making ``PutRecords`` entries with Faker in the send
+loop versus reading them from a pre-generated corpus.
+
+Usage::
+
+    python benchmark/bench_corpus.py
+"""
+
+import os
+import json
+import time
+import uuid
+import tempfile
+
+from faker import Faker
+from kds_example.load_test.corpus import Corpus, build_corpus
+
+n_records = 100000
+
+fake = Faker()
+st = time.perf_counter()
+for _ in range(n_records):
+    raw_record = {
+        "id": str(uuid.uuid4()),
+        "firstname": fake.first_name(),
+        "lastname": fake.last_name(),
+        "description": fake.sentence(nb_words=10),
+        "balance": 0,
+    }
+    kin_record = dict(
+        Data=(json.dumps(raw_record) + "\n").encode("utf-8"),
+        PartitionKey=raw_record["id"],
+    )
+faker_elapse = time.perf_counter() - st
+print(f"faker:  {n_records / faker_elapse:>12,.0f} records / sec")
+
+with tempfile.TemporaryDirectory() as dir_tmp:
+    path = os.path.join(dir_tmp, "corpus.ndjson")
+    st = time.perf_counter()
+    build_corpus(path, n_records)
+    print(f"build corpus of {n_records} records in {time.perf_counter() - st:.1f} sec (once)")
+
+    with Corpus(path) as corpus:
+        st = time.perf_counter()
+        for start in range(0, n_records, 100):
+            kin_records = corpus.kinesis_records(start, 100)
+        corpus_elapse = time.perf_counter() - st
+        print(f"corpus: {n_records / corpus_elapse:>12,.0f} records / sec ({faker_elapse / corpus_elapse:.0f}x)")
+
+        st = time.perf_counter()
+        for start in range(0, n_records, 100):
+            kin_records = corpus.kinesis_records(start, 100, salt="run")
+        salted_elapse = time.perf_counter() - st
+        print(f"salted: {n_records / salted_elapse:>12,.0f} records / sec ({faker_elapse / salted_elapse:.0f}x)")
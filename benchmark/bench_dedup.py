@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measure the false positive rate, memory and speed of the dedup filter used
+by the transformation lambda, per million record ids.
+
+Usage::
+
+    python benchmark/bench_dedup.py
+"""
+
+import time
+import uuid
+from kds_example.lbd.dedup import TimeWindowedBloomFilter
+
+n_ids = 1000000
+n_probes = 1000000
+
+for error_rate in [0.001, 0.0001, 0.00001]:
+    bloom = TimeWindowedBloomFilter(
+        window_seconds=3600,
+        n_generations=4,
+        capacity_per_generation=n_ids,
+        error_rate=error_rate,
+    )
+    ids = [uuid.uuid4().bytes for _ in range(n_ids)]
+    probes = [uuid.uuid4().bytes for _ in range(n_probes)]
+
+    st = time.perf_counter()
+    for key in ids:
+        bloom.add(key, now=0)
+    add_elapse = time.perf_counter() - st
+
+    st = time.perf_counter()
+    n_false_positive = sum(1 for key in probes if key in bloom)
+    probe_elapse = time.perf_counter() - st
+
+    print(
+        f"error_rate = {error_rate}: "
+        f"false positive rate = {n_false_positive / n_probes:.6f}, "
+        f"memory = {bloom.n_bytes / 1024 / 1024:.2f} MB per {n_ids} ids, "
+        f"add = {n_ids / add_elapse:.0f} ids / sec, "
+        f"lookup = {n_probes / probe_elapse:.0f} ids / sec"
+    )
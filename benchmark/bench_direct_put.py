@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compare the ``KinesisStreamAsSource`` path (producer -> data stream ->
+delivery stream) with the ``DirectPut`` path (producer -> delivery stream
+with ``PutRecordBatch``) in the local simulator: end-to-end latency from the
+producer to the S3 object, and the cost per GB of
+:func:`kds_example.capacity.ingestion_cost_per_gb`.
+
+The delivery stream reads each shard about once a second, the simulator
+polls the data stream once per simulated second, the Direct PUT producer
+flushes every second. Both paths use the same buffering hints, so the
+buffering dominates the latency, lower the hints to see the extra hop.
+
+Usage::
+
+    python benchmark/bench_direct_put.py
+"""
+
+import json
+
+from kds_example.fake_kinesis import FakeKinesisClient
+from kds_example.kds_helper import put_records_with_retries, FirehoseProducer
+from kds_example.load_test.histogram import Histogram
+from kds_example.capacity import ingestion_cost_per_gb, KINESIS_STREAM_AS_SOURCE, DIRECT_PUT
+from kds_example.object_store import InMemoryObjectStore
+from kds_example.simulator import (
+    SimClock, BufferingHints, S3Destination,
+    DeliveryStreamSimulator, PipelineSimulator, FakeFirehoseClient,
+)
+
+duration_sec = 300
+records_per_sec = 100
+
+
+class TimedObjectStore(InMemoryObjectStore):
+    """
+    Records the latency of every record of the success objects.
+    """
+
+    def __init__(self, clock: SimClock):
+        super().__init__()
+        self.clock = clock
+        self.latency_ms = Histogram()
+
+    def put_object(self, key: str, body: bytes):
+        super().put_object(key, body)
+        if "/03-success/" in key:
+            for line in body.decode("utf-8").splitlines():
+                self.latency_ms.record(int((self.clock() - json.loads(line)["produced_at"]) * 1000))
+
+
+def pass_through(event, context):
+    return {
+        "records": [
+            {"recordId": record["recordId"], "result": "Ok", "data": record["data"]}
+            for record in event["records"]
+        ]
+    }
+
+
+def make_delivery_stream(name: str, store, interval_in_sec: int) -> DeliveryStreamSimulator:
+    hints = BufferingHints(size_in_mb=5, interval_in_sec=interval_in_sec)
+    return DeliveryStreamSimulator(
+        name=name,
+        destination=S3Destination(store, f"{name}/03-success/", f"{name}/04-failed/", hints),
+        processor=pass_through,
+        processor_hints=BufferingHints(size_in_mb=3, interval_in_sec=interval_in_sec),
+    )
+
+
+def make_record(clock: SimClock, record_size: int) -> bytes:
+    record = {"produced_at": clock(), "padding": ""}
+    record["padding"] = "x" * max(0, record_size - len(json.dumps(record)) - 1)
+    return (json.dumps(record) + "\n").encode("utf-8")
+
+
+def run_kinesis_stream_as_source(interval_in_sec: int, record_size: int) -> Histogram:
+    clock = SimClock(start=1650000000)
+    store = TimedObjectStore(clock)
+    client = FakeKinesisClient(clock=clock)
+    client.create_stream(StreamName="s", ShardCount=1)
+    sim = PipelineSimulator(client, "s", [make_delivery_stream("kds", store, interval_in_sec)], clock)
+    for i in range(duration_sec):
+        put_records_with_retries(client, "s", [
+            {"Data": make_record(clock, record_size), "PartitionKey": str(j)}
+            for j in range(records_per_sec)
+        ])
+        sim.advance(1)
+    sim.drain()
+    return store.latency_ms
+
+
+def run_direct_put(interval_in_sec: int, record_size: int) -> Histogram:
+    clock = SimClock(start=1650000000)
+    store = TimedObjectStore(clock)
+    delivery_stream = make_delivery_stream("direct", store, interval_in_sec)
+    sim = PipelineSimulator(None, None, [delivery_stream], clock)
+    firehose_client = FakeFirehoseClient([delivery_stream], clock)
+    with FirehoseProducer(firehose_client, "direct", clock=clock) as producer:
+        for i in range(duration_sec):
+            producer.put_many(make_record(clock, record_size) for _ in range(records_per_sec))
+            producer.flush()
+            sim.advance(1)
+    sim.drain()
+    return store.latency_ms
+
+
+for interval_in_sec in [60, 1]:
+    for name, run in [(KINESIS_STREAM_AS_SOURCE, run_kinesis_stream_as_source), (DIRECT_PUT, run_direct_put)]:
+        latency_ms = run(interval_in_sec, 1024)
+        percentiles = latency_ms.percentiles([50, 99])
+        print(
+            f"buffer interval {interval_in_sec:>2} sec, {name:<21}: "
+            f"latency p50 {percentiles['p50'] / 1000:.1f} sec, p99 {percentiles['p99'] / 1000:.1f} sec"
+        )
+
+print()
+for record_size in [200, 1024, 5 * 1024, 20 * 1024]:
+    for target_mb_per_sec in [0.1, 1, 10]:
+        kds = ingestion_cost_per_gb(target_mb_per_sec, record_size, KINESIS_STREAM_AS_SOURCE, n_destinations=1)
+        direct = ingestion_cost_per_gb(target_mb_per_sec, record_size, DIRECT_PUT, n_destinations=1)
+        print(
+            f"{record_size:>6} bytes records, {target_mb_per_sec:>4} MB/s: cost per GB "
+            f"{KINESIS_STREAM_AS_SOURCE} ${kds['total']:.4f}, {DIRECT_PUT} ${direct['total']:.4f}"
+        )
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measure the overhead of the EMF metrics on the transformation pipeline,
+with a firehose event of 500 records.
+
+Usage::
+
+    python benchmark/bench_metrics.py
+"""
+
+import json
+import time
+import uuid
+import base64
+
+from kds_example.lbd.common import build_pipeline
+from kds_example.lbd.metrics import MetricsEmitter
+
+n_invocations = 50
+
+event = {
+    "records": [
+        {
+            "recordId": str(i),
+            "approximateArrivalTimestamp": 1650000000000,
+            "data": base64.b64encode((json.dumps({
+                "id": str(uuid.uuid4()),
+                "firstname": "Jerry",
+                "lastname": "Snyder",
+                "description": "Mrs air in wife financial within live pull artist back.",
+                "balance": 0,
+            }) + "\n").encode("utf-8")).decode("utf-8"),
+        }
+        for i in range(500)
+    ]
+}
+
+
+def transform(dct: dict) -> dict:
+    return dct
+
+
+bare = build_pipeline(transform)
+lines = list()
+instrumented = build_pipeline(transform, metrics=MetricsEmitter(
+    dimensions={"FunctionName": "to_s3"}, print_func=lines.append,
+))
+
+results = dict()
+# interleave and keep the best round, the machine may be noisy
+for _ in range(20):
+    for name, pipeline in [("bare", bare), ("instrumented", instrumented)]:
+        st = time.perf_counter()
+        for _ in range(n_invocations):
+            pipeline.handle(event)
+        elapse = (time.perf_counter() - st) / n_invocations
+        results[name] = min(results.get(name, elapse), elapse)
+
+print(f"bare:         {results['bare'] * 1000:.3f} ms / invocation")
+print(f"instrumented: {results['instrumented'] * 1000:.3f} ms / invocation")
+print(f"overhead:     {(results['instrumented'] / results['bare'] - 1):+.2%}")
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per-account query latency of the ``bank_account`` index with the default
+mapping and routing versus the routed profile of ``kds_example/schema.py``,
+on a local OpenSearch, for example::
+
+    docker run -d -p 9200:9200 -e "discovery.type=single-node" -e "DISABLE_SECURITY_PLUGIN=true" opensearchproject/opensearch:2.11.0
+    python benchmark/bench_oss_routing.py
+
+``OSS_URL`` overrides the default ``http://localhost:9200``. Documents are
+indexed without id and routing, like the delivery stream, the routed index
+gets its routing from its ingest pipeline. The ``id`` of the benchmark
+documents is the account, shared by many documents, so the routed profile
+is used without its ``id_field``.
+"""
+
+import os
+import time
+import random
+
+import attr
+
+from opensearchpy import OpenSearch, helpers
+
+from kds_example import oss_utils
+from kds_example.load_test.histogram import Histogram
+from kds_example.schema import (
+    bank_account_schema, make_index_body, MappingProfile,
+    bank_account_routed_profile, ROUTING_PIPELINE_NAME, make_final_pipeline_body,
+)
+from kds_example.tracing import TRACE_PIPELINE_NAME, trace_ingest_pipeline_body
+
+n_accounts = 2000
+docs_per_account = 50
+n_queries = 500
+number_of_shards = 24
+
+oss = OpenSearch(hosts=[os.environ.get("OSS_URL", "http://localhost:9200")])
+oss_utils.put_ingest_pipeline(oss, TRACE_PIPELINE_NAME, trace_ingest_pipeline_body)
+routed_profile = attr.evolve(bank_account_routed_profile, id_field=None)
+oss_utils.put_ingest_pipeline(oss, ROUTING_PIPELINE_NAME, make_final_pipeline_body(routed_profile))
+
+rng = random.Random(0)
+accounts = [f"account-{i:06d}" for i in range(n_accounts)]
+docs = [
+    {
+        "id": account,
+        "firstname": "Jerry",
+        "lastname": "Snyder",
+        "description": "Mrs air in wife financial within live pull artist back.",
+        "balance": rng.randint(-1000, 100000),
+    }
+    for account in accounts
+    for _ in range(docs_per_account)
+]
+rng.shuffle(docs)
+query_accounts = [rng.choice(accounts) for _ in range(n_queries)]
+
+for name, profile, routing in [
+    ("default", MappingProfile(), False),
+    ("routed", routed_profile, True),
+]:
+    index = f"bench-routing-{name}"
+    oss_utils.delete_index_if_exists(oss, index)
+    body = make_index_body(bank_account_schema, profile, number_of_shards=number_of_shards, number_of_replicas=0)
+    oss.indices.create(index=index, body=body)
+    helpers.bulk(oss, ({"_index": index, "_source": doc} for doc in docs), chunk_size=2000)
+    oss.indices.refresh(index=index)
+
+    search_ms, aggregate_ms = Histogram(), Histogram()
+    shards = None
+    for account in query_accounts:
+        st = time.perf_counter()
+        res = oss_utils.search_by_key(oss, index, "id", account, routing=routing)
+        search_ms.record(int((time.perf_counter() - st) * 1000000))
+        assert res["hits"]["total"]["value"] == docs_per_account
+        shards = res["_shards"]["total"]
+        st = time.perf_counter()
+        oss_utils.aggregate_by_key(
+            oss, index, "id", account, aggs={"balance": {"sum": {"field": "balance"}}}, routing=routing,
+        )
+        aggregate_ms.record(int((time.perf_counter() - st) * 1000000))
+
+    print(
+        f"{name:<8} {shards:>2} shards per query, "
+        f"search p50 {search_ms.percentile(50) / 1000:.2f} ms p99 {search_ms.percentile(99) / 1000:.2f} ms, "
+        f"aggregate p50 {aggregate_ms.percentile(50) / 1000:.2f} ms p99 {aggregate_ms.percentile(99) / 1000:.2f} ms"
+    )
+    oss_utils.delete_index_if_exists(oss, index)
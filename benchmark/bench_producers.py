@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compare the max send rate of thread producers versus process producers
+against the in-memory fake kinesis, where record generation and json
+encoding are the only cost. Thread producers are capped by the GIL, process
+producers should scale close to linearly with the number of cores.
+
+Usage::
+
+    python benchmark/bench_producers.py
+"""
+
+import os
+
+from kds_example.load_test.generator import LoadTestConfig, run_load_test
+from kds_example.load_test.process_pool import FakeClientFactory, run_process_load_test
+
+duration = 5
+client_factory = FakeClientFactory(stream_name="s", n_shards=1000, enforce_shard_limits=False)
+
+n_cpu = os.cpu_count()
+n_producers_list = sorted({1, 2, 4, n_cpu})
+for n_producers in n_producers_list:
+    # closed loop with a unreachable target rate, send as fast as possible
+    config = LoadTestConfig(
+        stream_name="s",
+        target_rate=10 ** 9,
+        n_producers=n_producers,
+        duration=duration,
+        records_per_request=500,
+        open_loop=False,
+        record_size_distribution="uniform",
+    )
+    thread_report = run_load_test(client_factory(), config)
+    process_report = run_process_load_test(config, client_factory)
+    print(
+        f"{n_producers} producers: "
+        f"threads = {thread_report['throughput']['records_per_sec']:>10,.0f} records / sec, "
+        f"processes = {process_report['throughput']['records_per_sec']:>10,.0f} records / sec"
+    )
+print(f"{n_cpu} cores")
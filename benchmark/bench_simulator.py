@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""
+Run records through the local pipeline simulator with the real
+transformation handlers, for several lambda buffer sizes, and show the
+processing throughput, the number of lambda invocations and S3 objects.
+
+Usage::
+
+    python benchmark/bench_simulator.py
+"""
+
+import json
+import time
+import uuid
+
+from kds_example.fake_kinesis import FakeKinesisClient
+from kds_example.object_store import InMemoryObjectStore
+from kds_example.simulator import SimClock, BufferingHints, FakeOpenSearch, build_stack_simulator
+
+n_records = 50000
+records = [
+    {
+        "id": str(uuid.uuid4()),
+        "firstname": "Jerry",
+        "lastname": "Snyder",
+        "description": "Mrs air in wife financial within live pull artist back.",
+        "balance": i,
+    }
+    for i in range(n_records)
+]
+
+for lambda_size_in_mb in [0.2, 1, 3]:
+    clock = SimClock(start=1650000000)
+    client = FakeKinesisClient(clock=clock)
+    client.create_stream(StreamName="s", ShardCount=10)
+    for i in range(0, n_records, 500):
+        client.put_records(
+            StreamName="s",
+            Records=[
+                {"Data": (json.dumps(record) + "\n").encode("utf-8"), "PartitionKey": record["id"]}
+                for record in records[i:i + 500]
+            ],
+        )
+    store = InMemoryObjectStore()
+    sim = build_stack_simulator(
+        client, "s", store, FakeOpenSearch(), clock,
+        lambda_hints=BufferingHints(size_in_mb=lambda_size_in_mb, interval_in_sec=60),
+    )
+
+    st = time.perf_counter()
+    sim.advance(300)
+    sim.drain()
+    elapse = time.perf_counter() - st
+
+    summary = sim.summary()
+    print(
+        f"lambda buffer {lambda_size_in_mb} MB: {2 * n_records / elapse:,.0f} records / sec, "
+        f"to-s3 {summary['to-s3']['invocations']} invocations "
+        f"({summary['to-s3']['processor_seconds']:.2f} sec in handler), "
+        f"to-oss {summary['to-oss']['invocations']} invocations, "
+        f"{len(store.list_keys())} S3 objects"
+    )
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compare the compiled bank_account validator with the generic interpreter of
+the same schema, and with the ``jsonschema`` package if it is installed.
+
+Usage::
+
+    python benchmark/bench_validator.py
+"""
+
+import time
+import uuid
+from kds_example.schema import bank_account_schema
+from kds_example.lbd.validator import compile_validator, interpret
+
+n_records = 200000
+
+records = [
+    {
+        "id": str(uuid.uuid4()),
+        "firstname": "Jerry",
+        "lastname": "Snyder",
+        "description": "Mrs air in wife financial within live pull artist back.",
+        "balance": i,
+    }
+    for i in range(n_records)
+]
+
+
+def timeit(name, func):
+    st = time.perf_counter()
+    for record in records:
+        func(record)
+    elapse = time.perf_counter() - st
+    print(f"{name:<12}: {n_records / elapse:>12,.0f} records / sec, {elapse / n_records * 1000000:.2f} us / record")
+
+
+validate = compile_validator(bank_account_schema)
+timeit("compiled", validate)
+timeit("interpreted", lambda record: interpret(bank_account_schema, record))
+
+try:
+    import jsonschema
+except ImportError:  # pragma: no cover
+    jsonschema = None
+
+if jsonschema is not None:
+    json_types = {
+        "keyword": "string", "text": "string", "integer": "integer", "long": "integer",
+        "float": "number", "double": "number", "boolean": "boolean", "date": "string",
+    }
+    json_schema = {
+        "type": "object",
+        "required": [name for name, field in bank_account_schema.items() if field.required],
+        "properties": {
+            name: {"type": [json_types[field.type], "null"] if field.nullable else json_types[field.type]}
+            for name, field in bank_account_schema.items()
+        },
+    }
+    validator = jsonschema.Draft7Validator(json_schema)
+    timeit("jsonschema", validator.is_valid)
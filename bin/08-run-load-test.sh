@@ -1,7 +1,23 @@
 #!/bin/bash
+# run locust load test against the kinesis data stream
+#
+# usage:
+#   bin/08-run-load-test.sh                   # single process
+#   bin/08-run-load-test.sh master 8          # master, wait for 8 workers
+#   bin/08-run-load-test.sh worker 10.0.0.1   # worker, connect to the master host
 
 dir_here="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )"
 dir_project_root="$(dirname "${dir_here}")"
 dir_load_test="${dir_project_root}/tests_load"
 
-${dir_project_root}/venv/bin/locust -f "${dir_load_test}/locustfile_slow.py" --headless --users 100 --spawn-rate 10 --stop-timeout 10
+mode="${1:-local}"
+users="${USERS:-100}"
+spawn_rate="${SPAWN_RATE:-10}"
+
+if [ "${mode}" == "master" ]; then
+    ${dir_project_root}/venv/bin/locust -f "${dir_load_test}/locustfile.py" --master --headless --users ${users} --spawn-rate ${spawn_rate} --expect-workers "${2:-1}" --stop-timeout 10
+elif [ "${mode}" == "worker" ]; then
+    ${dir_project_root}/venv/bin/locust -f "${dir_load_test}/locustfile.py" --worker --master-host "${2:-127.0.0.1}"
+else
+    ${dir_project_root}/venv/bin/locust -f "${dir_load_test}/locustfile.py" --headless --users ${users} --spawn-rate ${spawn_rate} --stop-timeout 10
+fi
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+"""
+Build the pre-generated record corpus used by the producers and the load test.
+
+Example::
+
+    python bin/s08_build_corpus.py --records 1000000 --seed 0 --path corpus.ndjson
+"""
+
+import time
+import argparse
+
+from kds_example.load_test.corpus import build_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--path", default="corpus.ndjson")
+    args = parser.parse_args()
+
+    st = time.perf_counter()
+    size = build_corpus(args.path, args.records, seed=args.seed)
+    elapse = time.perf_counter() - st
+    print(f"{args.records} records, {size / 1024 / 1024:.1f} MB written to {args.path} in {elapse:.1f} sec")
+
+
+if __name__ == "__main__":
+    main()
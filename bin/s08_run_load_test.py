@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""
+Run a load test against the kinesis data stream and write a JSON report.
+
+Examples::
+
+    # offline, against the in-memory fake kinesis with 10 shards
+    python bin/s08_run_load_test.py --fake --rate 5000 --duration 30 --report report.json
+
+    # records from a pre-generated corpus, see bin/s08_build_corpus.py
+    python bin/s08_run_load_test.py --fake --corpus corpus.ndjson --rate 5000 --duration 30
+
+    # one process per producer, for CPU bound rates
+    python bin/s08_run_load_test.py --fake --processes --producers 8 --rate 50000 --duration 30
+
+    # against the deployed stream, compared with a previous run
+    python bin/s08_run_load_test.py --rate 2500 --producers 32 --duration 600 \
+        --report report-new.json --baseline report-old.json
+"""
+
+import json
+import argparse
+
+from kds_example.load_test.generator import (
+    LoadTestConfig, run_load_test, write_report, read_report, compare_reports,
+)
+from kds_example.load_test.process_pool import (
+    FakeClientFactory, FanOutClientFactory, run_process_load_test,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=1000, help="target records / sec, all producers")
+    parser.add_argument("--producers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--records-per-request", type=int, default=100)
+    parser.add_argument("--record-size", type=int, default=180, help="mean record size in bytes")
+    parser.add_argument("--record-size-min", type=int, default=120)
+    parser.add_argument("--record-size-max", type=int, default=4096)
+    parser.add_argument("--record-size-distribution", choices=["fixed", "uniform", "lognormal"], default="fixed")
+    parser.add_argument("--closed-loop", action="store_true", help="wait for each response before pacing the next request")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--id-salt", default=None, help="mixed into the record ids, default to a new one per run")
+    parser.add_argument("--corpus", default=None, help="send records of this corpus instead of generated ones")
+    parser.add_argument("--trace-rate", type=float, default=0.0, help="ratio of records stamped with a trace")
+    parser.add_argument("--processes", action="store_true", help="run each producer in its own process")
+    parser.add_argument("--fake", action="store_true", help="run offline against the in-memory fake kinesis")
+    parser.add_argument("--fake-shards", type=int, default=10)
+    parser.add_argument("--fake-latency", type=float, default=0.02, help="seconds per fake PutRecords call")
+    parser.add_argument("--report", default="load-test-report.json")
+    parser.add_argument("--baseline", default=None, help="a previous report to compare with")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.fake:
+        stream_name = "fake-stream"
+        client_factory = FakeClientFactory(
+            stream_name=stream_name, n_shards=args.fake_shards, latency=args.fake_latency,
+        )
+    else:
+        from kds_example.iac.s2_app import stack
+
+        stream_name = stack.kinesis_data_stream_name
+        client_factory = FanOutClientFactory(fan_out=stack.fan_out)
+
+    config = LoadTestConfig(
+        stream_name=stream_name,
+        target_rate=args.rate,
+        n_producers=args.producers,
+        duration=args.duration,
+        records_per_request=args.records_per_request,
+        record_size_distribution=args.record_size_distribution,
+        record_size_mean=args.record_size,
+        record_size_min=args.record_size_min,
+        record_size_max=args.record_size_max,
+        open_loop=not args.closed_loop,
+        max_retries=args.max_retries,
+        seed=args.seed,
+        corpus_path=args.corpus,
+        trace_rate=args.trace_rate,
+    )
+    if args.id_salt is not None:
+        config.id_salt = args.id_salt
+    if args.processes:
+        report = run_process_load_test(config, client_factory)
+    else:
+        report = run_load_test(client_factory(), config)
+    write_report(report, args.report)
+
+    summary = {k: v for k, v in report.items() if k != "histograms"}
+    print(json.dumps(summary, indent=4))
+    print(f"report is written to {args.report}")
+
+    if args.baseline:
+        for name, dct in compare_reports(read_report(args.baseline), report).items():
+            change = "n/a" if dct["change"] is None else f"{dct['change']:+.1%}"
+            print(f"{name:<24} {dct['baseline']:>14} -> {dct['current']:>14} ({change})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""
+Replay the failed records of a firehose error prefix through the current
+transformation, back to the kinesis data stream or directly to OpenSearch.
+
+Examples::
+
+    # lambda failures of the S3 delivery stream, back to the data stream
+    python bin/s09_replay_failed.py --prefix to-s3/04-failed/ --target kinesis --rate 500
+
+    # OpenSearch delivery failures, indexed directly
+    python bin/s09_replay_failed.py --prefix to-oss/02-backup-failed/ --target oss
+
+A rerun with the same ``--checkpoint`` skips the objects already replayed.
+"""
+
+import json
+import argparse
+
+from kds_example.boto_ses import boto_ses
+from kds_example.config import config
+from kds_example.iac.s2_app import stack
+from kds_example.object_store import S3ObjectStore
+from kds_example.kds_helper import make_fan_out_client
+from kds_example.replay import (
+    KeyCheckpoint, KinesisSink, OpenSearchSink, ReplayEngine, make_replay_pipeline,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prefix", required=True)
+    parser.add_argument("--target", choices=["kinesis", "oss"], default="kinesis")
+    parser.add_argument("--rate", type=float, default=500, help="records / sec put back to kinesis")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--checkpoint", default="replay-checkpoint.txt")
+    args = parser.parse_args()
+
+    if args.target == "kinesis":
+        sink = KinesisSink(
+            make_fan_out_client(boto_ses.client("kinesis"), stack.fan_out),
+            stack.kinesis_data_stream_name,
+            rate=args.rate,
+        )
+    else:
+        from kds_example.oss_conn import oss
+
+        sink = OpenSearchSink(oss, config.oss_index_name)
+
+    engine = ReplayEngine(
+        store=S3ObjectStore(boto_ses.client("s3"), stack.s3_data_bucket_name),
+        pipeline=make_replay_pipeline(args.target),
+        sink=sink,
+        checkpoint=KeyCheckpoint(args.checkpoint),
+        n_workers=args.workers,
+    )
+    stats = engine.run_prefix(
+        args.prefix,
+        progress=lambda stats: print(f"{stats.objects} objects, {stats.records_written} records replayed"),
+    )
+    print(json.dumps(stats.to_dict(), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+Rebuild the ``bank_account`` alias from the ``to-oss/01-backup/`` prefix,
+into a new index the alias is moved to at the end.
+
+Example::
+
+    python bin/s10_backfill_oss.py --workers 16
+
+It prints the new index and its manifest, a rerun with
+``--resume-index {new index}`` and the same ``--manifest`` resumes,
+skipping the objects already indexed.
+"""
+
+import argparse
+
+from kds_example.boto_ses import boto_ses
+from kds_example.config import config
+from kds_example.iac.s2_app import stack
+from kds_example.oss_conn import oss
+from kds_example.oss_utils import versioned_index_name
+from kds_example.object_store import S3ObjectStore
+from kds_example.schema import bank_account_index_body
+from kds_example.backfill import BACKUP_PREFIX, backfill_to_new_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prefix", default=BACKUP_PREFIX)
+    parser.add_argument("--alias", default=config.oss_index_name)
+    parser.add_argument("--resume-index", default=None, help="the new index of an interrupted backfill")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--max-in-flight", type=int, default=None, help="objects held in memory")
+    parser.add_argument("--chunk-size", type=int, default=500, help="documents per bulk request")
+    parser.add_argument("--manifest", default=None, help="default to backfill-manifest-{new index}.txt")
+    parser.add_argument("--no-bulk-settings", action="store_true", help="keep refresh and replicas during the load")
+    parser.add_argument("--keep-old", action="store_true", help="do not delete the old indices")
+    args = parser.parse_args()
+
+    index = args.resume_index or versioned_index_name(args.alias)
+    manifest_path = args.manifest or f"backfill-manifest-{index}.txt"
+    print(f"backfill {index}, manifest {manifest_path}")
+
+    def progress(stats):
+        print(
+            f"{stats.objects} objects, {stats.records_written} docs indexed, "
+            f"{stats.records_per_sec:,.0f} docs / sec"
+        )
+
+    index, old_indices, stats, thread = backfill_to_new_index(
+        oss,
+        alias=args.alias,
+        body=bank_account_index_body,
+        store=S3ObjectStore(boto_ses.client("s3"), stack.s3_data_bucket_name),
+        prefix=args.prefix,
+        index=index,
+        manifest_path=manifest_path,
+        bulk_settings=not args.no_bulk_settings,
+        delete_old=not args.keep_old,
+        chunk_size=args.chunk_size,
+        progress=progress,
+        n_workers=args.workers,
+        max_in_flight=args.max_in_flight,
+    )
+    print(
+        f"done: {stats.records_written} docs indexed from {stats.objects} objects "
+        f"in {stats.elapsed:.1f} sec, {stats.records_per_sec:,.0f} docs / sec, "
+        f"{stats.records_still_failed} invalid, {stats.records_write_failed} failed to index"
+    )
+    print(f"{args.alias} -> {index}, removed {old_indices}")
+    if thread is not None:
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
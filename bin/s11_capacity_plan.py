@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""
+How many data streams, each with one delivery stream per destination, and
+shards per data stream a target ingestion rate needs, see ``kds_example/capacity.py``.
+
+Example::
+
+    python bin/s11_capacity_plan.py --target-mb 12 --record-size 300 --shards 10
+
+Set ``fan_out`` and ``kinesis_data_stream_shard_count`` of the ``Stack`` in
+``kds_example/iac/s2_app.py`` to the ``fan_out`` and ``n_shards_per_stream``
+of the plan.
+"""
+
+import json
+import argparse
+
+from kds_example.capacity import DeliveryStreamLimits, plan_fan_out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target-mb", type=float, required=True, help="target MB / sec")
+    parser.add_argument("--record-size", type=int, default=1024, help="average record size in bytes")
+    parser.add_argument("--shards", type=int, default=None, help="current number of shards per data stream")
+    parser.add_argument("--delivery-mb", type=float, default=5.0, help="MB / sec a delivery stream delivers")
+    parser.add_argument("--lambda-buffer-mb", type=float, default=3.0)
+    parser.add_argument("--lambda-duration", type=float, default=0.5, help="seconds to transform a full buffer")
+    parser.add_argument("--lambda-concurrency", type=int, default=1)
+    parser.add_argument("--extra-readers", type=int, default=0, help="other consumers of the data stream")
+    parser.add_argument("--headroom", type=float, default=0.8)
+    args = parser.parse_args()
+
+    plan = plan_fan_out(
+        args.target_mb,
+        record_size=args.record_size,
+        limits=DeliveryStreamLimits(
+            max_mb_per_sec=args.delivery_mb,
+            lambda_buffer_mb=args.lambda_buffer_mb,
+            lambda_duration_sec=args.lambda_duration,
+            lambda_concurrency=args.lambda_concurrency,
+        ),
+        extra_readers=args.extra_readers,
+        headroom=args.headroom,
+        n_shards=args.shards,
+    )
+    print(json.dumps(plan.to_dict(), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+Find the transformation lambda memory size and the firehose processor
+buffer size with the lowest cost per GB, see ``kds_example/power_tuning.py``.
+
+Example::
+
+    python bin/s12_power_tuning.py
+    python bin/s12_power_tuning.py --buffer-mb 0.5 1 3 --memory 256 512 1024 --cgroup /sys/fs/cgroup/kds-tuning
+
+Set ``lambda_memory_size`` and ``lambda_buffer_hint_size_in_mb`` of
+``kds_example/config.py`` to the recommendation, they are used by
+``lambda_app/update_charlice_config.py`` and the delivery streams of
+``kds_example/iac/s2_app.py``.
+"""
+
+import json
+import argparse
+
+from kds_example.power_tuning import run_power_tuning, recommend, combine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--memory", type=int, nargs="+", default=[128, 256, 512, 1024, 1769, 3008], help="memory sizes in MB")
+    parser.add_argument("--buffer-mb", type=float, nargs="+", default=[1, 2, 3], help="processor buffer sizes in MB")
+    parser.add_argument("--record-size", type=int, default=180, help="average record size in bytes")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-duration", type=float, default=5.0, help="max seconds per invocation")
+    parser.add_argument("--cgroup", default=None, help="writable cgroup v2 directory, to throttle the CPU for real")
+    parser.add_argument("--json", action="store_true", help="print all the results as json")
+    args = parser.parse_args()
+
+    from kds_example.lbd import to_s3, to_oss
+
+    handlers = {"to_s3": to_s3.handler, "to_oss": to_oss.handler}
+    results = run_power_tuning(
+        handlers,
+        memory_sizes=args.memory,
+        buffer_sizes=args.buffer_mb,
+        repeat=args.repeat,
+        record_size=args.record_size,
+        cgroup=args.cgroup,
+    )
+    if args.json:
+        print(json.dumps([result.to_dict() for result in results], indent=4))
+    else:
+        print(f"{'handler':<8} {'memory':>6} {'buffer':>6} {'duration':>9} {'$ / GB':>10}  fits")
+        for result in results:
+            print(
+                f"{result.handler_name:<8} {result.memory_mb:>6} {result.buffer_size_in_mb:>6g} "
+                f"{result.duration_seconds:>8.3f}s {result.cost_per_gb:>10.6f}  {result.fits}"
+            )
+
+    print()
+    groups = {
+        handler_name: [result for result in results if result.handler_name == handler_name]
+        for handler_name in handlers
+    }
+    # one memory size and buffer size for both functions
+    groups["all"] = combine(results)
+    for handler_name, group in groups.items():
+        best = recommend(group, max_duration_seconds=args.max_duration)
+        if best is None:
+            print(f"{handler_name}: no setting fits, lower the buffer size or raise the memory")
+        else:
+            print(
+                f"{handler_name}: lambda_memory_size = {best.memory_mb}, "
+                f"lambda_buffer_hint_size_in_mb = {best.buffer_size_in_mb:g} "
+                f"({best.duration_seconds:.3f} sec, ${best.cost_per_gb:.6f} / GB)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""
+Update the hourly balance rollup index from the new objects of the
+``to-s3/03-success/`` prefix, see ``kds_example/rollup.py``.
+
+Example::
+
+    python bin/s13_rollup.py --state rollup-state.json --manifest manifest.sqlite
+
+Run it on a schedule with the same ``--state`` and ``--manifest``, each run
+syncs the manifest and only reads the objects added since the last one.
+"""
+
+import argparse
+
+from kds_example.boto_ses import boto_ses
+from kds_example.iac.s2_app import stack
+from kds_example.oss_conn import oss
+from kds_example.object_store import S3ObjectStore
+from kds_example.manifest import ManifestIndex
+from kds_example.rollup import (
+    SUCCESS_PREFIX, ROLLUP_INDEX, rollup_index_body,
+    RollupState, RollupJob, OpenSearchRollupSink,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prefix", default=SUCCESS_PREFIX)
+    parser.add_argument("--index", default=ROLLUP_INDEX)
+    parser.add_argument("--state", default="rollup-state.json")
+    parser.add_argument("--manifest", default="manifest.sqlite", help="the ManifestIndex of the bucket")
+    parser.add_argument("--batch-size", type=int, default=100, help="objects per index write")
+    args = parser.parse_args()
+
+    if not oss.indices.exists(index=args.index):
+        oss.indices.create(index=args.index, body=rollup_index_body)
+
+    s3_client = boto_ses.client("s3")
+    manifest = ManifestIndex(args.manifest)
+    n_new = manifest.sync(s3_client, stack.s3_data_bucket_name, args.prefix)
+    print(f"manifest synced, {n_new} new objects")
+    job = RollupJob(
+        store=S3ObjectStore(s3_client, stack.s3_data_bucket_name),
+        sink=OpenSearchRollupSink(oss, args.index),
+        state=RollupState(args.state),
+        prefix=args.prefix,
+        batch_size=args.batch_size,
+        manifest=manifest,
+    )
+    stats = job.run(progress=lambda stats: print(f"{stats.objects} objects, {stats.records} records"))
+    print(
+        f"done: {stats.records} records of {stats.objects} objects "
+        f"({stats.objects_skipped} skipped), {stats.buckets_written} buckets written "
+        f"in {stats.elapsed:.1f} sec, watermark {job.state.watermark}"
+    )
+
+
+if __name__ == "__main__":
+    main()
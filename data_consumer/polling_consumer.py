@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+"""
+This script runs one host of the KCL style polling consumer. Run it on
+several machines at the same time, they balance the shards between them
+through the DynamoDB lease table.
+
+With fan-out it runs one worker per data stream, the lease table is keyed
+by stream name and shard id, so the streams share it.
+"""
+
+import time
+from kds_example.boto_ses import boto_ses
+from kds_example.iac.s2_app import stack
+from kds_example.consumer import Worker, DynamoDBLeaseTable
+
+k_client = boto_ses.client("kinesis")
+ddb_client = boto_ses.client("dynamodb")
+if not stack.polling_consumer_enabled:
+    raise SystemExit(
+        "the lease table is not deployed, set polling_consumer_enabled=True "
+        "in kds_example/iac/s2_app.py and deploy the stack"
+    )
+
+
+def make_record_processor(stream_name: str):
+    def process_records(shard_id: str, records: list):
+        print(
+            f"{stream_name} {shard_id}: got {len(records)} records, "
+            f"last sequence number = {records[-1]['SequenceNumber']}"
+        )
+
+    return process_records
+
+
+if __name__ == "__main__":
+    workers = [
+        Worker(
+            kinesis_client=k_client,
+            stream_name=stream_name,
+            lease_table=DynamoDBLeaseTable(
+                dynamodb_client=ddb_client,
+                table_name=stack.dynamodb_table_name_for_consumer_lease,
+                stream_name=stream_name,
+            ),
+            record_processor=make_record_processor(stream_name),
+            initial_position="LATEST",
+        )
+        for stream_name in stack.kinesis_data_stream_names
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        while True:
+            time.sleep(10)
+            for worker in workers:
+                print(f"worker {worker.worker_id} owns {worker.owned_shard_ids} of {worker.stream_name}")
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.stop()
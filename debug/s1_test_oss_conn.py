@@ -7,29 +7,41 @@ Test opensearch connection.
 from kds_example.oss_conn import oss
 from rich import print as rprint
 from kds_example import oss_utils
+from kds_example.schema import (
+    bank_account_index_body,
+    bank_account_id_pipeline_body,
+    bank_account_routed_index_body,
+    bank_account_routing_pipeline_body,
+    DOCUMENT_ID_PIPELINE_NAME,
+    ROUTING_PIPELINE_NAME,
+)
+from kds_example.tracing import TRACE_PIPELINE_NAME, trace_ingest_pipeline_body
 
 def create_index_with_mapping():
     """
     Create the test index with proper settings and mappings
     """
     index = "bank_account"
-    body = {
-        "settings": {
-            "number_of_shards": 24,
-            "number_of_replicas": 2,
-        },
-        "mappings": {
-            "properties": {
-                "id": {"type": "keyword"},
-                "firstname": {"type": "keyword"},
-                "lastname": {"type": "keyword"},
-                "balance": {"type": "integer"},
-                "description": {"type": "text"},
-            },
-        },
-    }
-    res = oss.indices.create(index=index, body=body, ignore=[400,])
-    rprint(res)
+    body = bank_account_index_body
+    # the index default and final pipelines have to exist first
+    rprint(oss_utils.put_ingest_pipeline(oss, TRACE_PIPELINE_NAME, trace_ingest_pipeline_body))
+    rprint(oss_utils.put_ingest_pipeline(oss, DOCUMENT_ID_PIPELINE_NAME, bank_account_id_pipeline_body))
+    # the delivery stream writes to the alias, see oss_utils.reset_index
+    if not oss_utils.get_alias_indices(oss, index):
+        rprint(oss_utils.create_index_with_alias(oss, index, body))
+
+
+def create_routed_index_with_mapping():
+    """
+    Same with the per-account routing profile, move an existing alias to it
+    with oss_utils.reindex_to_new_index, the reindex routes the documents.
+    """
+    index = "bank_account"
+    rprint(oss_utils.put_ingest_pipeline(oss, TRACE_PIPELINE_NAME, trace_ingest_pipeline_body))
+    rprint(oss_utils.put_ingest_pipeline(oss, ROUTING_PIPELINE_NAME, bank_account_routing_pipeline_body))
+    if not oss_utils.get_alias_indices(oss, index):
+        rprint(oss_utils.create_index_with_alias(oss, index, bank_account_routed_index_body))
+    # rprint(oss_utils.reindex_to_new_index(oss, alias=index, body=bank_account_routed_index_body, progress=rprint))
 
 #--- Test if the OpenSearch
 index = "test_index"
@@ -39,3 +51,4 @@ index = "test_index"
 
 #--- Create the test index with proper settings and mappings
 create_index_with_mapping()
+# create_routed_index_with_mapping()
@@ -8,9 +8,19 @@ from kds_example.oss_conn import oss
 from kds_example.config import config
 from rich import print as rprint
 from kds_example import oss_utils
+from kds_example.schema import bank_account_index_body
 
 index = config.oss_index_name
 
 # rprint(oss.search(index=index, body={"query": {"match_all": {}}}))
 # rprint(oss_utils.count_documents(oss, index=index))
 # rprint(oss_utils.delete_all_documents(oss, index=index))
+
+# --- empty the index in seconds, ``index`` is an alias
+# rprint(oss_utils.reset_index(oss, alias=index, body=bank_account_index_body))
+
+# --- apply a mapping change, documents indexed meanwhile are kept
+# rprint(oss_utils.reindex_to_new_index(oss, alias=index, body=bank_account_index_body, progress=rprint))
+
+# --- one time migration of the original concrete index to an alias
+# rprint(oss_utils.convert_index_to_alias(oss, index=index, body=bank_account_index_body))
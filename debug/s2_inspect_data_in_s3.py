@@ -49,3 +49,19 @@ def count_records_in_s3_folder(s3path):
 
 # --- Clear all data in s3 bucket
 # S3Path(stack.s3_data_bucket_name, "/").delete_if_exists()
+
+# --- Local manifest index, instant counts and time range queries
+# from datetime import datetime, timezone
+# from kds_example.boto_ses import boto_ses
+# from kds_example.manifest import ManifestIndex
+#
+# manifest = ManifestIndex("s3-manifest.sqlite")
+# for s3path in [s3path_to_s3_01_backup, s3path_to_s3_03_success, s3path_to_s3_04_failed]:
+#     n_new = manifest.sync(boto_ses.client("s3"), stack.s3_data_bucket_name, s3path.key)
+#     print(f"{s3path.key} has {manifest.count(s3path.key)} files ({n_new} new)")
+# print(manifest.count_by_hour(s3path_to_s3_03_success.key))
+# print(manifest.list_keys(
+#     s3path_to_s3_03_success.key,
+#     start=datetime(2022, 4, 15, 10, tzinfo=timezone.utc),
+#     end=datetime(2022, 4, 15, 11, tzinfo=timezone.utc),
+# ))
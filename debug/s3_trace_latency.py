@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compute the latency of each hop of the traced records, from the producer to
+``to-s3/03-success/`` and to the ``bank_account`` index.
+
+Send traced records first, for example::
+
+    python bin/s08_run_load_test.py --rate 1000 --duration 300 --trace-rate 0.01
+"""
+
+from rich import print as rprint
+from kds_example.boto_ses import boto_ses
+from kds_example.config import config
+from kds_example.iac.s2_app import stack
+from kds_example.oss_conn import oss
+from kds_example import tracing
+
+s3_client = boto_ses.client("s3")
+
+rprint("to-s3/03-success/ latency in ms:")
+rprint(tracing.summarize(tracing.iter_s3_traces(
+    s3_client, bucket=stack.s3_data_bucket_name, prefix="to-s3/03-success/",
+)))
+
+rprint(f"{config.oss_index_name} index latency in ms:")
+rprint(tracing.summarize(tracing.iter_oss_traces(oss, index=config.oss_index_name)))
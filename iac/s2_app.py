@@ -1,31 +1,63 @@
 # -*- coding: utf-8 -*-
 
+import os
+
 import cottonformation as cft
 from kds_example.iac.s1_dependency import artifacts_s3_bucket_name
 from kds_example.iac.s2_app import stack
+from kds_example.iac.deploy import deploy_template, deploy_groups
 from kds_example.boto_ses import boto_ses, aws_account_id, aws_region
 
 # create cloudformation template
 tpl = cft.Template()
 
 # partial deployment handling
-tpl.add(stack.rg1_data_bucket)
-tpl.add(stack.rg2_iam_permission)
-tpl.add(stack.rg3_opensearch)
-tpl.add(stack.rg4_kinesis_data_stream)
-
-# pause here, make sure you already have lambda function deployed using
-# bin/12-lbd-deploy.sh shell script
-tpl.add(stack.rg5_kinesis_delivery_stream_to_s3)
-tpl.add(stack.rg6_kinesis_delivery_stream_to_oss)
+resource_groups = [
+    stack.rg1_data_bucket,
+    stack.rg2_iam_permission,
+    stack.rg3_opensearch,
+    stack.rg4_kinesis_data_stream,
+    # pause here, make sure you already have lambda function deployed using
+    # bin/12-lbd-deploy.sh shell script
+    stack.rg5_kinesis_delivery_stream_to_s3,
+    stack.rg6_kinesis_delivery_stream_to_oss,
+]
+# Direct PUT delivery stream, see Stack.direct_put_delivery_stream_enabled
+if stack.direct_put_delivery_stream_enabled:
+    resource_groups.append(stack.rg7_direct_put_delivery_stream)
+for rg in resource_groups:
+    tpl.add(rg)
 
 tpl.batch_tagging(ProjectName=stack.project_name, Debug="1")
 
-# deploy stack
-env = cft.Env(boto_ses=boto_ses)
-env.deploy(
-    template=tpl,
-    stack_name=stack.stack_name,
-    bucket_name=artifacts_s3_bucket_name,
-    include_iam=True,
-)
+# one stack per resource group with KDS_SPLIT_STACKS=true, the independent
+# groups are deployed in parallel and the unchanged groups are skipped. The
+# resources have fixed names, delete the single stack before switching to
+# this layout.
+split_stacks = os.environ.get("KDS_SPLIT_STACKS", "false").lower() == "true"
+
+cf_client = boto_ses.client("cloudformation")
+s3_client = boto_ses.client("s3")
+if split_stacks:
+    groups = dict()
+    for rg in resource_groups:
+        rg_tpl = cft.Template()
+        rg_tpl.add(rg)
+        groups[rg.id] = list(rg_tpl.to_dict()["Resources"])
+    deploy_groups(
+        cf_client,
+        stack_name=stack.stack_name,
+        template=tpl.to_dict(),
+        groups=groups,
+        s3_client=s3_client,
+        bucket=artifacts_s3_bucket_name,
+    )
+else:
+    # deploy stack, skipped if the template didn't change
+    deploy_template(
+        cf_client,
+        stack_name=stack.stack_name,
+        template=tpl.to_dict(),
+        s3_client=s3_client,
+        bucket=artifacts_s3_bucket_name,
+    )
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+"""
+Avro binary encoding of records, without the object container file, for
+the schemas of :mod:`kds_example.schema_registry`.
+
+The pure python implementation supports the ``null``, ``boolean``, ``int``,
+``long``, ``float``, ``double``, ``string``, ``bytes`` and ``record`` types
+and the ``["null", type]`` unions, the schema is compiled once into nested
+closures. If the ``fastavro`` package is installed it is used instead, the
+bytes are the same.
+
+An optional (``["null", type]``) field missing from the encoded record is
+written as ``null`` and decoded as ``None``, the decoded record has every
+field of the schema, as the JSON records of the producers do. ``int`` and
+``long`` values out of the 32 and 64 bits range are rejected.
+"""
+
+import io
+import struct
+from typing import Dict, Tuple, Callable, Any
+
+try:
+    import fastavro
+    import fastavro.validation
+except ImportError:
+    fastavro = None
+
+Writer = Callable[[Any, bytearray], None]
+Reader = Callable[[bytes, int], Tuple[Any, int]]
+
+_pack_float = struct.Struct("<f").pack
+_pack_double = struct.Struct("<d").pack
+_unpack_float = struct.Struct("<f").unpack_from
+_unpack_double = struct.Struct("<d").unpack_from
+
+INT_MIN, INT_MAX = -2 ** 31, 2 ** 31 - 1
+LONG_MIN, LONG_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def write_long(n: int, out: bytearray):
+    n = (n << 1) ^ (n >> 63)
+    while n & ~0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_long(data: bytes, pos: int) -> Tuple[int, int]:
+    b = data[pos]
+    pos += 1
+    n = b & 0x7F
+    shift = 7
+    while b & 0x80:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        shift += 7
+    return (n >> 1) ^ -(n & 1), pos
+
+
+def _write_null(value, out: bytearray):
+    if value is not None:
+        raise TypeError(f"expect None, got {value!r}")
+
+
+def _write_boolean(value: bool, out: bytearray):
+    out.append(1 if value else 0)
+
+
+def _write_int(value: int, out: bytearray):
+    if not isinstance(value, int):
+        raise TypeError(f"expect int, got {value!r}")
+    if not INT_MIN <= value <= INT_MAX:
+        raise ValueError(f"{value!r} is out of the int range")
+    write_long(value, out)
+
+
+def _write_long(value: int, out: bytearray):
+    if not isinstance(value, int):
+        raise TypeError(f"expect int, got {value!r}")
+    if not LONG_MIN <= value <= LONG_MAX:
+        raise ValueError(f"{value!r} is out of the long range")
+    write_long(value, out)
+
+
+def _write_float(value: float, out: bytearray):
+    out += _pack_float(value)
+
+
+def _write_double(value: float, out: bytearray):
+    out += _pack_double(value)
+
+
+def _write_string(value: str, out: bytearray):
+    b = value.encode("utf-8")
+    write_long(len(b), out)
+    out += b
+
+
+def _write_bytes(value: bytes, out: bytearray):
+    write_long(len(value), out)
+    out += value
+
+
+def _read_null(data: bytes, pos: int):
+    return None, pos
+
+
+def _read_boolean(data: bytes, pos: int):
+    return data[pos] == 1, pos + 1
+
+
+def _read_float(data: bytes, pos: int):
+    return _unpack_float(data, pos)[0], pos + 4
+
+
+def _read_double(data: bytes, pos: int):
+    return _unpack_double(data, pos)[0], pos + 8
+
+
+def _read_string(data: bytes, pos: int):
+    n, pos = read_long(data, pos)
+    return data[pos:pos + n].decode("utf-8"), pos + n
+
+
+def _read_bytes(data: bytes, pos: int):
+    n, pos = read_long(data, pos)
+    return bytes(data[pos:pos + n]), pos + n
+
+
+_primitive_writers: Dict[str, Writer] = {
+    "null": _write_null,
+    "boolean": _write_boolean,
+    "int": _write_int,
+    "long": _write_long,
+    "float": _write_float,
+    "double": _write_double,
+    "string": _write_string,
+    "bytes": _write_bytes,
+}
+
+_primitive_readers: Dict[str, Reader] = {
+    "null": _read_null,
+    "boolean": _read_boolean,
+    "int": read_long,
+    "long": read_long,
+    "float": _read_float,
+    "double": _read_double,
+    "string": _read_string,
+    "bytes": _read_bytes,
+}
+
+
+def _type_name(schema) -> str:
+    if isinstance(schema, dict):
+        return schema["type"]
+    return schema
+
+
+def is_optional(schema) -> bool:
+    """
+    True for a ``["null", type]`` union.
+    """
+    return isinstance(schema, list) and len(schema) == 2 and schema[0] == "null"
+
+
+def _check_union(schema: list):
+    if not is_optional(schema):
+        raise ValueError(f"only ['null', type] unions are supported, got {schema!r}")
+
+
+def _compile_writer(schema) -> Writer:
+    if isinstance(schema, list):
+        _check_union(schema)
+        write_value = _compile_writer(schema[1])
+
+        def write_optional(value, out: bytearray):
+            if value is None:
+                out.append(0)
+            else:
+                out.append(2)  # zigzag encoded union index 1
+                write_value(value, out)
+
+        return write_optional
+
+    type_name = _type_name(schema)
+    if type_name in _primitive_writers:
+        return _primitive_writers[type_name]
+    if type_name != "record":
+        raise ValueError(f"unsupported avro type {type_name!r}")
+    fields = [(field["name"], _compile_writer(field["type"])) for field in schema["fields"]]
+
+    def write_record(record: dict, out: bytearray):
+        get = record.get
+        for name, write_field in fields:
+            write_field(get(name), out)
+
+    return write_record
+
+
+def _compile_reader(schema) -> Reader:
+    if isinstance(schema, list):
+        _check_union(schema)
+        read_value = _compile_reader(schema[1])
+
+        def read_optional(data: bytes, pos: int):
+            if data[pos] == 0:
+                return None, pos + 1
+            return read_value(data, pos + 1)
+
+        return read_optional
+
+    type_name = _type_name(schema)
+    if type_name in _primitive_readers:
+        return _primitive_readers[type_name]
+    if type_name != "record":
+        raise ValueError(f"unsupported avro type {type_name!r}")
+    fields = [(field["name"], _compile_reader(field["type"])) for field in schema["fields"]]
+
+    def read_record(data: bytes, pos: int):
+        record = dict()
+        for name, read_field in fields:
+            record[name], pos = read_field(data, pos)
+        return record, pos
+
+    return read_record
+
+
+def compile_encoder(schema: dict) -> Callable[[dict], bytes]:
+    """
+    :return: a function encoding a record of the record schema ``schema``.
+    """
+    names = {field["name"] for field in schema["fields"]}
+    if fastavro is not None:
+        parsed = fastavro.parse_schema(schema)
+
+        def write(record: dict, out: bytearray):
+            # schemaless_writer doesn't check the int and long ranges
+            fastavro.validation.validate(record, parsed, raise_errors=True)
+            buffer = io.BytesIO()
+            fastavro.schemaless_writer(buffer, parsed, record)
+            out += buffer.getvalue()
+    else:
+        write = _compile_writer(schema)
+
+    def encode(record: dict) -> bytes:
+        if not record.keys() <= names:
+            raise ValueError(f"fields not in the schema: {sorted(record.keys() - names)}")
+        out = bytearray()
+        try:
+            write(record, out)
+        except (TypeError, AttributeError, ValueError, struct.error) as e:
+            raise ValueError(f"the record doesn't match the schema: {e}")
+        return bytes(out)
+
+    return encode
+
+
+def compile_decoder(schema: dict) -> Callable[[bytes], dict]:
+    """
+    :return: a function decoding the bytes of a record of the record schema
+        ``schema``.
+    """
+    if fastavro is not None:
+        parsed = fastavro.parse_schema(schema)
+
+        def decode(data: bytes) -> dict:
+            return fastavro.schemaless_reader(io.BytesIO(data), parsed)
+
+        return decode
+
+    read = _compile_reader(schema)
+
+    def decode(data: bytes) -> dict:
+        return read(data, 0)[0]
+
+    return decode
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""
+Rebuild the OpenSearch index from ``to-oss/01-backup/``, which has every
+document sent to the index because of ``S3BackupMode="AllDocuments"``.
+
+It is the replay engine of :mod:`kds_example.replay` reading plain NDJSON
+objects, with the transformation and validation of
+:mod:`kds_example.lbd.to_oss`, and bulk indexing with the record id as the
+document id. The firehose documents of an index created before its
+``index.final_pipeline`` set the ``_id`` (see :mod:`kds_example.schema`)
+have ids generated by OpenSearch, a backfill into such an index would
+duplicate all of them, so :func:`backfill_to_new_index` builds a new index
+and moves the alias to it.
+Memory is bounded by ``max_in_flight`` objects, the processed keys are
+saved to a manifest to resume an interrupted backfill.
+"""
+
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import List, Tuple, Callable, Optional
+
+from .lbd.common import build_pipeline
+from .lbd.pipeline import Pipeline
+from .replay import KeyCheckpoint, ReplayEngine, ReplayStats, OpenSearchSink, parse_ndjson_line
+
+BACKUP_PREFIX = "to-oss/01-backup/"
+
+
+def make_backfill_pipeline() -> Pipeline:
+    """
+    The ``to_oss`` transformation without dedup, a backfill re-indexes
+    documents on purpose, and without tracing, the backup documents keep
+    their original trace.
+    """
+    from .lbd.to_oss import transform, validate
+
+    return build_pipeline(transform, validator=validate, trace=False)
+
+
+def make_backfill_engine(
+    store,
+    sink,
+    manifest_path: str = None,
+    pipeline: Pipeline = None,
+    n_workers: int = 8,
+    max_in_flight: int = None,
+    batch_size: int = 500,
+) -> ReplayEngine:
+    """
+    :param sink: usually a :class:`~kds_example.replay.OpenSearchSink`.
+    :param manifest_path: file of the processed keys, None to not resume.
+    """
+    return ReplayEngine(
+        store=store,
+        pipeline=make_backfill_pipeline() if pipeline is None else pipeline,
+        sink=sink,
+        checkpoint=KeyCheckpoint(manifest_path),
+        parse_line=parse_ndjson_line,
+        n_workers=n_workers,
+        max_in_flight=max_in_flight,
+        batch_size=batch_size,
+    )
+
+
+@contextmanager
+def bulk_load_settings(oss, index: str):
+    """
+    Disable refresh and replicas of an index during a bulk load, restore
+    the previous settings after.
+
+    :param index: an index or an alias, the settings of its write index are
+        changed.
+    """
+    from .oss_utils import get_write_index
+
+    index = get_write_index(oss, index)
+    settings = oss.indices.get_settings(index=index)[index]["settings"]["index"]
+    previous = {
+        "refresh_interval": settings.get("refresh_interval", "1s"),
+        "number_of_replicas": settings.get("number_of_replicas", "1"),
+    }
+    oss.indices.put_settings(index=index, body={"index": {"refresh_interval": "-1", "number_of_replicas": 0}})
+    try:
+        yield
+    finally:
+        oss.indices.put_settings(index=index, body={"index": previous})
+        oss.indices.refresh(index=index)
+
+
+def backfill_to_new_index(
+    oss,
+    alias: str,
+    body: dict,
+    store,
+    prefix: str = BACKUP_PREFIX,
+    index: str = None,
+    manifest_path: str = None,
+    bulk_settings: bool = True,
+    delete_old: bool = True,
+    chunk_size: int = 500,
+    progress: Callable[[ReplayStats], None] = None,
+    **kwargs,
+) -> Tuple[str, List[str], ReplayStats, Optional[threading.Thread]]:
+    """
+    Rebuild an alias from the backup objects:
+
+    1. create the new index from ``body``, outside of the alias.
+    2. backfill all the objects into it, with :func:`bulk_load_settings`.
+    3. backfill the objects created during step 2, retry the failed ones.
+    4. move the alias to the new index atomically and drop the old indices
+       in the background.
+
+    The documents firehose delivers between the listing of step 3 and the
+    alias swap are in the old indices only, a few buffer intervals at most,
+    pause the producers during step 3 and 4 to lose none. The alias is not
+    moved if a document failed to index.
+
+    :param index: the new index, created if it does not exist. An existing
+        index with the ``manifest_path`` of its first run resumes an
+        interrupted backfill.
+    :param manifest_path: file of the processed keys, it belongs to ``index``.
+    :param kwargs: see :func:`make_backfill_engine`.
+    :return: (new index, old indices, stats, deleting thread or None)
+    """
+    from .oss_utils import versioned_index_name, get_alias_indices, swap_alias, delete_indices_in_background
+
+    if index is None:
+        index = versioned_index_name(alias)
+    if not oss.indices.exists(index=index):
+        oss.indices.create(index=index, body=body)
+    engine = make_backfill_engine(
+        store,
+        OpenSearchSink(oss, index, chunk_size=chunk_size),
+        manifest_path=manifest_path,
+        batch_size=chunk_size,
+        **kwargs
+    )
+    with bulk_load_settings(oss, index) if bulk_settings else nullcontext():
+        engine.run_prefix(prefix, progress=progress)
+    # the objects created meanwhile, and the ones that failed to index
+    keys = [key for key in store.list_keys(prefix) if key not in engine.checkpoint]
+    stats = engine.run(keys, progress=progress)
+    failed_keys = [key for key in keys if key not in engine.checkpoint]
+    if failed_keys:
+        # the old indices stay behind the alias, resume to retry the objects
+        raise RuntimeError(
+            f"{len(failed_keys)} objects failed to index into {index}, "
+            f"the alias {alias!r} is not moved"
+        )
+
+    old_indices = [old for old in get_alias_indices(oss, alias) if old != index]
+    swap_alias(oss, alias, index, old_indices)
+    thread = None
+    if delete_old and old_indices:
+        thread = delete_indices_in_background(oss, old_indices)
+    return index, old_indices, stats, thread
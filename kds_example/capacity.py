@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""
+Capacity calculation of the delivery stream fan-out, see
+:mod:`kds_example.fan_out`.
+
+For a target ingestion rate it tells how many data streams, each with one
+delivery stream per destination, are needed and how many shards each data
+stream needs. The producers split the records over the data streams, so
+each data stream, its delivery streams and their lambda processors carry
+``target / fan_out``, and the readers of a data stream are its delivery
+streams plus the other consumers:
+
+- a shard takes 1 MB/s or 1000 records/s of writes.
+- a shard serves 2 MB/s and 5 ``GetRecords`` calls / s of reads, shared by
+  all the readers. A delivery stream polls each shard about once a second.
+- a delivery stream delivers at most ``max_mb_per_sec``, and its lambda
+  processor at most ``lambda_concurrency`` buffers of ``lambda_buffer_mb``
+  per ``lambda_duration_sec``. Use the ``InputBytes`` and ``TransformTime``
+  metrics of :mod:`kds_example.lbd.metrics` for measured values.
+
+:func:`ingestion_cost_per_gb` compares the cost of ingesting through a data
+stream (``KinesisStreamAsSource``) and writing to the delivery streams
+directly (``DirectPut``), a record is ingested once per destination
+whatever the fan-out.
+"""
+
+import math
+from typing import List, Dict
+
+import attr
+
+SHARD_WRITE_MB_PER_SEC = 1.0
+SHARD_WRITE_RECORDS_PER_SEC = 1000
+SHARD_READ_MB_PER_SEC = 2.0
+SHARD_READ_CALLS_PER_SEC = 5
+
+KINESIS_STREAM_AS_SOURCE = "KinesisStreamAsSource"
+DIRECT_PUT = "DirectPut"
+
+GB = 1024 * 1024 * 1024
+
+
+@attr.s
+class DeliveryStreamLimits:
+    max_mb_per_sec: float = attr.ib(default=5.0)
+    lambda_buffer_mb: float = attr.ib(default=3.0)
+    lambda_duration_sec: float = attr.ib(default=0.5)
+    lambda_concurrency: int = attr.ib(default=1)
+
+    @property
+    def lambda_mb_per_sec(self) -> float:
+        return self.lambda_buffer_mb / self.lambda_duration_sec * self.lambda_concurrency
+
+    @property
+    def mb_per_sec(self) -> float:
+        return min(self.max_mb_per_sec, self.lambda_mb_per_sec)
+
+
+@attr.s
+class CapacityPlan:
+    """
+    ``n_readers``, ``shards_for_write`` and ``shards_for_read`` are per data
+    stream.
+    """
+    target_mb_per_sec: float = attr.ib()
+    per_delivery_stream_mb_per_sec: float = attr.ib()
+    fan_out: int = attr.ib()
+    per_data_stream_mb_per_sec: float = attr.ib()
+    n_readers: int = attr.ib()
+    shards_for_write: int = attr.ib()
+    shards_for_read: int = attr.ib()
+    s3_objects_per_hour: int = attr.ib()
+    warnings: List[str] = attr.ib(factory=list)
+
+    @property
+    def n_shards_per_stream(self) -> int:
+        return max(self.shards_for_write, self.shards_for_read)
+
+    @property
+    def n_shards(self) -> int:
+        """
+        Shards of all the data streams.
+        """
+        return self.fan_out * self.n_shards_per_stream
+
+    def to_dict(self) -> dict:
+        dct = attr.asdict(self)
+        dct["n_shards_per_stream"] = self.n_shards_per_stream
+        dct["n_shards"] = self.n_shards
+        return dct
+
+
+def plan_fan_out(
+    target_mb_per_sec: float,
+    record_size: int = 1024,
+    limits: DeliveryStreamLimits = None,
+    n_destinations: int = 2,
+    extra_readers: int = 0,
+    headroom: float = 0.8,
+    buffer_interval_sec: int = 60,
+    n_shards: int = None,
+) -> CapacityPlan:
+    """
+    :param target_mb_per_sec: ingestion rate to sustain.
+    :param record_size: average record size in bytes.
+    :param n_destinations: delivery streams per data stream, "to-s3" and
+        "to-oss".
+    :param extra_readers: other consumers of each data stream, for example
+        the polling consumer.
+    :param headroom: fraction of each limit to plan for.
+    :param buffer_interval_sec: destination buffering interval, for the
+        number of S3 objects.
+    :param n_shards: current number of shards per data stream, to warn if
+        it is too low.
+    """
+    limits = limits or DeliveryStreamLimits()
+    fan_out = max(1, math.ceil(target_mb_per_sec / (limits.mb_per_sec * headroom)))
+    per_data_stream_mb_per_sec = target_mb_per_sec / fan_out
+    n_readers = n_destinations + extra_readers
+    write_mb_per_sec = max(
+        per_data_stream_mb_per_sec,
+        # small records hit the records / s limit first
+        per_data_stream_mb_per_sec * 1024 * 1024 / record_size / SHARD_WRITE_RECORDS_PER_SEC * SHARD_WRITE_MB_PER_SEC,
+    )
+    shards_for_write = math.ceil(write_mb_per_sec / (SHARD_WRITE_MB_PER_SEC * headroom))
+    shards_for_read = math.ceil(per_data_stream_mb_per_sec * n_readers / (SHARD_READ_MB_PER_SEC * headroom))
+    plan = CapacityPlan(
+        target_mb_per_sec=target_mb_per_sec,
+        per_delivery_stream_mb_per_sec=limits.mb_per_sec,
+        fan_out=fan_out,
+        per_data_stream_mb_per_sec=per_data_stream_mb_per_sec,
+        n_readers=n_readers,
+        shards_for_write=shards_for_write,
+        shards_for_read=shards_for_read,
+        s3_objects_per_hour=fan_out * math.ceil(3600 / buffer_interval_sec),
+    )
+    if n_readers > SHARD_READ_CALLS_PER_SEC:
+        plan.warnings.append(
+            f"{n_readers} readers poll each shard, over the {SHARD_READ_CALLS_PER_SEC} "
+            f"GetRecords calls / sec of a shard, reads will be throttled"
+        )
+    if n_shards is not None and n_shards < plan.n_shards_per_stream:
+        plan.warnings.append(
+            f"a data stream has {n_shards} shards, {plan.n_shards_per_stream} are needed"
+        )
+    if limits.lambda_mb_per_sec < limits.max_mb_per_sec:
+        plan.warnings.append(
+            f"the lambda processor ({limits.lambda_mb_per_sec:.2f} MB/s) is the bottleneck "
+            f"of a delivery stream, not the delivery ({limits.max_mb_per_sec:.2f} MB/s)"
+        )
+    return plan
+
+
+@attr.s
+class Prices:
+    """
+    On demand prices in USD, us-east-1 defaults, check the pricing pages of
+    your region.
+    """
+    kds_shard_hour: float = attr.ib(default=0.015)
+    # a PUT payload unit is a record rounded up to 25 KB
+    kds_put_payload_units_per_million: float = attr.ib(default=0.014)
+    kds_put_payload_unit_kb: int = attr.ib(default=25)
+    firehose_ingestion_per_gb: float = attr.ib(default=0.029)
+    # firehose bills each record rounded up to 5 KB
+    firehose_record_increment_kb: int = attr.ib(default=5)
+
+
+def round_up(size: int, increment: int) -> int:
+    return math.ceil(size / increment) * increment
+
+
+def ingestion_cost_per_gb(
+    target_mb_per_sec: float,
+    record_size: int = 1024,
+    source: str = KINESIS_STREAM_AS_SOURCE,
+    n_destinations: int = 2,
+    prices: Prices = None,
+    n_shards: int = None,
+) -> Dict[str, float]:
+    """
+    Cost in USD per GB of records produced, by component, and the total.
+
+    Each destination has its own delivery stream, a Direct PUT producer
+    writes every record to each of them. With a fan-out a record goes to
+    one data stream and its delivery streams, the firehose ingestion is the
+    same, the shards are the ones of all the data streams.
+
+    :param n_shards: shards of all the data streams, planned with
+        :func:`plan_fan_out` by default.
+    """
+    prices = prices or Prices()
+    records_per_gb = GB / record_size
+    billed_size = round_up(record_size, prices.firehose_record_increment_kb * 1024)
+    cost = {
+        "firehose_ingestion": (
+            prices.firehose_ingestion_per_gb * billed_size / record_size * n_destinations
+        ),
+    }
+    if source == KINESIS_STREAM_AS_SOURCE:
+        if n_shards is None:
+            n_shards = plan_fan_out(
+                target_mb_per_sec, record_size=record_size, n_destinations=n_destinations,
+            ).n_shards
+        gb_per_hour = target_mb_per_sec * 3600 / 1024
+        units_per_record = math.ceil(record_size / (prices.kds_put_payload_unit_kb * 1024))
+        cost["kds_shard_hours"] = n_shards * prices.kds_shard_hour / gb_per_hour
+        cost["kds_put_payload_units"] = (
+            records_per_gb * units_per_record * prices.kds_put_payload_units_per_million / 1000000
+        )
+    elif source != DIRECT_PUT:
+        raise ValueError(f"source has to be {KINESIS_STREAM_AS_SOURCE!r} or {DIRECT_PUT!r}, got {source!r}")
+    cost["total"] = sum(cost.values())
+    return cost
@@ -4,6 +4,10 @@ class Config:
     project_name = "kds_example"
     stage = "dev"
     oss_index_name = "bank_account"
+    # transformation lambda memory and firehose processor buffer size,
+    # tune them with bin/s12_power_tuning.py
+    lambda_memory_size = 512
+    lambda_buffer_hint_size_in_mb = 3
 
     @property
     def project_name_slug(self):
@@ -0,0 +1,611 @@
+# -*- coding: utf-8 -*-
+
+"""
+A KCL style polling consumer for the kinesis data stream.
+
+It is a cheaper alternative to enhanced fan-out. Each :class:`Worker` runs one
+``GetRecords`` loop per shard it owns in a thread pool. Several workers,
+usually on different hosts, share the shards through a lease table:
+
+- every shard has a lease, a worker only reads the shards it holds a lease on.
+- a worker renews its leases periodically, a lease that is not renewed before
+  ``expire_at`` can be taken by any worker.
+- every worker aims at ``ceil(n_leases / n_workers)`` leases, it takes expired
+  leases first, then steals at most one lease per round from the most loaded
+  worker, so the load converges without a coordinator.
+- child shards created by resharding are only processed after all their
+  parent shards are read to the end, which keeps per partition key ordering.
+
+The ``Limit`` and the poll interval of ``GetRecords`` adapt to
+``MillisBehindLatest``, see :class:`AdaptivePoller`.
+
+The kinesis client is injected, it can be a boto3 client, a boto3 client
+pointing to kinesalite / moto via ``endpoint_url``, or
+:class:`~kds_example.fake_kinesis.FakeKinesisClient`.
+"""
+
+import time
+import math
+import uuid
+import socket
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, Executor, Future
+from typing import List, Dict, Optional, Callable
+
+import attr
+
+from .fake_kinesis import get_error_code
+
+SHARD_END = "SHARD_END"
+
+
+@attr.s
+class Lease:
+    shard_id: str = attr.ib()
+    parent_shard_ids: List[str] = attr.ib(factory=list)
+    owner: Optional[str] = attr.ib(default=None)
+    counter: int = attr.ib(default=0)
+    checkpoint: Optional[str] = attr.ib(default=None)
+    expire_at: float = attr.ib(default=0.0)
+
+    def is_finished(self) -> bool:
+        return self.checkpoint == SHARD_END
+
+    def is_expired(self, now: float) -> bool:
+        return (self.owner is None) or (self.expire_at <= now)
+
+
+class LeaseTable:
+    """
+    Storage of the shard leases. Every write is conditional, it returns
+    False if another worker changed the lease in between.
+    """
+
+    def list_leases(self) -> List[Lease]:
+        raise NotImplementedError
+
+    def create_lease(self, lease: Lease) -> bool:
+        """
+        Create the lease if it doesn't exist yet.
+        """
+        raise NotImplementedError
+
+    def take_lease(self, lease: Lease, owner: str, expire_at: float) -> bool:
+        """
+        Take the lease if its counter is still the one we observed.
+        """
+        raise NotImplementedError
+
+    def renew_lease(self, shard_id: str, owner: str, expire_at: float) -> bool:
+        raise NotImplementedError
+
+    def update_checkpoint(self, shard_id: str, owner: str, checkpoint: str) -> bool:
+        raise NotImplementedError
+
+    def release_lease(self, shard_id: str, owner: str) -> bool:
+        raise NotImplementedError
+
+
+class InMemoryLeaseTable(LeaseTable):
+    """
+    Lease table for workers in the same process, for local runs and tests.
+    """
+
+    def __init__(self):
+        self._leases: Dict[str, Lease] = dict()
+        self._lock = threading.Lock()
+
+    def list_leases(self) -> List[Lease]:
+        with self._lock:
+            return [attr.evolve(lease) for lease in self._leases.values()]
+
+    def create_lease(self, lease: Lease) -> bool:
+        with self._lock:
+            if lease.shard_id in self._leases:
+                return False
+            self._leases[lease.shard_id] = attr.evolve(lease)
+            return True
+
+    def take_lease(self, lease: Lease, owner: str, expire_at: float) -> bool:
+        with self._lock:
+            current = self._leases[lease.shard_id]
+            if current.counter != lease.counter:
+                return False
+            current.owner = owner
+            current.counter += 1
+            current.expire_at = expire_at
+            return True
+
+    def renew_lease(self, shard_id: str, owner: str, expire_at: float) -> bool:
+        with self._lock:
+            current = self._leases[shard_id]
+            if current.owner != owner:
+                return False
+            current.counter += 1
+            current.expire_at = expire_at
+            return True
+
+    def update_checkpoint(self, shard_id: str, owner: str, checkpoint: str) -> bool:
+        with self._lock:
+            current = self._leases[shard_id]
+            if current.owner != owner:
+                return False
+            current.checkpoint = checkpoint
+            return True
+
+    def release_lease(self, shard_id: str, owner: str) -> bool:
+        with self._lock:
+            current = self._leases[shard_id]
+            if current.owner != owner:
+                return False
+            current.owner = None
+            current.counter += 1
+            current.expire_at = 0.0
+            return True
+
+
+class DynamoDBLeaseTable(LeaseTable):
+    """
+    Lease table backed by a DynamoDB table with ``stream_name`` as hash key
+    and ``shard_id`` as range key, shared by workers on different hosts. The
+    data streams of a fan-out have the same shard ids, one table holds the
+    leases of all of them, one instance per data stream.
+    """
+
+    def __init__(self, dynamodb_client, table_name: str, stream_name: str):
+        self.client = dynamodb_client
+        self.table_name = table_name
+        self.stream_name = stream_name
+
+    def create_table(self) -> dict:
+        return self.client.create_table(
+            TableName=self.table_name,
+            KeySchema=[
+                {"AttributeName": "stream_name", "KeyType": "HASH"},
+                {"AttributeName": "shard_id", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "stream_name", "AttributeType": "S"},
+                {"AttributeName": "shard_id", "AttributeType": "S"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+    def _key(self, shard_id: str) -> dict:
+        return {"stream_name": {"S": self.stream_name}, "shard_id": {"S": shard_id}}
+
+    @staticmethod
+    def _to_lease(item: dict) -> Lease:
+        return Lease(
+            shard_id=item["shard_id"]["S"],
+            parent_shard_ids=[v["S"] for v in item.get("parent_shard_ids", {}).get("L", [])],
+            owner=item["owner"]["S"] if "owner" in item else None,
+            counter=int(item["counter"]["N"]),
+            checkpoint=item["checkpoint"]["S"] if "checkpoint" in item else None,
+            expire_at=float(item["expire_at"]["N"]),
+        )
+
+    def _conditional_update(self, **kwargs) -> bool:
+        try:
+            self.client.update_item(TableName=self.table_name, **kwargs)
+            return True
+        except Exception as e:
+            if get_error_code(e) == "ConditionalCheckFailedException":
+                return False
+            raise
+
+    def list_leases(self) -> List[Lease]:
+        leases = list()
+        kwargs = dict(
+            TableName=self.table_name,
+            KeyConditionExpression="stream_name = :stream_name",
+            ExpressionAttributeValues={":stream_name": {"S": self.stream_name}},
+            ConsistentRead=True,
+        )
+        while True:
+            res = self.client.query(**kwargs)
+            leases.extend([self._to_lease(item) for item in res["Items"]])
+            if "LastEvaluatedKey" not in res:
+                return leases
+            kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+    def create_lease(self, lease: Lease) -> bool:
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    **self._key(lease.shard_id),
+                    "parent_shard_ids": {"L": [{"S": v} for v in lease.parent_shard_ids]},
+                    "counter": {"N": str(lease.counter)},
+                    "expire_at": {"N": str(lease.expire_at)},
+                },
+                ConditionExpression="attribute_not_exists(shard_id)",
+            )
+            return True
+        except Exception as e:
+            if get_error_code(e) == "ConditionalCheckFailedException":
+                return False
+            raise
+
+    def take_lease(self, lease: Lease, owner: str, expire_at: float) -> bool:
+        return self._conditional_update(
+            Key=self._key(lease.shard_id),
+            UpdateExpression="SET #owner = :owner, #counter = #counter + :one, expire_at = :expire_at",
+            ConditionExpression="#counter = :counter",
+            ExpressionAttributeNames={"#owner": "owner", "#counter": "counter"},
+            ExpressionAttributeValues={
+                ":owner": {"S": owner},
+                ":one": {"N": "1"},
+                ":counter": {"N": str(lease.counter)},
+                ":expire_at": {"N": str(expire_at)},
+            },
+        )
+
+    def renew_lease(self, shard_id: str, owner: str, expire_at: float) -> bool:
+        return self._conditional_update(
+            Key=self._key(shard_id),
+            UpdateExpression="SET #counter = #counter + :one, expire_at = :expire_at",
+            ConditionExpression="#owner = :owner",
+            ExpressionAttributeNames={"#owner": "owner", "#counter": "counter"},
+            ExpressionAttributeValues={
+                ":owner": {"S": owner},
+                ":one": {"N": "1"},
+                ":expire_at": {"N": str(expire_at)},
+            },
+        )
+
+    def update_checkpoint(self, shard_id: str, owner: str, checkpoint: str) -> bool:
+        return self._conditional_update(
+            Key=self._key(shard_id),
+            UpdateExpression="SET #checkpoint = :checkpoint",
+            ConditionExpression="#owner = :owner",
+            ExpressionAttributeNames={"#owner": "owner", "#checkpoint": "checkpoint"},
+            ExpressionAttributeValues={
+                ":owner": {"S": owner},
+                ":checkpoint": {"S": checkpoint},
+            },
+        )
+
+    def release_lease(self, shard_id: str, owner: str) -> bool:
+        return self._conditional_update(
+            Key=self._key(shard_id),
+            UpdateExpression="REMOVE #owner SET #counter = #counter + :one, expire_at = :zero",
+            ConditionExpression="#owner = :owner",
+            ExpressionAttributeNames={"#owner": "owner", "#counter": "counter"},
+            ExpressionAttributeValues={
+                ":owner": {"S": owner},
+                ":one": {"N": "1"},
+                ":zero": {"N": "0"},
+            },
+        )
+
+
+def plan_lease_actions(
+    leases: List[Lease],
+    worker_id: str,
+    now: float,
+    max_steal: int = 1,
+) -> List[Lease]:
+    """
+    Decide which leases ``worker_id`` should take in this round.
+
+    Finished leases are ignored, leases whose parent shards are not finished
+    yet are not eligible. Expired leases are taken first, then at most
+    ``max_steal`` leases are stolen from the most loaded worker.
+    """
+    finished = {lease.shard_id for lease in leases if lease.is_finished()}
+    known = {lease.shard_id for lease in leases}
+    available = [
+        lease
+        for lease in leases
+        if (not lease.is_finished()) and all(
+            (parent in finished) or (parent not in known)
+            for parent in lease.parent_shard_ids
+        )
+    ]
+    if not available:
+        return []
+
+    owned_by: Dict[str, List[Lease]] = dict()
+    for lease in available:
+        if not lease.is_expired(now):
+            owned_by.setdefault(lease.owner, []).append(lease)
+    n_workers = len(set(owned_by) | {worker_id})
+    target = math.ceil(len(available) / n_workers)
+    n_needed = target - len(owned_by.get(worker_id, []))
+    if n_needed <= 0:
+        return []
+
+    expired = sorted(
+        [lease for lease in available if lease.is_expired(now)],
+        key=lambda lease: lease.shard_id,
+    )
+    to_take = expired[:n_needed]
+    if len(to_take) < n_needed and max_steal:
+        candidates = [
+            (len(owned), owner)
+            for owner, owned in owned_by.items()
+            if owner != worker_id and len(owned) > target
+        ]
+        if candidates:
+            _, victim = max(candidates)
+            stealable = sorted(owned_by[victim], key=lambda lease: lease.shard_id)
+            to_take.extend(stealable[:min(max_steal, n_needed - len(to_take))])
+    return to_take
+
+
+@attr.s
+class AdaptivePoller:
+    """
+    Adapt ``GetRecords`` ``Limit`` and poll interval to the consumer lag.
+
+    - behind (``MillisBehindLatest`` over ``caught_up_millis``): poll as fast
+      as the 5 calls / sec / shard quota allows, double ``Limit`` whenever a
+      call returns a full page.
+    - caught up: shrink ``Limit`` toward twice the observed batch size and
+      back off the interval while the shard is idle.
+    - throttled: back off the interval.
+    """
+    min_limit: int = attr.ib(default=100)
+    max_limit: int = attr.ib(default=10000)
+    limit: int = attr.ib(default=1000)
+    min_interval: float = attr.ib(default=0.2)
+    max_interval: float = attr.ib(default=2.0)
+    interval: float = attr.ib(default=1.0)
+    caught_up_millis: int = attr.ib(default=1000)
+
+    def update(self, n_records: int, millis_behind_latest: int):
+        if millis_behind_latest > self.caught_up_millis:
+            if n_records >= self.limit:
+                self.limit = min(self.max_limit, self.limit * 2)
+            self.interval = self.min_interval
+        else:
+            if n_records * 2 < self.limit:
+                self.limit = max(self.min_limit, n_records * 2)
+            if n_records == 0:
+                self.interval = min(self.max_interval, self.interval * 1.5)
+
+    def throttled(self):
+        self.interval = min(self.max_interval, max(self.min_interval, self.interval) * 2)
+
+
+RecordProcessor = Callable[[str, List[dict]], None]
+
+
+class Worker:
+    """
+    One consumer host. Call :meth:`start` to run it in background threads,
+    or :meth:`run_once` to drive it step by step.
+
+    :param kinesis_client: boto3 kinesis client or a compatible stand-in.
+    :param stream_name: the kinesis data stream name.
+    :param lease_table: the lease table shared by all workers.
+    :param record_processor: ``func(shard_id, records)``, records are the
+        ``GetRecords`` response records. The checkpoint is written after it
+        returns, so processing is at least once.
+    :param processor_executor: optional executor, for example a
+        ``ProcessPoolExecutor``, to run CPU heavy ``record_processor`` out of
+        the polling threads. Batches of the same shard stay in order.
+    :param max_workers: max number of shards polled concurrently.
+    """
+
+    def __init__(
+        self,
+        kinesis_client,
+        stream_name: str,
+        lease_table: LeaseTable,
+        record_processor: RecordProcessor,
+        worker_id: str = None,
+        initial_position: str = "TRIM_HORIZON",
+        lease_duration: float = 10.0,
+        renew_interval: float = 2.0,
+        max_workers: int = 16,
+        processor_executor: Executor = None,
+        poller_factory: Callable[[], AdaptivePoller] = AdaptivePoller,
+        clock: Callable[[], float] = time.time,
+    ):
+        if worker_id is None:
+            worker_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.kinesis_client = kinesis_client
+        self.stream_name = stream_name
+        self.lease_table = lease_table
+        self.record_processor = record_processor
+        self.worker_id = worker_id
+        self.initial_position = initial_position
+        self.lease_duration = lease_duration
+        self.renew_interval = renew_interval
+        self.processor_executor = processor_executor
+        self.poller_factory = poller_factory
+        self.clock = clock
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._owned: Dict[str, Future] = dict()
+        self._owned_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # number of shard consumers stopped by an exception
+        self.n_shard_errors = 0
+
+    # --- lease management
+    def owns(self, shard_id: str) -> bool:
+        with self._owned_lock:
+            return shard_id in self._owned
+
+    @property
+    def owned_shard_ids(self) -> List[str]:
+        with self._owned_lock:
+            return sorted(self._owned)
+
+    def sync_shards(self) -> int:
+        """
+        Create leases for shards that don't have one yet, return the number
+        of leases created.
+        """
+        n_created = 0
+        kwargs = dict(StreamName=self.stream_name)
+        while True:
+            res = self.kinesis_client.list_shards(**kwargs)
+            for shard in res["Shards"]:
+                parent_shard_ids = [
+                    shard[key]
+                    for key in ["ParentShardId", "AdjacentParentShardId"]
+                    if shard.get(key)
+                ]
+                lease = Lease(shard_id=shard["ShardId"], parent_shard_ids=parent_shard_ids)
+                if self.lease_table.create_lease(lease):
+                    n_created += 1
+            if not res.get("NextToken"):
+                return n_created
+            kwargs = dict(NextToken=res["NextToken"])
+
+    def renew_leases(self):
+        expire_at = self.clock() + self.lease_duration
+        for shard_id in self.owned_shard_ids:
+            if not self.lease_table.renew_lease(shard_id, self.worker_id, expire_at):
+                self._drop(shard_id)
+
+    def take_leases(self) -> List[str]:
+        now = self.clock()
+        taken = list()
+        for lease in plan_lease_actions(self.lease_table.list_leases(), self.worker_id, now):
+            if lease.owner == self.worker_id and self.owns(lease.shard_id):
+                continue
+            if self.lease_table.take_lease(lease, self.worker_id, now + self.lease_duration):
+                taken.append(lease.shard_id)
+        return taken
+
+    def _drop(self, shard_id: str):
+        with self._owned_lock:
+            self._owned.pop(shard_id, None)
+
+    def _start_shard(self, shard_id: str):
+        with self._owned_lock:
+            if shard_id in self._owned:
+                return
+            # the task waits on the lock in ``owns()`` until it is registered
+            self._owned[shard_id] = self._executor.submit(self.consume_shard, shard_id)
+
+    def run_once(self):
+        """
+        One round of lease management: sync shards, drop lost and finished
+        shards, renew our leases, take new ones and start polling them.
+        """
+        self.sync_shards()
+        with self._owned_lock:
+            done = [
+                (shard_id, future)
+                for shard_id, future in self._owned.items()
+                if future.done()
+            ]
+        for shard_id, future in done:
+            error = future.exception()
+            if error is not None:
+                # the lease is still ours, the shard restarts from its checkpoint below
+                self.n_shard_errors += 1
+                print(
+                    f"worker {self.worker_id}: the consumer of {shard_id} failed, "
+                    f"restart from the last checkpoint\n"
+                    + "".join(traceback.format_exception(type(error), error, error.__traceback__))
+                )
+            self._drop(shard_id)
+        self.renew_leases()
+        owned = {
+            lease.shard_id
+            for lease in self.lease_table.list_leases()
+            if lease.owner == self.worker_id and not lease.is_finished()
+        }
+        for shard_id in sorted(owned | set(self.take_leases())):
+            self._start_shard(shard_id)
+
+    # --- shard consumption
+    def _get_iterator(self, shard_id: str) -> str:
+        checkpoint = None
+        for lease in self.lease_table.list_leases():
+            if lease.shard_id == shard_id:
+                checkpoint = lease.checkpoint
+        if checkpoint:
+            kwargs = dict(
+                ShardIteratorType="AFTER_SEQUENCE_NUMBER",
+                StartingSequenceNumber=checkpoint,
+            )
+        else:
+            kwargs = dict(ShardIteratorType=self.initial_position)
+        res = self.kinesis_client.get_shard_iterator(
+            StreamName=self.stream_name, ShardId=shard_id, **kwargs
+        )
+        return res["ShardIterator"]
+
+    def _process(self, shard_id: str, records: List[dict]):
+        if self.processor_executor is None:
+            self.record_processor(shard_id, records)
+        else:
+            self.processor_executor.submit(self.record_processor, shard_id, records).result()
+
+    def consume_shard(self, shard_id: str):
+        """
+        The ``GetRecords`` loop of one shard. It exits when the lease is lost,
+        the worker stops, or the shard end is reached.
+        """
+        poller = self.poller_factory()
+        iterator = self._get_iterator(shard_id)
+        while self.owns(shard_id) and not self._stop_event.is_set():
+            try:
+                res = self.kinesis_client.get_records(ShardIterator=iterator, Limit=poller.limit)
+            except Exception as e:
+                code = get_error_code(e)
+                if code == "ProvisionedThroughputExceededException":
+                    poller.throttled()
+                    self._stop_event.wait(poller.interval)
+                    continue
+                if code == "ExpiredIteratorException":
+                    iterator = self._get_iterator(shard_id)
+                    continue
+                raise
+
+            records = res["Records"]
+            if records:
+                self._process(shard_id, records)
+                if not self.lease_table.update_checkpoint(
+                    shard_id, self.worker_id, records[-1]["SequenceNumber"],
+                ):
+                    self._drop(shard_id)
+                    return
+            poller.update(len(records), res.get("MillisBehindLatest", 0))
+
+            iterator = res.get("NextShardIterator")
+            if iterator is None:
+                self.lease_table.update_checkpoint(shard_id, self.worker_id, SHARD_END)
+                for child in res.get("ChildShards", []):
+                    self.lease_table.create_lease(Lease(
+                        shard_id=child["ShardId"],
+                        parent_shard_ids=child.get("ParentShards", []),
+                    ))
+                self._drop(shard_id)
+                return
+            self._stop_event.wait(poller.interval)
+
+    # --- life cycle
+    def run(self):
+        while not self._stop_event.is_set():
+            self.run_once()
+            self._stop_event.wait(self.renew_interval)
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self, release: bool = True):
+        """
+        Stop polling, and release the leases so other workers can take them
+        over without waiting for them to expire.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._executor.shutdown(wait=True)
+        if release:
+            for shard_id in self.owned_shard_ids:
+                self.lease_table.release_lease(shard_id, self.worker_id)
+                self._drop(shard_id)
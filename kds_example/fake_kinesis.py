@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+
+"""
+An in-memory stand-in for the boto3 kinesis client.
+
+It implements the subset of the Kinesis Data Stream API this project uses,
+with the same request / response shape as ``boto3.client("kinesis")``, so
+producers and consumers can be exercised offline:
+
+- ``create_stream``, ``describe_stream_summary``, ``list_shards``
+- ``put_record``, ``put_records``
+- ``get_shard_iterator``, ``get_records``
+- ``split_shard``, ``merge_shards`` (resharding, with ``ChildShards``)
+
+Optionally it enforces the per shard write quota (1000 records / sec and
+1 MiB / sec) the same way as the real service, by failing the records over
+the quota with ``ProvisionedThroughputExceededException``, and adds a fixed
+latency to every put, so load tests can run offline.
+
+Partition keys are routed with the same MD5 hash key space as the real
+service. Errors are raised as :class:`FakeClientError`, which exposes the
+same ``response["Error"]["Code"]`` structure as ``botocore``'s ``ClientError``.
+"""
+
+import time
+import hashlib
+import threading
+from datetime import datetime, timezone
+from typing import List, Dict, Optional, Any
+
+MAX_HASH_KEY = 2 ** 128 - 1
+SHARD_MAX_RECORDS_PER_SEC = 1000
+SHARD_MAX_BYTES_PER_SEC = 1024 * 1024
+
+
+class FakeClientError(Exception):
+    def __init__(self, code: str, message: str = ""):
+        super().__init__(f"{code}: {message}")
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+
+def get_error_code(e: Exception) -> Optional[str]:
+    """
+    Get the AWS error code from a ``botocore`` ``ClientError`` or a
+    :class:`FakeClientError`, None for any other exception.
+    """
+    response = getattr(e, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code")
+    return None
+
+
+def hash_partition_key(partition_key: str) -> int:
+    """
+    Map a partition key to the 128 bit hash key space, same as Kinesis.
+    """
+    return int(hashlib.md5(partition_key.encode("utf-8")).hexdigest(), 16)
+
+
+class _Shard:
+    def __init__(
+        self,
+        shard_id: str,
+        starting_hash_key: int,
+        ending_hash_key: int,
+        starting_sequence_number: int,
+        parent_shard_id: Optional[str] = None,
+        adjacent_parent_shard_id: Optional[str] = None,
+    ):
+        self.shard_id = shard_id
+        self.starting_hash_key = starting_hash_key
+        self.ending_hash_key = ending_hash_key
+        self.starting_sequence_number = starting_sequence_number
+        self.ending_sequence_number: Optional[int] = None
+        self.parent_shard_id = parent_shard_id
+        self.adjacent_parent_shard_id = adjacent_parent_shard_id
+        self.child_shard_ids: List[str] = list()
+        # list of (sequence_number, partition_key, data, arrival_time)
+        self.records: List[tuple] = list()
+        # write quota usage of the current second, (second, n_records, n_bytes)
+        self.usage = (0, 0, 0)
+
+    def consume_quota(self, n_bytes: int, now: float) -> bool:
+        """
+        Return False if writing one more record of ``n_bytes`` exceeds the
+        per second write quota of the shard.
+        """
+        second, n_records_used, n_bytes_used = self.usage
+        if int(now) != second:
+            second, n_records_used, n_bytes_used = int(now), 0, 0
+        if (
+            n_records_used + 1 > SHARD_MAX_RECORDS_PER_SEC
+            or n_bytes_used + n_bytes > SHARD_MAX_BYTES_PER_SEC
+        ):
+            return False
+        self.usage = (second, n_records_used + 1, n_bytes_used + n_bytes)
+        return True
+
+    @property
+    def is_open(self) -> bool:
+        return self.ending_sequence_number is None
+
+    def to_dict(self) -> dict:
+        dct = {
+            "ShardId": self.shard_id,
+            "HashKeyRange": {
+                "StartingHashKey": str(self.starting_hash_key),
+                "EndingHashKey": str(self.ending_hash_key),
+            },
+            "SequenceNumberRange": {
+                "StartingSequenceNumber": str(self.starting_sequence_number),
+            },
+        }
+        if self.ending_sequence_number is not None:
+            dct["SequenceNumberRange"]["EndingSequenceNumber"] = str(self.ending_sequence_number)
+        if self.parent_shard_id:
+            dct["ParentShardId"] = self.parent_shard_id
+        if self.adjacent_parent_shard_id:
+            dct["AdjacentParentShardId"] = self.adjacent_parent_shard_id
+        return dct
+
+    def index_after(self, sequence_number: int) -> int:
+        """
+        Position of the first record whose sequence number is greater than
+        the given one.
+        """
+        for i, record in enumerate(self.records):
+            if record[0] > sequence_number:
+                return i
+        return len(self.records)
+
+
+class _Stream:
+    def __init__(self, name: str):
+        self.name = name
+        self.shards: Dict[str, _Shard] = dict()
+        self.n_shard_created = 0
+
+    def new_shard_id(self) -> str:
+        shard_id = "shardId-%012d" % self.n_shard_created
+        self.n_shard_created += 1
+        return shard_id
+
+    def open_shards(self) -> List[_Shard]:
+        return [shard for shard in self.shards.values() if shard.is_open]
+
+    def route(self, partition_key: str, explicit_hash_key: Optional[str] = None) -> _Shard:
+        if explicit_hash_key is None:
+            hash_key = hash_partition_key(partition_key)
+        else:
+            hash_key = int(explicit_hash_key)
+        for shard in self.open_shards():
+            if shard.starting_hash_key <= hash_key <= shard.ending_hash_key:
+                return shard
+        raise FakeClientError("InternalFailure", f"no shard for hash key {hash_key}")
+
+
+class FakeKinesisClient:
+    """
+    Thread safe in-memory kinesis client.
+
+    :param clock: a zero argument callable returning the current epoch time
+        in seconds, so tests and simulators can drive time themselves.
+    :param enforce_shard_limits: fail the records over the shard write quota.
+    :param latency: seconds to sleep in every put call, outside of the lock.
+    """
+
+    def __init__(
+        self,
+        clock=time.time,
+        enforce_shard_limits: bool = False,
+        latency: float = 0.0,
+    ):
+        self.clock = clock
+        self.enforce_shard_limits = enforce_shard_limits
+        self.latency = latency
+        self._streams: Dict[str, _Stream] = dict()
+        self._sequence_number = 10 ** 20
+        self._lock = threading.RLock()
+
+    # --- helpers
+    def _get_stream(self, StreamName: str) -> _Stream:
+        try:
+            return self._streams[StreamName]
+        except KeyError:
+            raise FakeClientError(
+                "ResourceNotFoundException", f"Stream {StreamName} not found"
+            )
+
+    def _next_sequence_number(self) -> int:
+        self._sequence_number += 1
+        return self._sequence_number
+
+    def _new_shard(self, stream: _Stream, starting_hash_key: int, ending_hash_key: int, **kwargs) -> _Shard:
+        shard = _Shard(
+            shard_id=stream.new_shard_id(),
+            starting_hash_key=starting_hash_key,
+            ending_hash_key=ending_hash_key,
+            starting_sequence_number=self._next_sequence_number(),
+            **kwargs
+        )
+        stream.shards[shard.shard_id] = shard
+        return shard
+
+    def _close_shard(self, shard: _Shard, children: List[_Shard]):
+        shard.ending_sequence_number = self._next_sequence_number()
+        shard.child_shard_ids = [child.shard_id for child in children]
+
+    # --- control plane
+    def create_stream(self, StreamName: str, ShardCount: int = 1, **kwargs) -> dict:
+        with self._lock:
+            if StreamName in self._streams:
+                raise FakeClientError("ResourceInUseException", f"Stream {StreamName} exists")
+            stream = _Stream(StreamName)
+            width = (MAX_HASH_KEY + 1) // ShardCount
+            for i in range(ShardCount):
+                start = i * width
+                end = MAX_HASH_KEY if i == ShardCount - 1 else (i + 1) * width - 1
+                self._new_shard(stream, start, end)
+            self._streams[StreamName] = stream
+            return {}
+
+    def describe_stream_summary(self, StreamName: str) -> dict:
+        with self._lock:
+            stream = self._get_stream(StreamName)
+            return {
+                "StreamDescriptionSummary": {
+                    "StreamName": StreamName,
+                    "StreamStatus": "ACTIVE",
+                    "OpenShardCount": len(stream.open_shards()),
+                }
+            }
+
+    def list_shards(self, StreamName: str = None, NextToken: str = None, **kwargs) -> dict:
+        with self._lock:
+            stream = self._get_stream(StreamName)
+            return {"Shards": [shard.to_dict() for shard in stream.shards.values()]}
+
+    def split_shard(self, StreamName: str, ShardToSplit: str, NewStartingHashKey: str) -> dict:
+        with self._lock:
+            stream = self._get_stream(StreamName)
+            parent = stream.shards[ShardToSplit]
+            if not parent.is_open:
+                raise FakeClientError("ResourceInUseException", f"{ShardToSplit} is closed")
+            new_start = int(NewStartingHashKey)
+            left = self._new_shard(
+                stream, parent.starting_hash_key, new_start - 1,
+                parent_shard_id=parent.shard_id,
+            )
+            right = self._new_shard(
+                stream, new_start, parent.ending_hash_key,
+                parent_shard_id=parent.shard_id,
+            )
+            self._close_shard(parent, [left, right])
+            return {}
+
+    def merge_shards(self, StreamName: str, ShardToMerge: str, AdjacentShardToMerge: str) -> dict:
+        with self._lock:
+            stream = self._get_stream(StreamName)
+            shard = stream.shards[ShardToMerge]
+            adjacent = stream.shards[AdjacentShardToMerge]
+            low, high = sorted([shard, adjacent], key=lambda s: s.starting_hash_key)
+            if low.ending_hash_key + 1 != high.starting_hash_key:
+                raise FakeClientError("InvalidArgumentException", "shards are not adjacent")
+            child = self._new_shard(
+                stream, low.starting_hash_key, high.ending_hash_key,
+                parent_shard_id=shard.shard_id,
+                adjacent_parent_shard_id=adjacent.shard_id,
+            )
+            self._close_shard(shard, [child])
+            self._close_shard(adjacent, [child])
+            return {}
+
+    # --- data plane
+    def _put_record(
+        self,
+        StreamName: str,
+        Data: bytes,
+        PartitionKey: str,
+        ExplicitHashKey: str = None,
+        **kwargs
+    ) -> dict:
+        stream = self._get_stream(StreamName)
+        shard = stream.route(PartitionKey, ExplicitHashKey)
+        now = self.clock()
+        if self.enforce_shard_limits:
+            n_bytes = len(Data) + len(PartitionKey.encode("utf-8"))
+            if not shard.consume_quota(n_bytes, now):
+                return {
+                    "ErrorCode": "ProvisionedThroughputExceededException",
+                    "ErrorMessage": f"Rate exceeded for shard {shard.shard_id} in stream {StreamName}",
+                }
+        sequence_number = self._next_sequence_number()
+        shard.records.append((sequence_number, PartitionKey, bytes(Data), now))
+        return {"ShardId": shard.shard_id, "SequenceNumber": str(sequence_number)}
+
+    def put_record(self, StreamName: str, Data: bytes, PartitionKey: str, **kwargs) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            result = self._put_record(StreamName, Data, PartitionKey, **kwargs)
+        if "ErrorCode" in result:
+            raise FakeClientError(result["ErrorCode"], result["ErrorMessage"])
+        return result
+
+    def put_records(self, Records: List[dict], StreamName: str, **kwargs) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            results = [
+                self._put_record(StreamName=StreamName, **record)
+                for record in Records
+            ]
+        return {
+            "FailedRecordCount": sum(1 for result in results if "ErrorCode" in result),
+            "Records": results,
+        }
+
+    def get_shard_iterator(
+        self,
+        StreamName: str,
+        ShardId: str,
+        ShardIteratorType: str,
+        StartingSequenceNumber: str = None,
+        Timestamp: Any = None,
+    ) -> dict:
+        with self._lock:
+            stream = self._get_stream(StreamName)
+            try:
+                shard = stream.shards[ShardId]
+            except KeyError:
+                raise FakeClientError("ResourceNotFoundException", f"Shard {ShardId} not found")
+            if ShardIteratorType == "TRIM_HORIZON":
+                position = 0
+            elif ShardIteratorType == "LATEST":
+                position = len(shard.records)
+            elif ShardIteratorType == "AT_SEQUENCE_NUMBER":
+                position = shard.index_after(int(StartingSequenceNumber) - 1)
+            elif ShardIteratorType == "AFTER_SEQUENCE_NUMBER":
+                position = shard.index_after(int(StartingSequenceNumber))
+            elif ShardIteratorType == "AT_TIMESTAMP":
+                if isinstance(Timestamp, datetime):
+                    Timestamp = Timestamp.timestamp()
+                position = len(shard.records)
+                for i, record in enumerate(shard.records):
+                    if record[3] >= Timestamp:
+                        position = i
+                        break
+            else:
+                raise FakeClientError("InvalidArgumentException", ShardIteratorType)
+            return {"ShardIterator": f"{StreamName}|{ShardId}|{position}"}
+
+    def get_records(self, ShardIterator: str, Limit: int = 10000) -> dict:
+        with self._lock:
+            stream_name, shard_id, position = ShardIterator.split("|")
+            position = int(position)
+            shard = self._get_stream(stream_name).shards[shard_id]
+            records = shard.records[position:position + Limit]
+            next_position = position + len(records)
+            now = self.clock()
+            if next_position < len(shard.records):
+                millis_behind_latest = int((now - shard.records[next_position][3]) * 1000)
+            else:
+                millis_behind_latest = 0
+            response = {
+                "Records": [
+                    {
+                        "SequenceNumber": str(sequence_number),
+                        "ApproximateArrivalTimestamp": datetime.fromtimestamp(arrival_time, tz=timezone.utc),
+                        "Data": data,
+                        "PartitionKey": partition_key,
+                    }
+                    for sequence_number, partition_key, data, arrival_time in records
+                ],
+                "MillisBehindLatest": millis_behind_latest,
+            }
+            if (not shard.is_open) and next_position >= len(shard.records):
+                stream = self._get_stream(stream_name)
+                child_shards = list()
+                for child_id in shard.child_shard_ids:
+                    child = stream.shards[child_id]
+                    child_shards.append({
+                        "ShardId": child_id,
+                        "ParentShards": [
+                            shard_id
+                            for shard_id in [
+                                child.parent_shard_id,
+                                child.adjacent_parent_shard_id,
+                            ]
+                            if shard_id
+                        ],
+                        "HashKeyRange": child.to_dict()["HashKeyRange"],
+                    })
+                response["NextShardIterator"] = None
+                response["ChildShards"] = child_shards
+            else:
+                response["NextShardIterator"] = f"{stream_name}|{shard_id}|{next_position}"
+            return response
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fan-out: the ingestion is split over N data streams, each one with its own
+"to-s3" and "to-oss" delivery streams, so the shard reads, the firehose
+ingestion, the lambda processor and the destination delivery of a
+destination are all split N ways.
+
+A delivery stream always reads every shard of its source stream, so the
+split has to happen before the data stream: the producers send a record to
+the data stream ``i`` of ``n`` chosen from its partition key, see
+:func:`fan_out_index` and :class:`kds_example.kds_helper.FanOutKinesisClient`.
+The records of a partition key stay in order in one data stream.
+
+The data streams and delivery streams are named ``{name}-{i:02d}of{n:02d}``
+and the delivery streams write to the ``{prefix}{i:02d}/`` sub folders.
+With ``n = 1`` the names and prefixes are unchanged.
+"""
+
+import re
+import hashlib
+from typing import List, Dict, Tuple, Optional
+
+fan_out_name_pattern = re.compile(r"-(?P<index>\d{2})of(?P<fan_out>\d{2})$")
+
+
+def fan_out_name(name: str, index: int, fan_out: int) -> str:
+    """
+    Name of the data stream or delivery stream ``index`` of ``fan_out``.
+    """
+    if fan_out == 1:
+        return name
+    return f"{name}-{index:02d}of{fan_out:02d}"
+
+
+def fan_out_names(name: str, fan_out: int) -> List[str]:
+    return [fan_out_name(name, i, fan_out) for i in range(fan_out)]
+
+
+def fan_out_prefix(prefix: str, index: int, fan_out: int) -> str:
+    """
+    S3 prefix of the delivery stream ``index`` of ``fan_out``, a sub folder
+    of ``prefix`` so the tools listing ``prefix`` still see every object.
+    """
+    if fan_out == 1:
+        return prefix
+    return f"{prefix}{index:02d}/"
+
+
+def parse_fan_out_name(name: str) -> Optional[Tuple[int, int]]:
+    """
+    :return: (index, fan out) of a stream name, None if it is not a fan-out
+        stream.
+    """
+    match = fan_out_name_pattern.search(name)
+    if match is None:
+        return None
+    return int(match.group("index")), int(match.group("fan_out"))
+
+
+def fan_out_index(partition_key: str, fan_out: int) -> int:
+    """
+    The data stream of a partition key, the MD5 hash kinesis uses to map a
+    partition key to a shard, so the split is even and stable.
+    """
+    if fan_out == 1:
+        return 0
+    return int(hashlib.md5(partition_key.encode("utf-8")).hexdigest(), 16) % fan_out
+
+
+def route_records(kin_records: List[dict], fan_out: int) -> Dict[int, List[int]]:
+    """
+    :return: data stream index -> positions of its records in ``kin_records``.
+    """
+    routes: Dict[int, List[int]] = dict()
+    for position, kin_record in enumerate(kin_records):
+        routes.setdefault(fan_out_index(kin_record["PartitionKey"], fan_out), list()).append(position)
+    return routes
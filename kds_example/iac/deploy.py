@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+
+"""
+Faster deploys of the cottonformation stacks.
+
+- :func:`deploy_template` compares the rendered template with the deployed
+  one and skips the deploy when nothing changed, otherwise it deploys
+  through a change set, prints the planned changes and the time each
+  resource took.
+- :func:`split_template` cuts the stack template into one template per
+  resource group (RG1 - RG6), references between groups become exports /
+  ``Fn::ImportValue``. :func:`deploy_groups` deploys the groups wave by
+  wave, the groups of a wave don't depend on each other and are deployed in
+  parallel. A change in the delivery streams doesn't wait on the OpenSearch
+  domain stack anymore, it is skipped.
+
+The functions take boto3 clients, nothing is called at import time.
+"""
+
+import re
+import json
+import time
+import hashlib
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Set, Callable, Optional
+
+import attr
+
+from ..fake_kinesis import get_error_code
+
+# the TemplateBody limit of CreateChangeSet, larger templates are uploaded
+MAX_TEMPLATE_BODY_SIZE = 51200
+
+SHARED_SECTIONS = ["AWSTemplateFormatVersion", "Parameters", "Mappings", "Conditions"]
+
+NO_CHANGES_REASONS = ("didn't contain changes", "No updates are to be performed")
+
+
+def as_reference(obj) -> Optional[Tuple[str, Optional[str]]]:
+    """
+    :return: (logical id, attribute or None) if ``obj`` is a ``Ref`` or a
+        ``Fn::GetAtt``, pseudo parameters ``AWS::*`` excluded.
+    """
+    if not isinstance(obj, dict) or len(obj) != 1:
+        return None
+    if "Ref" in obj and not obj["Ref"].startswith("AWS::"):
+        return obj["Ref"], None
+    if "Fn::GetAtt" in obj:
+        value = obj["Fn::GetAtt"]
+        logical_id, attribute = value.split(".", 1) if isinstance(value, str) else value
+        return logical_id, attribute
+    return None
+
+
+def find_references(obj) -> Set[Tuple[str, Optional[str]]]:
+    """
+    :return: the :func:`as_reference` of a template fragment.
+    """
+    refs = set()
+    if isinstance(obj, dict):
+        ref = as_reference(obj)
+        if ref is not None:
+            refs.add(ref)
+        elif "Ref" not in obj:
+            for value in obj.values():
+                refs.update(find_references(value))
+    elif isinstance(obj, list):
+        for value in obj:
+            refs.update(find_references(value))
+    return refs
+
+
+def diff_templates(deployed: dict, rendered: dict) -> Dict[str, List[str]]:
+    """
+    :return: the added, removed and modified resources and outputs, by
+        logical id.
+    """
+    diff = {"added": [], "removed": [], "modified": []}
+    for section in ["Resources", "Outputs"]:
+        old, new = deployed.get(section, {}), rendered.get(section, {})
+        diff["added"].extend(sorted(set(new) - set(old)))
+        diff["removed"].extend(sorted(set(old) - set(new)))
+        diff["modified"].extend(sorted(
+            key for key in set(old) & set(new)
+            if json.dumps(old[key], sort_keys=True) != json.dumps(new[key], sort_keys=True)
+        ))
+    # parameters, mappings, ... changed
+    for section in SHARED_SECTIONS:
+        if json.dumps(deployed.get(section), sort_keys=True) != json.dumps(rendered.get(section), sort_keys=True):
+            diff["modified"].append(section)
+    return diff
+
+
+def has_changes(diff: Dict[str, List[str]]) -> bool:
+    return any(diff.values())
+
+
+def output_key(logical_id: str, attribute: Optional[str]) -> str:
+    return logical_id + "".join(char for char in (attribute or "") if char.isalnum())
+
+
+def export_name(prefix: str, logical_id: str, attribute: Optional[str]) -> str:
+    return f"{prefix}-{output_key(logical_id, attribute)}"
+
+
+def _replace_references(obj, owner: Dict[str, str], group: str, prefix: str):
+    if isinstance(obj, dict):
+        ref = as_reference(obj)
+        if ref is not None:
+            logical_id, attribute = ref
+            if owner.get(logical_id, group) != group:
+                return {"Fn::ImportValue": export_name(prefix, logical_id, attribute)}
+            return obj
+        if "Fn::Sub" in obj:
+            text = obj["Fn::Sub"] if isinstance(obj["Fn::Sub"], str) else obj["Fn::Sub"][0]
+            for logical_id in owner:
+                if owner[logical_id] != group and re.search(r"\$\{" + logical_id + r"[.}]", text):
+                    raise ValueError(f"cross group reference to {logical_id} in Fn::Sub is not supported")
+        return {key: _replace_references(value, owner, group, prefix) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_replace_references(value, owner, group, prefix) for value in obj]
+    return obj
+
+
+def split_template(
+    template: dict,
+    groups: Dict[str, List[str]],
+    prefix: str,
+) -> Tuple[Dict[str, dict], Dict[str, Set[str]]]:
+    """
+    Split a template into one template per group.
+
+    :param groups: group name -> logical ids of the resources of the group,
+        every resource must be in exactly one group.
+    :param prefix: prefix of the export names, usually the stack name.
+    :return: (group name -> template, group name -> the groups it depends on)
+    """
+    owner = dict()
+    for group, logical_ids in groups.items():
+        for logical_id in logical_ids:
+            if logical_id in owner:
+                raise ValueError(f"{logical_id} is in both {owner[logical_id]} and {group}")
+            owner[logical_id] = group
+    missing = set(template.get("Resources", {})) - set(owner)
+    if missing:
+        raise ValueError(f"resources not in any group: {sorted(missing)}")
+
+    templates = {
+        group: {
+            **{section: template[section] for section in SHARED_SECTIONS if section in template},
+            "Resources": {},
+            "Outputs": {},
+        }
+        for group in groups
+    }
+    depends_on = {group: set() for group in groups}
+    for logical_id, resource in template.get("Resources", {}).items():
+        group = owner[logical_id]
+        resource = dict(resource)
+        # the waves order the groups, cross group DependsOn are dropped
+        if "DependsOn" in resource:
+            dependencies = resource["DependsOn"]
+            dependencies = [dependencies] if isinstance(dependencies, str) else dependencies
+            for dependency in dependencies:
+                if owner[dependency] != group:
+                    depends_on[group].add(owner[dependency])
+            local = [dependency for dependency in dependencies if owner[dependency] == group]
+            if local:
+                resource["DependsOn"] = local
+            else:
+                resource.pop("DependsOn")
+        for ref_id, attribute in find_references(resource):
+            ref_group = owner.get(ref_id, group)
+            if ref_group != group:
+                depends_on[group].add(ref_group)
+                value = {"Ref": ref_id} if attribute is None else {"Fn::GetAtt": [ref_id, attribute]}
+                templates[ref_group]["Outputs"][output_key(ref_id, attribute)] = {
+                    "Value": value,
+                    "Export": {"Name": export_name(prefix, ref_id, attribute)},
+                }
+        templates[group]["Resources"][logical_id] = _replace_references(resource, owner, group, prefix)
+
+    for key, output in template.get("Outputs", {}).items():
+        refs = find_references(output)
+        group = owner[sorted(refs)[0][0]] if refs else list(groups)[0]
+        templates[group]["Outputs"][key] = _replace_references(output, owner, group, prefix)
+    for group_template in templates.values():
+        if not group_template["Outputs"]:
+            group_template.pop("Outputs")
+    return templates, depends_on
+
+
+def plan_waves(depends_on: Dict[str, Set[str]]) -> List[List[str]]:
+    """
+    Order the groups in waves, a group only depends on groups of the
+    previous waves.
+    """
+    waves, done = list(), set()
+    while len(done) < len(depends_on):
+        wave = sorted(
+            group for group, dependencies in depends_on.items()
+            if group not in done and dependencies <= done
+        )
+        if not wave:
+            raise ValueError(f"circular dependency between {sorted(set(depends_on) - done)}")
+        waves.append(wave)
+        done.update(wave)
+    return waves
+
+
+@attr.s
+class ResourceTiming:
+    logical_id: str = attr.ib()
+    resource_type: str = attr.ib()
+    status: str = attr.ib()
+    seconds: float = attr.ib()
+
+
+def resource_timings(events: List[dict], since: datetime = None) -> List[ResourceTiming]:
+    """
+    How long each resource took, from its first ``*_IN_PROGRESS`` event to
+    its last event, the slowest first.
+
+    :param events: ``describe_stack_events`` events, in any order.
+    :param since: only the events after it.
+    """
+    first, last = dict(), dict()
+    for event in sorted(events, key=lambda e: e["Timestamp"]):
+        if (since is not None and event["Timestamp"] <= since) or event["ResourceType"] == "AWS::CloudFormation::Stack":
+            continue
+        logical_id = event["LogicalResourceId"]
+        if event["ResourceStatus"].endswith("_IN_PROGRESS"):
+            first.setdefault(logical_id, event)
+        last[logical_id] = event
+    timings = [
+        ResourceTiming(
+            logical_id=logical_id,
+            resource_type=event["ResourceType"],
+            status=event["ResourceStatus"],
+            seconds=(event["Timestamp"] - first.get(logical_id, event)["Timestamp"]).total_seconds(),
+        )
+        for logical_id, event in last.items()
+    ]
+    return sorted(timings, key=lambda timing: -timing.seconds)
+
+
+def format_timings(timings: List[ResourceTiming]) -> str:
+    return "\n".join(
+        f"{timing.seconds:8.1f}s  {timing.status:<20}  {timing.logical_id} ({timing.resource_type})"
+        for timing in timings
+    )
+
+
+@attr.s
+class DeployResult:
+    stack_name: str = attr.ib()
+    status: str = attr.ib()  # SKIPPED, NO_CHANGES or the final stack status
+    diff: Dict[str, List[str]] = attr.ib(factory=dict)
+    changes: List[dict] = attr.ib(factory=list)
+    timings: List[ResourceTiming] = attr.ib(factory=list)
+    seconds: float = attr.ib(default=0.0)
+
+
+def get_deployed_template(cf_client, stack_name: str) -> Optional[dict]:
+    """
+    :return: the template of a stack, None if the stack doesn't exist or
+        has never been deployed.
+    """
+    try:
+        res = cf_client.describe_stacks(StackName=stack_name)
+    except Exception as e:
+        if get_error_code(e) == "ValidationError":
+            return None
+        raise
+    if res["Stacks"][0]["StackStatus"] == "REVIEW_IN_PROGRESS":
+        return None
+    body = cf_client.get_template(StackName=stack_name, TemplateStage="Original")["TemplateBody"]
+    return json.loads(body) if isinstance(body, str) else body
+
+
+def deploy_template(
+    cf_client,
+    stack_name: str,
+    template: dict,
+    capabilities: List[str] = ("CAPABILITY_IAM", "CAPABILITY_NAMED_IAM"),
+    s3_client=None,
+    bucket: str = None,
+    force: bool = False,
+    poll_interval: float = 5.0,
+    sleep: Callable[[float], None] = time.sleep,
+    print_func: Callable[[str], None] = print,
+) -> DeployResult:
+    """
+    Create or update a stack through a change set, skipped when the
+    template equals the deployed one.
+
+    :param s3_client: with ``bucket``, where templates larger than the
+        ``TemplateBody`` limit are uploaded.
+    :param force: create the change set even if the templates are equal.
+    """
+    st = time.perf_counter()
+    deployed = get_deployed_template(cf_client, stack_name)
+    diff = diff_templates(deployed or {}, template)
+    if deployed is not None and not has_changes(diff) and not force:
+        print_func(f"{stack_name}: no change, skipped")
+        return DeployResult(stack_name=stack_name, status="SKIPPED", diff=diff)
+    print_func(f"{stack_name}: {json.dumps(diff)}")
+
+    body = json.dumps(template)
+    kwargs = dict(
+        StackName=stack_name,
+        ChangeSetName=f"deploy-{datetime.now(timezone.utc):%Y%m%d%H%M%S}",
+        ChangeSetType="UPDATE" if deployed is not None else "CREATE",
+        Capabilities=list(capabilities),
+    )
+    if len(body) > MAX_TEMPLATE_BODY_SIZE:
+        if s3_client is None or bucket is None:
+            raise ValueError(f"template of {stack_name} is {len(body)} bytes, an s3 bucket is required")
+        key = f"cloudformation/{stack_name}/{hashlib.md5(body.encode('utf-8')).hexdigest()}.json"
+        s3_client.put_object(Bucket=bucket, Key=key, Body=body.encode("utf-8"))
+        kwargs["TemplateURL"] = f"https://{bucket}.s3.amazonaws.com/{key}"
+    else:
+        kwargs["TemplateBody"] = body
+    change_set_id = cf_client.create_change_set(**kwargs)["Id"]
+
+    while True:
+        change_set = cf_client.describe_change_set(ChangeSetName=change_set_id, StackName=stack_name)
+        if change_set["Status"] not in ("CREATE_PENDING", "CREATE_IN_PROGRESS"):
+            break
+        sleep(poll_interval)
+    if change_set["Status"] == "FAILED":
+        reason = change_set.get("StatusReason", "")
+        if any(text in reason for text in NO_CHANGES_REASONS):
+            cf_client.delete_change_set(ChangeSetName=change_set_id, StackName=stack_name)
+            print_func(f"{stack_name}: no change, skipped")
+            return DeployResult(stack_name=stack_name, status="NO_CHANGES", diff=diff)
+        raise RuntimeError(f"change set of {stack_name} failed: {reason}")
+
+    changes = [change["ResourceChange"] for change in change_set.get("Changes", [])]
+    for change in changes:
+        print_func(
+            f"{stack_name}: {change['Action']:<7} {change['LogicalResourceId']} "
+            f"({change['ResourceType']}) replacement={change.get('Replacement', 'N/A')}"
+        )
+
+    # only the events of this deploy are timed
+    previous_events = cf_client.describe_stack_events(StackName=stack_name)["StackEvents"]
+    since = max(event["Timestamp"] for event in previous_events) if previous_events else None
+    cf_client.execute_change_set(ChangeSetName=change_set_id, StackName=stack_name)
+    while True:
+        stack = cf_client.describe_stacks(StackName=stack_name)["Stacks"][0]
+        status = stack["StackStatus"]
+        if not status.endswith("_IN_PROGRESS"):
+            break
+        sleep(poll_interval)
+
+    events = list()
+    for page in cf_client.get_paginator("describe_stack_events").paginate(StackName=stack_name):
+        events.extend(page["StackEvents"])
+        # newest first, stop at the previous deploy
+        if since is not None and page["StackEvents"] and page["StackEvents"][-1]["Timestamp"] <= since:
+            break
+    timings = resource_timings(events, since)
+    print_func(f"{stack_name}: {status}\n{format_timings(timings)}")
+    if status not in ("CREATE_COMPLETE", "UPDATE_COMPLETE"):
+        raise RuntimeError(f"deploy of {stack_name} failed: {status}")
+    return DeployResult(
+        stack_name=stack_name,
+        status=status,
+        diff=diff,
+        changes=changes,
+        timings=timings,
+        seconds=time.perf_counter() - st,
+    )
+
+
+def deploy_groups(
+    cf_client,
+    stack_name: str,
+    template: dict,
+    groups: Dict[str, List[str]],
+    max_workers: int = 6,
+    **kwargs,
+) -> Dict[str, DeployResult]:
+    """
+    Deploy each group of :func:`split_template` as the stack
+    ``{stack_name}-{group}``, the independent groups in parallel.
+
+    :param kwargs: see :func:`deploy_template`.
+    """
+    templates, depends_on = split_template(template, groups, prefix=stack_name)
+    results = dict()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for wave in plan_waves(depends_on):
+            futures = {
+                group: executor.submit(
+                    deploy_template, cf_client, f"{stack_name}-{group.lower()}", templates[group], **kwargs
+                )
+                for group in wave
+            }
+            for group, future in futures.items():
+                results[group] = future.result()
+    return results
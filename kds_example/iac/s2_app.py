@@ -27,15 +27,16 @@ Resources:
     - kinesis firehose
 """
 
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 import attr
 import cottonformation as cft
 from cottonformation.res import (
-    s3, iam, opensearchservice, kinesis, kinesisfirehose, awslambda,
+    s3, iam, opensearchservice, kinesis, kinesisfirehose, awslambda, dynamodb,
 )
 
 from ..config import config
 from ..boto_ses import aws_account_id, aws_region
+from ..fan_out import fan_out_names, fan_out_prefix
 
 
 def ensure_endswith_slash(s3_prefix: str) -> str:
@@ -259,7 +260,7 @@ def create_delivery_stream_with_s3_destination(
     aws_account_id: str,
     aws_region: str,
     delivery_stream_name: str,
-    kinesis_data_stream: kinesis.Stream,
+    kinesis_data_stream: Optional[kinesis.Stream],
     delivery_stream_iam_role: iam.Role,
     destination_s3_bucket: str,
     destination_s3_prefix_success: str,
@@ -274,6 +275,8 @@ def create_delivery_stream_with_s3_destination(
     s3_backup_buffer_hint_interval_in_sec: int,
     lambda_buffer_hint_size_in_mb: int,
     lambda_buffer_hint_interval_in_sec: int,
+    permission_logic_id: str = "DeliveryStreamToS3LbdPermission",
+    s3_backup_enabled: bool = True,
 ) -> Tuple[
     kinesisfirehose.DeliveryStream,
     awslambda.Permission,
@@ -285,7 +288,8 @@ def create_delivery_stream_with_s3_destination(
     :param aws_account_id:
     :param aws_region:
     :param delivery_stream_name:
-    :param kinesis_data_stream:
+    :param kinesis_data_stream: the source stream, None for a Direct PUT
+        delivery stream, see :func:`create_direct_put_delivery_stream_with_s3_destination`.
     :param delivery_stream_iam_role:
     :param destination_s3_bucket:
     :param destination_s3_prefix_success:
@@ -300,6 +304,8 @@ def create_delivery_stream_with_s3_destination(
     :param s3_backup_buffer_hint_interval_in_sec:
     :param lambda_buffer_hint_size_in_mb:
     :param lambda_buffer_hint_interval_in_sec:
+    :param permission_logic_id: logic id of the lambda permission.
+    :param s3_backup_enabled: back up the source records.
     :return:
     """
     destination_s3_prefix_success = ensure_endswith_slash(destination_s3_prefix_success)
@@ -307,14 +313,40 @@ def create_delivery_stream_with_s3_destination(
     backup_s3_prefix_success = ensure_endswith_slash(backup_s3_prefix_success)
     backup_s3_prefix_failed = ensure_endswith_slash(backup_s3_prefix_failed)
 
+    if s3_backup_enabled:
+        backup_kwargs = dict(
+            p_S3BackupMode="Enabled",
+            p_S3BackupConfiguration=kinesisfirehose.PropDeliveryStreamS3DestinationConfiguration(
+                rp_BucketARN=f"arn:aws:s3:::{backup_s3_bucket}",
+                rp_RoleARN=delivery_stream_iam_role.rv_Arn,
+                p_Prefix=backup_s3_prefix_success,
+                p_ErrorOutputPrefix=backup_s3_prefix_failed,
+                p_BufferingHints=kinesisfirehose.PropDeliveryStreamBufferingHints(
+                    p_IntervalInSeconds=s3_backup_buffer_hint_interval_in_sec,
+                    p_SizeInMBs=s3_backup_buffer_hint_size_in_mb,
+                ),
+            ),
+        )
+    else:
+        backup_kwargs = dict(p_S3BackupMode="Disabled")
+
+    if kinesis_data_stream is None:
+        source_kwargs = dict(p_DeliveryStreamType="DirectPut")
+        depends_on = [delivery_stream_iam_role]
+    else:
+        source_kwargs = dict(
+            p_DeliveryStreamType="KinesisStreamAsSource",
+            p_KinesisStreamSourceConfiguration=kinesisfirehose.PropDeliveryStreamKinesisStreamSourceConfiguration(
+                rp_KinesisStreamARN=kinesis_data_stream.rv_Arn,
+                rp_RoleARN=delivery_stream_iam_role.rv_Arn,
+            ),
+        )
+        depends_on = [delivery_stream_iam_role, kinesis_data_stream]
+
     delivery_stream = kinesisfirehose.DeliveryStream(
         logic_id,
         p_DeliveryStreamName=delivery_stream_name,
-        p_DeliveryStreamType="KinesisStreamAsSource",
-        p_KinesisStreamSourceConfiguration=kinesisfirehose.PropDeliveryStreamKinesisStreamSourceConfiguration(
-            rp_KinesisStreamARN=kinesis_data_stream.rv_Arn,
-            rp_RoleARN=delivery_stream_iam_role.rv_Arn,
-        ),
+        **source_kwargs,
         p_ExtendedS3DestinationConfiguration=kinesisfirehose.PropDeliveryStreamExtendedS3DestinationConfiguration(
             rp_BucketARN=f"arn:aws:s3:::{destination_s3_bucket}",
             rp_RoleARN=delivery_stream_iam_role.rv_Arn,
@@ -329,9 +361,135 @@ def create_delivery_stream_with_s3_destination(
                 p_LogGroupName=f"/aws/kinesis/firehose/{delivery_stream_name}",
                 p_LogStreamName="BackupDelivery",
             ),
-            p_S3BackupMode="Enabled",
-            p_S3BackupConfiguration=kinesisfirehose.PropDeliveryStreamS3DestinationConfiguration(
-                rp_BucketARN=f"arn:aws:s3:::{backup_s3_bucket}",
+            **backup_kwargs,
+            p_ProcessingConfiguration=kinesisfirehose.PropDeliveryStreamProcessingConfiguration(
+                p_Enabled=True,
+                p_Processors=[
+                    kinesisfirehose.PropDeliveryStreamProcessor(
+                        rp_Type="Lambda",
+                        p_Parameters=[
+                            kinesisfirehose.PropDeliveryStreamProcessorParameter(
+                                rp_ParameterName="LambdaArn",
+                                rp_ParameterValue=f"arn:aws:lambda:{aws_region}:{aws_account_id}:function:{transformation_lbd_func_name}",
+                            ),
+                            kinesisfirehose.PropDeliveryStreamProcessorParameter(
+                                rp_ParameterName="NumberOfRetries",
+                                rp_ParameterValue="1",
+                            ),
+                            kinesisfirehose.PropDeliveryStreamProcessorParameter(
+                                rp_ParameterName="RoleArn",
+                                rp_ParameterValue=delivery_stream_iam_role.rv_Arn,
+                            ),
+                            kinesisfirehose.PropDeliveryStreamProcessorParameter(
+                                rp_ParameterName="BufferIntervalInSeconds",
+                                rp_ParameterValue=f"{lambda_buffer_hint_interval_in_sec}",
+                            ),
+                            kinesisfirehose.PropDeliveryStreamProcessorParameter(
+                                rp_ParameterName="BufferSizeInMBs",
+                                rp_ParameterValue=f"{lambda_buffer_hint_size_in_mb}",
+                            ),
+                        ]
+                    )
+                ]
+            )
+        ),
+        ra_DependsOn=depends_on,
+    )
+
+    delivery_stream_to_lbd_permission = awslambda.Permission(
+        permission_logic_id,
+        rp_Action="lambda:InvokeFunction",
+        rp_FunctionName=f"arn:aws:lambda:{aws_region}:{aws_account_id}:function:{transformation_lbd_func_name}",
+        rp_Principal="firehose.amazonaws.com",
+        p_SourceArn=delivery_stream.rv_Arn,
+    )
+
+    return delivery_stream, delivery_stream_to_lbd_permission
+
+
+def create_direct_put_delivery_stream_with_s3_destination(
+    logic_id: str,
+    **kwargs
+) -> Tuple[
+    kinesisfirehose.DeliveryStream,
+    awslambda.Permission,
+]:
+    """
+    A delivery stream the producers write to with ``PutRecordBatch``, see
+    :class:`kds_example.kds_helper.FirehoseProducer`. No data stream, no
+    shard to pay for, good for low value streams with a single destination.
+    It takes the arguments of :func:`create_delivery_stream_with_s3_destination`
+    except ``kinesis_data_stream``.
+    """
+    return create_delivery_stream_with_s3_destination(
+        logic_id=logic_id,
+        kinesis_data_stream=None,
+        **kwargs
+    )
+
+
+def create_delivery_stream_with_oss_destination(
+    logic_id: str,
+    permission_logic_id: str,
+    aws_account_id: str,
+    aws_region: str,
+    delivery_stream_name: str,
+    kinesis_data_stream: kinesis.Stream,
+    delivery_stream_iam_role: iam.Role,
+    opensearch_domain: opensearchservice.Domain,
+    index_name: str,
+    backup_s3_bucket_arn: str,
+    backup_s3_prefix_success: str,
+    backup_s3_prefix_failed: str,
+    transformation_lbd_func_name: str,
+    delivery_stream_buffer_hint_size_in_mb: int,
+    delivery_stream_buffer_hint_interval_in_sec: int,
+    s3_backup_buffer_hint_size_in_mb: int,
+    s3_backup_buffer_hint_interval_in_sec: int,
+    lambda_buffer_hint_size_in_mb: int,
+    lambda_buffer_hint_interval_in_sec: int,
+) -> Tuple[
+    kinesisfirehose.DeliveryStream,
+    awslambda.Permission,
+]:
+    """
+    Delivery stream to an OpenSearch index, every document is also backed up
+    to S3 (``AllDocuments``). The Lambda Function should be deployed by AWS
+    Chalice, not by CloudFormation.
+
+    See :func:`create_delivery_stream_with_s3_destination` for the arguments.
+    """
+    backup_s3_prefix_success = ensure_endswith_slash(backup_s3_prefix_success)
+    backup_s3_prefix_failed = ensure_endswith_slash(backup_s3_prefix_failed)
+
+    delivery_stream = kinesisfirehose.DeliveryStream(
+        logic_id,
+        p_DeliveryStreamName=delivery_stream_name,
+        p_DeliveryStreamType="KinesisStreamAsSource",
+        p_KinesisStreamSourceConfiguration=kinesisfirehose.PropDeliveryStreamKinesisStreamSourceConfiguration(
+            rp_KinesisStreamARN=kinesis_data_stream.rv_Arn,
+            rp_RoleARN=delivery_stream_iam_role.rv_Arn,
+        ),
+        p_AmazonopensearchserviceDestinationConfiguration=kinesisfirehose.PropDeliveryStreamAmazonopensearchserviceDestinationConfiguration(
+            rp_IndexName=index_name,
+            rp_RoleARN=delivery_stream_iam_role.rv_Arn,
+            p_DomainARN=opensearch_domain.rv_DomainArn,
+            p_IndexRotationPeriod="NoRotation",
+            p_RetryOptions=kinesisfirehose.PropDeliveryStreamAmazonopensearchserviceRetryOptions(
+                p_DurationInSeconds=60,
+            ),
+            p_BufferingHints=kinesisfirehose.PropDeliveryStreamAmazonopensearchserviceBufferingHints(
+                p_IntervalInSeconds=delivery_stream_buffer_hint_interval_in_sec,
+                p_SizeInMBs=delivery_stream_buffer_hint_size_in_mb,
+            ),
+            p_CloudWatchLoggingOptions=kinesisfirehose.PropDeliveryStreamCloudWatchLoggingOptions(
+                p_Enabled=True,
+                p_LogGroupName=f"/aws/kinesis/firehose/{delivery_stream_name}",
+                p_LogStreamName="BackupDelivery",
+            ),
+            p_S3BackupMode="AllDocuments",
+            rp_S3Configuration=kinesisfirehose.PropDeliveryStreamS3DestinationConfiguration(
+                rp_BucketARN=backup_s3_bucket_arn,
                 rp_RoleARN=delivery_stream_iam_role.rv_Arn,
                 p_Prefix=backup_s3_prefix_success,
                 p_ErrorOutputPrefix=backup_s3_prefix_failed,
@@ -358,14 +516,14 @@ def create_delivery_stream_with_s3_destination(
                                 rp_ParameterName="RoleArn",
                                 rp_ParameterValue=delivery_stream_iam_role.rv_Arn,
                             ),
-                            kinesisfirehose.PropDeliveryStreamProcessorParameter(
-                                rp_ParameterName="BufferIntervalInSeconds",
-                                rp_ParameterValue=f"{lambda_buffer_hint_interval_in_sec}",
-                            ),
                             kinesisfirehose.PropDeliveryStreamProcessorParameter(
                                 rp_ParameterName="BufferSizeInMBs",
                                 rp_ParameterValue=f"{lambda_buffer_hint_size_in_mb}",
                             ),
+                            kinesisfirehose.PropDeliveryStreamProcessorParameter(
+                                rp_ParameterName="BufferIntervalInSeconds",
+                                rp_ParameterValue=f"{lambda_buffer_hint_interval_in_sec}",
+                            ),
                         ]
                     )
                 ]
@@ -378,11 +536,11 @@ def create_delivery_stream_with_s3_destination(
     )
 
     delivery_stream_to_lbd_permission = awslambda.Permission(
-        "DeliveryStreamToS3LbdPermission",
+        permission_logic_id,
         rp_Action="lambda:InvokeFunction",
         rp_FunctionName=f"arn:aws:lambda:{aws_region}:{aws_account_id}:function:{transformation_lbd_func_name}",
         rp_Principal="firehose.amazonaws.com",
-        p_SourceArn=kinesis_data_stream.rv_Arn,
+        p_SourceArn=delivery_stream.rv_Arn,
     )
 
     return delivery_stream, delivery_stream_to_lbd_permission
@@ -395,6 +553,17 @@ class Stack(cft.Stack):
     aws_account_id: str = attr.ib()
     aws_region: str = attr.ib()
     oss_index_name: str = attr.ib(default="bank_account")
+    # number of data streams, each one with its own delivery stream per
+    # destination, see kds_example/fan_out.py and kds_example/capacity.py
+    # to pick it, the producers have to use kds_helper.FanOutKinesisClient
+    fan_out: int = attr.ib(default=1)
+    kinesis_data_stream_shard_count: int = attr.ib(default=10)
+    # add a Direct PUT delivery stream to S3, no data stream in front of it
+    direct_put_delivery_stream_enabled: bool = attr.ib(default=False)
+    # add the DynamoDB lease table of data_consumer/polling_consumer.py
+    polling_consumer_enabled: bool = attr.ib(default=False)
+    # firehose lambda processor buffer size, see kds_example/power_tuning.py
+    lambda_buffer_hint_size_in_mb: int = attr.ib(default=3)
 
     @property
     def project_name_slug(self) -> str:
@@ -437,8 +606,20 @@ class Stack(cft.Stack):
 
     @property
     def kinesis_data_stream_name(self) -> str:
+        """
+        The base name of the data streams, the name of the only data stream
+        without fan-out.
+        """
         return f"{self.project_name_slug}"
 
+    @property
+    def kinesis_data_stream_names(self) -> List[str]:
+        return fan_out_names(self.kinesis_data_stream_name, self.fan_out)
+
+    @property
+    def dynamodb_table_name_for_consumer_lease(self) -> str:
+        return f"{self.project_name_slug}-consumer-lease"
+
     @property
     def kinesis_delivery_stream_name_for_s3(self) -> str:
         return f"{self.project_name_slug}-to-s3"
@@ -447,12 +628,24 @@ class Stack(cft.Stack):
     def kinesis_delivery_stream_name_for_oss(self) -> str:
         return f"{self.project_name_slug}-to-oss"
 
+    @property
+    def kinesis_delivery_stream_names_for_s3(self) -> List[str]:
+        return fan_out_names(self.kinesis_delivery_stream_name_for_s3, self.fan_out)
+
+    @property
+    def kinesis_delivery_stream_names_for_oss(self) -> List[str]:
+        return fan_out_names(self.kinesis_delivery_stream_name_for_oss, self.fan_out)
+
+    @property
+    def kinesis_delivery_stream_name_direct_put(self) -> str:
+        return f"{self.project_name_slug}-direct-to-s3"
+
     @property
     def all_kinesis_delivery_stream_name(self) -> List[str]:
-        return [
-            self.kinesis_delivery_stream_name_for_s3,
-            self.kinesis_delivery_stream_name_for_oss,
-        ]
+        names = self.kinesis_delivery_stream_names_for_s3 + self.kinesis_delivery_stream_names_for_oss
+        if self.direct_put_delivery_stream_enabled:
+            names.append(self.kinesis_delivery_stream_name_direct_put)
+        return names
 
     @property
     def oss_domain_name(self) -> str:
@@ -597,7 +790,10 @@ class Stack(cft.Stack):
                         "kinesis:GetRecords",
                         "kinesis:ListShards"
                     ],
-                    "Resource": f"arn:aws:kinesis:{self.aws_region}:{self.aws_account_id}:stream/{self.kinesis_data_stream_name}"
+                    "Resource": [
+                        f"arn:aws:kinesis:{self.aws_region}:{self.aws_account_id}:stream/{name}"
+                        for name in self.kinesis_data_stream_names
+                    ]
                 },
                 {
                     "Effect": "Allow",
@@ -612,7 +808,10 @@ class Stack(cft.Stack):
                             "kms:ViaService": f"kinesis.{self.aws_region}.amazonaws.com"
                         },
                         "StringLike": {
-                            "kms:EncryptionContext:aws:kinesis:arn": f"arn:aws:kinesis:{self.aws_region}:{self.aws_account_id}:stream/{self.kinesis_data_stream_name}"
+                            "kms:EncryptionContext:aws:kinesis:arn": [
+                                f"arn:aws:kinesis:{self.aws_region}:{self.aws_account_id}:stream/{name}"
+                                for name in self.kinesis_data_stream_names
+                            ]
                         }
                     }
                 }
@@ -707,15 +906,53 @@ class Stack(cft.Stack):
     def mk_rg4_kinesis_data_stream(self):
         self.rg4_kinesis_data_stream = cft.ResourceGroup("RG4")
 
-        self.kinesis_data_stream = kinesis.Stream(
-            "KinesisDataStream",
-            p_Name=self.kinesis_data_stream_name,
-            p_ShardCount=10,
-            p_StreamModeDetails=kinesis.PropStreamStreamModeDetails(
-                rp_StreamMode="PROVISIONED",
-            ),
+        self.kinesis_data_streams = list()
+        for i, name in enumerate(self.kinesis_data_stream_names):
+            suffix = f"{i:02d}" if self.fan_out > 1 else ""
+            kinesis_data_stream = kinesis.Stream(
+                f"KinesisDataStream{suffix}",
+                p_Name=name,
+                p_ShardCount=self.kinesis_data_stream_shard_count,
+                p_StreamModeDetails=kinesis.PropStreamStreamModeDetails(
+                    rp_StreamMode="PROVISIONED",
+                ),
+            )
+            self.kinesis_data_streams.append(kinesis_data_stream)
+            self.rg4_kinesis_data_stream.add(kinesis_data_stream)
+        self.kinesis_data_stream = self.kinesis_data_streams[0]
+
+        if self.polling_consumer_enabled:
+            self.mk_rg4_consumer_lease_table()
+
+    def mk_rg4_consumer_lease_table(self):
+        # lease table for the polling consumer, see kds_example/consumer.py
+        self.dynamodb_table_for_consumer_lease = dynamodb.Table(
+            "DynamoDBTableForConsumerLease",
+            p_TableName=self.dynamodb_table_name_for_consumer_lease,
+            rp_KeySchema=[
+                dynamodb.PropTableKeySchema(
+                    rp_AttributeName="stream_name",
+                    rp_KeyType="HASH",
+                ),
+                dynamodb.PropTableKeySchema(
+                    rp_AttributeName="shard_id",
+                    rp_KeyType="RANGE",
+                ),
+            ],
+            p_AttributeDefinitions=[
+                dynamodb.PropTableAttributeDefinition(
+                    rp_AttributeName="stream_name",
+                    rp_AttributeType="S",
+                ),
+                dynamodb.PropTableAttributeDefinition(
+                    rp_AttributeName="shard_id",
+                    rp_AttributeType="S",
+                ),
+            ],
+            p_BillingMode="PAY_PER_REQUEST",
+            ra_DeletionPolicy=cft.constant.DeletionPolicy.Delete,
         )
-        self.rg4_kinesis_data_stream.add(self.kinesis_data_stream)
+        self.rg4_kinesis_data_stream.add(self.dynamodb_table_for_consumer_lease)
 
     def mk_rg5_kinesis_delivery_stream_to_s3(self):
         self.rg5_kinesis_delivery_stream_to_s3 = cft.ResourceGroup("RG5")
@@ -790,32 +1027,41 @@ class Stack(cft.Stack):
         #     ]
         # )
 
-        (
-            kinesis_delivery_stream_to_s3,
-            delivery_stream_to_s3_lbd_permission,
-        ) = create_delivery_stream_with_s3_destination(
-            logic_id="KinesisDeliveryStreamToS3",
-            aws_account_id=aws_account_id,
-            aws_region=aws_region,
-            delivery_stream_name=self.kinesis_delivery_stream_name_for_s3,
-            kinesis_data_stream=self.kinesis_data_stream,
-            delivery_stream_iam_role=self.iam_role_for_firehose,
-            destination_s3_bucket=self.s3_data_bucket_name,
-            destination_s3_prefix_success="to-s3/03-success/",
-            destination_s3_prefix_failed="to-s3/04-failed/",
-            backup_s3_bucket=self.s3_data_bucket_name,
-            backup_s3_prefix_success="to-s3/01-backup/",
-            backup_s3_prefix_failed="to-s3/02-backup-failed/",
-            transformation_lbd_func_name=self.lbd_func_name_transformation_for_s3,
-            delivery_stream_buffer_hint_size_in_mb=5,
-            delivery_stream_buffer_hint_interval_in_sec=60,
-            s3_backup_buffer_hint_size_in_mb=5,
-            s3_backup_buffer_hint_interval_in_sec=60,
-            lambda_buffer_hint_size_in_mb=3,
-            lambda_buffer_hint_interval_in_sec=60,
-        )
-        self.kinesis_delivery_stream_to_s3 = kinesis_delivery_stream_to_s3
-        self.rg5_kinesis_delivery_stream_to_s3.add(self.kinesis_delivery_stream_to_s3)
+        fan_out = self.fan_out
+        self.kinesis_delivery_streams_to_s3 = list()
+        for i, delivery_stream_name in enumerate(self.kinesis_delivery_stream_names_for_s3):
+            suffix = f"{i:02d}" if fan_out > 1 else ""
+            (
+                kinesis_delivery_stream_to_s3,
+                delivery_stream_to_s3_lbd_permission,
+            ) = create_delivery_stream_with_s3_destination(
+                logic_id=f"KinesisDeliveryStreamToS3{suffix}",
+                permission_logic_id=f"DeliveryStreamToS3LbdPermission{suffix}",
+                aws_account_id=aws_account_id,
+                aws_region=aws_region,
+                delivery_stream_name=delivery_stream_name,
+                kinesis_data_stream=self.kinesis_data_streams[i],
+                delivery_stream_iam_role=self.iam_role_for_firehose,
+                destination_s3_bucket=self.s3_data_bucket_name,
+                destination_s3_prefix_success=fan_out_prefix("to-s3/03-success/", i, fan_out),
+                destination_s3_prefix_failed=fan_out_prefix("to-s3/04-failed/", i, fan_out),
+                backup_s3_bucket=self.s3_data_bucket_name,
+                backup_s3_prefix_success=fan_out_prefix("to-s3/01-backup/", i, fan_out),
+                backup_s3_prefix_failed=fan_out_prefix("to-s3/02-backup-failed/", i, fan_out),
+                transformation_lbd_func_name=self.lbd_func_name_transformation_for_s3,
+                delivery_stream_buffer_hint_size_in_mb=5,
+                delivery_stream_buffer_hint_interval_in_sec=60,
+                s3_backup_buffer_hint_size_in_mb=5,
+                s3_backup_buffer_hint_interval_in_sec=60,
+                lambda_buffer_hint_size_in_mb=self.lambda_buffer_hint_size_in_mb,
+                lambda_buffer_hint_interval_in_sec=60,
+            )
+            self.kinesis_delivery_streams_to_s3.append(kinesis_delivery_stream_to_s3)
+            self.rg5_kinesis_delivery_stream_to_s3.add(kinesis_delivery_stream_to_s3)
+            self.rg5_kinesis_delivery_stream_to_s3.add(delivery_stream_to_s3_lbd_permission)
+            if i == 0:
+                self.kinesis_delivery_stream_to_s3 = kinesis_delivery_stream_to_s3
+                self.delivery_stream_to_s3_lbd_permission = delivery_stream_to_s3_lbd_permission
 
         # self.delivery_stream_to_s3_lbd_permission = awslambda.Permission(
         #     "DeliveryStreamToS3LbdPermission",
@@ -824,94 +1070,74 @@ class Stack(cft.Stack):
         #     rp_Principal="firehose.amazonaws.com",
         #     p_SourceArn=self.kinesis_delivery_stream_to_s3.rv_Arn,
         # )
-        self.delivery_stream_to_s3_lbd_permission = delivery_stream_to_s3_lbd_permission
-        self.rg5_kinesis_delivery_stream_to_s3.add(self.delivery_stream_to_s3_lbd_permission)
 
     def mk_rg6_kinesis_delivery_stream_to_oss(self):
         self.rg6_kinesis_delivery_stream_to_oss = cft.ResourceGroup("RG6")
 
-        self.kinesis_delivery_stream_to_oss = kinesisfirehose.DeliveryStream(
-            "KinesisDeliveryStreamToOSS",
-            p_DeliveryStreamName=self.kinesis_delivery_stream_name_for_oss,
-            p_DeliveryStreamType="KinesisStreamAsSource",
-            p_KinesisStreamSourceConfiguration=kinesisfirehose.PropDeliveryStreamKinesisStreamSourceConfiguration(
-                rp_KinesisStreamARN=self.kinesis_data_stream.rv_Arn,
-                rp_RoleARN=self.iam_role_for_firehose.rv_Arn,
-            ),
-            p_AmazonopensearchserviceDestinationConfiguration=kinesisfirehose.PropDeliveryStreamAmazonopensearchserviceDestinationConfiguration(
-                rp_IndexName=self.oss_index_name,
-                rp_RoleARN=self.iam_role_for_firehose.rv_Arn,
-                p_DomainARN=self.opensearch_cluster.rv_DomainArn,
-                p_IndexRotationPeriod="NoRotation",
-                p_RetryOptions=kinesisfirehose.PropDeliveryStreamAmazonopensearchserviceRetryOptions(
-                    p_DurationInSeconds=60,
-                ),
-                p_BufferingHints=kinesisfirehose.PropDeliveryStreamAmazonopensearchserviceBufferingHints(
-                    p_IntervalInSeconds=60,
-                    p_SizeInMBs=5,
-                ),
-                p_CloudWatchLoggingOptions=kinesisfirehose.PropDeliveryStreamCloudWatchLoggingOptions(
-                    p_Enabled=True,
-                    p_LogGroupName=f"/aws/kinesis/firehose/{self.kinesis_delivery_stream_name_for_oss}",
-                    p_LogStreamName="BackupDelivery",
-                ),
-                p_S3BackupMode="AllDocuments",
-                rp_S3Configuration=kinesisfirehose.PropDeliveryStreamS3DestinationConfiguration(
-                    rp_BucketARN=self.s3_data_bucket.rv_Arn,
-                    rp_RoleARN=self.iam_role_for_firehose.rv_Arn,
-                    p_Prefix="to-oss/01-backup/",
-                    p_ErrorOutputPrefix="to-oss/02-backup-failed/",
-                    p_BufferingHints=kinesisfirehose.PropDeliveryStreamBufferingHints(
-                        p_IntervalInSeconds=60,
-                        p_SizeInMBs=5,
-                    ),
-                ),
-                p_ProcessingConfiguration=kinesisfirehose.PropDeliveryStreamProcessingConfiguration(
-                    p_Enabled=True,
-                    p_Processors=[
-                        kinesisfirehose.PropDeliveryStreamProcessor(
-                            rp_Type="Lambda",
-                            p_Parameters=[
-                                kinesisfirehose.PropDeliveryStreamProcessorParameter(
-                                    rp_ParameterName="LambdaArn",
-                                    rp_ParameterValue=f"arn:aws:lambda:{aws_region}:{aws_account_id}:function:{self.lbd_func_name_transformation_for_oss}",
-                                ),
-                                kinesisfirehose.PropDeliveryStreamProcessorParameter(
-                                    rp_ParameterName="NumberOfRetries",
-                                    rp_ParameterValue="1",
-                                ),
-                                kinesisfirehose.PropDeliveryStreamProcessorParameter(
-                                    rp_ParameterName="RoleArn",
-                                    rp_ParameterValue=self.iam_role_for_firehose.rv_Arn,
-                                ),
-                                kinesisfirehose.PropDeliveryStreamProcessorParameter(
-                                    rp_ParameterName="BufferSizeInMBs",
-                                    rp_ParameterValue="3",
-                                ),
-                                kinesisfirehose.PropDeliveryStreamProcessorParameter(
-                                    rp_ParameterName="BufferIntervalInSeconds",
-                                    rp_ParameterValue="60",
-                                ),
-                            ]
-                        )
-                    ]
-                )
-            ),
-            ra_DependsOn=[
-                self.iam_role_for_firehose,
-                self.kinesis_data_stream,
-            ]
-        )
-        self.rg6_kinesis_delivery_stream_to_oss.add(self.kinesis_delivery_stream_to_oss)
-
-        self.delivery_stream_to_oss_lbd_permission = awslambda.Permission(
-            "DeliveryStreamToOSSLbdPermission",
-            rp_Action="lambda:InvokeFunction",
-            rp_FunctionName=f"arn:aws:lambda:{aws_region}:{aws_account_id}:function:{self.lbd_func_name_transformation_for_oss}",
-            rp_Principal="firehose.amazonaws.com",
-            p_SourceArn=self.kinesis_delivery_stream_to_oss.rv_Arn,
+        fan_out = self.fan_out
+        self.kinesis_delivery_streams_to_oss = list()
+        for i, delivery_stream_name in enumerate(self.kinesis_delivery_stream_names_for_oss):
+            suffix = f"{i:02d}" if fan_out > 1 else ""
+            (
+                kinesis_delivery_stream_to_oss,
+                delivery_stream_to_oss_lbd_permission,
+            ) = create_delivery_stream_with_oss_destination(
+                logic_id=f"KinesisDeliveryStreamToOSS{suffix}",
+                permission_logic_id=f"DeliveryStreamToOSSLbdPermission{suffix}",
+                aws_account_id=aws_account_id,
+                aws_region=aws_region,
+                delivery_stream_name=delivery_stream_name,
+                kinesis_data_stream=self.kinesis_data_streams[i],
+                delivery_stream_iam_role=self.iam_role_for_firehose,
+                opensearch_domain=self.opensearch_cluster,
+                index_name=self.oss_index_name,
+                backup_s3_bucket_arn=self.s3_data_bucket.rv_Arn,
+                backup_s3_prefix_success=fan_out_prefix("to-oss/01-backup/", i, fan_out),
+                backup_s3_prefix_failed=fan_out_prefix("to-oss/02-backup-failed/", i, fan_out),
+                transformation_lbd_func_name=self.lbd_func_name_transformation_for_oss,
+                delivery_stream_buffer_hint_size_in_mb=5,
+                delivery_stream_buffer_hint_interval_in_sec=60,
+                s3_backup_buffer_hint_size_in_mb=5,
+                s3_backup_buffer_hint_interval_in_sec=60,
+                lambda_buffer_hint_size_in_mb=self.lambda_buffer_hint_size_in_mb,
+                lambda_buffer_hint_interval_in_sec=60,
+            )
+            self.kinesis_delivery_streams_to_oss.append(kinesis_delivery_stream_to_oss)
+            self.rg6_kinesis_delivery_stream_to_oss.add(kinesis_delivery_stream_to_oss)
+            self.rg6_kinesis_delivery_stream_to_oss.add(delivery_stream_to_oss_lbd_permission)
+            if i == 0:
+                self.kinesis_delivery_stream_to_oss = kinesis_delivery_stream_to_oss
+                self.delivery_stream_to_oss_lbd_permission = delivery_stream_to_oss_lbd_permission
+
+    def mk_rg7_direct_put_delivery_stream(self):
+        self.rg7_direct_put_delivery_stream = cft.ResourceGroup("RG7")
+
+        (
+            self.direct_put_delivery_stream_to_s3,
+            self.direct_put_delivery_stream_lbd_permission,
+        ) = create_direct_put_delivery_stream_with_s3_destination(
+            logic_id="DirectPutDeliveryStreamToS3",
+            permission_logic_id="DirectPutDeliveryStreamLbdPermission",
+            aws_account_id=aws_account_id,
+            aws_region=aws_region,
+            delivery_stream_name=self.kinesis_delivery_stream_name_direct_put,
+            delivery_stream_iam_role=self.iam_role_for_firehose,
+            destination_s3_bucket=self.s3_data_bucket_name,
+            destination_s3_prefix_success="direct-to-s3/03-success/",
+            destination_s3_prefix_failed="direct-to-s3/04-failed/",
+            backup_s3_bucket=self.s3_data_bucket_name,
+            backup_s3_prefix_success="direct-to-s3/01-backup/",
+            backup_s3_prefix_failed="direct-to-s3/02-backup-failed/",
+            transformation_lbd_func_name=self.lbd_func_name_transformation_for_s3,
+            delivery_stream_buffer_hint_size_in_mb=5,
+            delivery_stream_buffer_hint_interval_in_sec=60,
+            s3_backup_buffer_hint_size_in_mb=5,
+            s3_backup_buffer_hint_interval_in_sec=60,
+            lambda_buffer_hint_size_in_mb=self.lambda_buffer_hint_size_in_mb,
+            lambda_buffer_hint_interval_in_sec=60,
         )
-        self.rg6_kinesis_delivery_stream_to_oss.add(self.delivery_stream_to_oss_lbd_permission)
+        self.rg7_direct_put_delivery_stream.add(self.direct_put_delivery_stream_to_s3)
+        self.rg7_direct_put_delivery_stream.add(self.direct_put_delivery_stream_lbd_permission)
 
     def post_hook(self):
         self.mk_rg1_data_bucket()
@@ -920,6 +1146,8 @@ class Stack(cft.Stack):
         self.mk_rg4_kinesis_data_stream()
         self.mk_rg5_kinesis_delivery_stream_to_s3()
         self.mk_rg6_kinesis_delivery_stream_to_oss()
+        if self.direct_put_delivery_stream_enabled:
+            self.mk_rg7_direct_put_delivery_stream()
 
 
 stack = Stack(
@@ -928,4 +1156,5 @@ stack = Stack(
     aws_account_id=aws_account_id,
     aws_region=aws_region,
     oss_index_name=config.oss_index_name,
+    lambda_buffer_hint_size_in_mb=config.lambda_buffer_hint_size_in_mb,
 )
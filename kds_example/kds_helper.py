@@ -1,31 +1,414 @@
 # -*- coding: utf-8 -*-
 
 import json
+import time
 import base64
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from typing import List, Dict, Iterable, Any, Callable
 
+import attr
+
+from .fake_kinesis import get_error_code
+from .codec import compress, pack_records
+from .fan_out import fan_out_name, fan_out_index, route_records
+
+MAX_RECORDS_PER_PUT_RECORDS = 500
+MAX_BYTES_PER_PUT_RECORDS = 5 * 1024 * 1024
+
+MAX_RECORDS_PER_PUT_RECORD_BATCH = 500
+MAX_BYTES_PER_PUT_RECORD_BATCH = 4 * 1024 * 1024
+MAX_BYTES_PER_FIREHOSE_RECORD = 1000 * 1024
+
 
 def put_records(
     kinesis_client,
+    stream_name: str,
     records: Iterable[Dict[str, Any]],
     get_pk: Callable[[dict], str],
-) -> str:
+    codec: str = None,
+    schema=None,
+) -> dict:
+    """
+    :param codec: optional, compress each record with ``"gzip"`` or
+        ``"zstd"``, see :mod:`kds_example.codec`.
+    :param schema: optional :class:`~kds_example.schema_registry.RegisteredSchema`,
+        send the binary encoding of the records instead of JSON.
+    """
+    if schema is None:
+        dumps = lambda record: (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    else:
+        dumps = schema.encode
     kin_records = [
         {
-            "Data": (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"),
+            "Data": dumps(record),
             "PartitionKey": get_pk(record),
         }
         for record in records
     ]
-    return k_client.put_records(
+    if codec is not None:
+        for kin_record in kin_records:
+            kin_record["Data"] = compress(kin_record["Data"], codec=codec)
+    return kinesis_client.put_records(
         Records=kin_records,
         StreamName=stream_name,
     )
 
 
+def pack_kin_records(
+    records: Iterable[Dict[str, Any]],
+    get_pk: Callable[[dict], str],
+    codec: str = "gzip",
+    max_records: int = 100,
+    max_bytes: int = 256 * 1024,
+) -> List[dict]:
+    """
+    Pack consecutive records into compressed micro-batches, one
+    ``PutRecords`` entry each, with the partition key of its first record,
+    the order of the records of a key is only kept within a micro-batch.
+    The "to-s3" lambda unpacks them, the "to-oss" lambda fails them, only
+    use it for streams delivered to S3.
+
+    :param max_bytes: max uncompressed size of a micro-batch, under the
+        firehose 1000 KiB record limit.
+    """
+    kin_records = list()
+    lines, size, pk = list(), 0, None
+    for record in records:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        if lines and (len(lines) >= max_records or size + len(line) > max_bytes):
+            kin_records.append({"Data": pack_records(lines, codec=codec), "PartitionKey": pk})
+            lines, size = list(), 0
+        if not lines:
+            pk = get_pk(record)
+        lines.append(line)
+        size += len(line)
+    if lines:
+        kin_records.append({"Data": pack_records(lines, codec=codec), "PartitionKey": pk})
+    return kin_records
+
+
+class FanOutKinesisClient:
+    """
+    Wrap a kinesis client, send the records of ``put_records`` /
+    ``put_record`` for the stream ``name`` to the data streams of the
+    fan-out ``{name}-{i:02d}of{n:02d}`` chosen by partition key, see
+    :mod:`kds_example.fan_out`. The producers keep using the base
+    stream name. The other methods go to the wrapped client.
+    """
+
+    def __init__(self, kinesis_client, fan_out: int):
+        self.kinesis_client = kinesis_client
+        self.fan_out = fan_out
+
+    def __getattr__(self, name: str):
+        return getattr(self.kinesis_client, name)
+
+    def put_records(self, Records: List[dict], StreamName: str, **kwargs) -> dict:
+        """
+        One ``PutRecords`` call per data stream, the response entries are in
+        the order of ``Records``, like a single call.
+        """
+        results = [None] * len(Records)
+        failed = 0
+        for index, positions in sorted(route_records(Records, self.fan_out).items()):
+            res = self.kinesis_client.put_records(
+                Records=[Records[position] for position in positions],
+                StreamName=fan_out_name(StreamName, index, self.fan_out),
+                **kwargs
+            )
+            failed += res.get("FailedRecordCount", 0)
+            for position, result in zip(positions, res["Records"]):
+                results[position] = result
+        return {"FailedRecordCount": failed, "Records": results}
+
+    def put_record(self, StreamName: str, Data: bytes, PartitionKey: str, **kwargs) -> dict:
+        index = fan_out_index(PartitionKey, self.fan_out)
+        return self.kinesis_client.put_record(
+            StreamName=fan_out_name(StreamName, index, self.fan_out),
+            Data=Data,
+            PartitionKey=PartitionKey,
+            **kwargs
+        )
+
+
+def make_fan_out_client(kinesis_client, fan_out: int):
+    """
+    :return: the client itself without fan-out.
+    """
+    if fan_out == 1:
+        return kinesis_client
+    return FanOutKinesisClient(kinesis_client, fan_out)
+
+
+class RateLimiter:
+    """
+    Thread safe token bucket, ``rate`` tokens per second, up to ``burst``
+    tokens saved.
+    """
+
+    def __init__(self, rate: float, burst: float = None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.burst
+        self.updated_at = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, n: float = 1):
+        """
+        Take ``n`` tokens, block until they are available. ``n`` can be
+        larger than ``burst``, the caller then waits for the deficit.
+        """
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            self.sleep(wait)
+
+
+def iter_put_records_batches(
+    kin_records: Iterable[dict],
+    max_records: int = MAX_RECORDS_PER_PUT_RECORDS,
+    max_bytes: int = MAX_BYTES_PER_PUT_RECORDS,
+) -> Iterable[List[dict]]:
+    """
+    Group ``PutRecords`` entries into batches within the API limits.
+    """
+    batch, size = list(), 0
+    for kin_record in kin_records:
+        record_size = len(kin_record["Data"]) + len(kin_record["PartitionKey"])
+        if batch and (len(batch) >= max_records or size + record_size > max_bytes):
+            yield batch
+            batch, size = list(), 0
+        batch.append(kin_record)
+        size += record_size
+    if batch:
+        yield batch
+
+
+def put_records_with_retries(
+    kinesis_client,
+    stream_name: str,
+    kin_records: List[dict],
+    max_retries: int = 5,
+    base_delay: float = 0.1,
+    rate_limiter: RateLimiter = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> List[dict]:
+    """
+    Send one ``PutRecords`` batch, retry the failed entries with exponential
+    backoff and jitter.
+
+    :param rate_limiter: optional, one token per record sent, retries included.
+    :return: the entries still failed after ``max_retries`` retries
+    """
+    pending = kin_records
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire(len(pending))
+        res = kinesis_client.put_records(Records=pending, StreamName=stream_name)
+        if not res.get("FailedRecordCount"):
+            return list()
+        pending = [
+            kin_record
+            for kin_record, result in zip(pending, res["Records"])
+            if "ErrorCode" in result
+        ]
+        if attempt < max_retries:
+            sleep(base_delay * (2 ** attempt) * (1 + random.random()))
+    return pending
+
+
+def iter_put_record_batch_batches(
+    fh_records: Iterable[dict],
+    max_records: int = MAX_RECORDS_PER_PUT_RECORD_BATCH,
+    max_bytes: int = MAX_BYTES_PER_PUT_RECORD_BATCH,
+) -> Iterable[List[dict]]:
+    """
+    Group firehose ``PutRecordBatch`` entries into batches within the API
+    limits.
+    """
+    batch, size = list(), 0
+    for fh_record in fh_records:
+        record_size = len(fh_record["Data"])
+        if batch and (len(batch) >= max_records or size + record_size > max_bytes):
+            yield batch
+            batch, size = list(), 0
+        batch.append(fh_record)
+        size += record_size
+    if batch:
+        yield batch
+
+
+def put_record_batch_with_retries(
+    firehose_client,
+    delivery_stream_name: str,
+    fh_records: List[dict],
+    max_retries: int = 5,
+    base_delay: float = 0.1,
+    rate_limiter: RateLimiter = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> List[dict]:
+    """
+    Send one ``PutRecordBatch`` batch to a Direct PUT delivery stream, retry
+    the failed entries, and the whole batch on ``ServiceUnavailableException``
+    (the delivery stream throughput limit), with exponential backoff and
+    jitter.
+
+    :return: the entries still failed after ``max_retries`` retries
+    """
+    pending = fh_records
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire(len(pending))
+        try:
+            res = firehose_client.put_record_batch(
+                DeliveryStreamName=delivery_stream_name,
+                Records=pending,
+            )
+        except Exception as e:
+            if get_error_code(e) != "ServiceUnavailableException":
+                raise
+        else:
+            if not res.get("FailedPutCount"):
+                return list()
+            pending = [
+                fh_record
+                for fh_record, result in zip(pending, res["RequestResponses"])
+                if "ErrorCode" in result
+            ]
+        if attempt < max_retries:
+            sleep(base_delay * (2 ** attempt) * (1 + random.random()))
+    return pending
+
+
+@attr.s
+class FirehoseProducerStats:
+    records: int = attr.ib(default=0)
+    bytes: int = attr.ib(default=0)
+    batches: int = attr.ib(default=0)
+    records_failed: int = attr.ib(default=0)
+
+
+class FirehoseProducer:
+    """
+    Buffered producer of a Direct PUT delivery stream. Records are grouped
+    into ``PutRecordBatch`` calls of up to 500 records / 4 MiB, full batches
+    are sent by ``max_workers`` threads while the caller keeps adding records,
+    at most ``max_in_flight`` batches are pending.
+
+    The records still failed after the retries are kept in :attr:`failed`.
+
+    :param max_linger: seconds a partial batch waits for more records, checked
+        when a record is added; call :meth:`flush` to send everything.
+    """
+
+    def __init__(
+        self,
+        firehose_client,
+        delivery_stream_name: str,
+        max_workers: int = 4,
+        max_in_flight: int = None,
+        max_retries: int = 5,
+        base_delay: float = 0.1,
+        max_linger: float = 1.0,
+        rate_limiter: RateLimiter = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.firehose_client = firehose_client
+        self.delivery_stream_name = delivery_stream_name
+        self.max_in_flight = max_in_flight or max_workers * 2
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_linger = max_linger
+        self.rate_limiter = rate_limiter
+        self.clock = clock
+        self.sleep = sleep
+        self.stats = FirehoseProducerStats()
+        self.failed: List[dict] = list()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = set()
+        self._batch: List[dict] = list()
+        self._batch_size = 0
+        self._batch_started_at = None
+        self._lock = threading.Lock()
+
+    def put(self, data: bytes):
+        if len(data) > MAX_BYTES_PER_FIREHOSE_RECORD:
+            raise ValueError(f"record of {len(data)} bytes is over the {MAX_BYTES_PER_FIREHOSE_RECORD} bytes limit")
+        if self._batch and (
+            len(self._batch) >= MAX_RECORDS_PER_PUT_RECORD_BATCH
+            or self._batch_size + len(data) > MAX_BYTES_PER_PUT_RECORD_BATCH
+        ):
+            self._send_batch()
+        if not self._batch:
+            self._batch_started_at = self.clock()
+        self._batch.append({"Data": data})
+        self._batch_size += len(data)
+        if self.clock() - self._batch_started_at >= self.max_linger:
+            self._send_batch()
+
+    def put_many(self, datas: Iterable[bytes]):
+        for data in datas:
+            self.put(data)
+
+    def _send(self, batch: List[dict]):
+        failed = put_record_batch_with_retries(
+            self.firehose_client, self.delivery_stream_name, batch,
+            max_retries=self.max_retries, base_delay=self.base_delay,
+            rate_limiter=self.rate_limiter, sleep=self.sleep,
+        )
+        with self._lock:
+            self.stats.batches += 1
+            self.stats.records += len(batch) - len(failed)
+            self.stats.bytes += sum(len(fh_record["Data"]) for fh_record in batch)
+            self.stats.records_failed += len(failed)
+            self.failed.extend(failed)
+
+    def _send_batch(self):
+        batch = self._batch
+        self._batch, self._batch_size = list(), 0
+        # bounded memory: wait for a free slot
+        while len(self._futures) >= self.max_in_flight:
+            done, self._futures = wait(self._futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        self._futures.add(self._executor.submit(self._send, batch))
+
+    def flush(self):
+        """
+        Send the partial batch and wait for all the batches in flight.
+        """
+        if self._batch:
+            self._send_batch()
+        done, self._futures = wait(self._futures), set()
+        for future in done[0]:
+            future.result()
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 class DropIt(Exception): pass
 
 
+class FailIt(Exception): pass
+
+
 def delivery_stream_tranformation_handler(
     event: dict,
     transform_func: callable,
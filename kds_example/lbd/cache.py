@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lookup cache for enrichment in the transformation lambda.
+
+Caches are created at module level with :func:`get_cache`, so they survive
+warm invocations of the same lambda container. A :class:`TTLCache` is:
+
+- size bounded, the least recently used entry is evicted first.
+- time bounded, an entry older than ``ttl`` seconds is reloaded.
+- batch loaded, :meth:`TTLCache.get_many` loads all missing keys of a buffer
+  with one ``loader`` call.
+- single flight, if several threads need the same missing key, only one
+  loads it and the others wait for its result.
+
+Example::
+
+    from kds_example.lbd.cache import get_cache, make_enrich_stage
+
+    def load_accounts(account_ids: list) -> dict:
+        ...  # one remote call, return {account_id: metadata}
+
+    account_cache = get_cache("account", load_accounts, max_size=100000, ttl=300)
+    pipeline.add_stage(
+        "enrich",
+        make_enrich_stage(
+            account_cache,
+            get_key=lambda record: record["id"],
+            merge=lambda record, metadata: {**record, **(metadata or {})},
+        ),
+        mode="batch",
+    )
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Dict, Any, Callable, Iterable, Hashable
+
+import attr
+
+from .pipeline import Item
+
+Loader = Callable[[List[Hashable]], Dict[Hashable, Any]]
+
+
+@attr.s
+class CacheStats:
+    hits: int = attr.ib(default=0)
+    misses: int = attr.ib(default=0)
+    # misses served by another thread's in-flight load
+    waits: int = attr.ib(default=0)
+    # number of loader calls, and keys loaded
+    loads: int = attr.ib(default=0)
+    loaded_keys: int = attr.ib(default=0)
+    evictions: int = attr.ib(default=0)
+    expirations: int = attr.ib(default=0)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class TTLCache:
+    """
+    :param loader: ``func(keys) -> {key: value}``, keys missing from the
+        returned dict are cached as None, so unknown keys are not looked up
+        again before they expire.
+    :param max_size: max number of entries.
+    :param ttl: time to live of an entry in seconds.
+    """
+
+    def __init__(
+        self,
+        loader: Loader,
+        max_size: int = 10000,
+        ttl: float = 300,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.loader = loader
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = CacheStats()
+        # key -> (expire_at, value), least recently used first
+        self._data: OrderedDict = OrderedDict()
+        self._inflight: Dict[Hashable, Future] = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _lookup(self, key: Hashable, now: float):
+        """
+        Return ``(True, value)`` for a fresh entry. Must hold the lock.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return False, None
+        expire_at, value = entry
+        if expire_at <= now:
+            del self._data[key]
+            self.stats.expirations += 1
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def _store(self, key: Hashable, value: Any, now: float):
+        """
+        Must hold the lock.
+        """
+        self._data[key] = (now + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.stats.evictions += 1
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        """
+        Get the values of the distinct keys, load the missing ones with one
+        ``loader`` call.
+        """
+        result = dict()
+        to_load: Dict[Hashable, Future] = dict()
+        to_wait: Dict[Hashable, Future] = dict()
+        with self._lock:
+            now = self.clock()
+            for key in keys:
+                if key in result or key in to_load or key in to_wait:
+                    continue
+                found, value = self._lookup(key, now)
+                if found:
+                    self.stats.hits += 1
+                    result[key] = value
+                    continue
+                self.stats.misses += 1
+                if key in self._inflight:
+                    self.stats.waits += 1
+                    to_wait[key] = self._inflight[key]
+                else:
+                    future = Future()
+                    self._inflight[key] = future
+                    to_load[key] = future
+
+        if to_load:
+            try:
+                loaded = self.loader(list(to_load))
+            except Exception as e:
+                with self._lock:
+                    for key, future in to_load.items():
+                        del self._inflight[key]
+                        future.set_exception(e)
+                raise
+            with self._lock:
+                now = self.clock()
+                self.stats.loads += 1
+                self.stats.loaded_keys += len(to_load)
+                for key, future in to_load.items():
+                    value = loaded.get(key)
+                    self._store(key, value, now)
+                    del self._inflight[key]
+                    future.set_result(value)
+                    result[key] = value
+
+        for key, future in to_wait.items():
+            result[key] = future.result()
+        return result
+
+    def get(self, key: Hashable) -> Any:
+        return self.get_many([key])[key]
+
+    def prefetch(self, keys: Iterable[Hashable]):
+        """
+        Warm the cache for the distinct keys of a buffer in one loader call.
+        """
+        self.get_many(keys)
+
+    def invalidate(self, key: Hashable = None):
+        """
+        Remove one key, or everything if key is None.
+        """
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+
+_caches: Dict[str, TTLCache] = dict()
+_caches_lock = threading.Lock()
+
+
+def get_cache(name: str, loader: Loader, **kwargs) -> TTLCache:
+    """
+    Get the module level cache ``name``, create it on first use. The
+    ``loader`` and ``kwargs`` are only used at creation.
+    """
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = TTLCache(loader, **kwargs)
+        return _caches[name]
+
+
+def make_enrich_stage(
+    cache: TTLCache,
+    get_key: Callable[[Any], Hashable],
+    merge: Callable[[Any, Any], Any],
+) -> Callable[[List[Item]], None]:
+    """
+    Create a batch stage function for :class:`~kds_example.lbd.pipeline.Pipeline`
+    that looks up the distinct keys of the buffer at once, then merges the
+    looked up value into each record.
+    """
+
+    def enrich(items: List[Item]):
+        values = cache.get_many([get_key(item.value) for item in items])
+        for item in items:
+            item.value = merge(item.value, values[get_key(item.value)])
+
+    return enrich
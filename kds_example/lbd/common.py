@@ -1,33 +1,128 @@
 # -*- coding: utf-8 -*-
 
-import json
-import base64
+from typing import List, Dict
 
+from .dedup import Deduplicator
+from .validator import Validator
+from .metrics import MetricsEmitter
+from .profiler import InvocationProfiler
+from .pipeline import PROCESSING_FAILED, Item, Pipeline, decode, encode
+from ..tracing import now_ms, stamp_transformed
 
-def delivery_stream_tranformation_handler(
-    event: dict,
+
+def build_pipeline(
     transform_func: callable,
-):
-    output = []
-    for record in event["records"]:
-        # convert the data back to raw record
-        raw_record = json.loads(
-            base64.b64decode(
-                record["data"].encode("utf-8")
-            )
+    dedup: Deduplicator = None,
+    validator: Validator = None,
+    invalid_status: str = PROCESSING_FAILED,
+    log_timings: bool = False,
+    trace: bool = True,
+    metrics: MetricsEmitter = None,
+    unpack_aggregated: bool = True,
+    profiler: InvocationProfiler = None,
+) -> Pipeline:
+    """
+    Build the standard ``decode -> validate -> dedup -> transform -> trace -> encode``
+    pipeline.
+
+    :param validator: optional, returns an error message for an invalid
+        record, invalid records are not transformed and get ``invalid_status``.
+    :param invalid_status: "ProcessingFailed" sends invalid records to the
+        error output prefix, "Dropped" discards them.
+    :param trace: add the delivery stream timestamps to the records stamped
+        by the producer, see :mod:`kds_example.tracing`.
+    :param metrics: optional, emits the EMF metrics of each invocation.
+    :param unpack_aggregated: unpack the aggregated payloads of
+        :func:`kds_example.codec.pack_records`, compressed single records are
+        always decompressed.
+    :param profiler: optional, profiles the sampled invocations, see
+        :mod:`kds_example.lbd.profiler`.
+    """
+    pipeline = Pipeline(
+        log_timings=log_timings,
+        metrics=metrics,
+        unpack_aggregated=unpack_aggregated,
+        profiler=profiler,
+    )
+    # a record that can't be decoded fails alone, it would fail again on
+    # every retry of the batch
+    pipeline.add_stage("decode", decode, fail_on_error=True)
+
+    if validator is not None:
+        def validate(items: List[Item]):
+            for item in items:
+                error = validator(item.value)
+                if error is not None:
+                    item.status = invalid_status
+                    item.error = error
+
+        pipeline.add_stage("validate", validate, mode="batch")
+
+    if dedup is not None:
+        # item -> record id, for the records checked by this invocation
+        checked: Dict[int, bytes] = dict()
+
+        def deduplicate(items: List[Item]):
+            checked.clear()
+            for item in items:
+                if dedup.is_duplicate(item.value):
+                    item.drop()
+                else:
+                    checked[id(item)] = dedup.get_key(item.value)
+
+        def commit(items: List[Item]):
+            # only remember the records delivered, a record failed by a later
+            # stage is replayed from the error prefix and must not be dropped,
+            # the parts of an aggregated record fail with it
+            failed = {item.record_id for item in items if item.status == PROCESSING_FAILED}
+            dedup.commit(keys=[
+                checked[id(item)]
+                for item in items
+                if item.is_ok and item.record_id not in failed and checked.get(id(item)) is not None
+            ])
+            checked.clear()
+
+        def rollback():
+            checked.clear()
+            dedup.rollback()
+
+        # firehose retries a failed batch, don't remember its ids
+        pipeline.add_stage(
+            "dedup", deduplicate, mode="batch",
+            on_success=commit, on_error=rollback,
         )
 
-        # Do custom processing on the payload here
-        transformed_record = transform_func(raw_record)
+    pipeline.add_stage("transform", transform_func)
+
+    if trace:
+        def stamp_trace(items: List[Item]):
+            now = now_ms()
+            for item in items:
+                # the replayed records have no firehose event record
+                if isinstance(item.value, dict) and item.event_record is not None:
+                    stamp_transformed(item.value, item.event_record, now)
+
+        pipeline.add_stage("trace", stamp_trace, mode="batch")
+
+    pipeline.add_stage("encode", encode, fail_on_error=True)
+    return pipeline
 
-        # convert transformed data to output
-        output_record = {
-            "recordId": record["recordId"],
-            "result": "Ok",  # "OK" | "Dropped" | "ProcessingFailed"
-            "data": base64.b64encode(
-                (json.dumps(transformed_record) + "\n").encode("utf-8")
-            )
-        }
-        output.append(output_record)
 
-    return {"records": output}
+def delivery_stream_tranformation_handler(
+    event: dict,
+    transform_func: callable,
+    dedup: Deduplicator = None,
+    validator: Validator = None,
+    invalid_status: str = PROCESSING_FAILED,
+    profiler: InvocationProfiler = None,
+):
+    """
+    One shot version of :func:`build_pipeline`, see its arguments.
+    """
+    return build_pipeline(
+        transform_func,
+        dedup=dedup,
+        validator=validator,
+        invalid_status=invalid_status,
+        profiler=profiler,
+    ).handle(event)
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+"""
+Memory bounded record deduplication for the transformation lambda.
+
+Producers give every record an ``id = uuid4()``. Producer retries and
+firehose redelivery can send the same ``id`` more than once, the
+:class:`Deduplicator` remembers the ids seen in a sliding time window with a
+time windowed Bloom filter, so the handler can mark duplicates as
+``Dropped``.
+
+The filter lives at module level, so it survives warm invocations of the
+same lambda container. It can optionally be saved to a file shared by the
+containers, an EFS mount, at most every ``save_interval`` seconds, and
+loaded by the next container. ``/tmp`` dies with its container, saving the
+filter there costs a multi MB write and gains nothing.
+
+A Bloom filter never misses a duplicate, but may drop a new record with
+probability ``error_rate``, pick it according to what a lost record costs.
+
+A duplicate the filter doesn't see, after a cold start or in a replay, is
+still harmless in OpenSearch: the ``index.final_pipeline`` of the index
+uses the record id as the document ``_id``, see :mod:`kds_example.schema`.
+"""
+
+import os
+import io
+import json
+import math
+import time
+import hashlib
+from typing import List, Iterable, Optional
+
+
+class BloomFilter:
+    """
+    A classic Bloom filter using double hashing on a blake2b digest.
+
+    :param capacity: expected number of items.
+    :param error_rate: false positive rate when ``capacity`` items are added.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.n_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.n_hashes = max(1, int(round(self.n_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+        self.count = 0
+
+    @property
+    def n_bytes(self) -> int:
+        return len(self.bits)
+
+    def _positions(self, key: bytes) -> List[int]:
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        n_bits = self.n_bits
+        return [(h1 + i * h2) % n_bits for i in range(self.n_hashes)]
+
+    def __contains__(self, key: bytes) -> bool:
+        bits = self.bits
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add(self, key: bytes):
+        bits = self.bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= (1 << (pos & 7))
+        self.count += 1
+
+
+class TimeWindowedBloomFilter:
+    """
+    Remember keys for about ``window_seconds``.
+
+    The window is split into ``n_generations`` Bloom filters. New keys go to
+    the newest generation, lookups check all of them. A new generation starts
+    when the newest one is older than ``window_seconds / n_generations`` or
+    full, the oldest one is dropped when it leaves the window or when there
+    are more than ``n_generations``. So memory never exceeds
+    ``n_generations`` filters of ``capacity_per_generation`` items.
+    """
+
+    def __init__(
+        self,
+        window_seconds: int = 3600,
+        n_generations: int = 4,
+        capacity_per_generation: int = 1000000,
+        error_rate: float = 0.00001,
+    ):
+        self.window_seconds = window_seconds
+        self.n_generations = n_generations
+        self.capacity_per_generation = capacity_per_generation
+        self.error_rate = error_rate
+        # list of (start_time, BloomFilter), oldest first
+        self.generations: List[tuple] = list()
+
+    @property
+    def generation_seconds(self) -> float:
+        return self.window_seconds / self.n_generations
+
+    @property
+    def n_bytes(self) -> int:
+        return sum(bloom.n_bytes for _, bloom in self.generations)
+
+    def _new_bloom(self) -> BloomFilter:
+        # each generation is checked on lookup, split the error budget
+        return BloomFilter(
+            capacity=self.capacity_per_generation,
+            error_rate=self.error_rate / self.n_generations,
+        )
+
+    def expire(self, now: float):
+        self.generations = [
+            (start_time, bloom)
+            for start_time, bloom in self.generations
+            if start_time + self.window_seconds > now
+        ]
+
+    def __contains__(self, key: bytes) -> bool:
+        for _, bloom in reversed(self.generations):
+            if key in bloom:
+                return True
+        return False
+
+    def add(self, key: bytes, now: float):
+        if (
+            (not self.generations)
+            or (self.generations[-1][0] + self.generation_seconds <= now)
+            or (self.generations[-1][1].count >= self.capacity_per_generation)
+        ):
+            self.generations.append((now, self._new_bloom()))
+            self.generations = self.generations[-self.n_generations:]
+        self.generations[-1][1].add(key)
+
+    def dump(self, f: io.BufferedIOBase):
+        meta = dict(
+            window_seconds=self.window_seconds,
+            n_generations=self.n_generations,
+            capacity_per_generation=self.capacity_per_generation,
+            error_rate=self.error_rate,
+            generations=[
+                dict(start_time=start_time, count=bloom.count)
+                for start_time, bloom in self.generations
+            ],
+        )
+        f.write((json.dumps(meta) + "\n").encode("utf-8"))
+        for _, bloom in self.generations:
+            f.write(bloom.bits)
+
+    @classmethod
+    def load(cls, f: io.BufferedIOBase) -> "TimeWindowedBloomFilter":
+        meta = json.loads(f.readline().decode("utf-8"))
+        twbf = cls(
+            window_seconds=meta["window_seconds"],
+            n_generations=meta["n_generations"],
+            capacity_per_generation=meta["capacity_per_generation"],
+            error_rate=meta["error_rate"],
+        )
+        for generation in meta["generations"]:
+            bloom = twbf._new_bloom()
+            bloom.bits = bytearray(f.read(bloom.n_bytes))
+            bloom.count = generation["count"]
+            twbf.generations.append((generation["start_time"], bloom))
+        return twbf
+
+
+class Deduplicator:
+    """
+    Record id based dedup stage for
+    :func:`~kds_example.lbd.common.delivery_stream_tranformation_handler`.
+
+    Ids are only committed to the filter by :meth:`commit` once the whole
+    invocation succeeded. If the invocation fails, firehose retries it with
+    the same records, and they must not be dropped as duplicates of
+    themselves.
+
+    :param path: optional file to persist the filter between containers.
+    :param save_interval: minimum seconds between two saves to ``path``.
+    """
+
+    def __init__(
+        self,
+        bloom: TimeWindowedBloomFilter = None,
+        path: str = None,
+        id_field: str = "id",
+        clock=time.time,
+        save_interval: float = 60,
+    ):
+        if path is not None and os.path.exists(path):
+            with open(path, "rb") as f:
+                bloom = TimeWindowedBloomFilter.load(f)
+        if bloom is None:
+            bloom = TimeWindowedBloomFilter()
+        self.bloom = bloom
+        self.path = path
+        self.id_field = id_field
+        self.clock = clock
+        self.save_interval = save_interval
+        self.saved_at: Optional[float] = None
+        self._pending: set = set()
+
+    def get_key(self, record: dict) -> Optional[bytes]:
+        record_id = record.get(self.id_field)
+        if record_id is None:
+            return None
+        return str(record_id).encode("utf-8")
+
+    def is_duplicate(self, record: dict) -> bool:
+        """
+        Check a record, and remember its id as pending. Records without id
+        are never duplicates.
+        """
+        key = self.get_key(record)
+        if key is None:
+            return False
+        if key in self._pending or key in self.bloom:
+            return True
+        self._pending.add(key)
+        return False
+
+    def commit(self, keys: Iterable[bytes] = None):
+        """
+        Remember the pending ids, or only ``keys`` among them, the ids of the
+        records delivered. The other pending ids are forgotten.
+        """
+        now = self.clock()
+        self.bloom.expire(now)
+        for key in (self._pending if keys is None else self._pending.intersection(keys)):
+            self.bloom.add(key, now)
+        self._pending.clear()
+        if self.path is not None and (
+            self.saved_at is None or now - self.saved_at >= self.save_interval
+        ):
+            self.save()
+            self.saved_at = now
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            self.bloom.dump(f)
+        os.replace(tmp_path, self.path)
+
+    def rollback(self):
+        self._pending.clear()
+
+
+def deduplicator_from_env() -> Optional[Deduplicator]:
+    """
+    Create the deduplicator configured by environment variables, None if
+    ``KDS_DEDUP_ENABLED`` is not ``"true"``.
+
+    - ``KDS_DEDUP_WINDOW_SECONDS``, default 3600
+    - ``KDS_DEDUP_CAPACITY``, ids per generation, default 1000000
+    - ``KDS_DEDUP_ERROR_RATE``, default 0.00001
+    - ``KDS_DEDUP_PATH``, optional file shared by the containers, such as
+      an EFS mount, to persist the filter
+    - ``KDS_DEDUP_SAVE_INTERVAL_SECONDS``, default 60
+    """
+    if os.environ.get("KDS_DEDUP_ENABLED", "false").lower() != "true":
+        return None
+    bloom = TimeWindowedBloomFilter(
+        window_seconds=int(os.environ.get("KDS_DEDUP_WINDOW_SECONDS", "3600")),
+        capacity_per_generation=int(os.environ.get("KDS_DEDUP_CAPACITY", "1000000")),
+        error_rate=float(os.environ.get("KDS_DEDUP_ERROR_RATE", "0.00001")),
+    )
+    return Deduplicator(
+        bloom=bloom,
+        path=os.environ.get("KDS_DEDUP_PATH"),
+        save_interval=float(os.environ.get("KDS_DEDUP_SAVE_INTERVAL_SECONDS", "60")),
+    )
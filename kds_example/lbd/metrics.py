@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per invocation metrics of the transformation lambda, written as one
+CloudWatch Embedded Metric Format (EMF) log line, CloudWatch extracts the
+metrics from the log asynchronously, no ``PutMetricData`` call is made.
+
+Metrics of an invocation:
+
+- ``InputBytes`` / ``OutputBytes``: decoded size of the firehose records
+  received and of the ``Ok`` records returned.
+- ``RecordsOk`` / ``RecordsDropped`` / ``RecordsProcessingFailed``, each
+  record of an aggregated payload counts.
+- ``<Stage>Time``: milliseconds spent in each pipeline stage, for example
+  ``DecodeTime``, ``TransformTime``, ``EncodeTime``.
+- ``RemainingTime``: milliseconds left before the lambda timeout when the
+  response is ready.
+"""
+
+import os
+import json
+import time
+from typing import List, Dict, Callable, Optional
+
+from .pipeline import OK, DROPPED, PROCESSING_FAILED, Item
+
+STATUS_METRIC_NAMES = {
+    OK: "RecordsOk",
+    DROPPED: "RecordsDropped",
+    PROCESSING_FAILED: "RecordsProcessingFailed",
+}
+
+
+def b64_decoded_size(data) -> int:
+    """
+    Size of the decoded data, computed from the length of the base64 string.
+    """
+    return b64_decoded_total_size([data])
+
+
+def b64_decoded_total_size(datas: list) -> int:
+    """
+    Total decoded size of a list of base64 strings (or bytes, not mixed),
+    without a python level loop over the records.
+    """
+    if not datas:
+        return 0
+    tails = [data[-2:] for data in datas]
+    empty = tails[0][:0]
+    padding = "=" if isinstance(empty, str) else b"="
+    return sum(map(len, datas)) * 3 // 4 - empty.join(tails).count(padding)
+
+
+def stage_metric_name(stage_name: str) -> str:
+    return "".join(part.capitalize() for part in stage_name.split("_")) + "Time"
+
+
+class MetricsEmitter:
+    """
+    :param namespace: CloudWatch metric namespace.
+    :param dimensions: dimension name and value, all metrics are published
+        with this set of dimensions.
+    :param print_func: where the EMF line goes, stdout goes to CloudWatch logs.
+    """
+
+    def __init__(
+        self,
+        namespace: str = "KdsExample",
+        dimensions: Dict[str, str] = None,
+        print_func: Callable[[str], None] = print,
+    ):
+        self.namespace = namespace
+        self.dimensions = dict(dimensions or {})
+        self.print_func = print_func
+
+    def collect(
+        self,
+        items: List[Item],
+        timings: Dict[str, float],
+        context=None,
+    ) -> Dict[str, float]:
+        """
+        Compute the metric values of an invocation.
+        """
+        statuses = [item.status for item in items]
+        # the items of an aggregated record share its record id and data
+        input_data = {item.record_id: item.data for item in items}
+        values = {
+            "InputBytes": b64_decoded_total_size(list(input_data.values())),
+            "OutputBytes": b64_decoded_total_size([item.value for item in items if item.status == OK]),
+        }
+        for status, name in STATUS_METRIC_NAMES.items():
+            values[name] = statuses.count(status)
+        for stage_name, elapse in timings.items():
+            values[stage_metric_name(stage_name)] = round(elapse * 1000, 3)
+        if context is not None:
+            values["RemainingTime"] = context.get_remaining_time_in_millis()
+        return values
+
+    def render(self, values: Dict[str, float], timestamp: int = None) -> str:
+        """
+        Render the EMF log line.
+        """
+        units = {
+            name: (
+                "Bytes" if name.endswith("Bytes")
+                else "Milliseconds" if name.endswith("Time")
+                else "Count"
+            )
+            for name in values
+        }
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000) if timestamp is None else timestamp,
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [list(self.dimensions)],
+                        "Metrics": [
+                            {"Name": name, "Unit": unit}
+                            for name, unit in units.items()
+                        ],
+                    }
+                ],
+            },
+        }
+        document.update(self.dimensions)
+        document.update(values)
+        return json.dumps(document)
+
+    def emit(self, items: List[Item], timings: Dict[str, float], context=None):
+        self.print_func(self.render(self.collect(items, timings, context)))
+
+
+def metrics_from_env() -> Optional[MetricsEmitter]:
+    """
+    Create the metrics emitter configured by environment variables, None if
+    ``KDS_METRICS_ENABLED`` is not ``"true"``.
+
+    - ``KDS_METRICS_NAMESPACE``, default "KdsExample"
+    - ``AWS_LAMBDA_FUNCTION_NAME``, set by lambda, the ``FunctionName``
+      dimension
+    """
+    if os.environ.get("KDS_METRICS_ENABLED", "false").lower() != "true":
+        return None
+    return MetricsEmitter(
+        namespace=os.environ.get("KDS_METRICS_NAMESPACE", "KdsExample"),
+        dimensions={"FunctionName": os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "unknown")},
+    )
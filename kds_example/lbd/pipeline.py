@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+"""
+Composable transformation pipeline for the firehose transformation lambda.
+
+A :class:`Pipeline` is a list of named :class:`Stage`, typically::
+
+    decode -> validate -> enrich -> project -> encode
+
+- a ``record`` stage is called as ``func(value) -> new_value`` for every
+  record still in flight.
+- a ``batch`` stage is called once as ``func(items)`` with the list of
+  :class:`Item` still in flight, it can update ``item.value`` or call
+  ``item.drop()`` / ``item.fail()``, good for lookups that should be done
+  once per buffer.
+
+A stage short-circuits a record by raising :class:`~kds_example.kds_helper.DropIt`
+(``Dropped``) or :class:`~kds_example.kds_helper.FailIt` (``ProcessingFailed``),
+later stages skip it and its original data is returned to firehose. Any
+other exception fails the whole invocation, so firehose retries it, unless
+the stage is created with ``fail_on_error=True``: then it only fails the
+record, for the stages whose errors come from the record itself, such as
+a malformed payload in ``decode``. A corrupt aggregated payload also only
+fails its firehose record.
+
+Compressed payloads of :mod:`kds_example.codec` are decompressed and the
+binary records of :mod:`kds_example.schema_registry` decoded by
+:func:`decode`, the encode stage writes NDJSON for every input. An aggregated payload, a micro-batch of records in one
+firehose record, is unpacked into one :class:`Item` per record, the ``Ok``
+outputs are joined back into the firehose record, any ``ProcessingFailed``
+record fails the whole firehose record, see :meth:`Pipeline.handle`.
+
+Every stage is timed, :attr:`Pipeline.last_timings` has the seconds spent in
+each stage during the last invocation, :attr:`Pipeline.total_timings` the sum
+over all warm invocations of the container.
+"""
+
+import json
+import time
+import base64
+from typing import List, Dict, Any, Callable, Optional, Union
+
+import attr
+
+from ..kds_helper import DropIt, FailIt
+from ..codec import decompress, is_aggregated, unpack_records
+from ..schema_registry import loads
+
+OK = "Ok"
+DROPPED = "Dropped"
+PROCESSING_FAILED = "ProcessingFailed"
+
+
+@attr.s
+class Item:
+    """
+    One firehose record flowing through the pipeline.
+
+    :param record_id: firehose ``recordId``.
+    :param data: the original base64 encoded data.
+    :param value: the current value, the output of the last stage.
+    :param event_record: the firehose event record, for its metadata such as
+        ``approximateArrivalTimestamp``.
+    """
+    record_id: str = attr.ib()
+    data: str = attr.ib()
+    value: Any = attr.ib()
+    status: str = attr.ib(default=OK)
+    error: Optional[str] = attr.ib(default=None)
+    event_record: Optional[dict] = attr.ib(default=None, repr=False)
+
+    @property
+    def is_ok(self) -> bool:
+        return self.status == OK
+
+    def drop(self):
+        self.status = DROPPED
+
+    def fail(self, error: str = None):
+        self.status = PROCESSING_FAILED
+        self.error = error
+
+
+@attr.s
+class Stage:
+    """
+    :param on_success: called with all the items after the whole invocation
+        succeeded.
+    :param on_error: called if the invocation failed, firehose will retry it.
+    :param fail_on_error: a record stage turns any exception raised for a
+        record into ``ProcessingFailed``, instead of failing the invocation.
+    """
+    name: str = attr.ib()
+    func: Callable = attr.ib()
+    mode: str = attr.ib(default="record")
+    on_success: Optional[Callable[[List["Item"]], None]] = attr.ib(default=None)
+    on_error: Optional[Callable[[], None]] = attr.ib(default=None)
+    fail_on_error: bool = attr.ib(default=False)
+
+    @mode.validator
+    def check_mode(self, attribute, value):
+        if value not in ("record", "batch"):
+            raise ValueError(f"mode has to be 'record' or 'batch', got {value!r}")
+
+    def run(self, items: List[Item]):
+        if self.mode == "batch":
+            self.func(items)
+            return
+        func = self.func
+        for item in items:
+            try:
+                item.value = func(item.value)
+            except DropIt:
+                item.drop()
+            except FailIt as e:
+                item.fail(str(e) or self.name)
+            except Exception as e:
+                if not self.fail_on_error:
+                    raise
+                item.fail(f"{self.name}: {e!r}")
+
+
+def decode(data: Union[str, bytes]) -> dict:
+    """
+    :param data: the base64 firehose data, or the bytes of a record unpacked
+        from an aggregated payload, compressed or not, JSON or binary.
+    """
+    if isinstance(data, str):
+        data = base64.b64decode(data.encode("utf-8"))
+    return loads(decompress(data))
+
+
+def is_aggregated_data(data: str) -> bool:
+    """
+    Check the header of a base64 firehose data without decoding all of it.
+    """
+    return is_aggregated(base64.b64decode(data[:8].encode("utf-8")))
+
+
+def encode(record: dict) -> bytes:
+    return base64.b64encode((json.dumps(record) + "\n").encode("utf-8"))
+
+
+def project(fields: List[str]) -> Callable[[dict], dict]:
+    """
+    Create a record stage function that only keeps the given fields.
+    """
+    fields = list(fields)
+
+    def _project(record: dict) -> dict:
+        return {k: record[k] for k in fields if k in record}
+
+    return _project
+
+
+class Pipeline:
+    """
+    :param metrics: optional :class:`~kds_example.lbd.metrics.MetricsEmitter`,
+        emits the metrics of each :meth:`handle` call.
+    :param unpack_aggregated: unpack the aggregated payloads, if False they
+        are ``ProcessingFailed``, for destinations that need one document per
+        firehose record such as OpenSearch.
+    :param profiler: optional
+        :class:`~kds_example.lbd.profiler.InvocationProfiler`, profiles the
+        sampled :meth:`handle` calls.
+    """
+
+    def __init__(
+        self,
+        stages: List[Stage] = None,
+        log_timings: bool = False,
+        metrics=None,
+        unpack_aggregated: bool = True,
+        profiler=None,
+    ):
+        self.stages: List[Stage] = list(stages or [])
+        self.log_timings = log_timings
+        self.metrics = metrics
+        self.unpack_aggregated = unpack_aggregated
+        self.profiler = profiler
+        # name of the stage running, the profiler labels its samples with it
+        self.current_stage: Optional[str] = None
+        self.last_timings: Dict[str, float] = dict()
+        self.total_timings: Dict[str, float] = dict()
+        self.n_invocations = 0
+
+    def add_stage(self, name: str, func: Callable, mode: str = "record", **kwargs) -> "Pipeline":
+        self.stages.append(Stage(name=name, func=func, mode=mode, **kwargs))
+        return self
+
+    def stage(self, name: str = None, mode: str = "record", **kwargs):
+        """
+        Decorator to register a function as the next stage.
+        """
+
+        def decorator(func):
+            self.add_stage(name or func.__name__, func, mode=mode, **kwargs)
+            return func
+
+        return decorator
+
+    def run(self, items: List[Item]) -> List[Item]:
+        timings = dict()
+        try:
+            for stage in self.stages:
+                self.current_stage = stage.name
+                st = time.perf_counter()
+                stage.run([item for item in items if item.is_ok])
+                timings[stage.name] = time.perf_counter() - st
+        except Exception:
+            for stage in self.stages:
+                if stage.on_error is not None:
+                    stage.on_error()
+            raise
+        finally:
+            self.current_stage = None
+        for stage in self.stages:
+            if stage.on_success is not None:
+                stage.on_success(items)
+
+        self.last_timings = timings
+        self.n_invocations += 1
+        for name, elapse in timings.items():
+            self.total_timings[name] = self.total_timings.get(name, 0.0) + elapse
+        if self.log_timings:
+            print(json.dumps({
+                "n_records": len(items),
+                "stage_timings_ms": {
+                    name: round(elapse * 1000, 3)
+                    for name, elapse in timings.items()
+                },
+            }))
+        return items
+
+    def handle(self, event: dict, context=None) -> dict:
+        """
+        Run the pipeline on a firehose transformation event, return the
+        firehose transformation response.
+
+        :param context: the lambda context, for the remaining time metric.
+        """
+        items = list()
+        # record id -> the items of an aggregated record
+        aggregated: Dict[str, List[Item]] = dict()
+        for record in event["records"]:
+            data = record["data"]
+            if not is_aggregated_data(data):
+                items.append(Item(
+                    record_id=record["recordId"],
+                    data=data,
+                    value=data,
+                    event_record=record,
+                ))
+                continue
+            if not self.unpack_aggregated:
+                item = Item(record_id=record["recordId"], data=data, value=data, event_record=record)
+                item.fail("aggregated record")
+                items.append(item)
+                continue
+            try:
+                values = unpack_records(base64.b64decode(data.encode("utf-8")))
+            except Exception as e:
+                item = Item(record_id=record["recordId"], data=data, value=data, event_record=record)
+                item.fail(f"unpack: {e!r}")
+                items.append(item)
+                continue
+            parts = [
+                Item(record_id=record["recordId"], data=data, value=value, event_record=record)
+                for value in values
+            ]
+            if not parts:
+                item = Item(record_id=record["recordId"], data=data, value=data, event_record=record)
+                item.drop()
+                items.append(item)
+                continue
+            aggregated[record["recordId"]] = parts
+            items.extend(parts)
+
+        if self.profiler is None:
+            self.run(items)
+        else:
+            with self.profiler.maybe_profile(
+                event.get("invocationId", "unknown"),
+                label=lambda: self.current_stage,
+            ):
+                self.run(items)
+        if self.metrics is not None:
+            self.metrics.emit(items, self.last_timings, context)
+
+        records = list()
+        for item in items:
+            if item.record_id not in aggregated:
+                records.append({
+                    "recordId": item.record_id,
+                    "result": item.status,
+                    "data": item.value if item.is_ok else item.data,
+                })
+            elif item is aggregated[item.record_id][0]:
+                records.append(self._join(item.event_record, aggregated[item.record_id]))
+        return {"records": records}
+
+    @staticmethod
+    def _join(record: dict, parts: List[Item]) -> dict:
+        """
+        The firehose result of an aggregated record.
+        """
+        statuses = {item.status for item in parts}
+        if PROCESSING_FAILED in statuses:
+            status = PROCESSING_FAILED
+        elif statuses == {DROPPED}:
+            status = DROPPED
+        else:
+            status = OK
+        if status != OK:
+            return {"recordId": record["recordId"], "result": status, "data": record["data"]}
+        return {
+            "recordId": record["recordId"],
+            "result": OK,
+            "data": base64.b64encode(b"".join(
+                base64.b64decode(item.value) for item in parts if item.is_ok
+            )),
+        }
@@ -1,11 +1,36 @@
 # -*- coding: utf-8 -*-
 
-from .common import delivery_stream_tranformation_handler
+import os
+
+from .common import build_pipeline
+from .dedup import deduplicator_from_env
+from .metrics import metrics_from_env
+from .profiler import profiler_from_env
+from .validator import compile_validator
+from ..schema import bank_account_schema
+
+# module level, so the seen ids survive warm invocations
+dedup = deduplicator_from_env()
+
+# reject malformed documents here, instead of one by one in opensearch bulk
+validate = compile_validator(bank_account_schema)
 
 
 def transform(dct: dict) -> dict:
     return dct
 
 
+pipeline = build_pipeline(
+    transform,
+    dedup=dedup,
+    validator=validate,
+    log_timings=os.environ.get("KDS_LOG_STAGE_TIMINGS", "false").lower() == "true",
+    metrics=metrics_from_env(),
+    profiler=profiler_from_env(),
+    # opensearch takes one document per firehose record
+    unpack_aggregated=False,
+)
+
+
 def handler(event, context):
-    return delivery_stream_tranformation_handler(event, transform)
+    return pipeline.handle(event, context)
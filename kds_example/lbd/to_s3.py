@@ -1,11 +1,28 @@
 # -*- coding: utf-8 -*-
 
-from .common import delivery_stream_tranformation_handler
+import os
+
+from .common import build_pipeline
+from .dedup import deduplicator_from_env
+from .metrics import metrics_from_env
+from .profiler import profiler_from_env
+
+# module level, so the seen ids survive warm invocations
+dedup = deduplicator_from_env()
 
 
 def transform(dct: dict) -> dict:
     return dct
 
 
+pipeline = build_pipeline(
+    transform,
+    dedup=dedup,
+    log_timings=os.environ.get("KDS_LOG_STAGE_TIMINGS", "false").lower() == "true",
+    metrics=metrics_from_env(),
+    profiler=profiler_from_env(),
+)
+
+
 def handler(event, context):
-    return delivery_stream_tranformation_handler(event, transform)
+    return pipeline.handle(event, context)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+"""
+Record validator compiled from a :mod:`kds_example.schema` schema.
+
+:func:`compile_validator` generates the source code of a validation function
+specialized for one schema, with every type check and constant inlined, and
+compiles it once at import time. The generated function returns None for a
+valid record, or the first error message, it does no work for fields the
+schema doesn't declare.
+
+:func:`interpret` is the generic, jsonschema style interpreter of the same
+rules. It walks the schema for every record, it is the reference
+implementation in tests and the baseline in ``benchmark/bench_validator.py``.
+"""
+
+from typing import Callable, Optional
+
+from ..schema import Schema, Field
+
+INT32_MIN, INT32_MAX = -2 ** 31, 2 ** 31 - 1
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+# mapping type -> (python type check expression on ``v``, description)
+_type_checks = {
+    "keyword": ("type(v) is str", "string"),
+    "text": ("type(v) is str", "string"),
+    "integer": (f"type(v) is int and {INT32_MIN} <= v <= {INT32_MAX}", "32 bit integer"),
+    "long": (f"type(v) is int and {INT64_MIN} <= v <= {INT64_MAX}", "64 bit integer"),
+    "float": ("type(v) is float or type(v) is int", "number"),
+    "double": ("type(v) is float or type(v) is int", "number"),
+    "boolean": ("type(v) is bool", "boolean"),
+    "date": ("type(v) is str or type(v) is int", "date string or epoch millis"),
+}
+
+Validator = Callable[[dict], Optional[str]]
+
+
+def _render_field(name: str, field: Field) -> str:
+    check, description = _type_checks[field.type]
+    lines = [
+        f"    v = record.get({name!r}, _MISSING)",
+        f"    if v is _MISSING:",
+        f"        {'return ' + repr(name + ': missing') if field.required else 'pass'}",
+    ]
+    if field.nullable:
+        lines.append(f"    elif v is None:")
+        lines.append(f"        pass")
+    lines.append(f"    elif not ({check}):")
+    lines.append(f"        return {name + ': expect ' + description!r}")
+    if field.max_length is not None:
+        lines.append(f"    elif len(v) > {field.max_length}:")
+        lines.append(f"        return {name + ': longer than ' + str(field.max_length)!r}")
+    return "\n".join(lines)
+
+
+def render_validator_source(schema: Schema, func_name: str = "validate") -> str:
+    parts = [
+        f"def {func_name}(record):",
+        f"    if type(record) is not dict:",
+        f"        return 'record: expect object'",
+    ]
+    for name, field in schema.items():
+        parts.append(_render_field(name, field))
+    parts.append("    return None")
+    return "\n".join(parts) + "\n"
+
+
+def compile_validator(schema: Schema) -> Validator:
+    source = render_validator_source(schema)
+    namespace = {"_MISSING": object()}
+    exec(compile(source, "<validator>", "exec"), namespace)
+    return namespace["validate"]
+
+
+def _check_type(type_: str, v) -> bool:
+    if type_ in ("keyword", "text"):
+        return isinstance(v, str)
+    if type_ == "integer":
+        return isinstance(v, int) and not isinstance(v, bool) and INT32_MIN <= v <= INT32_MAX
+    if type_ == "long":
+        return isinstance(v, int) and not isinstance(v, bool) and INT64_MIN <= v <= INT64_MAX
+    if type_ in ("float", "double"):
+        return isinstance(v, (int, float)) and not isinstance(v, bool)
+    if type_ == "boolean":
+        return isinstance(v, bool)
+    if type_ == "date":
+        return isinstance(v, (str, int)) and not isinstance(v, bool)
+    raise ValueError(f"unknown type {type_!r}")
+
+
+def interpret(schema: Schema, record) -> Optional[str]:
+    if not isinstance(record, dict):
+        return "record: expect object"
+    for name, field in schema.items():
+        if name not in record:
+            if field.required:
+                return f"{name}: missing"
+            continue
+        v = record[name]
+        if v is None and field.nullable:
+            continue
+        if not _check_type(field.type, v):
+            return f"{name}: expect {_type_checks[field.type][1]}"
+        if field.max_length is not None and len(v) > field.max_length:
+            return f"{name}: longer than {field.max_length}"
+    return None
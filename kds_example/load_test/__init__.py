@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+
+"""
+Load test tool kit for the kinesis data stream producers.
+"""
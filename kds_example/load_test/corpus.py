@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pre-generated record corpus for the producers.
+
+Generating fake records with Faker costs more CPU than sending them, so the
+load generators read them from a corpus built ahead of time instead:
+
+- ``{path}`` is the NDJSON encoded records, one per line, exactly the bytes
+  sent as the kinesis record ``Data``.
+- ``{path}.idx`` is ``n_records + 1`` little endian uint64 offsets of the
+  lines in ``{path}``.
+
+The data file is memory mapped, so many producer processes share the same
+pages and a producer only touches the records it sends. The same ``seed``
+always builds the same corpus, and each producer walks it from a fixed
+start, so two runs send the same records in the same order. With a
+``salt`` the id of a record is replaced by :func:`salted_id` when it is
+sent, a new run or a new lap over the corpus sends new ids the
+deduplicator does not drop, the sizes and the other fields stay the same.
+"""
+
+import sys
+import json
+import mmap
+import uuid
+import random
+import hashlib
+from array import array
+from typing import List, Callable, Optional
+
+# every line starts with ``{"id": "<uuid>"``, so the partition key is read
+# from fixed offsets without parsing the json
+ID_START = len('{"id": "')
+ID_END = ID_START + 36
+
+
+def salted_id(salt: str, record_id: str, lap: int = 0) -> str:
+    """
+    A uuid4 string made from a record id and a salt, the same length as the
+    id, so the record size does not change.
+    """
+    digest = hashlib.md5(f"{salt}:{record_id}:{lap}".encode("utf-8")).digest()
+    return str(uuid.UUID(bytes=digest, version=4))
+
+
+def faker_record_maker(seed: int) -> Callable[[], dict]:
+    """
+    Return a callable that makes a random ``bank_account`` record, same as
+    ``data_producer/multi_process_producer.py`` but deterministic.
+    """
+    from faker import Faker
+
+    fake = Faker()
+    fake.seed_instance(seed)
+    rng = random.Random(seed)
+
+    def make_record() -> dict:
+        return {
+            "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            "firstname": fake.first_name(),
+            "lastname": fake.last_name(),
+            "description": fake.sentence(nb_words=10),
+            "balance": 0,
+        }
+
+    return make_record
+
+
+def build_corpus(
+    path: str,
+    n_records: int,
+    seed: int = 0,
+    make_record: Optional[Callable[[], dict]] = None,
+) -> int:
+    """
+    Generate ``n_records`` records and write the corpus files.
+
+    :param make_record: zero argument callable returning a record dict with
+        ``id`` as the first key, default to :func:`faker_record_maker`.
+    :return: size of the data file in bytes
+    """
+    if make_record is None:
+        make_record = faker_record_maker(seed)
+    offsets = array("Q", [0])
+    offset = 0
+    with open(path, "wb") as f:
+        for _ in range(n_records):
+            line = (json.dumps(make_record()) + "\n").encode("utf-8")
+            if line[ID_END:ID_END + 1] != b'"':
+                raise ValueError("record has to start with a 36 characters 'id'")
+            f.write(line)
+            offset += len(line)
+            offsets.append(offset)
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    with open(path + ".idx", "wb") as f:
+        offsets.tofile(f)
+    return offset
+
+
+class Corpus:
+    """
+    Read only view of a corpus built by :func:`build_corpus`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        offsets = array("Q")
+        with open(path + ".idx", "rb") as f:
+            offsets.frombytes(f.read())
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        self.offsets = offsets
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def view(self, i: int) -> memoryview:
+        """
+        Zero copy view of the i-th record.
+        """
+        return memoryview(self._mmap)[self.offsets[i]:self.offsets[i + 1]]
+
+    def data(self, i: int) -> bytes:
+        return self._mmap[self.offsets[i]:self.offsets[i + 1]]
+
+    def partition_key(self, i: int) -> str:
+        start = self.offsets[i]
+        return self._mmap[start + ID_START:start + ID_END].decode("ascii")
+
+    def kinesis_record(self, i: int, salt: str = None, lap: int = 0) -> dict:
+        """
+        :param salt: optional, replace the id with :func:`salted_id`.
+        :param lap: number of times the corpus was sent before, a part of
+            the salted id.
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        mm = self._mmap
+        record_id = mm[start + ID_START:start + ID_END].decode("ascii")
+        if salt is None:
+            return {"Data": mm[start:end], "PartitionKey": record_id}
+        record_id = salted_id(salt, record_id, lap)
+        return {
+            "Data": mm[start:start + ID_START] + record_id.encode("ascii") + mm[start + ID_END:end],
+            "PartitionKey": record_id,
+        }
+
+    def kinesis_records(self, start: int, n: int, salt: str = None) -> List[dict]:
+        """
+        ``PutRecords`` entries of ``n`` records from ``start``, wrapping
+        around the end of the corpus.
+        """
+        n_records = len(self)
+        return [
+            self.kinesis_record((start + i) % n_records, salt, (start + i) // n_records)
+            for i in range(n)
+        ]
+
+    def start_of(self, producer_id: int, n_producers: int) -> int:
+        """
+        Where a producer starts, producers are spread evenly over the corpus
+        so they don't send the same records at the same time.
+        """
+        return len(self) * producer_id // n_producers
+
+    def record_factory(self, start: int = 0, salt: str = None) -> Callable[[], dict]:
+        """
+        Return a zero argument callable returning the next ``PutRecords``
+        entry from ``start``, for ``generator.run_producer``.
+
+        :param salt: optional, see :meth:`kinesis_record`.
+        """
+        n_records = len(self)
+        # position, lap
+        state = [start % n_records, 0]
+
+        def make_kinesis_record() -> dict:
+            i, lap = state
+            state[0] = (i + 1) % n_records
+            if state[0] == 0:
+                state[1] += 1
+            return self.kinesis_record(i, salt, lap)
+
+        return make_kinesis_record
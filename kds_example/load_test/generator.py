@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+
+"""
+Load generator for the kinesis data stream.
+
+- ``n_producers`` threads share a ``target_rate`` in records / sec, each
+  sends ``PutRecords`` requests of ``records_per_request`` records.
+- open loop pacing (default): request ``i`` of a producer is scheduled at
+  ``start + i * interval`` no matter how long the previous ones took, and
+  its response time is measured from that scheduled time, so a slow stream
+  shows up as growing latency instead of a silently lower send rate
+  (no coordinated omission). Closed loop waits ``interval`` after each
+  response, like the original producer script.
+- record sizes follow a fixed, uniform or lognormal distribution, or
+  records are read from a pre-generated corpus (``corpus_path``), see
+  :mod:`.corpus`. The same ``seed`` makes the same records, their ids are
+  mixed with ``id_salt``, a new one per run, so the deduplicator of the
+  delivery stream doesn't drop the records of a previous run. Pass the
+  ``id_salt`` of a report to send the exact same records again.
+- ``trace_rate`` of the records are stamped with a trace right before they
+  are sent, see :mod:`kds_example.tracing`.
+- records failed in a ``PutRecords`` response are retried with exponential
+  backoff, throttles and retries are counted.
+- every producer keeps its own counters and histograms, they are merged
+  after the run, there is no shared state in the hot loop.
+
+:func:`run_load_test` returns a JSON serializable report, see
+:func:`compare_reports` to compare two runs.
+"""
+
+import json
+import math
+import time
+import uuid
+import random
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Callable
+
+import attr
+
+from ..fake_kinesis import get_error_code
+from .histogram import Histogram
+from .corpus import Corpus, salted_id
+from ..tracing import now_ms, stamp_data
+
+THROTTLE_ERROR_CODE = "ProvisionedThroughputExceededException"
+
+first_names = ["Jerry", "Alice", "Bob", "Cathy", "David", "Emma", "Frank", "Grace"]
+last_names = ["Snyder", "Smith", "Johnson", "Brown", "Jones", "Garcia", "Miller", "Davis"]
+filler = "Mrs air in wife financial within live pull artist back. " * 1000
+
+
+@attr.s
+class LoadTestConfig:
+    stream_name: str = attr.ib()
+    target_rate: float = attr.ib(default=1000)
+    n_producers: int = attr.ib(default=8)
+    duration: float = attr.ib(default=60)
+    records_per_request: int = attr.ib(default=100)
+    record_size_distribution: str = attr.ib(default="fixed")
+    record_size_mean: int = attr.ib(default=180)
+    record_size_min: int = attr.ib(default=120)
+    record_size_max: int = attr.ib(default=4096)
+    open_loop: bool = attr.ib(default=True)
+    max_retries: int = attr.ib(default=3)
+    retry_base_delay: float = attr.ib(default=0.05)
+    seed: int = attr.ib(default=0)
+    corpus_path: str = attr.ib(default=None)
+    trace_rate: float = attr.ib(default=0.0)
+    # mixed into the record ids, None to send the ids of the seed as is
+    id_salt: str = attr.ib(factory=lambda: uuid.uuid4().hex)
+
+    @record_size_distribution.validator
+    def check_record_size_distribution(self, attribute, value):
+        if value not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"unknown record size distribution {value!r}")
+
+    @property
+    def request_interval(self) -> float:
+        """
+        Seconds between two requests of the same producer.
+        """
+        return self.n_producers * self.records_per_request / self.target_rate
+
+
+class RecordFactory:
+    """
+    Create ``bank_account`` records of a random size, the size is the length
+    of the NDJSON line in bytes, tuned with the ``description`` field.
+    """
+
+    def __init__(self, config: LoadTestConfig, rng: random.Random):
+        self.config = config
+        self.rng = rng
+
+    def next_size(self) -> int:
+        config = self.config
+        if config.record_size_distribution == "fixed":
+            size = config.record_size_mean
+        elif config.record_size_distribution == "uniform":
+            size = self.rng.randint(config.record_size_min, config.record_size_max)
+        else:
+            # lognormal with the given mean and a sigma of 0.5
+            sigma = 0.5
+            mu = max(1.0, float(config.record_size_mean))
+            size = self.rng.lognormvariate(mu=math.log(mu) - sigma ** 2 / 2, sigma=sigma)
+        return int(min(max(size, config.record_size_min), config.record_size_max))
+
+    def make_record(self, size: int) -> dict:
+        rng = self.rng
+        record_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        if self.config.id_salt is not None:
+            record_id = salted_id(self.config.id_salt, record_id)
+        record = {
+            "id": record_id,
+            "firstname": rng.choice(first_names),
+            "lastname": rng.choice(last_names),
+            "description": "",
+            "balance": 0,
+        }
+        base_size = len(json.dumps(record)) + 1
+        n = max(0, size - base_size)
+        offset = rng.randrange(0, len(filler) - n) if n < len(filler) else 0
+        record["description"] = filler[offset:offset + n]
+        return record
+
+    def make_kinesis_record(self) -> dict:
+        record = self.make_record(self.next_size())
+        return {
+            "Data": (json.dumps(record) + "\n").encode("utf-8"),
+            "PartitionKey": record["id"],
+        }
+
+
+@attr.s
+class ProducerStats:
+    requests: int = attr.ib(default=0)
+    request_errors: int = attr.ib(default=0)
+    throttled_requests: int = attr.ib(default=0)
+    retries: int = attr.ib(default=0)
+    records_sent: int = attr.ib(default=0)
+    records_ok: int = attr.ib(default=0)
+    records_throttled: int = attr.ib(default=0)
+    records_retried: int = attr.ib(default=0)
+    records_failed: int = attr.ib(default=0)
+    bytes_ok: int = attr.ib(default=0)
+    # service time of each PutRecords call, in micro seconds
+    latency: Histogram = attr.ib(factory=Histogram)
+    # from the scheduled send time to the final response, including retries
+    response_time: Histogram = attr.ib(factory=Histogram)
+
+    def merge(self, other: "ProducerStats"):
+        for field in attr.fields(ProducerStats):
+            value = getattr(self, field.name)
+            if isinstance(value, Histogram):
+                value.merge(getattr(other, field.name))
+            else:
+                setattr(self, field.name, value + getattr(other, field.name))
+
+
+def send_with_retries(
+    kinesis_client,
+    config: LoadTestConfig,
+    kin_records: List[dict],
+    stats: ProducerStats,
+    rng: random.Random,
+    sleep: Callable[[float], None] = time.sleep,
+):
+    pending = kin_records
+    stats.records_sent += len(kin_records)
+    for attempt in range(config.max_retries + 1):
+        st = time.perf_counter()
+        try:
+            res = kinesis_client.put_records(Records=pending, StreamName=config.stream_name)
+        except Exception as e:
+            stats.request_errors += 1
+            if get_error_code(e) == THROTTLE_ERROR_CODE:
+                stats.throttled_requests += 1
+            res = None
+        stats.latency.record((time.perf_counter() - st) * 1000000)
+        stats.requests += 1
+
+        if res is None:
+            failed = pending
+        else:
+            failed = list()
+            for kin_record, result in zip(pending, res["Records"]):
+                if "ErrorCode" in result:
+                    failed.append(kin_record)
+                    if result["ErrorCode"] == THROTTLE_ERROR_CODE:
+                        stats.records_throttled += 1
+                else:
+                    stats.records_ok += 1
+                    stats.bytes_ok += len(kin_record["Data"])
+
+        if not failed:
+            return
+        if attempt == config.max_retries:
+            stats.records_failed += len(failed)
+            return
+        stats.retries += 1
+        stats.records_retried += len(failed)
+        sleep(config.retry_base_delay * (2 ** attempt) * (1 + rng.random()))
+        pending = failed
+
+
+def run_producer(
+    kinesis_client,
+    config: LoadTestConfig,
+    producer_id: int,
+    start_at: float,
+    make_kinesis_record: Callable[[], dict] = None,
+    on_request: Callable[[ProducerStats], None] = None,
+    should_stop: Callable[[], bool] = None,
+) -> ProducerStats:
+    """
+    Run one producer until ``start_at + duration``.
+
+    :param make_kinesis_record: optional zero argument callable returning a
+        ``PutRecords`` entry, default to :class:`RecordFactory`.
+    :param on_request: optional callable called with the stats after each
+        request, to publish progress.
+    :param should_stop: optional zero argument callable, the producer stops
+        early when it returns True.
+    """
+    rng = random.Random(config.seed * 1000003 + producer_id)
+    if make_kinesis_record is None:
+        make_kinesis_record = RecordFactory(config, rng).make_kinesis_record
+    stats = ProducerStats()
+    interval = config.request_interval
+    end_at = start_at + config.duration
+    # spread the producers over the first interval
+    first_at = start_at + interval * producer_id / config.n_producers
+    # count requests with an int, float accumulation would drift
+    n_requests = int(config.duration / interval + 1e-9)
+    i = 0
+    scheduled = first_at
+    while (i < n_requests) if config.open_loop else (scheduled < end_at):
+        now = time.time()
+        if scheduled > now:
+            time.sleep(scheduled - now)
+        kin_records = [make_kinesis_record() for _ in range(config.records_per_request)]
+        if config.trace_rate:
+            produced_at = now_ms()
+            for i_record, kin_record in enumerate(kin_records):
+                if rng.random() < config.trace_rate:
+                    kin_records[i_record] = dict(
+                        kin_record,
+                        Data=stamp_data(kin_record["Data"], now=produced_at),
+                    )
+        send_with_retries(kinesis_client, config, kin_records, stats, rng)
+        finished = time.time()
+        stats.response_time.record((finished - scheduled) * 1000000)
+        if on_request is not None:
+            on_request(stats)
+        if should_stop is not None and should_stop():
+            break
+        i += 1
+        if config.open_loop:
+            scheduled = first_at + i * interval
+        else:
+            scheduled = finished + interval
+    return stats
+
+
+def make_report(
+    config: LoadTestConfig,
+    stats: ProducerStats,
+    started_at: float,
+    elapsed: float,
+) -> dict:
+    return {
+        "config": attr.asdict(config),
+        "started_at": datetime.fromtimestamp(started_at, tz=timezone.utc).isoformat(),
+        "elapsed": round(elapsed, 3),
+        "requests": {
+            "total": stats.requests,
+            "errors": stats.request_errors,
+            "throttled": stats.throttled_requests,
+            "retries": stats.retries,
+        },
+        "records": {
+            "sent": stats.records_sent,
+            "ok": stats.records_ok,
+            "throttled": stats.records_throttled,
+            "retried": stats.records_retried,
+            "failed": stats.records_failed,
+        },
+        "throughput": {
+            "records_per_sec": round(stats.records_ok / elapsed, 1) if elapsed else 0,
+            "mb_per_sec": round(stats.bytes_ok / elapsed / 1024 / 1024, 4) if elapsed else 0,
+        },
+        "latency_us": {
+            "put_records": stats.latency.summary(),
+            "response_time": stats.response_time.summary(),
+        },
+        "histograms": {
+            "put_records": stats.latency.to_dict(),
+            "response_time": stats.response_time.to_dict(),
+        },
+    }
+
+
+def run_load_test(kinesis_client, config: LoadTestConfig) -> dict:
+    """
+    Run all producers in threads, return the report.
+    """
+    corpus = None if config.corpus_path is None else Corpus(config.corpus_path)
+    start_at = time.time() + 0.1
+    with ThreadPoolExecutor(max_workers=config.n_producers) as executor:
+        futures = [
+            executor.submit(
+                run_producer, kinesis_client, config, producer_id, start_at,
+                None if corpus is None else corpus.record_factory(
+                    corpus.start_of(producer_id, config.n_producers), salt=config.id_salt,
+                ),
+            )
+            for producer_id in range(config.n_producers)
+        ]
+        all_stats = [future.result() for future in futures]
+    elapsed = time.time() - start_at
+    if corpus is not None:
+        corpus.close()
+
+    stats = ProducerStats()
+    for producer_stats in all_stats:
+        stats.merge(producer_stats)
+    return make_report(config, stats, start_at, elapsed)
+
+
+def write_report(report: dict, path: str):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=4)
+
+
+def read_report(path: str) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def compare_reports(baseline: dict, current: dict) -> Dict[str, dict]:
+    """
+    Compare the key metrics of two reports.
+
+    :return: ``{metric: {"baseline": ..., "current": ..., "change": ratio}}``
+    """
+
+    def metrics(report: dict) -> dict:
+        n_sent = report["records"]["sent"] or 1
+        return {
+            "records_per_sec": report["throughput"]["records_per_sec"],
+            "mb_per_sec": report["throughput"]["mb_per_sec"],
+            # throttled attempts per record, retries included
+            "throttle_rate": round(report["records"]["throttled"] / n_sent, 4),
+            "failure_rate": round(report["records"]["failed"] / n_sent, 4),
+            "put_records_p50_us": report["latency_us"]["put_records"]["p50"],
+            "put_records_p99_us": report["latency_us"]["put_records"]["p99"],
+            "response_time_p99_us": report["latency_us"]["response_time"]["p99"],
+        }
+
+    baseline_metrics, current_metrics = metrics(baseline), metrics(current)
+    return {
+        name: {
+            "baseline": baseline_metrics[name],
+            "current": current_metrics[name],
+            "change": (
+                (current_metrics[name] - baseline_metrics[name]) / baseline_metrics[name]
+                if baseline_metrics[name] else None
+            ),
+        }
+        for name in baseline_metrics
+    }
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+A small HDR style latency histogram.
+
+Values are integers (microseconds for latencies). Values below
+``2 ** sub_bucket_bits`` are recorded exactly, larger values go to log
+linear buckets of ``2 ** (sub_bucket_bits - 1)`` sub buckets per power of
+two, so the relative error stays below ``2 ** -(sub_bucket_bits - 1)``
+(< 1% with the default 8 bits) on any range, with a memory proportional to
+the number of distinct buckets hit. Histograms can be merged, which is how
+per producer histograms are aggregated, and serialized to JSON.
+"""
+
+from typing import Dict, List
+
+
+class Histogram:
+    def __init__(self, sub_bucket_bits: int = 8):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts: Dict[int, int] = dict()
+        self.total_count = 0
+        self.min = None
+        self.max = None
+        self.sum = 0
+
+    def _index(self, value: int) -> int:
+        shift = value.bit_length() - self.sub_bucket_bits
+        if shift <= 0:
+            return value
+        # ``value >> shift`` has exactly ``sub_bucket_bits`` bits, so
+        # (shift, value >> shift) packed in one int is unique and ordered
+        return (shift << self.sub_bucket_bits) + (value >> shift)
+
+    def _value_of(self, index: int) -> int:
+        """
+        The highest value that maps to this bucket.
+        """
+        shift = index >> self.sub_bucket_bits
+        if shift == 0:
+            return index
+        top = index & ((1 << self.sub_bucket_bits) - 1)
+        return ((top + 1) << shift) - 1
+
+    def record(self, value: int, count: int = 1):
+        value = max(0, int(value))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total_count += count
+        self.sum += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: "Histogram"):
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError("can't merge histograms with different precision")
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total_count += other.total_count
+        self.sum += other.sum
+        for value in [other.min, other.max]:
+            if value is not None:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+
+    def percentile(self, q: float) -> int:
+        """
+        :param q: 0 - 100
+        """
+        if not self.total_count:
+            return 0
+        target = max(1, int(round(q / 100 * self.total_count)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._value_of(index), self.max)
+        return self.max
+
+    def percentiles(self, qs: List[float] = (50, 90, 95, 99, 99.9)) -> Dict[str, int]:
+        return {f"p{q:g}": self.percentile(q) for q in qs}
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.total_count if self.total_count else 0.0
+
+    def summary(self) -> dict:
+        dct = {
+            "count": self.total_count,
+            "min": self.min or 0,
+            "mean": round(self.mean, 1),
+            "max": self.max or 0,
+        }
+        dct.update(self.percentiles())
+        return dct
+
+    def to_dict(self) -> dict:
+        return {
+            "sub_bucket_bits": self.sub_bucket_bits,
+            "counts": {str(index): count for index, count in sorted(self.counts.items())},
+            "min": self.min,
+            "max": self.max,
+            "sum": self.sum,
+        }
+
+    @classmethod
+    def from_dict(cls, dct: dict) -> "Histogram":
+        histogram = cls(sub_bucket_bits=dct["sub_bucket_bits"])
+        histogram.counts = {int(index): count for index, count in dct["counts"].items()}
+        histogram.total_count = sum(histogram.counts.values())
+        histogram.min = dct["min"]
+        histogram.max = dct["max"]
+        histogram.sum = dct["sum"]
+        return histogram
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+"""
+Multi process producers.
+
+Thread producers share one GIL, so json encoding and record generation cap
+the send rate at about one core. :func:`run_process_load_test` runs each
+producer of :func:`.generator.run_producer` in its own process instead:
+
+- every process builds its own kinesis client with ``client_factory`` and
+  its own record source (corpus mmap or :class:`.generator.RecordFactory`).
+- progress counters live in a shared memory array, one slot per process.
+  A slot is only written by its process, the parent only reads, so no lock
+  is needed. Totals read while running may be a few requests behind.
+- processes signal they are ready on a barrier, then all of them wait for
+  the same start event and start time, a stop event ends the run early.
+- full stats with the latency histograms are sent back once at the end and
+  merged into the same report as :func:`.generator.run_load_test`.
+"""
+
+import time
+import queue
+import threading
+import multiprocessing
+from typing import Dict, Callable, Optional
+
+import attr
+
+from .generator import LoadTestConfig, ProducerStats, run_producer, make_report
+from .corpus import Corpus
+
+COUNTER_FIELDS = (
+    "requests",
+    "records_sent",
+    "records_ok",
+    "records_throttled",
+    "records_failed",
+    "bytes_ok",
+)
+
+
+class SharedCounters:
+    """
+    ``n_slots`` rows of :data:`COUNTER_FIELDS` int64 counters in shared memory.
+    """
+
+    def __init__(self, n_slots: int, array=None, ctx=None):
+        self.n_slots = n_slots
+        if array is None:
+            ctx = ctx or multiprocessing.get_context()
+            array = ctx.RawArray("q", n_slots * len(COUNTER_FIELDS))
+        self.array = array
+
+    def publish(self, slot: int, stats: ProducerStats):
+        """
+        Write the counters of a producer to its slot.
+        """
+        base = slot * len(COUNTER_FIELDS)
+        array = self.array
+        for i, field in enumerate(COUNTER_FIELDS):
+            array[base + i] = getattr(stats, field)
+
+    def read(self, slot: int) -> Dict[str, int]:
+        base = slot * len(COUNTER_FIELDS)
+        return {field: self.array[base + i] for i, field in enumerate(COUNTER_FIELDS)}
+
+    def total(self) -> Dict[str, int]:
+        total = dict.fromkeys(COUNTER_FIELDS, 0)
+        for slot in range(self.n_slots):
+            for field, value in self.read(slot).items():
+                total[field] += value
+        return total
+
+
+def boto_kinesis_client():
+    """
+    Default ``client_factory``, a kinesis client of the project boto session.
+    """
+    from ..boto_ses import boto_ses
+
+    return boto_ses.client("kinesis")
+
+
+@attr.s
+class FakeClientFactory:
+    """
+    Picklable ``client_factory`` of an in-memory fake kinesis, each process
+    gets its own fake stream.
+    """
+
+    stream_name: str = attr.ib()
+    n_shards: int = attr.ib(default=10)
+    latency: float = attr.ib(default=0.0)
+    enforce_shard_limits: bool = attr.ib(default=True)
+
+    def __call__(self):
+        from ..fake_kinesis import FakeKinesisClient
+
+        client = FakeKinesisClient(enforce_shard_limits=self.enforce_shard_limits, latency=self.latency)
+        client.create_stream(StreamName=self.stream_name, ShardCount=self.n_shards)
+        return client
+
+
+@attr.s
+class FanOutClientFactory:
+    """
+    Picklable ``client_factory`` routing the records over the ``fan_out``
+    data streams of a stack, see
+    :class:`~kds_example.kds_helper.FanOutKinesisClient`.
+    """
+
+    fan_out: int = attr.ib()
+    client_factory: Callable = attr.ib(default=boto_kinesis_client)
+
+    def __call__(self):
+        from ..kds_helper import make_fan_out_client
+
+        return make_fan_out_client(self.client_factory(), self.fan_out)
+
+
+def _process_main(
+    config: LoadTestConfig,
+    producer_id: int,
+    client_factory: Callable,
+    counters_array,
+    ready_barrier,
+    start_event,
+    stop_event,
+    start_at_value,
+    result_queue,
+):
+    try:
+        kinesis_client = client_factory()
+        make_kinesis_record = None
+        if config.corpus_path is not None:
+            corpus = Corpus(config.corpus_path)
+            make_kinesis_record = corpus.record_factory(
+                corpus.start_of(producer_id, config.n_producers), salt=config.id_salt,
+            )
+        counters = SharedCounters(config.n_producers, array=counters_array)
+    except Exception as e:
+        ready_barrier.abort()
+        result_queue.put((producer_id, e))
+        return
+
+    try:
+        ready_barrier.wait()
+    except threading.BrokenBarrierError:
+        return
+    start_event.wait()
+    if stop_event.is_set():
+        return
+    try:
+        stats = run_producer(
+            kinesis_client, config, producer_id, start_at_value.value,
+            make_kinesis_record=make_kinesis_record,
+            on_request=lambda stats: counters.publish(producer_id, stats),
+            should_stop=stop_event.is_set,
+        )
+        counters.publish(producer_id, stats)
+        result_queue.put((producer_id, stats))
+    except Exception as e:
+        result_queue.put((producer_id, e))
+
+
+def run_process_load_test(
+    config: LoadTestConfig,
+    client_factory: Callable = boto_kinesis_client,
+    progress: Optional[Callable[[float, Dict[str, int]], None]] = None,
+    progress_interval: float = 1.0,
+    start_method: Optional[str] = None,
+) -> dict:
+    """
+    Run ``config.n_producers`` producers in processes, return the report.
+
+    :param client_factory: picklable zero argument callable returning a
+        kinesis client, called once in each process.
+    :param progress: optional callable called every ``progress_interval``
+        seconds with the elapsed time and the counter totals.
+    """
+    ctx = multiprocessing.get_context(start_method)
+    n = config.n_producers
+    counters = SharedCounters(n, ctx=ctx)
+    ready_barrier = ctx.Barrier(n + 1)
+    start_event = ctx.Event()
+    stop_event = ctx.Event()
+    start_at_value = ctx.RawValue("d", 0.0)
+    result_queue = ctx.Queue()
+
+    processes = [
+        ctx.Process(
+            target=_process_main,
+            args=(
+                config, producer_id, client_factory, counters.array,
+                ready_barrier, start_event, stop_event, start_at_value, result_queue,
+            ),
+            daemon=True,
+        )
+        for producer_id in range(n)
+    ]
+    for process in processes:
+        process.start()
+
+    results = dict()
+    try:
+        try:
+            ready_barrier.wait()
+        except threading.BrokenBarrierError:
+            # a process failed to initialize and broke the barrier
+            producer_id, error = result_queue.get()
+            raise RuntimeError(f"producer {producer_id} failed to start: {error!r}")
+        start_at = time.time() + 0.1
+        start_at_value.value = start_at
+        start_event.set()
+
+        while len(results) < n:
+            try:
+                producer_id, result = result_queue.get(timeout=progress_interval)
+            except queue.Empty:
+                if progress is not None:
+                    progress(time.time() - start_at, counters.total())
+                if not any(process.is_alive() for process in processes) and result_queue.empty():
+                    raise RuntimeError("producer processes exited without a result")
+                continue
+            if isinstance(result, Exception):
+                raise RuntimeError(f"producer {producer_id} failed: {result!r}")
+            results[producer_id] = result
+        elapsed = time.time() - start_at
+    finally:
+        stop_event.set()
+        start_event.set()
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    stats = ProducerStats()
+    for producer_id in range(n):
+        stats.merge(results[producer_id])
+    return make_report(config, stats, start_at, elapsed)
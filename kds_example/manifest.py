@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local SQLite index of the objects in the data bucket.
+
+Listing a firehose prefix with ``ListObjectsV2`` on every run is slow once
+it has many objects. :class:`ManifestIndex` keeps the key, size, last
+modified time and the firehose timestamp parsed from the object name of
+every object, so counts and time range queries are local SQL:
+
+- :meth:`ManifestIndex.sync` lists only the recent keys of a prefix
+  (``StartAfter``). Firehose keys are ``{sub folder}YYYY/MM/DD/HH/...``, but
+  a new object does not always sort after the last seen key: the fan-out
+  sub folders ``00/``, ``01/`` are written at the same time, and a buffer
+  flushed late lands in the folder of the previous hour. So each sub folder
+  is listed again from the start of the hour before its last seen key, the
+  objects already known are replaced.
+- :meth:`ManifestIndex.sync_from_inventory` loads an S3 inventory report
+  (CSV format) instead of listing at all.
+"""
+
+import io
+import re
+import csv
+import gzip
+import json
+import sqlite3
+import calendar
+from datetime import datetime, timezone, timedelta
+from urllib.parse import unquote
+from typing import List, Dict, Tuple, Iterable, Optional
+
+# {sub folder}YYYY/MM/DD/HH/{object name}
+firehose_hour_key_pattern = re.compile(r"^(?P<sub_prefix>(?:.*/)?)(?P<hour>\d{4}/\d{2}/\d{2}/\d{2})/[^/]+$")
+year_folder_pattern = re.compile(r"^\d{4}/$")
+
+# {delivery stream}-{version}-YYYY-MM-DD-HH-MM-SS-{uuid}
+firehose_object_name_pattern = re.compile(
+    r"^(?P<delivery_stream>.+)-(?P<version>\d+)-"
+    r"(?P<timestamp>\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})-"
+    r"(?P<uuid>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})$"
+)
+
+
+def parse_firehose_key(key: str) -> Optional[Tuple[str, int]]:
+    """
+    :return: (delivery stream name, epoch seconds of the object) or None if
+        the key is not a firehose object.
+    """
+    match = firehose_object_name_pattern.match(key.rsplit("/", 1)[-1])
+    if match is None:
+        return None
+    dt = datetime.strptime(match.group("timestamp"), "%Y-%m-%d-%H-%M-%S")
+    return match.group("delivery_stream"), calendar.timegm(dt.utctimetuple())
+
+
+def sub_prefix_of(key: str) -> str:
+    """
+    The folder holding the ``YYYY/MM/DD/HH/`` folders of a firehose key, the
+    folder of the object for any other key.
+    """
+    match = firehose_hour_key_pattern.match(key)
+    if match is not None:
+        return match.group("sub_prefix")
+    return key.rsplit("/", 1)[0] + "/" if "/" in key else ""
+
+
+def lookback_start(key: str) -> str:
+    """
+    ``StartAfter`` to list again the keys from the start of the hour before
+    the hour of a firehose key, the key itself for any other key.
+    """
+    match = firehose_hour_key_pattern.match(key)
+    if match is None:
+        return key
+    hour = datetime.strptime(match.group("hour"), "%Y/%m/%d/%H") - timedelta(hours=1)
+    return f"{match.group('sub_prefix')}{hour:%Y/%m/%d/%H}/"
+
+
+def list_sub_prefixes(s3_client, bucket: str, prefix: str) -> List[str]:
+    """
+    The folders under ``prefix``, itself included, holding objects or the
+    ``YYYY/MM/DD/HH/`` folders of firehose, such as the fan-out ``00/`` or
+    ``processing-failed/`` folders. One ``Delimiter="/"`` listing per
+    folder, the hour folders are not walked.
+    """
+    paginator = s3_client.get_paginator("list_objects_v2")
+    sub_prefixes, todo = list(), [prefix]
+    while todo:
+        folder = todo.pop()
+        is_sub_prefix = False
+        for page in paginator.paginate(
+            Bucket=bucket, Prefix=folder, Delimiter="/", PaginationConfig={"PageSize": 1000},
+        ):
+            if page.get("Contents"):
+                is_sub_prefix = True
+            for common_prefix in page.get("CommonPrefixes", []):
+                if year_folder_pattern.match(common_prefix["Prefix"][len(folder):]):
+                    is_sub_prefix = True
+                else:
+                    todo.append(common_prefix["Prefix"])
+        if is_sub_prefix:
+            sub_prefixes.append(folder)
+    return sorted(sub_prefixes)
+
+
+def to_epoch(value) -> Optional[int]:
+    """
+    Epoch seconds of a datetime, an ISO 8601 string or an epoch number.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+class ManifestIndex:
+    """
+    :param path: SQLite database file, ``":memory:"`` for a throwaway index.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS objects (
+                key TEXT PRIMARY KEY,
+                prefix TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_modified INTEGER,
+                delivery_stream TEXT,
+                created_at INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS ix_objects_prefix_created_at
+                ON objects (prefix, created_at);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                prefix TEXT PRIMARY KEY,
+                last_key TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sync_cursor (
+                prefix TEXT NOT NULL,
+                sub_prefix TEXT NOT NULL,
+                last_key TEXT NOT NULL,
+                PRIMARY KEY (prefix, sub_prefix)
+            );
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def add_objects(self, prefix: str, objects: Iterable[Tuple[str, int, Optional[int]]]) -> int:
+        """
+        Insert or replace objects.
+
+        :param objects: (key, size, last modified epoch seconds)
+        :return: number of objects added
+        """
+        rows = list()
+        for key, size, last_modified in objects:
+            parsed = parse_firehose_key(key)
+            delivery_stream, created_at = parsed if parsed else (None, last_modified)
+            rows.append((key, prefix, size, last_modified, delivery_stream, created_at))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)", rows,
+            )
+        return len(rows)
+
+    def last_key(self, prefix: str) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT last_key FROM sync_state WHERE prefix = ?", (prefix,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_last_key(self, prefix: str, key: str):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (prefix, key),
+            )
+
+    def sub_prefix_cursors(self, prefix: str) -> Dict[str, str]:
+        """
+        :return: sub folder -> last seen key in it.
+        """
+        return dict(self.conn.execute(
+            "SELECT sub_prefix, last_key FROM sync_cursor WHERE prefix = ?", (prefix,),
+        ))
+
+    def _set_cursors(self, prefix: str, keys: Iterable[str]):
+        """
+        Move the last seen key of a prefix and of its sub folders forward.
+        """
+        cursors = self.sub_prefix_cursors(prefix)
+        updates = dict()
+        for key in keys:
+            sub_prefix = sub_prefix_of(key)
+            if key > max(cursors.get(sub_prefix, ""), updates.get(sub_prefix, "")):
+                updates[sub_prefix] = key
+        if not updates:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO sync_cursor VALUES (?, ?, ?)",
+                [(prefix, sub_prefix, key) for sub_prefix, key in updates.items()],
+            )
+        last_key = max(updates.values())
+        if (self.last_key(prefix) or "") < last_key:
+            self._set_last_key(prefix, last_key)
+
+    def sync(self, s3_client, bucket: str, prefix: str, page_size: int = 1000) -> int:
+        """
+        Add the objects created under a prefix since the last sync, each sub
+        folder is listed from the start of the hour before its last seen
+        key.
+
+        :return: number of new objects
+        """
+        n_before = self.count(prefix)
+        cursors = self.sub_prefix_cursors(prefix)
+        paginator = s3_client.get_paginator("list_objects_v2")
+        for sub_prefix in list_sub_prefixes(s3_client, bucket, prefix):
+            kwargs = dict(Bucket=bucket, Prefix=sub_prefix, PaginationConfig={"PageSize": page_size})
+            if sub_prefix in cursors:
+                kwargs["StartAfter"] = lookback_start(cursors[sub_prefix])
+            for page in paginator.paginate(**kwargs):
+                # the nested sub folders are listed on their own
+                contents = [
+                    obj
+                    for obj in page.get("Contents", [])
+                    if sub_prefix_of(obj["Key"]) == sub_prefix
+                ]
+                if not contents:
+                    continue
+                self.add_objects(prefix, [
+                    (obj["Key"], obj["Size"], to_epoch(obj.get("LastModified")))
+                    for obj in contents
+                ])
+                # commit the progress page by page, an interrupted sync resumes
+                self._set_cursors(prefix, [obj["Key"] for obj in contents])
+        return self.count(prefix) - n_before
+
+    def sync_from_inventory(
+        self,
+        s3_client,
+        inventory_bucket: str,
+        manifest_key: str,
+        prefixes: List[str],
+    ) -> int:
+        """
+        Load an S3 inventory report in CSV format, only keys under one of
+        ``prefixes`` are added.
+
+        :param manifest_key: key of the ``manifest.json`` of the report.
+        """
+        manifest = json.loads(
+            s3_client.get_object(Bucket=inventory_bucket, Key=manifest_key)["Body"].read()
+        )
+        if manifest.get("fileFormat", "CSV") != "CSV":
+            raise ValueError(f"only CSV inventory reports are supported, got {manifest['fileFormat']!r}")
+        columns = [column.strip() for column in manifest["fileSchema"].split(",")]
+        i_key, i_size = columns.index("Key"), columns.index("Size")
+        i_last_modified = columns.index("LastModifiedDate") if "LastModifiedDate" in columns else None
+
+        n_objects = 0
+        for file in manifest["files"]:
+            body = s3_client.get_object(Bucket=inventory_bucket, Key=file["key"])["Body"].read()
+            reader = csv.reader(io.TextIOWrapper(io.BytesIO(gzip.decompress(body)), encoding="utf-8"))
+            by_prefix: Dict[str, list] = dict()
+            for row in reader:
+                # keys are url encoded in inventory reports
+                key = unquote(row[i_key])
+                for prefix in prefixes:
+                    if key.startswith(prefix):
+                        last_modified = to_epoch(row[i_last_modified]) if i_last_modified is not None else None
+                        by_prefix.setdefault(prefix, list()).append((key, int(row[i_size] or 0), last_modified))
+                        break
+            for prefix, objects in by_prefix.items():
+                n_objects += self.add_objects(prefix, objects)
+                self._set_cursors(prefix, [key for key, _, _ in objects])
+        return n_objects
+
+    def _where(self, prefix: str, start: Optional[datetime], end: Optional[datetime]) -> Tuple[str, list]:
+        sql, params = "prefix = ?", [prefix]
+        if start is not None:
+            sql += " AND created_at >= ?"
+            params.append(to_epoch(start))
+        if end is not None:
+            sql += " AND created_at < ?"
+            params.append(to_epoch(end))
+        return sql, params
+
+    def count(self, prefix: str, start: datetime = None, end: datetime = None) -> int:
+        """
+        Number of objects created in ``[start, end)``.
+        """
+        where, params = self._where(prefix, start, end)
+        return self.conn.execute(f"SELECT COUNT(*) FROM objects WHERE {where}", params).fetchone()[0]
+
+    def total_size(self, prefix: str, start: datetime = None, end: datetime = None) -> int:
+        where, params = self._where(prefix, start, end)
+        return self.conn.execute(
+            f"SELECT COALESCE(SUM(size), 0) FROM objects WHERE {where}", params,
+        ).fetchone()[0]
+
+    def list_keys(self, prefix: str, start: datetime = None, end: datetime = None) -> List[str]:
+        where, params = self._where(prefix, start, end)
+        return [
+            row[0]
+            for row in self.conn.execute(
+                f"SELECT key FROM objects WHERE {where} ORDER BY created_at, key", params,
+            )
+        ]
+
+    def count_by_hour(self, prefix: str) -> List[Tuple[str, int, int]]:
+        """
+        :return: (hour "YYYY-MM-DD HH:00", number of objects, total size)
+        """
+        return list(self.conn.execute(
+            """
+            SELECT strftime('%Y-%m-%d %H:00', created_at, 'unixepoch') AS hour,
+                   COUNT(*), SUM(size)
+            FROM objects WHERE prefix = ?
+            GROUP BY hour ORDER BY hour
+            """,
+            (prefix,),
+        ))
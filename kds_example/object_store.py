@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""
+Minimal object stores with the same interface, used by the pipeline
+simulator and the S3 tools so they run against a S3 bucket, a local
+directory or memory:
+
+- ``put_object(key, body)``
+- ``get_object(key) -> bytes``
+- ``list_keys(prefix) -> List[str]``
+"""
+
+from pathlib import Path
+from typing import List, Dict
+
+
+class InMemoryObjectStore:
+    def __init__(self):
+        self.objects: Dict[str, bytes] = dict()
+
+    def put_object(self, key: str, body: bytes):
+        self.objects[key] = body
+
+    def get_object(self, key: str) -> bytes:
+        return self.objects[key]
+
+    def list_keys(self, prefix: str = "") -> List[str]:
+        return sorted(key for key in self.objects if key.startswith(prefix))
+
+
+class LocalObjectStore:
+    """
+    Objects are files under ``root``, the key is the relative path.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def put_object(self, key: str, body: bytes):
+        path = self.root.joinpath(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(body)
+
+    def get_object(self, key: str) -> bytes:
+        return self.root.joinpath(key).read_bytes()
+
+    def list_keys(self, prefix: str = "") -> List[str]:
+        if not self.root.exists():
+            return list()
+        keys = [
+            path.relative_to(self.root).as_posix()
+            for path in self.root.glob("**/*")
+            if path.is_file()
+        ]
+        return sorted(key for key in keys if key.startswith(prefix))
+
+
+class S3ObjectStore:
+    """
+    Objects in a S3 bucket, works with a moto mocked client too.
+    """
+
+    def __init__(self, s3_client, bucket: str):
+        self.s3_client = s3_client
+        self.bucket = bucket
+
+    def put_object(self, key: str, body: bytes):
+        self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=body)
+
+    def get_object(self, key: str) -> bytes:
+        return self.s3_client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    def list_keys(self, prefix: str = "") -> List[str]:
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        return [
+            obj["Key"]
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix)
+            for obj in page.get("Contents", [])
+        ]
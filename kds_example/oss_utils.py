@@ -4,9 +4,14 @@
 Opensearch helpers
 """
 
+import time
+import threading
+from datetime import datetime, timezone
+from typing import List, Tuple, Iterable, Callable, Optional, Union
+
 import boto3
 from requests_aws4auth import AWS4Auth
-from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy import OpenSearch, RequestsHttpConnection, helpers
 
 
 def create_opensearch_connection(
@@ -48,6 +53,9 @@ def count_documents(oss: OpenSearch, index: str) -> dict:
 
 
 def delete_all_documents(oss: OpenSearch, index: str) -> dict:
+    """
+    Slow on a large index, use :func:`reset_index` on an alias instead.
+    """
     return oss.delete_by_query(index=index, body=match_all_query)
 
 
@@ -61,3 +69,359 @@ def create_index_if_not_exists(
     body: dict = None,
 ):
     return oss.indices.create(index=index, body=body)
+
+
+def put_ingest_pipeline(oss: OpenSearch, pipeline_id: str, body: dict) -> dict:
+    """
+    Create or update an ingest pipeline.
+    """
+    return oss.ingest.put_pipeline(id=pipeline_id, body=body)
+
+
+def bulk_index(
+    oss: OpenSearch,
+    index: str,
+    docs: Iterable[dict],
+    id_field: str = "id",
+    chunk_size: int = 500,
+) -> tuple:
+    """
+    Bulk index documents using ``doc[id_field]`` as the document ``_id``, so
+    indexing the same record twice overwrites it instead of creating a
+    duplicate.
+
+    :return: (number of succeeded actions, list of errors)
+    """
+    actions = (
+        {
+            "_op_type": "index",
+            "_index": index,
+            "_id": doc[id_field],
+            "_source": doc,
+        }
+        for doc in docs
+    )
+    return helpers.bulk(oss, actions, chunk_size=chunk_size, raise_on_error=False)
+
+
+# --- routed queries
+# with the routing profile of kds_example/schema.py the documents with the
+# same key are in one shard, pass the key as ``routing`` so only this shard
+# is searched, without it the query fans out to every shard.
+
+
+def key_query(field: str, value: Union[str, List[str]]) -> dict:
+    if isinstance(value, (list, tuple)):
+        return {"bool": {"filter": [{"terms": {field: list(value)}}]}}
+    return {"bool": {"filter": [{"term": {field: value}}]}}
+
+
+def routing_of(value: Union[str, List[str]]) -> str:
+    if isinstance(value, (list, tuple)):
+        return ",".join(sorted(set(value)))
+    return value
+
+
+def search_by_key(
+    oss: OpenSearch,
+    index: str,
+    field: str,
+    value: Union[str, List[str]],
+    size: int = 100,
+    routing: bool = True,
+    **kwargs
+) -> dict:
+    """
+    Search the documents of one or several keys, for example all the
+    documents of an account.
+
+    :param routing: the index is routed by ``field``, search only the shards
+        of the keys.
+    """
+    if routing:
+        kwargs["routing"] = routing_of(value)
+    return oss.search(index=index, body={"query": key_query(field, value), "size": size}, **kwargs)
+
+
+def aggregate_by_key(
+    oss: OpenSearch,
+    index: str,
+    field: str,
+    value: Union[str, List[str]],
+    aggs: dict,
+    routing: bool = True,
+    **kwargs
+) -> dict:
+    """
+    Run aggregations on the documents of one or several keys, no hits.
+    """
+    if routing:
+        kwargs["routing"] = routing_of(value)
+    return oss.search(
+        index=index,
+        body={"query": key_query(field, value), "size": 0, "aggs": aggs},
+        **kwargs
+    )
+
+
+# --- alias based index management
+# the delivery stream and the readers use an alias, the documents are in a
+# versioned index ``{alias}-{YYYYmmddHHMMSSffffff}`` behind it. Resetting or
+# changing the mapping creates a new index and moves the alias atomically,
+# instead of a slow ``delete_by_query`` on the live index.
+
+
+def versioned_index_name(alias: str, now: datetime = None) -> str:
+    now = datetime.now(timezone.utc) if now is None else now
+    return f"{alias}-{now:%Y%m%d%H%M%S%f}"
+
+
+def get_alias_indices(oss: OpenSearch, alias: str) -> List[str]:
+    """
+    :return: the indices behind an alias, empty if the alias does not exist.
+    """
+    if not oss.indices.exists_alias(name=alias):
+        return []
+    return sorted(oss.indices.get_alias(name=alias))
+
+
+def get_write_index(oss: OpenSearch, name: str) -> str:
+    """
+    :return: the concrete index written through ``name``, the write index
+        of an alias, ``name`` itself if it is not an alias.
+    """
+    if not oss.indices.exists_alias(name=name):
+        return name
+    response = oss.indices.get_alias(name=name)
+    write_indices = [
+        index
+        for index, dct in response.items()
+        if dct["aliases"][name].get("is_write_index", len(response) == 1)
+    ]
+    if len(write_indices) != 1:
+        raise ValueError(f"alias {name!r} has no write index, its indices are {sorted(response)}")
+    return write_indices[0]
+
+
+def create_index_with_alias(oss: OpenSearch, alias: str, body: dict) -> str:
+    """
+    Create the first versioned index of an alias.
+
+    :return: the new index name
+    """
+    index = versioned_index_name(alias)
+    body = dict(body)
+    body["aliases"] = {alias: {"is_write_index": True}}
+    oss.indices.create(index=index, body=body)
+    return index
+
+
+def swap_alias(oss: OpenSearch, alias: str, index: str, old_indices: List[str]):
+    """
+    Make ``index`` the only index of an alias, in one atomic action.
+    """
+    actions = [{"remove": {"index": old, "alias": alias}} for old in old_indices]
+    actions.append({"add": {"index": index, "alias": alias, "is_write_index": True}})
+    oss.indices.update_aliases(body={"actions": actions})
+
+
+def delete_indices_in_background(oss: OpenSearch, indices: List[str]) -> threading.Thread:
+    """
+    Delete indices in a thread, the caller does not wait for the shards to
+    be removed. Join the returned thread to wait.
+    """
+    thread = threading.Thread(
+        target=lambda: [oss.indices.delete(index=index, ignore=[404]) for index in indices],
+        name="delete-indices",
+    )
+    thread.start()
+    return thread
+
+
+def flat_index_settings(settings: dict) -> dict:
+    """
+    ``{"number_of_replicas": 2, "index": {"refresh_interval": "1s"}}`` to
+    ``{"index.number_of_replicas": 2, "index.refresh_interval": "1s"}``.
+    """
+    flat = dict()
+
+    def walk(dct: dict, path: str):
+        for key, value in dct.items():
+            if isinstance(value, dict):
+                walk(value, f"{path}{key}.")
+            else:
+                flat[f"{path}{key}"] = value
+
+    walk(settings, "")
+    return {
+        key if key.startswith("index.") else f"index.{key}": value
+        for key, value in flat.items()
+    }
+
+
+def reset_index(
+    oss: OpenSearch,
+    alias: str,
+    body: dict,
+    delete_old: bool = True,
+) -> Tuple[str, List[str], Optional[threading.Thread]]:
+    """
+    Empty an alias in seconds: create a new index from ``body``, move the
+    alias to it atomically and drop the old indices in the background.
+
+    :return: (new index, old indices, deleting thread or None)
+    """
+    old_indices = get_alias_indices(oss, alias)
+    index = versioned_index_name(alias)
+    oss.indices.create(index=index, body=body)
+    swap_alias(oss, alias, index, old_indices)
+    thread = None
+    if delete_old and old_indices:
+        thread = delete_indices_in_background(oss, old_indices)
+    return index, old_indices, thread
+
+
+def wait_for_task(
+    oss: OpenSearch,
+    task_id: str,
+    poll_interval: float = 5.0,
+    timeout: float = None,
+    progress: Callable[[dict], None] = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> dict:
+    """
+    Poll a task started with ``wait_for_completion=false`` until it is done.
+
+    :return: the ``response`` of the task
+    """
+    waited = 0.0
+    while True:
+        task = oss.tasks.get(task_id=task_id)
+        if progress is not None:
+            progress(task["task"]["status"])
+        if task.get("completed"):
+            break
+        if timeout is not None and waited >= timeout:
+            raise TimeoutError(f"task {task_id} is not completed after {waited} sec")
+        sleep(poll_interval)
+        waited += poll_interval
+    if "error" in task:
+        raise RuntimeError(f"task {task_id} failed: {task['error']}")
+    response = task.get("response", {})
+    if response.get("failures"):
+        raise RuntimeError(f"task {task_id} has failures: {response['failures'][:3]}")
+    return response
+
+
+def reindex(
+    oss: OpenSearch,
+    source: str,
+    dest: str,
+    slices="auto",
+    batch_size: int = 1000,
+    op_type: str = "index",
+    poll_interval: float = 5.0,
+    timeout: float = None,
+    progress: Callable[[dict], None] = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> dict:
+    """
+    Reindex with sliced scrolls in parallel, as a task polled until done,
+    so it doesn't hit the http timeout.
+
+    :param slices: number of parallel slices, "auto" is one per shard.
+    :param op_type: "create" to keep the documents already in ``dest``.
+    """
+    body = {
+        "source": {"index": source, "size": batch_size},
+        "dest": {"index": dest, "op_type": op_type},
+    }
+    if op_type == "create":
+        body["conflicts"] = "proceed"
+    res = oss.reindex(body=body, slices=slices, wait_for_completion=False)
+    return wait_for_task(
+        oss, res["task"],
+        poll_interval=poll_interval, timeout=timeout, progress=progress, sleep=sleep,
+    )
+
+
+def reindex_to_new_index(
+    oss: OpenSearch,
+    alias: str,
+    body: dict,
+    delete_old: bool = True,
+    slices="auto",
+    poll_interval: float = 5.0,
+    timeout: float = None,
+    progress: Callable[[dict], None] = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> Tuple[str, List[str], Optional[threading.Thread]]:
+    """
+    Move the documents of an alias to a new index created from ``body``, for
+    a mapping or settings change, without losing the documents indexed
+    during the reindex:
+
+    1. create the new index with the settings of ``body``.
+    2. make it the write index of the alias, the old indices stay readable.
+    3. reindex the old indices into it with ``op_type=create``, the
+       documents written since step 2 are kept.
+    4. remove the old indices from the alias and drop them in the
+       background.
+
+    The new index takes the live writes from step 2, so it keeps its
+    replicas and refresh interval during the reindex: the new documents
+    are durable and searchable as usual. A document copied in step 3 is in
+    an old index and in the new one until step 4, a search on the alias
+    can return it twice, a count on the alias counts it twice.
+
+    :return: (new index, old indices, deleting thread or None)
+    """
+    old_indices = get_alias_indices(oss, alias)
+    index = versioned_index_name(alias)
+    oss.indices.create(index=index, body=body)
+
+    actions = [{"add": {"index": old, "alias": alias, "is_write_index": False}} for old in old_indices]
+    actions.append({"add": {"index": index, "alias": alias, "is_write_index": True}})
+    oss.indices.update_aliases(body={"actions": actions})
+
+    if old_indices:
+        reindex(
+            oss, ",".join(old_indices), index, slices=slices, op_type="create",
+            poll_interval=poll_interval, timeout=timeout, progress=progress, sleep=sleep,
+        )
+    oss.indices.refresh(index=index)
+
+    thread = None
+    if old_indices:
+        oss.indices.update_aliases(body={"actions": [
+            {"remove": {"index": old, "alias": alias}} for old in old_indices
+        ]})
+        if delete_old:
+            thread = delete_indices_in_background(oss, old_indices)
+    return index, old_indices, thread
+
+
+def convert_index_to_alias(
+    oss: OpenSearch,
+    index: str,
+    body: dict,
+    **kwargs,
+) -> str:
+    """
+    One time migration of a concrete index (the original ``bank_account``)
+    to a versioned index behind an alias of the same name. The reindexed
+    index replaces the old one in a single atomic ``remove_index`` + ``add``
+    alias action, documents written after the reindex and before the swap
+    are lost, pause the producers while it runs.
+
+    :param kwargs: see :func:`reindex`.
+    :return: the new index name
+    """
+    new_index = versioned_index_name(index)
+    oss.indices.create(index=new_index, body=body)
+    reindex(oss, index, new_index, **kwargs)
+    oss.indices.update_aliases(body={"actions": [
+        {"remove_index": {"index": index}},
+        {"add": {"index": new_index, "alias": index, "is_write_index": True}},
+    ]})
+    return new_index
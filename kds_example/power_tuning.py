@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local power tuning of the transformation lambda memory size and the
+firehose processor ``BufferSizeInMBs``.
+
+Lambda gives a function CPU in proportion to its memory, one full vCPU at
+1769 MB. The handlers are single threaded, so the duration at ``m`` MB is
+the CPU time on one core scaled by ``1769 / m`` below 1769 MB, and flat
+above. :func:`run_power_tuning` measures the CPU time of the real handlers
+on synthetic firehose events of each buffer size, pinned to one core like
+``taskset``, then either:
+
+- models the duration of each memory size, the default, or
+- with ``cgroup``, a writable cgroup v2 directory, really throttles the
+  process with ``cpu.max`` for each memory size and measures the wall
+  time, for example after
+  ``sudo mkdir /sys/fs/cgroup/kds-tuning && sudo chown -R $USER /sys/fs/cgroup/kds-tuning``.
+
+The cost per GB is the lambda cost (GB-seconds and requests) of
+transforming a GB of records, the peak memory of a run tells which memory
+sizes can hold the event.
+"""
+
+import os
+import gc
+import json
+import time
+import uuid
+import base64
+import random
+import tracemalloc
+import statistics
+from pathlib import Path
+from typing import List, Dict, Callable, Optional
+
+import attr
+
+from .load_test.generator import LoadTestConfig, RecordFactory
+
+MB = 1024 * 1024
+
+# memory size with one full vCPU
+FULL_VCPU_MEMORY_MB = 1769
+# the python runtime and the imported modules
+RUNTIME_OVERHEAD_MB = 70
+
+
+@attr.s
+class LambdaPrices:
+    """
+    x86 on demand prices in USD, us-east-1.
+    """
+    per_gb_second: float = attr.ib(default=0.0000166667)
+    per_million_requests: float = attr.ib(default=0.2)
+
+
+def cpu_share(memory_mb: int) -> float:
+    return min(1.0, memory_mb / FULL_VCPU_MEMORY_MB)
+
+
+def make_event(
+    size_in_mb: float,
+    record_size: int = 180,
+    seed: int = None,
+    delivery_stream_name: str = "power-tuning",
+) -> dict:
+    """
+    Create a firehose transformation event of ``size_in_mb`` of decoded
+    ``bank_account`` records, from a data stream source. Use a new seed for
+    new record ids, the deduplication drops the ids it has seen.
+    """
+    rng = random.Random(seed)
+    factory = RecordFactory(
+        LoadTestConfig(stream_name="", record_size_distribution="lognormal", record_size_mean=record_size),
+        rng,
+    )
+    now = int(time.time() * 1000)
+    records = list()
+    size = 0
+    i = 0
+    while size < size_in_mb * MB:
+        data = (json.dumps(factory.make_record(factory.next_size())) + "\n").encode("utf-8")
+        size += len(data)
+        records.append({
+            "recordId": f"{i:020d}",
+            "approximateArrivalTimestamp": now,
+            "data": base64.b64encode(data).decode("utf-8"),
+            "kinesisRecordMetadata": {
+                "sequenceNumber": f"{i:056d}",
+                "subsequenceNumber": 0,
+                "partitionKey": uuid.UUID(int=rng.getrandbits(128)).hex,
+                "shardId": "shardId-000000000000",
+                "approximateArrivalTimestamp": now,
+            },
+        })
+        i += 1
+    return {
+        "invocationId": str(uuid.UUID(int=rng.getrandbits(128))),
+        "deliveryStreamArn": f"arn:aws:firehose:us-east-1:000000000000:deliverystream/{delivery_stream_name}",
+        "sourceKinesisStreamArn": "arn:aws:kinesis:us-east-1:000000000000:stream/source",
+        "region": "us-east-1",
+        "records": records,
+    }
+
+
+def pin_to_one_core():
+    """
+    Run the process on one core, like ``taskset -c <core>``.
+    """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+
+
+class CgroupCpuLimit:
+    """
+    Throttle the current process with the ``cpu.max`` of a cgroup v2
+    directory it can write to.
+    """
+
+    def __init__(self, path: str, period_us: int = 100000):
+        self.path = Path(path)
+        self.period_us = period_us
+        self.path.joinpath("cgroup.procs").write_text(str(os.getpid()))
+
+    def set(self, share: float):
+        quota = int(self.period_us * share)
+        self.path.joinpath("cpu.max").write_text(f"{quota} {self.period_us}")
+
+    def reset(self):
+        self.path.joinpath("cpu.max").write_text(f"max {self.period_us}")
+
+
+@attr.s
+class Measurement:
+    handler_name: str = attr.ib()
+    buffer_size_in_mb: float = attr.ib()
+    n_records: int = attr.ib()
+    cpu_seconds: float = attr.ib()
+    wall_seconds: float = attr.ib()
+    peak_memory_mb: float = attr.ib()
+
+
+def measure(
+    handler_name: str,
+    handler: Callable[[dict, object], dict],
+    buffer_size_in_mb: float,
+    repeat: int = 3,
+    record_size: int = 180,
+) -> Measurement:
+    """
+    Run the handler ``repeat`` times on new events, the median CPU and wall
+    time, the peak memory of a separate traced run.
+    """
+    cpu_times, wall_times = list(), list()
+    n_records = 0
+    for i in range(repeat):
+        event = make_event(buffer_size_in_mb, record_size=record_size, seed=i)
+        n_records = len(event["records"])
+        gc.collect()
+        st_cpu, st_wall = time.process_time(), time.perf_counter()
+        handler(event, None)
+        cpu_times.append(time.process_time() - st_cpu)
+        wall_times.append(time.perf_counter() - st_wall)
+
+    event = make_event(buffer_size_in_mb, record_size=record_size, seed=repeat)
+    event_size = sum(len(record["data"]) for record in event["records"])
+    tracemalloc.start()
+    handler(event, None)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return Measurement(
+        handler_name=handler_name,
+        buffer_size_in_mb=buffer_size_in_mb,
+        n_records=n_records,
+        cpu_seconds=statistics.median(cpu_times),
+        wall_seconds=statistics.median(wall_times),
+        # lambda holds the raw event json too
+        peak_memory_mb=(peak + event_size) / MB,
+    )
+
+
+@attr.s
+class TuningResult:
+    handler_name: str = attr.ib()
+    memory_mb: int = attr.ib()
+    buffer_size_in_mb: float = attr.ib()
+    duration_seconds: float = attr.ib()
+    cost_per_invocation: float = attr.ib()
+    cost_per_gb: float = attr.ib()
+    fits: bool = attr.ib()
+
+    def to_dict(self) -> dict:
+        return attr.asdict(self)
+
+
+def evaluate(
+    measurement: Measurement,
+    memory_mb: int,
+    prices: LambdaPrices = None,
+    duration_seconds: float = None,
+) -> TuningResult:
+    """
+    :param duration_seconds: measured duration at this memory size, modeled
+        from the CPU time by default.
+    """
+    prices = prices or LambdaPrices()
+    if duration_seconds is None:
+        io_seconds = max(0.0, measurement.wall_seconds - measurement.cpu_seconds)
+        duration_seconds = measurement.cpu_seconds / cpu_share(memory_mb) + io_seconds
+    # lambda bills by the millisecond
+    billed_seconds = max(0.001, round(duration_seconds, 3))
+    cost_per_invocation = (
+        billed_seconds * memory_mb / 1024 * prices.per_gb_second
+        + prices.per_million_requests / 1000000
+    )
+    return TuningResult(
+        handler_name=measurement.handler_name,
+        memory_mb=memory_mb,
+        buffer_size_in_mb=measurement.buffer_size_in_mb,
+        duration_seconds=duration_seconds,
+        cost_per_invocation=cost_per_invocation,
+        cost_per_gb=cost_per_invocation * 1024 / measurement.buffer_size_in_mb,
+        fits=measurement.peak_memory_mb + RUNTIME_OVERHEAD_MB <= memory_mb,
+    )
+
+
+def combine(results: List[TuningResult], handler_name: str = "all") -> List[TuningResult]:
+    """
+    Combine the results of the handlers sharing the same settings, the chalice
+    stage memory and the buffer size of ``Config``: the costs add up, the
+    slowest duration counts, it fits if all fit.
+    """
+    groups: Dict[tuple, List[TuningResult]] = dict()
+    for result in results:
+        groups.setdefault((result.memory_mb, result.buffer_size_in_mb), list()).append(result)
+    return [
+        TuningResult(
+            handler_name=handler_name,
+            memory_mb=memory_mb,
+            buffer_size_in_mb=buffer_size_in_mb,
+            duration_seconds=max(result.duration_seconds for result in group),
+            cost_per_invocation=sum(result.cost_per_invocation for result in group),
+            cost_per_gb=sum(result.cost_per_gb for result in group),
+            fits=all(result.fits for result in group),
+        )
+        for (memory_mb, buffer_size_in_mb), group in groups.items()
+    ]
+
+
+def recommend(
+    results: List[TuningResult],
+    max_duration_seconds: float = 5.0,
+    cost_tolerance: float = 0.05,
+) -> Optional[TuningResult]:
+    """
+    The cheapest setting per GB that fits in memory and runs within
+    ``max_duration_seconds``, among the settings within ``cost_tolerance``
+    of the cheapest, the fastest one.
+    """
+    candidates = [
+        result for result in results
+        if result.fits and result.duration_seconds <= max_duration_seconds
+    ]
+    if not candidates:
+        return None
+    cheapest = min(result.cost_per_gb for result in candidates)
+    candidates = [result for result in candidates if result.cost_per_gb <= cheapest * (1 + cost_tolerance)]
+    return min(candidates, key=lambda result: (result.duration_seconds, result.cost_per_gb))
+
+
+def run_power_tuning(
+    handlers: Dict[str, Callable[[dict, object], dict]],
+    memory_sizes: List[int] = (128, 256, 512, 1024, 1769, 3008),
+    buffer_sizes: List[float] = (1, 2, 3),
+    repeat: int = 3,
+    record_size: int = 180,
+    cgroup: str = None,
+    prices: LambdaPrices = None,
+    pin: bool = True,
+) -> List[TuningResult]:
+    """
+    Measure every handler for every buffer size and evaluate every memory
+    size, see the module docstring.
+
+    :param pin: pin the process to one core first.
+    """
+    if pin:
+        pin_to_one_core()
+    limit = CgroupCpuLimit(cgroup) if cgroup else None
+    results = list()
+    try:
+        for handler_name, handler in handlers.items():
+            for buffer_size_in_mb in buffer_sizes:
+                measurement = measure(handler_name, handler, buffer_size_in_mb, repeat=repeat, record_size=record_size)
+                for memory_mb in memory_sizes:
+                    duration_seconds = None
+                    if limit is not None:
+                        limit.set(cpu_share(memory_mb))
+                        event = make_event(buffer_size_in_mb, record_size=record_size)
+                        st = time.perf_counter()
+                        handler(event, None)
+                        duration_seconds = time.perf_counter() - st
+                    results.append(evaluate(measurement, memory_mb, prices, duration_seconds))
+    finally:
+        if limit is not None:
+            limit.reset()
+    return results
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+"""
+Replay the records of the firehose error prefixes
+(``to-s3/04-failed/``, ``to-s3/02-backup-failed/``, ``to-oss/02-backup-failed/``).
+
+Each object is a NDJSON file of firehose error envelopes, the original
+record is base64 encoded in ``rawData``. The replay engine:
+
+- streams the objects of a prefix with ``n_workers`` threads, at most
+  ``max_in_flight`` objects are held in memory at the same time.
+- runs the records through the current transformation pipeline
+  (:mod:`kds_example.lbd.to_s3` / :mod:`kds_example.lbd.to_oss`), records the
+  pipeline still drops or fails are counted, not replayed.
+- writes the output to a sink: :class:`KinesisSink` puts them back to the
+  data stream with a rate limited batched producer, :class:`OpenSearchSink`
+  bulk indexes them with the record id as the document id, so a replay is
+  idempotent.
+- marks an object done in a :class:`KeyCheckpoint` once all its records are
+  written, a rerun skips the objects already done.
+
+The same engine backfills an index from the plain NDJSON backup objects
+with :func:`parse_ndjson_line`.
+"""
+
+import gzip
+import json
+import time
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Callable, Iterable, Optional
+
+import attr
+
+from .kds_helper import RateLimiter, iter_put_records_batches, put_records_with_retries
+from .codec import decompress, is_aggregated, unpack_records
+from .schema_registry import loads
+from .lbd.pipeline import DROPPED, PROCESSING_FAILED, Item, Pipeline
+
+
+class KeyCheckpoint:
+    """
+    Set of the done keys, persisted as an append only file with one key per
+    line, so a crash loses at most the key being written.
+
+    :param path: None to keep the checkpoint in memory only.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.done = set()
+        self._lock = threading.Lock()
+        if path is not None:
+            try:
+                with open(path, "r") as f:
+                    self.done = {line.rstrip("\n") for line in f if line.strip()}
+            except FileNotFoundError:
+                pass
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.done
+
+    def __len__(self) -> int:
+        return len(self.done)
+
+    def mark_done(self, key: str):
+        with self._lock:
+            if key in self.done:
+                return
+            self.done.add(key)
+            if self.path is not None:
+                with open(self.path, "a") as f:
+                    f.write(key + "\n")
+
+
+def parse_error_envelope_line(line: bytes) -> Optional[str]:
+    """
+    :return: the base64 encoded original record of a firehose error envelope.
+    """
+    return json.loads(line).get("rawData")
+
+
+def parse_ndjson_line(line: bytes) -> Optional[str]:
+    """
+    :return: the base64 encoded record of a plain NDJSON line.
+    """
+    return base64.b64encode(line).decode("utf-8")
+
+
+def make_replay_pipeline(target: str = "kinesis") -> Pipeline:
+    """
+    The transformation of :mod:`kds_example.lbd.to_s3` (``target="kinesis"``)
+    or :mod:`kds_example.lbd.to_oss` (``target="oss"``), without dedup, a
+    replay sends the records again on purpose, and without tracing, the
+    replayed records have no firehose event record and keep their original
+    trace.
+    """
+    from .lbd.common import build_pipeline
+
+    if target == "kinesis":
+        from .lbd.to_s3 import transform
+
+        return build_pipeline(transform, trace=False)
+    if target == "oss":
+        from .lbd.to_oss import transform, validate
+
+        return build_pipeline(transform, validator=validate, trace=False, unpack_aggregated=False)
+    raise ValueError(f"target has to be 'kinesis' or 'oss', got {target!r}")
+
+
+def read_object(store, key: str) -> bytes:
+    body = store.get_object(key)
+    if body[:2] == b"\x1f\x8b":
+        body = gzip.decompress(body)
+    return body
+
+
+def get_partition_key(data: bytes) -> str:
+    """
+    The ``id`` of a record, compressed or not, JSON or binary, ``"replay"`` for an aggregated
+    record, see :mod:`kds_example.codec`.
+    """
+    if is_aggregated(data):
+        return "replay"
+    return str(loads(decompress(data)).get("id", "")) or "replay"
+
+
+class KinesisSink:
+    """
+    Put the records back to the kinesis data stream, within ``rate``
+    records / sec over all workers.
+    """
+
+    def __init__(
+        self,
+        kinesis_client,
+        stream_name: str,
+        rate: float = 500,
+        max_retries: int = 5,
+    ):
+        self.kinesis_client = kinesis_client
+        self.stream_name = stream_name
+        self.rate_limiter = RateLimiter(rate=rate)
+        self.max_retries = max_retries
+
+    def write(self, records: List[bytes]) -> int:
+        """
+        :return: number of records failed
+        """
+        kin_records = [
+            {
+                "Data": data,
+                "PartitionKey": get_partition_key(data),
+            }
+            for data in records
+        ]
+        n_failed = 0
+        for batch in iter_put_records_batches(kin_records):
+            n_failed += len(put_records_with_retries(
+                self.kinesis_client, self.stream_name, batch,
+                max_retries=self.max_retries, rate_limiter=self.rate_limiter,
+            ))
+        return n_failed
+
+
+class OpenSearchSink:
+    """
+    Bulk index the records, ``doc[id_field]`` is the document id.
+    """
+
+    def __init__(self, oss, index: str, id_field: str = "id", chunk_size: int = 500):
+        self.oss = oss
+        self.index = index
+        self.id_field = id_field
+        self.chunk_size = chunk_size
+
+    def write(self, records: List[bytes]) -> int:
+        from .oss_utils import bulk_index
+
+        docs = [loads(line) for data in records for line in unpack_records(data)]
+        _, errors = bulk_index(self.oss, self.index, docs, id_field=self.id_field, chunk_size=self.chunk_size)
+        return len(errors)
+
+
+@attr.s
+class ReplayStats:
+    objects: int = attr.ib(default=0)
+    objects_skipped: int = attr.ib(default=0)
+    objects_failed: int = attr.ib(default=0)
+    records: int = attr.ib(default=0)
+    records_written: int = attr.ib(default=0)
+    records_dropped: int = attr.ib(default=0)
+    records_still_failed: int = attr.ib(default=0)
+    records_write_failed: int = attr.ib(default=0)
+    elapsed: float = attr.ib(default=0.0)
+
+    @property
+    def records_per_sec(self) -> float:
+        return self.records_written / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> dict:
+        dct = attr.asdict(self)
+        dct["records_per_sec"] = round(self.records_per_sec, 1)
+        return dct
+
+
+class ReplayEngine:
+    """
+    :param store: where the objects are, usually a
+        :class:`~kds_example.object_store.S3ObjectStore` of the data bucket.
+    :param pipeline: the transformation pipeline to re-run, with an
+        ``encode`` stage as its last stage, like the lambda ones.
+    :param sink: :class:`KinesisSink`, :class:`OpenSearchSink` or any object
+        with a ``write(records: List[bytes]) -> n_failed`` method.
+    :param parse_line: returns the base64 encoded record of a line, or None
+        to skip the line.
+    :param batch_size: records per pipeline run and sink write.
+    """
+
+    def __init__(
+        self,
+        store,
+        pipeline: Pipeline,
+        sink,
+        checkpoint: KeyCheckpoint = None,
+        parse_line: Callable[[bytes], Optional[str]] = parse_error_envelope_line,
+        n_workers: int = 8,
+        max_in_flight: int = None,
+        batch_size: int = 500,
+    ):
+        self.store = store
+        self.pipeline = pipeline
+        self.sink = sink
+        self.checkpoint = KeyCheckpoint() if checkpoint is None else checkpoint
+        self.parse_line = parse_line
+        self.n_workers = n_workers
+        self.max_in_flight = max_in_flight or n_workers * 2
+        self.batch_size = batch_size
+        self.stats = ReplayStats()
+        self._lock = threading.Lock()
+        # the pipeline stages keep per invocation state
+        self._pipeline_lock = threading.Lock()
+
+    def _count(self, **kwargs):
+        with self._lock:
+            for key, value in kwargs.items():
+                setattr(self.stats, key, getattr(self.stats, key) + value)
+
+    def process_object(self, key: str):
+        lines = read_object(self.store, key).splitlines()
+        n_write_failed = 0
+        for i in range(0, len(lines), self.batch_size):
+            items = list()
+            for j, line in enumerate(lines[i:i + self.batch_size]):
+                if not line.strip():
+                    continue
+                data = self.parse_line(line)
+                if data is not None:
+                    items.append(Item(record_id=f"{key}:{i + j}", data=data, value=data))
+            with self._pipeline_lock:
+                self.pipeline.run(items)
+            outputs = [base64.b64decode(item.value) for item in items if item.is_ok]
+            n_failed = self.sink.write(outputs) if outputs else 0
+            n_write_failed += n_failed
+            self._count(
+                records=len(items),
+                records_written=len(outputs) - n_failed,
+                records_dropped=sum(1 for item in items if item.status == DROPPED),
+                records_still_failed=sum(1 for item in items if item.status == PROCESSING_FAILED),
+                records_write_failed=n_failed,
+            )
+        if n_write_failed:
+            # keep it for the next run
+            self._count(objects_failed=1)
+        else:
+            self.checkpoint.mark_done(key)
+            self._count(objects=1)
+
+    def run(self, keys: Iterable[str], progress: Callable[[ReplayStats], None] = None) -> ReplayStats:
+        """
+        Replay the objects, skip the ones in the checkpoint.
+
+        :param progress: optional, called with the stats after each object.
+        """
+        st = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            futures = set()
+            for key in keys:
+                if key in self.checkpoint:
+                    self._count(objects_skipped=1)
+                    continue
+                # bounded memory: wait for a free slot before reading more
+                while len(futures) >= self.max_in_flight:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    self._collect(done, st, progress)
+                futures.add(executor.submit(self.process_object, key))
+            done, _ = wait(futures)
+            self._collect(done, st, progress)
+        self.stats.elapsed = time.perf_counter() - st
+        return self.stats
+
+    def _collect(self, done, st: float, progress):
+        for future in done:
+            future.result()
+            if progress is not None:
+                self.stats.elapsed = time.perf_counter() - st
+                progress(self.stats)
+
+    def run_prefix(self, prefix: str, progress: Callable[[ReplayStats], None] = None) -> ReplayStats:
+        return self.run(self.store.list_keys(prefix), progress=progress)
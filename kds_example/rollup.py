@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+
+"""
+Hourly balance rollups of the ``bank_account`` records.
+
+The dashboards aggregate the balances per hour and per customer segment,
+running these aggregations on the raw documents on every refresh is what
+drives the cluster CPU at peak. :class:`RollupJob` keeps a small summary
+index instead, one document per (hour, segment) with the count and the
+sum, min and max balance.
+
+The job reads the ``to-s3/03-success/`` objects, not the index: the raw
+documents have neither a record time nor a segment field, so an OpenSearch
+rollup job has nothing to group by. The hour of a record is the hour of
+its firehose object, parsed from the object name, the segment is derived
+from the balance, see :data:`SEGMENTS`.
+
+It is incremental: a :class:`RollupState` file holds the done object keys
+and the current buckets, each run only reads the new objects, oldest
+first, and rewrites the buckets they touched, with the full values, so a
+run interrupted between the index write and the state save writes the same
+documents again on the next run. The watermark, before which the hours are
+complete, is stored in the ``_meta`` of the rollup index mapping.
+
+No new object is created before the watermark, so the objects before it
+are skipped without looking at the done keys, and the done keys before it
+are pruned from the state. With a
+:class:`~kds_example.manifest.ManifestIndex` the job asks the manifest for
+the objects since the watermark instead of listing the whole prefix, sync
+the manifest before the run.
+
+:func:`balance_totals` reads the rollup when the window is whole hours
+before the watermark, and aggregates the raw index for all time totals.
+"""
+
+import os
+import json
+import time
+from typing import List, Dict, Tuple, Iterable, Callable, Optional
+
+import attr
+
+from .manifest import parse_firehose_key
+from .replay import read_object
+from .schema_registry import loads
+
+SUCCESS_PREFIX = "to-s3/03-success/"
+ROLLUP_INDEX = "bank_account_rollup_hourly"
+
+HOUR_MS = 3600 * 1000
+# firehose buffers up to 900 sec, no new object of an hour after that
+MAX_BUFFER_SECONDS = 900
+
+# (segment, min balance included, max balance excluded)
+SEGMENTS: List[Tuple[str, Optional[int], Optional[int]]] = [
+    ("overdrawn", None, 0),
+    ("standard", 0, 10000),
+    ("premium", 10000, 100000),
+    ("private", 100000, None),
+]
+
+rollup_index_body = {
+    "settings": {
+        "number_of_shards": 1,
+        "number_of_replicas": 1,
+    },
+    "mappings": {
+        "properties": {
+            "id": {"type": "keyword"},
+            "hour": {"type": "date", "format": "epoch_millis"},
+            "segment": {"type": "keyword"},
+            "count": {"type": "long"},
+            "balance_sum": {"type": "long"},
+            "balance_min": {"type": "long"},
+            "balance_max": {"type": "long"},
+        }
+    },
+}
+
+
+def segment_of(balance: int) -> str:
+    for segment, lower, upper in SEGMENTS:
+        if (lower is None or balance >= lower) and (upper is None or balance < upper):
+            return segment
+
+
+def floor_hour(epoch_ms: int) -> int:
+    return epoch_ms - epoch_ms % HOUR_MS
+
+
+@attr.s
+class Bucket:
+    hour: int = attr.ib()  # epoch millis
+    segment: str = attr.ib()
+    count: int = attr.ib(default=0)
+    balance_sum: int = attr.ib(default=0)
+    balance_min: Optional[int] = attr.ib(default=None)
+    balance_max: Optional[int] = attr.ib(default=None)
+
+    @property
+    def id(self) -> str:
+        return f"{self.hour}-{self.segment}"
+
+    def add(self, balance: int):
+        self.count += 1
+        self.balance_sum += balance
+        self.balance_min = balance if self.balance_min is None else min(self.balance_min, balance)
+        self.balance_max = balance if self.balance_max is None else max(self.balance_max, balance)
+
+    def merge(self, other: "Bucket"):
+        self.count += other.count
+        self.balance_sum += other.balance_sum
+        for value in (other.balance_min, other.balance_max):
+            if value is not None:
+                self.balance_min = value if self.balance_min is None else min(self.balance_min, value)
+                self.balance_max = value if self.balance_max is None else max(self.balance_max, value)
+
+    def to_doc(self) -> dict:
+        dct = attr.asdict(self)
+        dct["id"] = self.id
+        return dct
+
+    @classmethod
+    def from_doc(cls, dct: dict) -> "Bucket":
+        return cls(**{k: v for k, v in dct.items() if k != "id"})
+
+
+def rollup_lines(lines: Iterable[bytes], hour: int) -> Dict[str, Bucket]:
+    """
+    Aggregate the NDJSON records of one hour, records without an integer
+    balance are skipped.
+    """
+    buckets: Dict[str, Bucket] = dict()
+    for line in lines:
+        if not line.strip():
+            continue
+        balance = loads(line).get("balance")
+        if not isinstance(balance, int):
+            continue
+        segment = segment_of(balance)
+        key = f"{hour}-{segment}"
+        if key not in buckets:
+            buckets[key] = Bucket(hour=hour, segment=segment)
+        buckets[key].add(balance)
+    return buckets
+
+
+class RollupState:
+    """
+    The done object keys and the buckets, saved as a JSON file with an
+    atomic rename.
+
+    :param path: None to keep the state in memory only.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.done = set()
+        self.buckets: Dict[str, Bucket] = dict()
+        # epoch seconds of the newest object
+        self.last_object_at: Optional[int] = None
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                dct = json.load(f)
+            self.done = set(dct["done"])
+            self.buckets = {
+                bucket.id: bucket
+                for bucket in map(Bucket.from_doc, dct["buckets"])
+            }
+            self.last_object_at = dct["last_object_at"]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.done
+
+    def prune(self) -> int:
+        """
+        Forget the done keys of the objects before the watermark, the job
+        skips these objects anyway.
+
+        :return: number of keys removed
+        """
+        watermark = self.watermark
+        if watermark is None:
+            return 0
+        n_done = len(self.done)
+        self.done = {
+            key
+            for key in self.done
+            if parse_firehose_key(key)[1] * 1000 >= watermark
+        }
+        return n_done - len(self.done)
+
+    @property
+    def watermark(self) -> Optional[int]:
+        """
+        Epoch millis, the hours before it are complete.
+        """
+        if self.last_object_at is None:
+            return None
+        return floor_hour((self.last_object_at - MAX_BUFFER_SECONDS) * 1000)
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "done": sorted(self.done),
+                "buckets": [bucket.to_doc() for bucket in self.buckets.values()],
+                "last_object_at": self.last_object_at,
+            }, f)
+        os.replace(tmp_path, self.path)
+
+
+class OpenSearchRollupSink:
+    """
+    Write the buckets to the rollup index, the bucket id is the document id.
+    """
+
+    def __init__(self, oss, index: str = ROLLUP_INDEX, chunk_size: int = 500):
+        self.oss = oss
+        self.index = index
+        self.chunk_size = chunk_size
+
+    def write(self, buckets: List[Bucket]) -> int:
+        """
+        :return: number of buckets failed
+        """
+        from .oss_utils import bulk_index
+
+        docs = [bucket.to_doc() for bucket in buckets]
+        _, errors = bulk_index(self.oss, self.index, docs, chunk_size=self.chunk_size)
+        return len(errors)
+
+    def set_watermark(self, watermark: int):
+        self.oss.indices.put_mapping(index=self.index, body={"_meta": {"watermark": watermark}})
+
+
+@attr.s
+class RollupStats:
+    objects: int = attr.ib(default=0)
+    objects_skipped: int = attr.ib(default=0)
+    records: int = attr.ib(default=0)
+    buckets_written: int = attr.ib(default=0)
+    elapsed: float = attr.ib(default=0.0)
+
+    def to_dict(self) -> dict:
+        return attr.asdict(self)
+
+
+class RollupJob:
+    """
+    :param store: the data bucket, usually a
+        :class:`~kds_example.object_store.S3ObjectStore`.
+    :param sink: :class:`OpenSearchRollupSink` or any object with the
+        ``write(buckets) -> n_failed`` and ``set_watermark(epoch_ms)`` methods.
+    :param batch_size: objects per index write and state save.
+    :param manifest: optional :class:`~kds_example.manifest.ManifestIndex`
+        of the prefix, synced by the caller, the new objects are looked up
+        in it instead of listing the prefix.
+    """
+
+    def __init__(
+        self,
+        store,
+        sink,
+        state: RollupState = None,
+        prefix: str = SUCCESS_PREFIX,
+        batch_size: int = 100,
+        manifest=None,
+    ):
+        self.store = store
+        self.sink = sink
+        self.state = RollupState() if state is None else state
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.manifest = manifest
+
+    def list_keys(self) -> List[str]:
+        """
+        The candidate keys, the objects since the watermark if there is a
+        manifest, all the keys of the prefix otherwise.
+        """
+        if self.manifest is None:
+            return self.store.list_keys(self.prefix)
+        watermark = self.state.watermark
+        start = None if watermark is None else watermark // 1000
+        return self.manifest.list_keys(self.prefix, start=start)
+
+    def run(self, progress: Callable[[RollupStats], None] = None) -> RollupStats:
+        """
+        Roll up the new objects of the prefix.
+
+        :param progress: optional, called with the stats after each batch.
+        """
+        st = time.perf_counter()
+        stats = RollupStats()
+        watermark = self.state.watermark
+        keys = list()
+        for key in self.list_keys():
+            parsed = parse_firehose_key(key)
+            if (
+                parsed is None
+                or (watermark is not None and parsed[1] * 1000 < watermark)
+                or key in self.state
+            ):
+                stats.objects_skipped += 1
+                continue
+            keys.append((key, parsed[1]))
+        # oldest first, the objects not done yet are never before the watermark
+        keys.sort(key=lambda x: (x[1], x[0]))
+
+        for i in range(0, len(keys), self.batch_size):
+            batch = keys[i:i + self.batch_size]
+            touched: Dict[str, Bucket] = dict()
+            for key, created_at in batch:
+                lines = read_object(self.store, key).splitlines()
+                stats.records += sum(1 for line in lines if line.strip())
+                for bucket_id, partial in rollup_lines(lines, floor_hour(created_at * 1000)).items():
+                    if bucket_id not in touched:
+                        current = self.state.buckets.get(bucket_id)
+                        touched[bucket_id] = attr.evolve(current) if current else Bucket(partial.hour, partial.segment)
+                    touched[bucket_id].merge(partial)
+            n_failed = self.sink.write(list(touched.values()))
+            if n_failed:
+                raise RuntimeError(f"{n_failed} rollup buckets failed to write, rerun the job")
+            # the index has the new values, now the state
+            self.state.buckets.update(touched)
+            self.state.done.update(key for key, _ in batch)
+            last_object_at = max(created_at for _, created_at in batch)
+            if self.state.last_object_at is None or last_object_at > self.state.last_object_at:
+                self.state.last_object_at = last_object_at
+            self.state.save()
+            stats.objects += len(batch)
+            stats.buckets_written += len(touched)
+            if progress is not None:
+                stats.elapsed = time.perf_counter() - st
+                progress(stats)
+
+        if self.state.watermark is not None:
+            self.sink.set_watermark(self.state.watermark)
+        if self.state.prune():
+            self.state.save()
+        stats.elapsed = time.perf_counter() - st
+        return stats
+
+
+# --- query
+def get_watermark(oss, rollup_index: str = ROLLUP_INDEX) -> Optional[int]:
+    res = oss.indices.get_mapping(index=rollup_index)
+    for mapping in res.values():
+        return mapping["mappings"].get("_meta", {}).get("watermark")
+    return None
+
+
+def can_use_rollup(start: Optional[int], end: Optional[int], watermark: Optional[int]) -> bool:
+    """
+    The rollup answers a window ``[start, end)`` of whole hours before the
+    watermark, ``start`` None for since the beginning.
+    """
+    if end is None or watermark is None:
+        return False
+    if start is not None and start % HOUR_MS:
+        return False
+    return end % HOUR_MS == 0 and end <= watermark
+
+
+@attr.s
+class BalanceTotals:
+    source: str = attr.ib()  # "rollup" or "raw"
+    segments: Dict[str, dict] = attr.ib()
+
+
+def _rollup_totals(oss, rollup_index: str, start: Optional[int], end: int) -> Dict[str, dict]:
+    hour_range = {"lt": end}
+    if start is not None:
+        hour_range["gte"] = start
+    res = oss.search(
+        index=rollup_index,
+        body={
+            "size": 0,
+            "query": {"bool": {"filter": [{"range": {"hour": hour_range}}]}},
+            "aggs": {
+                "segment": {
+                    "terms": {"field": "segment", "size": len(SEGMENTS)},
+                    "aggs": {
+                        "count": {"sum": {"field": "count"}},
+                        "balance_sum": {"sum": {"field": "balance_sum"}},
+                        "balance_min": {"min": {"field": "balance_min"}},
+                        "balance_max": {"max": {"field": "balance_max"}},
+                    },
+                }
+            },
+        },
+    )
+    return {
+        bucket["key"]: {
+            "count": int(bucket["count"]["value"]),
+            "balance_sum": int(bucket["balance_sum"]["value"]),
+            "balance_min": bucket["balance_min"]["value"],
+            "balance_max": bucket["balance_max"]["value"],
+        }
+        for bucket in res["aggregations"]["segment"]["buckets"]
+    }
+
+
+def _raw_totals(oss, index: str) -> Dict[str, dict]:
+    ranges = list()
+    for segment, lower, upper in SEGMENTS:
+        dct = {"key": segment}
+        if lower is not None:
+            dct["from"] = lower
+        if upper is not None:
+            dct["to"] = upper
+        ranges.append(dct)
+    res = oss.search(
+        index=index,
+        body={
+            "size": 0,
+            "aggs": {
+                "segment": {
+                    "range": {"field": "balance", "ranges": ranges, "keyed": True},
+                    "aggs": {"balance": {"stats": {"field": "balance"}}},
+                }
+            },
+        },
+    )
+    return {
+        segment: {
+            "count": bucket["doc_count"],
+            "balance_sum": int(bucket["balance"]["sum"]),
+            "balance_min": bucket["balance"]["min"],
+            "balance_max": bucket["balance"]["max"],
+        }
+        for segment, bucket in res["aggregations"]["segment"]["buckets"].items()
+        if bucket["doc_count"]
+    }
+
+
+def balance_totals(
+    oss,
+    index: str,
+    rollup_index: str = ROLLUP_INDEX,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> BalanceTotals:
+    """
+    Count and balance sum, min and max per segment.
+
+    :param start: epoch millis, included.
+    :param end: epoch millis, excluded. Without ``start`` and ``end`` the
+        all time totals are aggregated from the raw index ``index``, they
+        include the records after the watermark.
+    """
+    if start is None and end is None:
+        return BalanceTotals(source="raw", segments=_raw_totals(oss, index))
+    watermark = get_watermark(oss, rollup_index)
+    if not can_use_rollup(start, end, watermark):
+        raise ValueError(
+            f"the raw documents have no record time, the window has to be "
+            f"whole hours ending before the rollup watermark {watermark}"
+        )
+    return BalanceTotals(source="rollup", segments=_rollup_totals(oss, rollup_index, start, end))
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+"""
+Declarative schema of the ``bank_account`` records.
+
+The field types use the OpenSearch mapping type names, the schema is the
+single source of truth for both the index mapping and the record validator
+in :mod:`kds_example.lbd.validator`.
+
+A :class:`MappingProfile` tunes the mapping for the queries:
+
+- ``id_field``: its value is the document ``_id``, a record indexed twice,
+  a firehose retry or a replay, overwrites its document instead of adding
+  a duplicate. The delivery stream can't set the ``_id``, it is set by the
+  ``index.final_pipeline`` of the index, see :func:`final_pipeline_name`.
+- ``routing_field``: documents with the same value go to the same shard, a
+  query by this field with ``routing`` (see
+  :func:`kds_example.oss_utils.search_by_key`) hits one shard instead of
+  all of them. The delivery stream only sends the document source, the
+  routing is set by the :data:`ROUTING_PIPELINE_NAME` ingest pipeline, the
+  ``index.final_pipeline`` of the index, it sets the ``_id`` too.
+- ``aggregation_only``: fields only used in aggregations and sorting, not
+  indexed, they keep their doc values.
+- ``no_scoring``: text fields never used for relevance scoring, no norms.
+"""
+
+from typing import Dict, List, Optional
+
+import attr
+
+from .tracing import TRACE_FIELD, TRACE_PIPELINE_NAME, trace_mapping
+
+
+@attr.s
+class Field:
+    """
+    :param type: OpenSearch mapping type, one of ``keyword``, ``text``,
+        ``integer``, ``long``, ``float``, ``double``, ``boolean``, ``date``.
+    :param required: the key must exist.
+    :param nullable: the value can be None.
+    :param max_length: max length of string values.
+    """
+    type: str = attr.ib()
+    required: bool = attr.ib(default=True)
+    nullable: bool = attr.ib(default=False)
+    max_length: int = attr.ib(default=None)
+
+
+Schema = Dict[str, Field]
+
+DOCUMENT_ID_PIPELINE_NAME = "kds-document-id"
+ROUTING_PIPELINE_NAME = "kds-routing"
+
+
+@attr.s
+class MappingProfile:
+    id_field: Optional[str] = attr.ib(default=None)
+    routing_field: Optional[str] = attr.ib(default=None)
+    aggregation_only: List[str] = attr.ib(factory=list)
+    no_scoring: List[str] = attr.ib(factory=list)
+
+
+bank_account_schema: Schema = {
+    "id": Field("keyword", max_length=36),
+    "firstname": Field("keyword", max_length=256),
+    "lastname": Field("keyword", max_length=256),
+    "balance": Field("integer"),
+    "description": Field("text", required=False, nullable=True),
+}
+
+
+def to_mapping(schema: Schema, profile: MappingProfile = None) -> dict:
+    profile = profile or MappingProfile()
+    properties = dict()
+    for name, field in schema.items():
+        properties[name] = {"type": field.type}
+        if name in profile.aggregation_only:
+            if field.type == "text":
+                raise ValueError(f"text field {name!r} has no doc values, it can't be aggregation only")
+            properties[name]["index"] = False
+        if name in profile.no_scoring:
+            if field.type != "text":
+                raise ValueError(f"only text fields have norms, {name!r} is {field.type!r}")
+            properties[name]["norms"] = False
+    mapping = {"properties": properties}
+    if profile.id_field is not None and profile.id_field not in schema:
+        raise ValueError(f"id field {profile.id_field!r} is not in the schema")
+    if profile.routing_field is not None:
+        if profile.routing_field not in schema:
+            raise ValueError(f"routing field {profile.routing_field!r} is not in the schema")
+        mapping["_routing"] = {"required": True}
+    return mapping
+
+
+def final_pipeline_name(profile: MappingProfile) -> Optional[str]:
+    """
+    The ``index.final_pipeline`` of the profile, None if it needs none.
+    """
+    if profile.routing_field is not None:
+        return ROUTING_PIPELINE_NAME
+    if profile.id_field is not None:
+        return DOCUMENT_ID_PIPELINE_NAME
+    return None
+
+
+def make_final_pipeline_body(profile: MappingProfile) -> dict:
+    """
+    The ingest pipeline setting the ``_id`` and the ``_routing`` of the
+    documents, create it as :func:`final_pipeline_name` before the index.
+    """
+    processors = list()
+    descriptions = list()
+    if profile.id_field is not None:
+        descriptions.append(f"use {profile.id_field} as the document id")
+        processors.append({"set": {"field": "_id", "value": "{{{%s}}}" % profile.id_field}})
+    if profile.routing_field is not None:
+        descriptions.append(f"route the documents by {profile.routing_field}")
+        processors.append({"set": {"field": "_routing", "value": "{{{%s}}}" % profile.routing_field}})
+    return {"description": ", ".join(descriptions), "processors": processors}
+
+
+def make_index_body(
+    schema: Schema,
+    profile: MappingProfile = None,
+    number_of_shards: int = 24,
+    number_of_replicas: int = 2,
+) -> dict:
+    """
+    Create the index settings and mappings, create the ingest pipelines it
+    uses before the index.
+    """
+    profile = profile or MappingProfile()
+    body = {
+        "settings": {
+            "number_of_shards": number_of_shards,
+            "number_of_replicas": number_of_replicas,
+            # stamps trace.indexed_at
+            "index.default_pipeline": TRACE_PIPELINE_NAME,
+        },
+        "mappings": to_mapping(schema, profile),
+    }
+    pipeline_name = final_pipeline_name(profile)
+    if pipeline_name is not None:
+        body["settings"]["index.final_pipeline"] = pipeline_name
+    body["mappings"]["properties"][TRACE_FIELD] = trace_mapping
+    return body
+
+
+# the record id is the document id, the firehose deliveries are idempotent
+bank_account_profile = MappingProfile(id_field="id")
+bank_account_index_body = make_index_body(bank_account_schema, bank_account_profile)
+bank_account_id_pipeline_body = make_final_pipeline_body(bank_account_profile)
+
+# the per-account queries hit one shard, balance is only aggregated and the
+# description is never scored
+bank_account_routed_profile = MappingProfile(
+    id_field="id",
+    routing_field="id",
+    aggregation_only=["balance"],
+    no_scoring=["description"],
+)
+bank_account_routed_index_body = make_index_body(bank_account_schema, bank_account_routed_profile)
+bank_account_routing_pipeline_body = make_final_pipeline_body(bank_account_routed_profile)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local schema registry of the binary stream records.
+
+The Avro schemas are versioned files of a directory, by default the
+``avro_schemas`` folder of this package, so the transformation lambda ships
+with every version the producers may write::
+
+    {id:04d}-{name}-v{version}.avsc
+
+A binary record is a 4 bytes header and the Avro binary encoding of the
+record, see :mod:`kds_example.avro`::
+
+    b"KB" | schema id (uint16, big endian) | avro data
+
+The schema id is global, so a record decodes without knowing its schema
+name. JSON records start with ``{``, :func:`loads` decodes both, a stream
+can move to the binary encoding one producer at a time. Register a new
+version before the producers send a new field, :meth:`SchemaRegistry.encode`
+rejects fields not in the schema.
+"""
+
+import re
+import json
+import struct
+from pathlib import Path
+from typing import List, Dict, Optional
+
+import attr
+
+from .avro import compile_encoder, compile_decoder
+from .schema import Schema, bank_account_schema
+from .tracing import TRACE_FIELD
+
+MAGIC = b"KB"
+HEADER_SIZE = 4
+
+_header = struct.Struct(">2sH")
+
+dir_default_root = Path(__file__).absolute().parent / "avro_schemas"
+
+schema_file_pattern = re.compile(r"^(?P<id>\d{4})-(?P<name>.+)-v(?P<version>\d+)\.avsc$")
+
+# OpenSearch mapping type -> avro type
+avro_types = {
+    "keyword": "string",
+    "text": "string",
+    "date": "string",
+    "integer": "int",
+    "long": "long",
+    "float": "float",
+    "double": "double",
+    "boolean": "boolean",
+}
+
+# the producer side fields of kds_example.tracing.new_trace
+trace_avro_schema = {
+    "type": "record",
+    "name": "Trace",
+    "fields": [
+        {"name": "id", "type": "string"},
+        {"name": "produced_at", "type": "long"},
+    ],
+}
+
+
+def to_avro_schema(name: str, schema: Schema, trace: bool = True) -> dict:
+    """
+    Convert a :mod:`kds_example.schema` schema, the fields that are not
+    required or nullable are ``["null", type]`` unions.
+
+    :param trace: add the optional ``trace`` field of :mod:`kds_example.tracing`.
+    """
+    fields = list()
+    for field_name, field in schema.items():
+        avro_type = avro_types[field.type]
+        if field.nullable or not field.required:
+            fields.append({"name": field_name, "type": ["null", avro_type], "default": None})
+        else:
+            fields.append({"name": field_name, "type": avro_type})
+    if trace:
+        fields.append({"name": TRACE_FIELD, "type": ["null", trace_avro_schema], "default": None})
+    return {"type": "record", "name": name, "fields": fields}
+
+
+def is_binary(data: bytes) -> bool:
+    return data[:2] == MAGIC
+
+
+@attr.s
+class RegisteredSchema:
+    id: int = attr.ib()
+    name: str = attr.ib()
+    version: int = attr.ib()
+    avro_schema: dict = attr.ib(repr=False)
+    _encode = attr.ib(default=None, init=False, repr=False)
+    _decode = attr.ib(default=None, init=False, repr=False)
+
+    @property
+    def filename(self) -> str:
+        return f"{self.id:04d}-{self.name}-v{self.version}.avsc"
+
+    def encode(self, record: dict) -> bytes:
+        if self._encode is None:
+            self._encode = compile_encoder(self.avro_schema)
+        return _header.pack(MAGIC, self.id) + self._encode(record)
+
+    def decode(self, data: bytes) -> dict:
+        if self._decode is None:
+            self._decode = compile_decoder(self.avro_schema)
+        return self._decode(data[HEADER_SIZE:])
+
+
+class SchemaRegistry:
+    """
+    :param root: the directory of the schema files.
+    """
+
+    def __init__(self, root: str = dir_default_root):
+        self.root = Path(root)
+        self.by_id: Dict[int, RegisteredSchema] = dict()
+        self.by_name: Dict[str, List[RegisteredSchema]] = dict()
+        if self.root.exists():
+            for path in sorted(self.root.iterdir()):
+                match = schema_file_pattern.match(path.name)
+                if match is None:
+                    continue
+                self._add(RegisteredSchema(
+                    id=int(match.group("id")),
+                    name=match.group("name"),
+                    version=int(match.group("version")),
+                    avro_schema=json.loads(path.read_text()),
+                ))
+
+    def _add(self, registered: RegisteredSchema):
+        self.by_id[registered.id] = registered
+        versions = self.by_name.setdefault(registered.name, list())
+        versions.append(registered)
+        versions.sort(key=lambda x: x.version)
+
+    def versions(self, name: str) -> List[int]:
+        return [registered.version for registered in self.by_name.get(name, [])]
+
+    def get(self, name: str, version: int = None) -> RegisteredSchema:
+        """
+        :param version: default to the latest version.
+        """
+        versions = self.by_name.get(name)
+        if not versions:
+            raise KeyError(f"schema {name!r} is not registered")
+        if version is None:
+            return versions[-1]
+        for registered in versions:
+            if registered.version == version:
+                return registered
+        raise KeyError(f"schema {name!r} has no version {version}")
+
+    def get_by_id(self, schema_id: int) -> RegisteredSchema:
+        try:
+            return self.by_id[schema_id]
+        except KeyError:
+            raise KeyError(f"unknown schema id {schema_id}")
+
+    def register(self, name: str, avro_schema: dict) -> RegisteredSchema:
+        """
+        Write a new version of the schema, unless it is the same as the
+        latest version.
+        """
+        versions = self.by_name.get(name)
+        if versions and versions[-1].avro_schema == avro_schema:
+            return versions[-1]
+        registered = RegisteredSchema(
+            id=max(self.by_id, default=0) + 1,
+            name=name,
+            version=versions[-1].version + 1 if versions else 1,
+            avro_schema=avro_schema,
+        )
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.root.joinpath(registered.filename).write_text(json.dumps(avro_schema, indent=4) + "\n")
+        self._add(registered)
+        return registered
+
+    def encode(self, record: dict, name: str, version: int = None) -> bytes:
+        return self.get(name, version).encode(record)
+
+    def decode(self, data: bytes) -> dict:
+        magic, schema_id = _header.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("not a binary record")
+        return self.get_by_id(schema_id).decode(data)
+
+
+_default_registry: Optional[SchemaRegistry] = None
+
+
+def get_default_registry() -> SchemaRegistry:
+    """
+    The registry of the schema files shipped with the package, loaded once.
+    """
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = SchemaRegistry()
+    return _default_registry
+
+
+def loads(data: bytes, registry: SchemaRegistry = None) -> dict:
+    """
+    Decode a binary or a JSON record.
+    """
+    if is_binary(data):
+        return (registry or get_default_registry()).decode(data)
+    return json.loads(data)
+
+
+if __name__ == "__main__":
+    # register the current bank_account schema
+    print(SchemaRegistry().register("bank_account", to_avro_schema("bank_account", bank_account_schema)))
@@ -0,0 +1,737 @@
+# -*- coding: utf-8 -*-
+
+"""
+In process simulator of the data pipeline built by
+:class:`kds_example.iac.s2_app.Stack`::
+
+    kinesis data stream -> delivery stream -> lambda -> S3 / OpenSearch
+                                           -> S3 backup
+
+It reads the records of a :class:`~kds_example.fake_kinesis.FakeKinesisClient`
+stream (with the real partition key hashing) and mimics the delivery stream:
+
+- the lambda processor buffer, flushed by size or interval, the real
+  transformation handlers are called with the same event as firehose, and
+  retried ``number_of_retries`` times when they raise or return a bad
+  response.
+- ``Ok`` records go to the destination buffer, ``Dropped`` records are
+  discarded, ``ProcessingFailed`` records and records of a failed
+  invocation are written as firehose error records to the error prefix.
+- the S3 destination writes one object per buffer flush under
+  ``{prefix}YYYY/MM/DD/HH/`` with the firehose object naming. The
+  OpenSearch destination bulk indexes into :class:`FakeOpenSearch`, every
+  document also goes to the S3 backup (``AllDocuments``), rejected ones to
+  its error prefix.
+- the S3 destination backs up the source records (``S3BackupMode=Enabled``).
+
+A Direct PUT delivery stream is fed by :class:`FakeFirehoseClient` instead of
+the data stream, its events have no ``kinesisRecordMetadata``.
+
+Objects are written to an object store of :mod:`kds_example.object_store`,
+a local directory, a boto3 or moto S3 client, or memory. Time is simulated with :class:`SimClock`, so an
+hour of buffering runs in milliseconds. This is a behavior model for tests
+and buffer tuning, not an emulation of every firehose limit.
+"""
+
+import json
+import time
+import uuid
+import base64
+import threading
+from datetime import datetime, timezone
+from typing import List, Dict, Tuple, Callable, Optional
+
+import attr
+
+from .fake_kinesis import FakeClientError
+
+MB = 1024 * 1024
+
+ERROR_PROCESSING_FAILED = "processing-failed"
+ERROR_OPENSEARCH_FAILED = "opensearch-failed"
+
+
+class SimClock:
+    """
+    A manually advanced clock, in epoch seconds.
+    """
+
+    def __init__(self, start: float = None):
+        self.now = time.time() if start is None else start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+def to_ms(seconds: float) -> int:
+    return int(seconds * 1000)
+
+
+@attr.s
+class BufferingHints:
+    size_in_mb: float = attr.ib(default=5)
+    interval_in_sec: float = attr.ib(default=300)
+
+
+class Buffer:
+    """
+    Items buffered until the size or the interval hint is reached.
+    """
+
+    def __init__(self, hints: BufferingHints):
+        self.hints = hints
+        self.items = list()
+        self.size = 0
+        self.opened_at = None
+
+    def add(self, item, size: int, now: float) -> bool:
+        """
+        :return: True if the buffer is full and should be flushed.
+        """
+        if not self.items:
+            self.opened_at = now
+        self.items.append(item)
+        self.size += size
+        return self.size >= self.hints.size_in_mb * MB
+
+    def is_due(self, now: float) -> bool:
+        return bool(self.items) and now - self.opened_at >= self.hints.interval_in_sec
+
+    def drain(self) -> list:
+        items = self.items
+        self.items = list()
+        self.size = 0
+        self.opened_at = None
+        return items
+
+
+class FakeOpenSearch:
+    """
+    Documents per index in memory.
+
+    :param validator: optional, returns an error message for a document the
+        index mapping would reject, see :mod:`kds_example.lbd.validator`.
+    """
+
+    def __init__(self, validator: Callable[[dict], Optional[str]] = None):
+        self.validator = validator
+        self.indices: Dict[str, Dict[str, dict]] = dict()
+
+    def bulk_index(self, index: str, docs: List[bytes]) -> List[Optional[str]]:
+        """
+        Index the raw json documents with generated ids, like the firehose
+        OpenSearch destination.
+
+        :return: the error of each document, None if indexed
+        """
+        documents = self.indices.setdefault(index, dict())
+        errors = list()
+        for doc in docs:
+            try:
+                source = json.loads(doc)
+            except ValueError as e:
+                errors.append(f"mapper_parsing_exception: {e}")
+                continue
+            error = None if self.validator is None else self.validator(source)
+            if error is None:
+                documents[uuid.uuid4().hex] = source
+            errors.append(error)
+        return errors
+
+    def count(self, index: str) -> int:
+        return len(self.indices.get(index, {}))
+
+    def search(self, index: str) -> List[dict]:
+        return list(self.indices.get(index, {}).values())
+
+
+# --- delivery stream
+@attr.s
+class SourceRecord:
+    """
+    A record read from the data stream, the kinesis fields are None for a
+    Direct PUT record.
+    """
+    record_id: str = attr.ib()
+    data: bytes = attr.ib()
+    partition_key: str = attr.ib()
+    sequence_number: str = attr.ib()
+    shard_id: str = attr.ib()
+    stream_arrived_at: int = attr.ib()
+    arrived_at: int = attr.ib()
+
+
+@attr.s
+class DeliveryStreamStats:
+    records_in: int = attr.ib(default=0)
+    invocations: int = attr.ib(default=0)
+    invocation_errors: int = attr.ib(default=0)
+    records_ok: int = attr.ib(default=0)
+    records_dropped: int = attr.ib(default=0)
+    records_processing_failed: int = attr.ib(default=0)
+    objects: int = attr.ib(default=0)
+    bytes_delivered: int = attr.ib(default=0)
+    docs_indexed: int = attr.ib(default=0)
+    docs_failed: int = attr.ib(default=0)
+    # wall clock seconds spent in the lambda handler
+    processor_seconds: float = attr.ib(default=0.0)
+
+
+def format_hour_prefix(now: float) -> str:
+    return datetime.fromtimestamp(now, tz=timezone.utc).strftime("%Y/%m/%d/%H/")
+
+
+def make_object_name(delivery_stream_name: str, now: float) -> str:
+    """
+    ``{delivery stream}-{version}-YYYY-MM-DD-HH-MM-SS-{uuid}``, the firehose
+    S3 object name.
+    """
+    timestamp = datetime.fromtimestamp(now, tz=timezone.utc).strftime("%Y-%m-%d-%H-%M-%S")
+    return f"{delivery_stream_name}-1-{timestamp}-{uuid.uuid4()}"
+
+
+def make_error_record(
+    data: bytes,
+    arrived_at: int,
+    error_code: str,
+    error_message: str,
+    attempts_made: int,
+    now: float,
+    lambda_arn: str = None,
+) -> bytes:
+    record = {
+        "attemptsMade": attempts_made,
+        "arrivalTimestamp": arrived_at,
+        "errorCode": error_code,
+        "errorMessage": error_message,
+        "attemptEndingTimestamp": to_ms(now),
+        "rawData": base64.b64encode(data).decode("utf-8"),
+    }
+    if lambda_arn is not None:
+        record["lambdaArn"] = lambda_arn
+    return (json.dumps(record) + "\n").encode("utf-8")
+
+
+class S3Destination:
+    """
+    Buffers data and writes one object per flush.
+    """
+
+    def __init__(
+        self,
+        store,
+        prefix: str,
+        error_prefix: str,
+        hints: BufferingHints = None,
+    ):
+        self.store = store
+        self.prefix = prefix
+        self.error_prefix = error_prefix
+        self.hints = hints or BufferingHints()
+        self.buffer = Buffer(self.hints)
+        self.error_buffers: Dict[str, Buffer] = dict()
+        self.delivery_stream_name = "delivery-stream"
+        self.stats = DeliveryStreamStats()
+
+    def add(self, data: bytes, now: float):
+        if self.buffer.add(data, len(data), now):
+            self._write(self.prefix, self.buffer.drain(), now)
+
+    def add_error(self, error_type: str, error_record: bytes, now: float):
+        buffer = self.error_buffers.setdefault(error_type, Buffer(self.hints))
+        if buffer.add(error_record, len(error_record), now):
+            self._write(f"{self.error_prefix}{error_type}/", buffer.drain(), now)
+
+    def _write(self, prefix: str, items: List[bytes], now: float):
+        body = b"".join(items)
+        key = f"{prefix}{format_hour_prefix(now)}{make_object_name(self.delivery_stream_name, now)}"
+        self.store.put_object(key, body)
+        self.stats.objects += 1
+        self.stats.bytes_delivered += len(body)
+
+    def tick(self, now: float, force: bool = False):
+        if self.buffer.items and (force or self.buffer.is_due(now)):
+            self._write(self.prefix, self.buffer.drain(), now)
+        for error_type, buffer in self.error_buffers.items():
+            if buffer.items and (force or buffer.is_due(now)):
+                self._write(f"{self.error_prefix}{error_type}/", buffer.drain(), now)
+
+
+class OpenSearchDestination:
+    """
+    Buffers documents and bulk indexes them per flush, all documents also go
+    to the S3 backup (``AllDocuments``), rejected ones to its error prefix.
+    """
+
+    def __init__(
+        self,
+        oss: FakeOpenSearch,
+        index: str,
+        backup: S3Destination,
+        hints: BufferingHints = None,
+    ):
+        self.oss = oss
+        self.index = index
+        self.backup = backup
+        self.hints = hints or BufferingHints()
+        self.buffer = Buffer(self.hints)
+        self.stats = DeliveryStreamStats()
+
+    @property
+    def delivery_stream_name(self) -> str:
+        return self.backup.delivery_stream_name
+
+    @delivery_stream_name.setter
+    def delivery_stream_name(self, value: str):
+        self.backup.delivery_stream_name = value
+
+    def add(self, data: bytes, now: float):
+        self.backup.add(data, now)
+        if self.buffer.add(data, len(data), now):
+            self._index(self.buffer.drain(), now)
+
+    def add_error(self, error_type: str, error_record: bytes, now: float):
+        self.backup.add_error(error_type, error_record, now)
+
+    def _index(self, docs: List[bytes], now: float):
+        errors = self.oss.bulk_index(self.index, docs)
+        for doc, error in zip(docs, errors):
+            if error is None:
+                self.stats.docs_indexed += 1
+            else:
+                self.stats.docs_failed += 1
+                self.backup.add_error(
+                    ERROR_OPENSEARCH_FAILED,
+                    make_error_record(doc, to_ms(now), "OS.MapperParsingException", error, 1, now),
+                    now,
+                )
+        self.stats.bytes_delivered += sum(len(doc) for doc in docs)
+
+    def tick(self, now: float, force: bool = False):
+        if self.buffer.items and (force or self.buffer.is_due(now)):
+            self._index(self.buffer.drain(), now)
+        self.backup.tick(now, force=force)
+
+
+class FakeLambdaContext:
+    def __init__(self, function_name: str, timeout: float):
+        self.function_name = function_name
+        self.deadline = time.perf_counter() + timeout
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int((self.deadline - time.perf_counter()) * 1000)
+
+
+class DeliveryStreamSimulator:
+    """
+    :param destination: :class:`S3Destination` or :class:`OpenSearchDestination`.
+    :param processor: the lambda handler ``handler(event, context)``, None
+        means no transformation.
+    :param source_backup: optional, backup of the source records.
+    :param source_stream_name: the data stream it reads, default to the
+        stream of the :class:`PipelineSimulator`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        destination,
+        processor: Callable[[dict, object], dict] = None,
+        processor_hints: BufferingHints = None,
+        number_of_retries: int = 1,
+        source_backup: S3Destination = None,
+        lambda_timeout: float = 120,
+        lambda_arn: str = None,
+        source_stream_name: str = None,
+    ):
+        self.name = name
+        self.source_stream_name = source_stream_name
+        self.destination = destination
+        self.destination.delivery_stream_name = name
+        self.processor = processor
+        self.processor_buffer = Buffer(processor_hints or BufferingHints(size_in_mb=3, interval_in_sec=60))
+        self.number_of_retries = number_of_retries
+        self.source_backup = source_backup
+        if source_backup is not None:
+            source_backup.delivery_stream_name = name
+        self.lambda_timeout = lambda_timeout
+        self.lambda_arn = lambda_arn or f"arn:aws:lambda:us-east-1:000000000000:function:{name}"
+        self.stats = DeliveryStreamStats()
+
+    def put(self, record: SourceRecord, now: float):
+        self.stats.records_in += 1
+        if self.source_backup is not None:
+            self.source_backup.add(record.data, now)
+        if self.processor is None:
+            self.stats.records_ok += 1
+            self.destination.add(record.data, now)
+        elif self.processor_buffer.add(record, len(record.data), now):
+            self._invoke(self.processor_buffer.drain(), now)
+
+    def make_event(self, records: List[SourceRecord]) -> dict:
+        event_records = list()
+        for record in records:
+            event_record = {
+                "recordId": record.record_id,
+                "approximateArrivalTimestamp": record.arrived_at,
+                "data": base64.b64encode(record.data).decode("utf-8"),
+            }
+            # a Direct PUT record has no kinesis metadata
+            if record.shard_id is not None:
+                event_record["kinesisRecordMetadata"] = {
+                    "sequenceNumber": record.sequence_number,
+                    "subsequenceNumber": 0,
+                    "partitionKey": record.partition_key,
+                    "shardId": record.shard_id,
+                    "approximateArrivalTimestamp": record.stream_arrived_at,
+                }
+            event_records.append(event_record)
+        event = {
+            "invocationId": str(uuid.uuid4()),
+            "deliveryStreamArn": f"arn:aws:firehose:us-east-1:000000000000:deliverystream/{self.name}",
+            "region": "us-east-1",
+            "records": event_records,
+        }
+        if any(record.shard_id is not None for record in records):
+            event["sourceKinesisStreamArn"] = "arn:aws:kinesis:us-east-1:000000000000:stream/source"
+        return event
+
+    def _check_response(self, records: List[SourceRecord], response: dict):
+        results = response["records"]
+        if [result["recordId"] for result in results] != [record.record_id for record in records]:
+            raise ValueError("the response record ids don't match the event")
+        for result in results:
+            if result["result"] not in ("Ok", "Dropped", "ProcessingFailed"):
+                raise ValueError(f"invalid result {result['result']!r}")
+
+    def _invoke(self, records: List[SourceRecord], now: float):
+        event = self.make_event(records)
+        response = None
+        error = None
+        attempts = 0
+        for _ in range(1 + self.number_of_retries):
+            attempts += 1
+            self.stats.invocations += 1
+            context = FakeLambdaContext(self.name, self.lambda_timeout)
+            st = time.perf_counter()
+            try:
+                response = self.processor(event, context)
+                self._check_response(records, response)
+                error = None
+                break
+            except Exception as e:
+                response = None
+                error = f"{type(e).__name__}: {e}"
+                self.stats.invocation_errors += 1
+            finally:
+                self.stats.processor_seconds += time.perf_counter() - st
+
+        if response is None:
+            for record in records:
+                self.stats.records_processing_failed += 1
+                self.destination.add_error(
+                    ERROR_PROCESSING_FAILED,
+                    make_error_record(
+                        record.data, record.arrived_at, "Lambda.FunctionError", error,
+                        attempts, now, self.lambda_arn,
+                    ),
+                    now,
+                )
+            return
+
+        for record, result in zip(records, response["records"]):
+            status = result["result"]
+            if status == "Ok":
+                self.stats.records_ok += 1
+                self.destination.add(base64.b64decode(result["data"]), now)
+            elif status == "Dropped":
+                self.stats.records_dropped += 1
+            else:
+                self.stats.records_processing_failed += 1
+                self.destination.add_error(
+                    ERROR_PROCESSING_FAILED,
+                    make_error_record(
+                        record.data, record.arrived_at, "Lambda.ProcessingFailed",
+                        "the lambda function returned ProcessingFailed",
+                        attempts, now, self.lambda_arn,
+                    ),
+                    now,
+                )
+
+    def tick(self, now: float, force: bool = False):
+        if self.processor_buffer.items and (force or self.processor_buffer.is_due(now)):
+            self._invoke(self.processor_buffer.drain(), now)
+        self.destination.tick(now, force=force)
+        if self.source_backup is not None:
+            self.source_backup.tick(now, force=force)
+
+    def summary(self) -> dict:
+        dct = attr.asdict(self.stats)
+        destinations = [self.destination]
+        if isinstance(self.destination, OpenSearchDestination):
+            destinations.append(self.destination.backup)
+        if self.source_backup is not None:
+            destinations.append(self.source_backup)
+        for destination in destinations:
+            for key in ["objects", "bytes_delivered", "docs_indexed", "docs_failed"]:
+                dct[key] += getattr(destination.stats, key)
+        return dct
+
+
+class FakeFirehoseClient:
+    """
+    The ``put_record_batch`` API of a Direct PUT delivery stream, backed by
+    :class:`DeliveryStreamSimulator`. It checks the ``PutRecordBatch`` limits
+    and, with ``max_records_per_sec``, fails the records over the limit with
+    ``ServiceUnavailableException`` like a throttled delivery stream.
+    """
+
+    def __init__(
+        self,
+        delivery_streams: List[DeliveryStreamSimulator],
+        clock: Callable[[], float],
+        max_records_per_sec: int = None,
+    ):
+        self.delivery_streams = {
+            delivery_stream.name: delivery_stream
+            for delivery_stream in delivery_streams
+        }
+        self.clock = clock
+        self.max_records_per_sec = max_records_per_sec
+        self._second = None
+        self._records_in_second = 0
+        self._lock = threading.Lock()
+        self._n_records = 0
+
+    def put_record_batch(self, DeliveryStreamName: str, Records: List[dict]) -> dict:
+        if DeliveryStreamName not in self.delivery_streams:
+            raise FakeClientError("ResourceNotFoundException", f"delivery stream {DeliveryStreamName} not found")
+        if len(Records) > 500:
+            raise FakeClientError("InvalidArgumentException", "more than 500 records")
+        if sum(len(record["Data"]) for record in Records) > 4 * MB:
+            raise FakeClientError("InvalidArgumentException", "more than 4 MiB")
+        delivery_stream = self.delivery_streams[DeliveryStreamName]
+        responses = list()
+        failed = 0
+        with self._lock:
+            now = self.clock()
+            second = int(now)
+            if second != self._second:
+                self._second, self._records_in_second = second, 0
+            for record in Records:
+                if (
+                    self.max_records_per_sec is not None
+                    and self._records_in_second >= self.max_records_per_sec
+                ):
+                    failed += 1
+                    responses.append({
+                        "ErrorCode": "ServiceUnavailableException",
+                        "ErrorMessage": "Slow down.",
+                    })
+                    continue
+                self._records_in_second += 1
+                self._n_records += 1
+                record_id = f"{self._n_records:020d}"
+                delivery_stream.put(
+                    SourceRecord(
+                        record_id=record_id,
+                        data=record["Data"],
+                        partition_key=None,
+                        sequence_number=None,
+                        shard_id=None,
+                        stream_arrived_at=None,
+                        arrived_at=to_ms(now),
+                    ),
+                    now,
+                )
+                responses.append({"RecordId": record_id})
+        return {
+            "FailedPutCount": failed,
+            "Encrypted": False,
+            "RequestResponses": responses,
+        }
+
+
+class PipelineSimulator:
+    """
+    Reads every shard of a fake kinesis stream, like the delivery stream
+    source, and feeds the records to the delivery streams. The delivery
+    streams with a ``source_stream_name`` read this stream instead.
+
+    :param kinesis_client: None for Direct PUT delivery streams fed by a
+        :class:`FakeFirehoseClient`, only the buffers are flushed.
+    """
+
+    def __init__(
+        self,
+        kinesis_client,
+        stream_name: str,
+        delivery_streams: List[DeliveryStreamSimulator],
+        clock: SimClock,
+    ):
+        self.kinesis_client = kinesis_client
+        self.stream_name = stream_name
+        self.delivery_streams = delivery_streams
+        self.clock = clock
+        # (stream name, shard id) -> shard iterator
+        self.shard_iterators: Dict[Tuple[str, str], Optional[str]] = dict()
+
+    def poll(self) -> int:
+        """
+        Read the new records of all shards.
+
+        :return: number of records read
+        """
+        n_records = 0
+        if self.kinesis_client is None:
+            return n_records
+        now = self.clock()
+        sources: Dict[str, List[DeliveryStreamSimulator]] = dict()
+        for delivery_stream in self.delivery_streams:
+            sources.setdefault(delivery_stream.source_stream_name or self.stream_name, list()).append(delivery_stream)
+        for stream_name, delivery_streams in sources.items():
+            shards = self.kinesis_client.list_shards(StreamName=stream_name)["Shards"]
+            for shard in shards:
+                shard_id = shard["ShardId"]
+                key = (stream_name, shard_id)
+                if key not in self.shard_iterators:
+                    self.shard_iterators[key] = self.kinesis_client.get_shard_iterator(
+                        StreamName=stream_name,
+                        ShardId=shard_id,
+                        ShardIteratorType="TRIM_HORIZON",
+                    )["ShardIterator"]
+                while self.shard_iterators[key] is not None:
+                    res = self.kinesis_client.get_records(ShardIterator=self.shard_iterators[key])
+                    self.shard_iterators[key] = res["NextShardIterator"]
+                    for kin_record in res["Records"]:
+                        record = SourceRecord(
+                            record_id=f"{shard_id}-{kin_record['SequenceNumber']}",
+                            data=kin_record["Data"],
+                            partition_key=kin_record["PartitionKey"],
+                            sequence_number=kin_record["SequenceNumber"],
+                            shard_id=shard_id,
+                            stream_arrived_at=to_ms(kin_record["ApproximateArrivalTimestamp"].timestamp()),
+                            arrived_at=to_ms(now),
+                        )
+                        for delivery_stream in delivery_streams:
+                            delivery_stream.put(record, now)
+                    n_records += len(res["Records"])
+                    if not res["Records"]:
+                        break
+        return n_records
+
+    def tick(self, force: bool = False):
+        now = self.clock()
+        for delivery_stream in self.delivery_streams:
+            delivery_stream.tick(now, force=force)
+
+    def advance(self, seconds: float, step: float = 1.0):
+        """
+        Move the simulated time forward, polling and flushing every ``step``.
+        """
+        end = self.clock() + seconds
+        while self.clock() < end:
+            self.clock.advance(min(step, end - self.clock()))
+            self.poll()
+            self.tick()
+
+    def drain(self):
+        """
+        Deliver everything, flushing all buffers no matter the hints.
+        """
+        self.poll()
+        self.tick(force=True)
+        # the flushed lambda output may have filled new buffers
+        self.tick(force=True)
+
+    def summary(self) -> Dict[str, dict]:
+        return {
+            delivery_stream.name: delivery_stream.summary()
+            for delivery_stream in self.delivery_streams
+        }
+
+
+def build_stack_simulator(
+    kinesis_client,
+    stream_name: str,
+    store,
+    oss: FakeOpenSearch,
+    clock: SimClock,
+    to_s3_handler: Callable = None,
+    to_oss_handler: Callable = None,
+    oss_index_name: str = "bank_account",
+    lambda_hints: BufferingHints = None,
+    destination_hints: BufferingHints = None,
+    backup_hints: BufferingHints = None,
+    fan_out: int = 1,
+) -> PipelineSimulator:
+    """
+    Build the simulator of the two delivery streams of ``Stack``, with the
+    same prefixes and buffering hints.
+
+    :param to_s3_handler: default to :func:`kds_example.lbd.to_s3.handler`.
+    :param to_oss_handler: default to :func:`kds_example.lbd.to_oss.handler`.
+    :param lambda_hints: override the lambda processor buffering hints.
+    :param destination_hints: override the destination buffering hints.
+    :param backup_hints: override the S3 backup buffering hints.
+    :param fan_out: number of data streams ``{stream_name}-{i:02d}of{n:02d}``,
+        each read by a "to-s3" and a "to-oss" delivery stream, see
+        :mod:`kds_example.fan_out`.
+    """
+    from .fan_out import fan_out_name, fan_out_prefix
+
+    if to_s3_handler is None:
+        from .lbd.to_s3 import handler as to_s3_handler
+    if to_oss_handler is None:
+        from .lbd.to_oss import handler as to_oss_handler
+    lambda_hints = lambda_hints or BufferingHints(size_in_mb=3, interval_in_sec=60)
+    destination_hints = destination_hints or BufferingHints(size_in_mb=5, interval_in_sec=60)
+    backup_hints = backup_hints or BufferingHints(size_in_mb=5, interval_in_sec=60)
+
+    to_s3 = [
+        DeliveryStreamSimulator(
+            name=fan_out_name("to-s3", i, fan_out),
+            destination=S3Destination(
+                store,
+                fan_out_prefix("to-s3/03-success/", i, fan_out),
+                fan_out_prefix("to-s3/04-failed/", i, fan_out),
+                destination_hints,
+            ),
+            processor=to_s3_handler,
+            processor_hints=lambda_hints,
+            number_of_retries=1,
+            source_backup=S3Destination(
+                store,
+                fan_out_prefix("to-s3/01-backup/", i, fan_out),
+                fan_out_prefix("to-s3/02-backup-failed/", i, fan_out),
+                backup_hints,
+            ),
+            source_stream_name=fan_out_name(stream_name, i, fan_out),
+        )
+        for i in range(fan_out)
+    ]
+    to_oss = [
+        DeliveryStreamSimulator(
+            name=fan_out_name("to-oss", i, fan_out),
+            destination=OpenSearchDestination(
+                oss,
+                oss_index_name,
+                backup=S3Destination(
+                    store,
+                    fan_out_prefix("to-oss/01-backup/", i, fan_out),
+                    fan_out_prefix("to-oss/02-backup-failed/", i, fan_out),
+                    backup_hints,
+                ),
+                hints=destination_hints,
+            ),
+            processor=to_oss_handler,
+            processor_hints=lambda_hints,
+            number_of_retries=1,
+            source_stream_name=fan_out_name(stream_name, i, fan_out),
+        )
+        for i in range(fan_out)
+    ]
+    return PipelineSimulator(kinesis_client, stream_name, to_s3 + to_oss, clock)
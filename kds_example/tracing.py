@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+"""
+End to end latency tracing of records.
+
+A producer stamps a sample of the records with a ``trace`` field::
+
+    {"id": "...", ..., "trace": {"id": "<trace id>", "produced_at": 1650000000000}}
+
+then every hop adds its own epoch millisecond timestamp:
+
+- ``arrived_at``: arrival in the kinesis data stream and ``read_at``:
+  arrival in the delivery stream, from the ``approximateArrivalTimestamp``
+  of the firehose transformation event.
+- ``transformed_at``: the transformation lambda is done with the record.
+- ``indexed_at``: set by the ``kds-trace`` OpenSearch ingest pipeline, the
+  default pipeline of the ``bank_account`` index.
+- ``delivered_at``: for S3 it is the ``LastModified`` of the object, added
+  by the reconciler as S3 has no per record time.
+
+The reconciler reads traced records back from S3 and OpenSearch and
+computes the latency percentiles of each hop, see :func:`hop_latencies`.
+"""
+
+import gzip
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import List, Dict, Tuple, Iterable, Optional
+
+from .load_test.histogram import Histogram
+
+TRACE_FIELD = "trace"
+TRACE_PIPELINE_NAME = "kds-trace"
+
+# (hop name, from timestamp, to timestamp), in order
+HOPS: List[Tuple[str, str, str]] = [
+    ("producer_to_stream", "produced_at", "arrived_at"),
+    ("stream_to_firehose", "arrived_at", "read_at"),
+    ("firehose_to_transformed", "read_at", "transformed_at"),
+    ("transformed_to_delivered", "transformed_at", "delivered_at"),
+    ("end_to_end", "produced_at", "delivered_at"),
+]
+
+trace_mapping = {
+    "properties": {
+        "id": {"type": "keyword"},
+        "produced_at": {"type": "date", "format": "epoch_millis"},
+        "arrived_at": {"type": "date", "format": "epoch_millis"},
+        "read_at": {"type": "date", "format": "epoch_millis"},
+        "transformed_at": {"type": "date", "format": "epoch_millis"},
+        "indexed_at": {"type": "date"},
+    }
+}
+
+trace_ingest_pipeline_body = {
+    "description": "stamp the index time of traced records",
+    "processors": [
+        {
+            "set": {
+                "if": f"ctx.{TRACE_FIELD} != null",
+                "field": f"{TRACE_FIELD}.indexed_at",
+                "value": "{{_ingest.timestamp}}",
+            }
+        }
+    ],
+}
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def new_trace(trace_id: str = None, now: int = None) -> dict:
+    return {
+        "id": trace_id or uuid.uuid4().hex,
+        "produced_at": now_ms() if now is None else now,
+    }
+
+
+def stamp(record: dict, trace_id: str = None, now: int = None) -> dict:
+    """
+    Add a new trace to a record, in place.
+    """
+    record[TRACE_FIELD] = new_trace(trace_id, now)
+    return record
+
+
+def stamp_data(data: bytes, trace_id: str = None, now: int = None) -> bytes:
+    """
+    Add a new trace to an already encoded NDJSON record without parsing it,
+    for pre-encoded records, see :mod:`kds_example.load_test.corpus`.
+    """
+    end = data.rstrip().rindex(b"}")
+    trace = json.dumps(new_trace(trace_id, now)).encode("utf-8")
+    return data[:end] + b', "' + TRACE_FIELD.encode("utf-8") + b'": ' + trace + data[end:]
+
+
+def stamp_transformed(record: dict, event_record: dict, now: int = None) -> dict:
+    """
+    Add the delivery stream timestamps of a traced record, in place. Records
+    without a trace are left as is.
+    """
+    trace = record.get(TRACE_FIELD)
+    if not isinstance(trace, dict):
+        return record
+    kinesis_metadata = event_record.get("kinesisRecordMetadata")
+    if kinesis_metadata is not None:
+        trace["arrived_at"] = kinesis_metadata.get("approximateArrivalTimestamp")
+    trace["read_at"] = event_record.get("approximateArrivalTimestamp")
+    trace["transformed_at"] = now_ms() if now is None else now
+    return record
+
+
+def to_epoch_ms(value) -> Optional[int]:
+    """
+    Convert an epoch millisecond number, an ISO 8601 string or a datetime.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return int(value.timestamp() * 1000)
+
+
+def iter_s3_traces(
+    s3_client,
+    bucket: str,
+    prefix: str,
+    max_objects: int = None,
+) -> Iterable[dict]:
+    """
+    Yield the traces of the records in the firehose output objects under a
+    prefix, with ``delivered_at`` set to the ``LastModified`` of the object.
+    """
+    paginator = s3_client.get_paginator("list_objects_v2")
+    n_objects = 0
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if max_objects is not None and n_objects >= max_objects:
+                return
+            n_objects += 1
+            body = s3_client.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read()
+            if body[:2] == b"\x1f\x8b":
+                body = gzip.decompress(body)
+            delivered_at = to_epoch_ms(obj["LastModified"])
+            for line in body.splitlines():
+                if TRACE_FIELD.encode("utf-8") not in line:
+                    continue
+                trace = json.loads(line).get(TRACE_FIELD)
+                if isinstance(trace, dict):
+                    trace["delivered_at"] = delivered_at
+                    yield trace
+
+
+def iter_oss_traces(
+    oss,
+    index: str,
+    since: int = None,
+    size: int = 1000,
+) -> Iterable[dict]:
+    """
+    Yield the traces of the documents in an index, with ``delivered_at`` set
+    to ``indexed_at``.
+
+    :param since: only documents produced after this epoch millisecond.
+    """
+    from opensearchpy import helpers
+
+    filters = [{"exists": {"field": f"{TRACE_FIELD}.id"}}]
+    if since is not None:
+        filters.append({"range": {f"{TRACE_FIELD}.produced_at": {"gte": since}}})
+    query = {
+        "query": {"bool": {"filter": filters}},
+        "_source": [TRACE_FIELD],
+    }
+    for hit in helpers.scan(oss, index=index, query=query, size=size):
+        trace = hit["_source"][TRACE_FIELD]
+        trace["delivered_at"] = to_epoch_ms(trace.get("indexed_at"))
+        yield trace
+
+
+def hop_latencies(traces: Iterable[dict]) -> Dict[str, Histogram]:
+    """
+    Compute the latency histogram in milliseconds of each hop in :data:`HOPS`,
+    hops with a missing timestamp are skipped.
+
+    :return: ``{hop name: Histogram}``
+    """
+    histograms = {name: Histogram() for name, _, _ in HOPS}
+    for trace in traces:
+        for name, start, end in HOPS:
+            start_at, end_at = trace.get(start), trace.get(end)
+            if start_at is not None and end_at is not None:
+                # clocks of different hosts may drift a little
+                histograms[name].record(max(0, end_at - start_at))
+    return histograms
+
+
+def summarize(traces: Iterable[dict]) -> Dict[str, dict]:
+    """
+    Latency summary in milliseconds of each hop, see
+    :meth:`~kds_example.load_test.histogram.Histogram.summary`.
+    """
+    return {
+        name: histogram.summary()
+        for name, histogram in hop_latencies(traces).items()
+    }
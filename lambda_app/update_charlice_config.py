@@ -12,13 +12,23 @@ chalice_config = {
     "app_name": config.chalice_app_name,
     "stages": {
         "dev": {
-            "lambda_memory_size": 512,
+            "lambda_memory_size": config.lambda_memory_size,
             "lambda_timeout": 120, # it has to longer than 60 seconds, the minimal kinesis buffer hint time
             "manage_iam_role": False,
             "iam_role_arn": f"arn:aws:iam::{aws_account_id}:role/{stack.iam_role_name_for_lbd}",
             "layers": [
                 f"arn:aws:lambda:{aws_region}:{aws_account_id}:layer:{config.project_name_slug}:1"
             ],
+            "environment_variables": {
+                "KDS_DEDUP_ENABLED": "true",
+                # stage timings are part of the EMF metrics
+                "KDS_LOG_STAGE_TIMINGS": "false",
+                "KDS_METRICS_ENABLED": "true",
+                # flame graphs of 1 in 100 invocations, when turned on
+                "KDS_PROFILE_ENABLED": "false",
+                "KDS_PROFILE_SAMPLE_ONE_IN": "100",
+                "KDS_PROFILE_OUTPUT": "/tmp/kds_profiles",
+            },
         }
     }
 }
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import json
+from types import SimpleNamespace
+
+import pytest
+from opensearchpy.serializer import JSONSerializer
+from kds_example.schema import bank_account_index_body
+from kds_example.fake_kinesis import FakeKinesisClient
+from kds_example.object_store import InMemoryObjectStore
+from kds_example.simulator import SimClock, BufferingHints, FakeOpenSearch, build_stack_simulator
+from kds_example.backfill import BACKUP_PREFIX, make_backfill_engine, bulk_load_settings, backfill_to_new_index
+
+
+class FakeOpenSearchSink:
+    def __init__(self, oss: FakeOpenSearch, index: str, fail_times: int = 0):
+        self.oss = oss
+        self.index = index
+        self.fail_times = fail_times
+
+    def write(self, records):
+        if self.fail_times:
+            self.fail_times -= 1
+            return len(records)
+        return sum(error is not None for error in self.oss.bulk_index(self.index, records))
+
+
+def make_backup(n_records: int) -> InMemoryObjectStore:
+    clock = SimClock(start=1650000000)
+    client = FakeKinesisClient(clock=clock)
+    client.create_stream(StreamName="s", ShardCount=2)
+    client.put_records(StreamName="s", Records=[
+        {
+            "Data": (json.dumps({"id": str(i), "firstname": "A", "lastname": "B", "balance": i}) + "\n").encode("utf-8"),
+            "PartitionKey": str(i),
+        }
+        for i in range(n_records)
+    ])
+    store = InMemoryObjectStore()
+    sim = build_stack_simulator(
+        client, "s", store, FakeOpenSearch(), clock,
+        backup_hints=BufferingHints(size_in_mb=0.002, interval_in_sec=60),
+    )
+    sim.drain()
+    return store
+
+
+def test_backfill(tmp_path):
+    store = make_backup(n_records=200)
+    keys = store.list_keys(BACKUP_PREFIX)
+    assert len(keys) > 2
+
+    manifest_path = str(tmp_path / "manifest.txt")
+    oss = FakeOpenSearch()
+    # the first object fails to index, it is not in the manifest
+    engine = make_backfill_engine(
+        store, FakeOpenSearchSink(oss, "bank_account", fail_times=1),
+        manifest_path=manifest_path, n_workers=2, max_in_flight=2, batch_size=50,
+    )
+    stats = engine.run_prefix(BACKUP_PREFIX)
+    assert stats.objects_failed == 1
+    assert stats.objects == len(keys) - 1
+
+    # the rerun only processes the failed object
+    engine = make_backfill_engine(
+        store, FakeOpenSearchSink(oss, "bank_account"), manifest_path=manifest_path,
+    )
+    stats = engine.run_prefix(BACKUP_PREFIX)
+    assert stats.objects == 1
+    assert stats.objects_skipped == len(keys) - 1
+    assert oss.count("bank_account") == 200
+    assert stats.records_per_sec > 0
+
+
+class FakeIndices:
+    def __init__(self):
+        self.settings = {
+            "bank_account-1": {"refresh_interval": "1s", "number_of_replicas": "2"},
+            "bank_account-2": {"refresh_interval": "5s", "number_of_replicas": "2"},
+        }
+        self.aliases = {"bank_account": {"bank_account-1": False, "bank_account-2": True}}
+        self.docs = {"bank_account-1": dict(), "bank_account-2": dict()}
+        self.refreshed = list()
+
+    def exists(self, index):
+        return index in self.docs
+
+    def create(self, index, body):
+        self.docs[index] = dict()
+        self.settings[index] = {"refresh_interval": "1s", "number_of_replicas": "1"}
+
+    def delete(self, index, ignore=None):
+        self.docs.pop(index, None)
+
+    def update_aliases(self, body):
+        for action in body["actions"]:
+            (op, params), = action.items()
+            if op == "add":
+                self.aliases[params["alias"]][params["index"]] = params["is_write_index"]
+            else:
+                del self.aliases[params["alias"]][params["index"]]
+
+    def exists_alias(self, name):
+        return name in self.aliases
+
+    def get_alias(self, name):
+        return {
+            index: {"aliases": {name: {"is_write_index": is_write}}}
+            for index, is_write in self.aliases[name].items()
+        }
+
+    def get_settings(self, index):
+        return {index: {"settings": {"index": dict(self.settings[index])}}}
+
+    def put_settings(self, index, body):
+        self.settings[index].update(body["index"])
+
+    def refresh(self, index):
+        self.refreshed.append(index)
+
+
+class FakeOpenSearchClient:
+    def __init__(self, fail_ids=()):
+        self.indices = FakeIndices()
+        self.transport = SimpleNamespace(serializer=JSONSerializer())
+        self.fail_ids = set(fail_ids)
+
+    def bulk(self, body, **kwargs):
+        lines = body.splitlines()
+        items = list()
+        for action, doc in zip(lines[::2], lines[1::2]):
+            params = json.loads(action)["index"]
+            if params["_id"] in self.fail_ids:
+                items.append({"index": {"_id": params["_id"], "status": 400, "error": "mapper_parsing_exception"}})
+                continue
+            self.indices.docs[params["_index"]][params["_id"]] = json.loads(doc)
+            items.append({"index": {"_id": params["_id"], "status": 201}})
+        return {"errors": any(item["index"]["status"] >= 300 for item in items), "items": items}
+
+
+def test_bulk_load_settings_alias():
+    oss = FakeOpenSearchClient()
+    with bulk_load_settings(oss, "bank_account"):
+        # the write index behind the alias is changed, not the others
+        assert oss.indices.settings["bank_account-2"] == {"refresh_interval": "-1", "number_of_replicas": 0}
+        assert oss.indices.settings["bank_account-1"]["number_of_replicas"] == "2"
+    assert oss.indices.settings["bank_account-2"] == {"refresh_interval": "5s", "number_of_replicas": "2"}
+    assert oss.indices.refreshed == ["bank_account-2"]
+
+
+def test_backfill_to_new_index(tmp_path):
+    store = make_backup(n_records=50)
+    oss = FakeOpenSearchClient()
+    # a document indexed by firehose, with a generated id
+    oss.indices.docs["bank_account-2"]["generated-id"] = {"id": "0"}
+
+    manifest_path = str(tmp_path / "manifest.txt")
+    index, old_indices, stats, thread = backfill_to_new_index(
+        oss, "bank_account", bank_account_index_body, store,
+        index="bank_account-3", manifest_path=manifest_path, n_workers=2,
+    )
+    thread.join()
+    assert old_indices == ["bank_account-1", "bank_account-2"]
+    assert oss.indices.aliases["bank_account"] == {"bank_account-3": True}
+    assert sorted(oss.indices.docs) == ["bank_account-3"]
+    # one document per record, not a second copy of the firehose ones
+    assert len(oss.indices.docs["bank_account-3"]) == 50
+    assert stats.records_written == 50
+    # the bulk load settings are restored
+    assert oss.indices.settings["bank_account-3"] == {"refresh_interval": "1s", "number_of_replicas": "1"}
+
+
+def test_backfill_to_new_index_failed_documents():
+    store = make_backup(n_records=20)
+    oss = FakeOpenSearchClient(fail_ids={"3"})
+    with pytest.raises(RuntimeError):
+        backfill_to_new_index(oss, "bank_account", bank_account_index_body, store, index="bank_account-3")
+    # the alias is not moved
+    assert "bank_account-3" not in oss.indices.aliases["bank_account"]
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
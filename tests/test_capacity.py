@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from kds_example.capacity import (
+    DeliveryStreamLimits, plan_fan_out, ingestion_cost_per_gb,
+    KINESIS_STREAM_AS_SOURCE, DIRECT_PUT,
+)
+
+
+def test_plan_fan_out():
+    plan = plan_fan_out(3.0, n_shards=10)
+    assert plan.fan_out == 1
+    assert plan.n_readers == 2
+    assert plan.shards_for_write == 4
+    assert plan.shards_for_read == 4
+    assert plan.warnings == []
+
+    plan = plan_fan_out(12.0, n_shards=10)
+    assert plan.fan_out == 3
+    # each data stream carries a third of the load and has 2 readers
+    assert plan.per_data_stream_mb_per_sec == 4.0
+    assert plan.n_readers == 2
+    assert plan.n_shards_per_stream == 6
+    assert plan.n_shards == 18
+    assert plan.warnings == []
+    assert plan.to_dict()["n_shards"] == 18
+
+    plan = plan_fan_out(12.0, n_shards=4)
+    assert len(plan.warnings) == 1
+
+
+def test_plan_fan_out_lambda_bound():
+    limits = DeliveryStreamLimits(lambda_buffer_mb=3, lambda_duration_sec=2.0)
+    plan = plan_fan_out(3.0, limits=limits)
+    assert plan.per_delivery_stream_mb_per_sec == 1.5
+    assert plan.fan_out == 3
+    assert plan.n_shards_per_stream == 2
+    assert "bottleneck" in plan.warnings[-1]
+
+
+def test_plan_fan_out_small_records():
+    # 100 bytes records hit the 1000 records / sec shard limit first
+    plan = plan_fan_out(1.0, record_size=100)
+    assert plan.shards_for_write == 14
+
+
+def test_ingestion_cost_per_gb():
+    direct = ingestion_cost_per_gb(1.0, record_size=5 * 1024, source=DIRECT_PUT, n_destinations=1)
+    assert list(direct) == ["firehose_ingestion", "total"]
+    assert direct["total"] == pytest.approx(0.029)
+    # 1 KB records are billed as 5 KB
+    direct = ingestion_cost_per_gb(1.0, record_size=1024, source=DIRECT_PUT, n_destinations=1)
+    assert direct["total"] == pytest.approx(0.145)
+
+    kds = ingestion_cost_per_gb(1.0, record_size=5 * 1024, source=KINESIS_STREAM_AS_SOURCE, n_destinations=1)
+    assert kds["total"] > direct["total"] / 5
+    assert kds["kds_shard_hours"] > 0
+
+    with pytest.raises(ValueError):
+        ingestion_cost_per_gb(1.0, source="Unknown")
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from kds_example import codec
+
+
+def test_compress():
+    data = b'{"id": 1, "description": "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa"}\n'
+    compressed = codec.compress(data)
+    assert codec.is_compressed(compressed)
+    assert not codec.is_aggregated(compressed)
+    assert codec.decompress(compressed) == data
+    # the same data gives the same bytes
+    assert codec.compress(data) == compressed
+    # plain payloads pass through
+    assert codec.decompress(data) == data
+    assert codec.unpack_records(data) == [data]
+
+    with pytest.raises(ValueError):
+        codec.compress(data, codec="lz4")
+    with pytest.raises(ValueError):
+        codec.decompress(b"KC\x09\x00")
+
+
+def test_pack_records():
+    lines = [f'{{"id": {i}}}\n'.encode("utf-8") for i in range(100)]
+    packed = codec.pack_records(lines)
+    assert codec.is_aggregated(packed)
+    assert len(packed) < sum(len(line) for line in lines)
+    assert codec.unpack_records(packed) == lines
+
+
+@pytest.mark.skipif(codec.zstandard is None, reason="zstandard is not installed")
+def test_zstd():
+    lines = [f'{{"id": {i}}}\n'.encode("utf-8") for i in range(100)]
+    assert codec.unpack_records(codec.pack_records(lines, codec=codec.ZSTD)) == lines
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
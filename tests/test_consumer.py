@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import threading
+import pytest
+from kds_example.fake_kinesis import FakeKinesisClient, MAX_HASH_KEY
+from kds_example.consumer import (
+    SHARD_END, Lease, InMemoryLeaseTable, plan_lease_actions, AdaptivePoller, Worker,
+)
+
+
+def test_plan_lease_actions():
+    now = 100.0
+    leases = [
+        Lease(shard_id=f"s{i}", owner="a", expire_at=200.0)
+        for i in range(4)
+    ]
+    # a new worker takes nothing expired, so it steals one from "a"
+    to_take = plan_lease_actions(leases, "b", now)
+    assert [lease.shard_id for lease in to_take] == ["s0"]
+
+    # expired leases are taken first, then one is stolen to reach the target
+    leases[3].expire_at = 50.0
+    to_take = plan_lease_actions(leases, "b", now)
+    assert [lease.shard_id for lease in to_take] == ["s3", "s0"]
+
+    # balanced, nothing to do
+    leases = [
+        Lease(shard_id="s0", owner="a", expire_at=200.0),
+        Lease(shard_id="s1", owner="b", expire_at=200.0),
+    ]
+    assert plan_lease_actions(leases, "b", now) == []
+
+    # child shards wait for their parents
+    leases = [
+        Lease(shard_id="s0", owner="a", expire_at=200.0),
+        Lease(shard_id="s1", parent_shard_ids=["s0"]),
+    ]
+    assert plan_lease_actions(leases, "b", now) == []
+    leases[0].checkpoint = SHARD_END
+    to_take = plan_lease_actions(leases, "b", now)
+    assert [lease.shard_id for lease in to_take] == ["s1"]
+
+
+def test_adaptive_poller():
+    poller = AdaptivePoller(limit=1000)
+    poller.update(n_records=1000, millis_behind_latest=60000)
+    assert poller.limit == 2000
+    assert poller.interval == poller.min_interval
+
+    poller.update(n_records=10, millis_behind_latest=0)
+    assert poller.limit == poller.min_limit
+    poller.update(n_records=0, millis_behind_latest=0)
+    assert poller.interval > poller.min_interval
+
+
+def put(client, stream_name, n, offset=0):
+    client.put_records(
+        StreamName=stream_name,
+        Records=[
+            {
+                "Data": json.dumps({"id": i}).encode("utf-8"),
+                "PartitionKey": str(i % 7),
+            }
+            for i in range(offset, offset + n)
+        ],
+    )
+
+
+def test_worker_end_to_end_with_resharding():
+    stream_name = "test-stream"
+    client = FakeKinesisClient()
+    client.create_stream(StreamName=stream_name, ShardCount=2)
+    put(client, stream_name, 100)
+    client.split_shard(
+        StreamName=stream_name,
+        ShardToSplit="shardId-000000000000",
+        NewStartingHashKey=str(MAX_HASH_KEY // 4),
+    )
+    put(client, stream_name, 100, offset=100)
+
+    received = list()
+    lock = threading.Lock()
+
+    def processor(shard_id, records):
+        with lock:
+            received.extend([json.loads(record["Data"])["id"] for record in records])
+
+    lease_table = InMemoryLeaseTable()
+    workers = [
+        Worker(
+            kinesis_client=client,
+            stream_name=stream_name,
+            lease_table=lease_table,
+            record_processor=processor,
+            worker_id=worker_id,
+            poller_factory=lambda: AdaptivePoller(interval=0.0, min_interval=0.0, max_interval=0.0),
+        )
+        for worker_id in ["host-1", "host-2"]
+    ]
+    deadline = time.time() + 10
+    while len(set(received)) < 200 and time.time() < deadline:
+        for worker in workers:
+            worker.run_once()
+        time.sleep(0.01)
+    for worker in workers:
+        worker.stop()
+
+    # at least once, a stolen lease may replay its last uncheckpointed batch
+    assert set(received) == set(range(200))
+    leases = {lease.shard_id: lease for lease in lease_table.list_leases()}
+    assert len(leases) == 4
+    assert leases["shardId-000000000000"].checkpoint == SHARD_END
+    # leases are only held by the two hosts
+    assert {lease.owner for lease in leases.values()} <= {"host-1", "host-2", None}
+
+
+def test_worker_processor_error(capsys):
+    stream_name = "test-stream"
+    client = FakeKinesisClient()
+    client.create_stream(StreamName=stream_name, ShardCount=1)
+    put(client, stream_name, 10)
+
+    received = list()
+    calls = list()
+
+    def processor(shard_id, records):
+        calls.append(len(records))
+        if len(calls) == 1:
+            raise ValueError("bad batch")
+        received.extend([json.loads(record["Data"])["id"] for record in records])
+
+    worker = Worker(
+        kinesis_client=client,
+        stream_name=stream_name,
+        lease_table=InMemoryLeaseTable(),
+        record_processor=processor,
+        worker_id="host-1",
+        poller_factory=lambda: AdaptivePoller(interval=0.0, min_interval=0.0, max_interval=0.0),
+    )
+    deadline = time.time() + 10
+    while len(received) < 10 and time.time() < deadline:
+        worker.run_once()
+        time.sleep(0.01)
+    worker.stop()
+
+    # the failed consumer is reported, then restarted from the checkpoint
+    assert worker.n_shard_errors == 1
+    assert "ValueError: bad batch" in capsys.readouterr().out
+    assert sorted(received) == list(range(10))
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
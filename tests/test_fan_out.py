@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from kds_example.kds_helper import FanOutKinesisClient, make_fan_out_client
+from kds_example.fan_out import (
+    fan_out_name, fan_out_names, fan_out_prefix, parse_fan_out_name,
+    fan_out_index, route_records,
+)
+
+
+def test_naming():
+    assert fan_out_name("kds-example-to-s3", 0, 1) == "kds-example-to-s3"
+    assert fan_out_name("kds-example-to-s3", 2, 4) == "kds-example-to-s3-02of04"
+    assert fan_out_names("s", 2) == ["s-00of02", "s-01of02"]
+    assert fan_out_prefix("to-s3/03-success/", 0, 1) == "to-s3/03-success/"
+    assert fan_out_prefix("to-s3/03-success/", 2, 4) == "to-s3/03-success/02/"
+    assert parse_fan_out_name("arn:aws:firehose:us-east-1:111122223333:deliverystream/kds-example-to-s3-02of04") == (2, 4)
+    assert parse_fan_out_name("kds-example-to-s3") is None
+
+
+def test_fan_out_index():
+    assert fan_out_index("id-1", 1) == 0
+    indexes = [fan_out_index(f"id-{i}", 4) for i in range(1000)]
+    # stable and spread over every data stream
+    assert indexes == [fan_out_index(f"id-{i}", 4) for i in range(1000)]
+    assert set(indexes) == {0, 1, 2, 3}
+    assert min(indexes.count(i) for i in range(4)) > 150
+
+    kin_records = [{"Data": b"", "PartitionKey": f"id-{i}"} for i in range(20)]
+    routes = route_records(kin_records, 3)
+    assert sorted(p for positions in routes.values() for p in positions) == list(range(20))
+    for index, positions in routes.items():
+        assert all(fan_out_index(kin_records[p]["PartitionKey"], 3) == index for p in positions)
+
+
+class FakeKinesisClient:
+    def __init__(self):
+        self.calls = list()
+
+    def put_records(self, Records, StreamName):
+        self.calls.append((StreamName, [r["PartitionKey"] for r in Records]))
+        results = [
+            {"ErrorCode": "ProvisionedThroughputExceededException", "ErrorMessage": "slow down"}
+            if r["PartitionKey"] == "id-0" else
+            {"SequenceNumber": "1", "ShardId": StreamName}
+            for r in Records
+        ]
+        return {
+            "FailedRecordCount": sum("ErrorCode" in result for result in results),
+            "Records": results,
+        }
+
+    def describe_stream(self, StreamName):
+        return {"StreamDescription": {"StreamName": StreamName}}
+
+
+def test_fan_out_kinesis_client():
+    fake = FakeKinesisClient()
+    assert make_fan_out_client(fake, 1) is fake
+
+    client = make_fan_out_client(fake, 2)
+    assert isinstance(client, FanOutKinesisClient)
+    kin_records = [{"Data": b"", "PartitionKey": f"id-{i}"} for i in range(10)]
+    res = client.put_records(Records=kin_records, StreamName="s")
+
+    # one call per data stream, the results in the order of the records
+    assert sorted(name for name, _ in fake.calls) == ["s-00of02", "s-01of02"]
+    assert res["FailedRecordCount"] == 1
+    assert len(res["Records"]) == 10
+    for kin_record, result in zip(kin_records, res["Records"]):
+        if kin_record["PartitionKey"] == "id-0":
+            assert result["ErrorCode"] == "ProvisionedThroughputExceededException"
+        else:
+            assert result["ShardId"] == fan_out_name("s", fan_out_index(kin_record["PartitionKey"], 2), 2)
+
+    # the other calls go to the wrapped client
+    assert client.describe_stream(StreamName="x")["StreamDescription"]["StreamName"] == "x"
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
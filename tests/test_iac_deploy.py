@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from kds_example.fake_kinesis import FakeClientError
+from kds_example.iac.deploy import (
+    diff_templates, split_template, plan_waves, resource_timings, deploy_template, deploy_groups,
+)
+
+TEMPLATE = {
+    "AWSTemplateFormatVersion": "2010-09-09",
+    "Resources": {
+        "Bucket": {"Type": "AWS::S3::Bucket", "Properties": {"BucketName": "data"}},
+        "Role": {"Type": "AWS::IAM::Role", "Properties": {"RoleName": "firehose"}},
+        "Domain": {"Type": "AWS::OpenSearchService::Domain", "Properties": {}},
+        "Stream": {"Type": "AWS::Kinesis::Stream", "Properties": {"ShardCount": 10}},
+        "ToS3": {
+            "Type": "AWS::KinesisFirehose::DeliveryStream",
+            "Properties": {
+                "StreamArn": {"Fn::GetAtt": ["Stream", "Arn"]},
+                "RoleArn": {"Fn::GetAtt": ["Role", "Arn"]},
+                "Bucket": {"Ref": "Bucket"},
+                "Region": {"Ref": "AWS::Region"},
+            },
+            "DependsOn": ["Role", "Stream"],
+        },
+        "ToOss": {
+            "Type": "AWS::KinesisFirehose::DeliveryStream",
+            "Properties": {
+                "StreamArn": {"Fn::GetAtt": ["Stream", "Arn"]},
+                "DomainArn": {"Fn::GetAtt": ["Domain", "DomainArn"]},
+            },
+        },
+        "ToOssPermission": {
+            "Type": "AWS::Lambda::Permission",
+            "Properties": {"SourceArn": {"Fn::GetAtt": ["ToOss", "Arn"]}},
+        },
+    },
+}
+
+GROUPS = {
+    "RG1": ["Bucket"],
+    "RG2": ["Role"],
+    "RG3": ["Domain"],
+    "RG4": ["Stream"],
+    "RG5": ["ToS3"],
+    "RG6": ["ToOss", "ToOssPermission"],
+}
+
+
+def test_diff_templates():
+    new = json.loads(json.dumps(TEMPLATE))
+    assert not any(diff_templates(TEMPLATE, new).values())
+    new["Resources"]["Stream"]["Properties"]["ShardCount"] = 20
+    del new["Resources"]["Domain"]
+    new["Resources"]["Table"] = {"Type": "AWS::DynamoDB::Table"}
+    assert diff_templates(TEMPLATE, new) == {
+        "added": ["Table"], "removed": ["Domain"], "modified": ["Stream"],
+    }
+
+
+def test_split_template():
+    templates, depends_on = split_template(TEMPLATE, GROUPS, prefix="app")
+    assert depends_on["RG5"] == {"RG1", "RG2", "RG4"}
+    assert depends_on["RG6"] == {"RG3", "RG4"}
+    assert plan_waves(depends_on) == [["RG1", "RG2", "RG3", "RG4"], ["RG5", "RG6"]]
+
+    to_s3 = templates["RG5"]["Resources"]["ToS3"]
+    assert "DependsOn" not in to_s3
+    assert to_s3["Properties"]["StreamArn"] == {"Fn::ImportValue": "app-StreamArn"}
+    assert to_s3["Properties"]["Bucket"] == {"Fn::ImportValue": "app-Bucket"}
+    assert to_s3["Properties"]["Region"] == {"Ref": "AWS::Region"}
+    assert templates["RG4"]["Outputs"]["StreamArn"] == {
+        "Value": {"Fn::GetAtt": ["Stream", "Arn"]},
+        "Export": {"Name": "app-StreamArn"},
+    }
+    # references within a group are kept
+    permission = templates["RG6"]["Resources"]["ToOssPermission"]
+    assert permission["Properties"]["SourceArn"] == {"Fn::GetAtt": ["ToOss", "Arn"]}
+
+    with pytest.raises(ValueError):
+        split_template(TEMPLATE, {"RG1": ["Bucket"]}, prefix="app")
+    with pytest.raises(ValueError):
+        plan_waves({"a": {"b"}, "b": {"a"}})
+
+
+T0 = datetime(2022, 4, 15, tzinfo=timezone.utc)
+
+
+def event(logical_id: str, status: str, seconds: float, resource_type: str = "AWS::Kinesis::Stream") -> dict:
+    return {
+        "LogicalResourceId": logical_id,
+        "ResourceType": resource_type,
+        "ResourceStatus": status,
+        "Timestamp": T0 + timedelta(seconds=seconds),
+    }
+
+
+def test_resource_timings():
+    timings = resource_timings([
+        event("Old", "UPDATE_IN_PROGRESS", 0),
+        event("Old", "UPDATE_COMPLETE", 5),
+        event("Stream", "UPDATE_IN_PROGRESS", 10),
+        event("Domain", "UPDATE_IN_PROGRESS", 11),
+        event("Stream", "UPDATE_COMPLETE", 20),
+        event("Domain", "UPDATE_COMPLETE", 611),
+        event("app", "UPDATE_COMPLETE", 612, "AWS::CloudFormation::Stack"),
+    ], since=T0 + timedelta(seconds=5))
+    assert [(t.logical_id, t.seconds) for t in timings] == [("Domain", 600), ("Stream", 10)]
+
+
+class FakeCloudFormationClient:
+    """
+    Change set based create / update, each resource takes one second.
+    """
+
+    def __init__(self, no_changes_reason: str = None):
+        self.stacks = dict()
+        self.change_sets = dict()
+        self.executed = list()
+        self.no_changes_reason = no_changes_reason
+        self._lock = threading.Lock()
+
+    def describe_stacks(self, StackName):
+        if StackName not in self.stacks:
+            raise FakeClientError("ValidationError", f"Stack with id {StackName} does not exist")
+        stack = self.stacks[StackName]
+        return {"Stacks": [{"StackName": StackName, "StackStatus": stack["status"]}]}
+
+    def get_template(self, StackName, TemplateStage):
+        return {"TemplateBody": self.stacks[StackName]["template"]}
+
+    def create_change_set(self, StackName, ChangeSetName, ChangeSetType, Capabilities, TemplateBody):
+        with self._lock:
+            if ChangeSetType == "CREATE":
+                assert StackName not in self.stacks
+                self.stacks[StackName] = {"status": "REVIEW_IN_PROGRESS", "template": None, "events": []}
+            change_set_id = f"{StackName}/{ChangeSetName}"
+            self.change_sets[change_set_id] = {"polls": 1, "template": json.loads(TemplateBody)}
+        return {"Id": change_set_id}
+
+    def describe_change_set(self, ChangeSetName, StackName):
+        change_set = self.change_sets[ChangeSetName]
+        change_set["polls"] -= 1
+        if change_set["polls"] >= 0:
+            return {"Status": "CREATE_IN_PROGRESS"}
+        if self.no_changes_reason:
+            return {"Status": "FAILED", "StatusReason": self.no_changes_reason}
+        return {
+            "Status": "CREATE_COMPLETE",
+            "Changes": [
+                {"ResourceChange": {"Action": "Modify", "LogicalResourceId": key, "ResourceType": res["Type"]}}
+                for key, res in change_set["template"]["Resources"].items()
+            ],
+        }
+
+    def delete_change_set(self, ChangeSetName, StackName):
+        del self.change_sets[ChangeSetName]
+
+    def execute_change_set(self, ChangeSetName, StackName):
+        stack = self.stacks[StackName]
+        template = self.change_sets.pop(ChangeSetName)["template"]
+        start = stack["events"][0]["Timestamp"] if stack["events"] else T0
+        new_events = list()
+        for i, (key, res) in enumerate(template["Resources"].items()):
+            new_events.append(event(key, "UPDATE_IN_PROGRESS", i + 1, res["Type"]))
+            new_events.append(event(key, "UPDATE_COMPLETE", i + 2, res["Type"]))
+        for e in new_events:
+            e["Timestamp"] += start - T0 + timedelta(seconds=1)
+        stack["events"] = sorted(new_events, key=lambda e: e["Timestamp"], reverse=True) + stack["events"]
+        created = stack["template"] is None
+        stack.update(status="CREATE_COMPLETE" if created else "UPDATE_COMPLETE", template=template)
+        self.executed.append(StackName)
+
+    def describe_stack_events(self, StackName):
+        return {"StackEvents": self.stacks[StackName]["events"]}
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, StackName):
+        yield self.describe_stack_events(StackName)
+
+
+def test_deploy_template():
+    cf = FakeCloudFormationClient()
+    kwargs = dict(sleep=lambda _: None, print_func=lambda _: None)
+    result = deploy_template(cf, "app", TEMPLATE, **kwargs)
+    assert result.status == "CREATE_COMPLETE"
+    assert len(result.timings) == len(TEMPLATE["Resources"])
+
+    # no change, no change set
+    result = deploy_template(cf, "app", TEMPLATE, **kwargs)
+    assert result.status == "SKIPPED"
+    assert cf.executed == ["app"]
+
+    template = json.loads(json.dumps(TEMPLATE))
+    template["Resources"]["Stream"]["Properties"]["ShardCount"] = 20
+    result = deploy_template(cf, "app", template, **kwargs)
+    assert result.status == "UPDATE_COMPLETE"
+    assert result.diff["modified"] == ["Stream"]
+    # the events of the first deploy are not timed again
+    assert len(result.timings) == len(TEMPLATE["Resources"])
+
+    cf.no_changes_reason = "The submitted information didn't contain changes."
+    result = deploy_template(cf, "app", TEMPLATE, force=True, **kwargs)
+    assert result.status == "NO_CHANGES"
+    assert not cf.change_sets
+
+
+def test_deploy_groups():
+    cf = FakeCloudFormationClient()
+    kwargs = dict(sleep=lambda _: None, print_func=lambda _: None)
+    results = deploy_groups(cf, "app", TEMPLATE, GROUPS, **kwargs)
+    assert set(cf.executed[:4]) == {"app-rg1", "app-rg2", "app-rg3", "app-rg4"}
+    assert set(cf.executed[4:]) == {"app-rg5", "app-rg6"}
+
+    # only the changed group is deployed
+    template = json.loads(json.dumps(TEMPLATE))
+    template["Resources"]["ToOss"]["Properties"]["BufferSize"] = 5
+    results = deploy_groups(cf, "app", template, GROUPS, **kwargs)
+    assert results["RG6"].status == "UPDATE_COMPLETE"
+    assert results["RG3"].status == "SKIPPED"
+    assert cf.executed[6:] == ["app-rg6"]
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
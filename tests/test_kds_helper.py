@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pytest
+from kds_example.fake_kinesis import FakeClientError
+from kds_example.kds_helper import (
+    iter_put_record_batch_batches,
+    put_record_batch_with_retries,
+    FirehoseProducer,
+    pack_kin_records,
+)
+from kds_example.codec import unpack_records
+from kds_example.object_store import InMemoryObjectStore
+from kds_example.simulator import (
+    SimClock, BufferingHints, S3Destination,
+    DeliveryStreamSimulator, PipelineSimulator, FakeFirehoseClient,
+)
+
+
+def make_direct_put(clock, processor=None, max_records_per_sec=None):
+    store = InMemoryObjectStore()
+    delivery_stream = DeliveryStreamSimulator(
+        name="direct",
+        destination=S3Destination(store, "direct/03-success/", "direct/04-failed/", BufferingHints()),
+        processor=processor,
+    )
+    firehose_client = FakeFirehoseClient([delivery_stream], clock, max_records_per_sec=max_records_per_sec)
+    return store, delivery_stream, firehose_client
+
+
+def test_iter_put_record_batch_batches():
+    records = [{"Data": b"x" * 1000} for _ in range(1200)]
+    assert [len(batch) for batch in iter_put_record_batch_batches(records)] == [500, 500, 200]
+    records = [{"Data": b"x" * 1000 * 1024} for _ in range(10)]
+    # 4 MiB per call
+    assert [len(batch) for batch in iter_put_record_batch_batches(records)] == [4, 4, 2]
+
+
+def test_put_record_batch_with_retries():
+    clock = SimClock(start=1650000000)
+    store, delivery_stream, firehose_client = make_direct_put(clock, max_records_per_sec=300)
+    delays = list()
+
+    def sleep(seconds):
+        delays.append(seconds)
+        clock.advance(1)
+
+    records = [{"Data": f"{i}\n".encode("utf-8")} for i in range(500)]
+    failed = put_record_batch_with_retries(firehose_client, "direct", records, sleep=sleep)
+    assert failed == []
+    assert len(delays) == 1
+    assert delivery_stream.stats.records_in == 500
+
+    clock.advance(1)
+    failed = put_record_batch_with_retries(firehose_client, "direct", records, max_retries=0, sleep=sleep)
+    assert len(failed) == 200
+
+    with pytest.raises(FakeClientError):
+        put_record_batch_with_retries(firehose_client, "direct", records * 2, sleep=sleep)
+
+
+def test_firehose_producer():
+    clock = SimClock(start=1650000000)
+    events = list()
+
+    def processor(event, context):
+        events.append(event)
+        return {
+            "records": [
+                {"recordId": record["recordId"], "result": "Ok", "data": record["data"]}
+                for record in event["records"]
+            ]
+        }
+
+    store, delivery_stream, firehose_client = make_direct_put(clock, processor=processor)
+    with FirehoseProducer(firehose_client, "direct", max_workers=3, clock=clock) as producer:
+        producer.put_many(f"{i}\n".encode("utf-8") for i in range(1234))
+    assert producer.stats.records == 1234
+    assert producer.stats.batches == 3
+    assert producer.failed == []
+
+    sim = PipelineSimulator(None, None, [delivery_stream], clock)
+    sim.drain()
+    lines = b"".join(store.get_object(key) for key in store.list_keys("direct/03-success/")).splitlines()
+    assert sorted(int(line) for line in lines) == list(range(1234))
+    # a Direct PUT event has no kinesis metadata
+    assert "sourceKinesisStreamArn" not in events[0]
+    assert "kinesisRecordMetadata" not in events[0]["records"][0]
+
+    with pytest.raises(ValueError):
+        FirehoseProducer(firehose_client, "direct").put(b"x" * 1024 * 1024)
+
+
+def test_pack_kin_records():
+    records = [{"id": str(i), "balance": i} for i in range(250)]
+    kin_records = pack_kin_records(records, get_pk=lambda record: record["id"], max_records=100)
+    assert [kin_record["PartitionKey"] for kin_record in kin_records] == ["0", "100", "200"]
+    lines = [line for kin_record in kin_records for line in unpack_records(kin_record["Data"])]
+    assert [json.loads(line) for line in lines] == records
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import pytest
+from kds_example.lbd.cache import TTLCache, make_enrich_stage
+from kds_example.lbd.pipeline import Item
+
+
+class FakeAccountBackend:
+    """
+    Local stand-in of the remote account metadata lookup.
+
+    :param release: optional, the loader blocks until it is set.
+    """
+
+    def __init__(self, delay: float = 0.0, release: threading.Event = None):
+        self.delay = delay
+        self.release = release
+        self.calls = list()
+        self.lock = threading.Lock()
+
+    def __call__(self, keys):
+        with self.lock:
+            self.calls.append(sorted(keys))
+        if self.release is not None:
+            self.release.wait(5)
+        time.sleep(self.delay)
+        return {key: {"segment": f"segment-{key}"} for key in keys if key != "unknown"}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_batch_load_ttl_and_lru():
+    backend = FakeAccountBackend()
+    clock = FakeClock()
+    cache = TTLCache(backend, max_size=3, ttl=10, clock=clock)
+
+    values = cache.get_many(["a", "b", "a", "unknown"])
+    assert values["a"] == {"segment": "segment-a"}
+    assert values["unknown"] is None
+    assert backend.calls == [["a", "b", "unknown"]]
+
+    # hits, including the negative cached key
+    cache.get_many(["a", "unknown"])
+    assert len(backend.calls) == 1
+    assert cache.stats.hits == 2
+    assert cache.stats.misses == 3
+
+    # "b" is the least recently used one
+    cache.get("c")
+    assert cache.stats.evictions == 1
+    cache.get("b")
+    assert backend.calls[-1] == ["b"]
+
+    # expired entries are reloaded
+    clock.now = 11
+    cache.get("c")
+    assert backend.calls[-1] == ["c"]
+    assert cache.stats.expirations == 1
+
+
+def test_single_flight():
+    release = threading.Event()
+    backend = FakeAccountBackend(release=release)
+    cache = TTLCache(backend)
+    threads = [
+        threading.Thread(target=cache.get_many, args=(["a", "b"],))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    # hold the first load until the 4 other threads wait for it
+    deadline = time.time() + 5
+    while cache.stats.waits < 8 and time.time() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert backend.calls == [["a", "b"]]
+    assert cache.stats.waits == 8
+
+
+def test_enrich_stage():
+    backend = FakeAccountBackend()
+    cache = TTLCache(backend)
+    enrich = make_enrich_stage(
+        cache,
+        get_key=lambda record: record["id"],
+        merge=lambda record, metadata: {**record, **(metadata or {})},
+    )
+    items = [Item(record_id=str(i), data="", value={"id": key}) for i, key in enumerate("aab")]
+    enrich(items)
+    assert items[1].value == {"id": "a", "segment": "segment-a"}
+    assert backend.calls == [["a", "b"]]
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
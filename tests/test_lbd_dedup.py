@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import json
+import base64
+import pytest
+from kds_example.kds_helper import FailIt
+from kds_example.lbd.common import delivery_stream_tranformation_handler
+from kds_example.lbd.dedup import TimeWindowedBloomFilter, Deduplicator
+
+
+def make_event(raw_records):
+    return {
+        "invocationId": "invocationIdExample",
+        "deliveryStreamArn": "arn:aws:kinesis:EXAMPLE",
+        "region": "us-east-1",
+        "records": [
+            {
+                "recordId": str(i),
+                "approximateArrivalTimestamp": 1495072949453,
+                "data": base64.b64encode((json.dumps(raw_record) + "\n").encode("utf-8")).decode("utf-8")
+            }
+            for i, raw_record in enumerate(raw_records)
+        ]
+    }
+
+
+def test_time_windowed_bloom_filter():
+    bloom = TimeWindowedBloomFilter(window_seconds=40, n_generations=4, capacity_per_generation=100)
+    bloom.add(b"a", now=0)
+    bloom.add(b"b", now=15)
+    assert len(bloom.generations) == 2
+    assert b"a" in bloom and b"b" in bloom
+    bloom.expire(now=45)
+    assert b"a" not in bloom
+    assert b"b" in bloom
+
+
+def test_handler_dedup(tmp_path):
+    path = str(tmp_path / "dedup.bin")
+    dedup = Deduplicator(path=path, save_interval=0)
+
+    def transform(dct):
+        return dct
+
+    # duplicates within the same batch
+    res = delivery_stream_tranformation_handler(
+        make_event([{"id": "a"}, {"id": "b"}, {"id": "a"}]), transform, dedup=dedup,
+    )
+    assert [r["result"] for r in res["records"]] == ["Ok", "Ok", "Dropped"]
+
+    # duplicates across warm invocations
+    res = delivery_stream_tranformation_handler(
+        make_event([{"id": "b"}, {"id": "c"}]), transform, dedup=dedup,
+    )
+    assert [r["result"] for r in res["records"]] == ["Dropped", "Ok"]
+
+    # duplicates across containers, through the persisted file
+    res = delivery_stream_tranformation_handler(
+        make_event([{"id": "c"}, {"id": "d"}]), transform, dedup=Deduplicator(path=path),
+    )
+    assert [r["result"] for r in res["records"]] == ["Dropped", "Ok"]
+
+
+def test_handler_dedup_rollback():
+    dedup = Deduplicator()
+
+    def transform(dct):
+        if dct["id"] == "boom":
+            raise ValueError
+        return dct
+
+    event = make_event([{"id": "a"}, {"id": "boom"}])
+    with pytest.raises(ValueError):
+        delivery_stream_tranformation_handler(event, transform, dedup=dedup)
+    # the retried batch is not dropped as a duplicate of itself
+    res = delivery_stream_tranformation_handler(
+        make_event([{"id": "a"}]), transform, dedup=dedup,
+    )
+    assert [r["result"] for r in res["records"]] == ["Ok"]
+
+
+def test_handler_dedup_commits_ok_records_only():
+    dedup = Deduplicator()
+
+    def transform(dct):
+        if dct["id"] == "bad":
+            raise FailIt("bad record")
+        return dct
+
+    event = make_event([{"id": "a"}, {"id": "bad"}])
+    res = delivery_stream_tranformation_handler(event, transform, dedup=dedup)
+    assert [r["result"] for r in res["records"]] == ["Ok", "ProcessingFailed"]
+    # the failed record is replayed later, it is not a duplicate
+    res = delivery_stream_tranformation_handler(event, lambda dct: dct, dedup=dedup)
+    assert [r["result"] for r in res["records"]] == ["Dropped", "Ok"]
+
+
+def test_dedup_save_interval(tmp_path):
+    path = str(tmp_path / "dedup.bin")
+    now = [1000.0]
+    dedup = Deduplicator(
+        bloom=TimeWindowedBloomFilter(capacity_per_generation=100),
+        path=path, clock=lambda: now[0], save_interval=60,
+    )
+    for record_id, t in [("a", 1000.0), ("b", 1030.0), ("c", 1060.0)]:
+        now[0] = t
+        assert not dedup.is_duplicate({"id": record_id})
+        dedup.commit()
+        if record_id == "a":
+            assert Deduplicator(path=path).is_duplicate({"id": "a"})
+        if record_id == "b":
+            # not saved again within the interval
+            assert not Deduplicator(path=path).is_duplicate({"id": "b"})
+    assert Deduplicator(path=path).is_duplicate({"id": "b"})
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import json
+import base64
+import pytest
+from kds_example.kds_helper import DropIt
+from kds_example.codec import pack_records
+from kds_example.lbd.common import build_pipeline
+from kds_example.lbd.metrics import MetricsEmitter, b64_decoded_size
+
+
+class FakeContext:
+    def get_remaining_time_in_millis(self):
+        return 60000
+
+
+def test_b64_decoded_size():
+    for n in range(10):
+        data = b"x" * n
+        assert b64_decoded_size(base64.b64encode(data)) == n
+        assert b64_decoded_size(base64.b64encode(data).decode("utf-8")) == n
+
+
+def test_emit():
+    lines = list()
+    metrics = MetricsEmitter(dimensions={"FunctionName": "to_s3"}, print_func=lines.append)
+
+    def transform(dct):
+        if dct["balance"] == 0:
+            raise DropIt
+        return dct
+
+    pipeline = build_pipeline(transform, metrics=metrics)
+    records = [{"id": str(i), "balance": i} for i in range(3)]
+    event = {
+        "records": [
+            {
+                "recordId": str(i),
+                "data": base64.b64encode((json.dumps(record) + "\n").encode("utf-8")).decode("utf-8"),
+            }
+            for i, record in enumerate(records)
+        ]
+    }
+    pipeline.handle(event, FakeContext())
+
+    assert len(lines) == 1
+    document = json.loads(lines[0])
+    definition = document["_aws"]["CloudWatchMetrics"][0]
+    assert definition["Dimensions"] == [["FunctionName"]]
+    units = {dct["Name"]: dct["Unit"] for dct in definition["Metrics"]}
+    assert units["InputBytes"] == "Bytes"
+    assert units["DecodeTime"] == "Milliseconds"
+    assert units["RecordsOk"] == "Count"
+
+    assert document["FunctionName"] == "to_s3"
+    assert document["RecordsOk"] == 2
+    assert document["RecordsDropped"] == 1
+    assert document["RecordsProcessingFailed"] == 0
+    assert document["InputBytes"] == sum(len(json.dumps(record)) + 1 for record in records)
+    assert document["OutputBytes"] == sum(len(json.dumps(record)) + 1 for record in records[1:])
+    assert document["RemainingTime"] == 60000
+    for name in ["DecodeTime", "TransformTime", "EncodeTime"]:
+        assert document[name] >= 0
+
+
+def test_emit_aggregated():
+    lines = list()
+    pipeline = build_pipeline(lambda dct: dct, metrics=MetricsEmitter(print_func=lines.append))
+    payload = pack_records([(json.dumps({"id": str(i)}) + "\n").encode("utf-8") for i in range(10)])
+    pipeline.handle({"records": [{"recordId": "0", "data": base64.b64encode(payload).decode("utf-8")}]})
+
+    document = json.loads(lines[0])
+    # the payload is counted once, not once per record in it
+    assert document["InputBytes"] == len(payload)
+    assert document["RecordsOk"] == 10
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
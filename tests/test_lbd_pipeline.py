@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import json
+import base64
+import pytest
+from kds_example.kds_helper import DropIt, FailIt
+from kds_example.codec import MAGIC, compress, pack_records
+from kds_example.lbd.common import build_pipeline
+from kds_example.lbd.pipeline import Pipeline, decode, encode, project
+
+
+def make_event(raw_records):
+    return {
+        "records": [
+            {
+                "recordId": str(i),
+                "approximateArrivalTimestamp": 1495072949453,
+                "data": base64.b64encode((json.dumps(raw_record) + "\n").encode("utf-8")).decode("utf-8")
+            }
+            for i, raw_record in enumerate(raw_records)
+        ]
+    }
+
+
+def test_pipeline():
+    pipeline = Pipeline()
+    pipeline.add_stage("decode", decode)
+
+    @pipeline.stage()
+    def validate(record):
+        if record["balance"] < 0:
+            raise FailIt("negative balance")
+        if record["balance"] == 0:
+            raise DropIt
+        return record
+
+    n_enrich_calls = list()
+
+    @pipeline.stage(mode="batch")
+    def enrich(items):
+        n_enrich_calls.append(len(items))
+        for item in items:
+            item.value["vip"] = item.value["balance"] > 100
+
+    pipeline.add_stage("project", project(["id", "vip"]))
+    pipeline.add_stage("encode", encode)
+
+    event = make_event([
+        {"id": 1, "balance": 1000},
+        {"id": 2, "balance": 0},
+        {"id": 3, "balance": -1},
+        {"id": 4, "balance": 10},
+    ])
+    response = pipeline.handle(event)
+    records = response["records"]
+    assert [r["result"] for r in records] == ["Ok", "Dropped", "ProcessingFailed", "Ok"]
+    assert decode(records[0]["data"].decode("utf-8")) == {"id": 1, "vip": True}
+    # short-circuited records keep their original data
+    assert records[2]["data"] == event["records"][2]["data"]
+    # the batch stage is called once, with the records still in flight
+    assert n_enrich_calls == [2]
+    assert list(pipeline.last_timings) == ["decode", "validate", "enrich", "project", "encode"]
+    assert pipeline.n_invocations == 1
+
+
+def test_pipeline_compressed_records():
+    def to_data(payload: bytes) -> str:
+        return base64.b64encode(payload).decode("utf-8")
+
+    def line(i: int) -> bytes:
+        return (json.dumps({"id": i, "balance": i}) + "\n").encode("utf-8")
+
+    def negative_balance(record):
+        if record["balance"] < 0:
+            raise FailIt("negative balance")
+        if record["balance"] == 0:
+            raise DropIt
+        return record
+
+    event = {
+        "records": [
+            {"recordId": "0", "data": to_data(line(1))},
+            {"recordId": "1", "data": to_data(compress(line(2)))},
+            {"recordId": "2", "data": to_data(pack_records([line(0), line(3), line(4)]))},
+            {"recordId": "3", "data": to_data(pack_records([line(5), line(-1)]))},
+            {"recordId": "4", "data": to_data(pack_records([line(0)]))},
+        ]
+    }
+    pipeline = Pipeline()
+    pipeline.add_stage("decode", decode)
+    pipeline.add_stage("validate", negative_balance)
+    pipeline.add_stage("encode", encode)
+    records = pipeline.handle(event)["records"]
+    assert [r["recordId"] for r in records] == ["0", "1", "2", "3", "4"]
+    assert [r["result"] for r in records] == ["Ok", "Ok", "Ok", "ProcessingFailed", "Dropped"]
+    assert decode(records[1]["data"].decode("utf-8")) == {"id": 2, "balance": 2}
+    # the Ok records of a micro-batch are joined back
+    assert base64.b64decode(records[2]["data"]) == line(3) + line(4)
+    assert records[3]["data"] == event["records"][3]["data"]
+
+    pipeline.unpack_aggregated = False
+    records = pipeline.handle(event)["records"]
+    assert [r["result"] for r in records] == ["Ok", "Ok", "ProcessingFailed", "ProcessingFailed", "ProcessingFailed"]
+
+
+def test_pipeline_bad_records():
+    def to_data(payload: bytes) -> str:
+        return base64.b64encode(payload).decode("utf-8")
+
+    event = {
+        "records": [
+            {"recordId": "0", "data": to_data(b'{"id": 1, "balance": 1}\n')},
+            {"recordId": "1", "data": to_data(b'{"id": 2, "bala')},
+            # unknown schema id
+            {"recordId": "2", "data": to_data(b"KB\xff\xff" + b"\x00" * 8)},
+            # corrupt gzip, single and aggregated
+            {"recordId": "3", "data": to_data(MAGIC + b"\x01\x00" + b"not gzip")},
+            {"recordId": "4", "data": to_data(MAGIC + b"\x01\x01" + b"not gzip")},
+        ]
+    }
+
+    pipeline = build_pipeline(lambda record: record, trace=False)
+    records = pipeline.handle(event)["records"]
+    # the bad records fail alone, the batch goes through
+    assert [r["recordId"] for r in records] == ["0", "1", "2", "3", "4"]
+    assert [r["result"] for r in records] == ["Ok"] + ["ProcessingFailed"] * 4
+    assert all(r["data"] == e["data"] for r, e in zip(records[1:], event["records"][1:]))
+
+    # without fail_on_error an unexpected error still fails the invocation
+    pipeline = Pipeline()
+    pipeline.add_stage("decode", decode)
+    with pytest.raises(ValueError):
+        pipeline.handle(event)
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import base64
+import random
+
+import pytest
+from kds_example.lbd.common import build_pipeline
+from kds_example.lbd.dedup import Deduplicator, TimeWindowedBloomFilter
+from kds_example.lbd.profiler import SamplingProfiler, InvocationProfiler, profiler_from_env
+
+
+def busy(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def make_event(n: int) -> dict:
+    return {
+        "invocationId": "inv-1",
+        "records": [
+            {
+                "recordId": str(i),
+                "data": base64.b64encode((json.dumps({"id": str(i), "balance": i}) + "\n").encode("utf-8")).decode("utf-8"),
+            }
+            for i in range(n)
+        ],
+    }
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.objects = dict()
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+
+
+class DeniedS3Client:
+    def put_object(self, Bucket, Key, Body):
+        raise PermissionError("s3:PutObject denied")
+
+
+def test_sampling_profiler():
+    with SamplingProfiler(interval=0.001, label=lambda: "transform") as profiler:
+        busy(0.1)
+    assert profiler.n_samples > 0
+    assert profiler.stage_counts() == {"stage:transform": profiler.n_samples}
+    lines = profiler.to_collapsed().splitlines()
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == profiler.n_samples
+    assert any("busy (test_lbd_profiler.py:" in line for line in lines)
+
+
+def test_invocation_profiler(tmp_path):
+    profiler = InvocationProfiler(sample_one_in=3, rng=random.Random(1), output=str(tmp_path))
+    sampled = [profiler.should_profile() for _ in range(300)]
+    assert 50 < sum(sampled) < 150
+
+    s3_client = FakeS3Client()
+    profiler = InvocationProfiler(interval=0.001, output="s3://bucket/profiles", name="to_s3", s3_client=s3_client)
+    with profiler.maybe_profile("inv-1"):
+        busy(0.02)
+    (bucket, key), = s3_client.objects
+    assert bucket == "bucket"
+    assert key.startswith("profiles/to_s3-") and key.endswith("-inv-1.collapsed")
+    assert profiler.last_path == f"s3://bucket/{key}"
+
+
+def test_pipeline_profiling(tmp_path):
+    def transform(dct):
+        busy(0.002)
+        return dct
+
+    profiler = InvocationProfiler(interval=0.001, output=str(tmp_path))
+    pipeline = build_pipeline(transform, profiler=profiler)
+    res = pipeline.handle(make_event(50))
+    assert len(res["records"]) == 50
+    assert pipeline.current_stage is None
+    path, = tmp_path.iterdir()
+    assert str(path) == profiler.last_path
+    stacks = path.read_text().splitlines()
+    assert any(line.startswith("stage:transform;") for line in stacks)
+
+    # not sampled, nothing written
+    profiler.sample_one_in = 1000000
+    pipeline.handle(make_event(1))
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_profile_write_failure_with_dedup():
+    profiler = InvocationProfiler(interval=0.001, output="s3://bucket/profiles", s3_client=DeniedS3Client())
+    dedup = Deduplicator(bloom=TimeWindowedBloomFilter(window_seconds=3600, capacity_per_generation=1000))
+    pipeline = build_pipeline(lambda dct: dct, dedup=dedup, profiler=profiler)
+    res = pipeline.handle(make_event(3))
+    assert [record["result"] for record in res["records"]] == ["Ok"] * 3
+    assert profiler.last_path is None
+
+
+def test_profiler_from_env(monkeypatch):
+    monkeypatch.delenv("KDS_PROFILE_ENABLED", raising=False)
+    assert profiler_from_env() is None
+    monkeypatch.setenv("KDS_PROFILE_ENABLED", "true")
+    monkeypatch.setenv("KDS_PROFILE_SAMPLE_ONE_IN", "100")
+    monkeypatch.setenv("KDS_PROFILE_INTERVAL_MS", "10")
+    profiler = profiler_from_env()
+    assert profiler.sample_one_in == 100
+    assert profiler.interval == 0.01
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
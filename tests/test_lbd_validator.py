@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import json
+import base64
+import pytest
+from kds_example.schema import bank_account_schema
+from kds_example.lbd.validator import compile_validator, interpret
+from kds_example.lbd.to_oss import handler
+
+valid_record = {
+    "id": "bbec70d6-35eb-485f-9729-8465b9bda59f",
+    "firstname": "Jerry",
+    "lastname": "Snyder",
+    "description": "Mrs air in wife financial within live pull artist back.",
+    "balance": 0,
+}
+
+cases = [
+    (valid_record, None),
+    ({**valid_record, "description": None}, None),
+    ({k: v for k, v in valid_record.items() if k != "description"}, None),
+    ({k: v for k, v in valid_record.items() if k != "id"}, "id: missing"),
+    ({**valid_record, "balance": "0"}, "balance: expect 32 bit integer"),
+    ({**valid_record, "balance": True}, "balance: expect 32 bit integer"),
+    ({**valid_record, "balance": 2 ** 31}, "balance: expect 32 bit integer"),
+    ({**valid_record, "firstname": None}, "firstname: expect string"),
+    ({**valid_record, "id": "x" * 37}, "id: longer than 36"),
+    ([valid_record], "record: expect object"),
+]
+
+
+def test_compiled_validator_matches_interpreter():
+    validate = compile_validator(bank_account_schema)
+    for record, error in cases:
+        assert validate(record) == error
+        assert interpret(bank_account_schema, record) == error
+
+
+def test_to_oss_handler_rejects_invalid_record():
+    event = {
+        "records": [
+            {
+                "recordId": str(i),
+                "approximateArrivalTimestamp": 1495072949453,
+                "data": base64.b64encode((json.dumps(record) + "\n").encode("utf-8")).decode("utf-8")
+            }
+            for i, (record, _) in enumerate(cases[:5])
+        ]
+    }
+    response = handler(event=event, context=None)
+    assert [r["result"] for r in response["records"]] == [
+        "Ok", "Ok", "Ok", "ProcessingFailed", "ProcessingFailed",
+    ]
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
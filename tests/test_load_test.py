@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import json
+import random
+import pytest
+from kds_example.fake_kinesis import FakeKinesisClient
+from kds_example.load_test.histogram import Histogram
+from kds_example.load_test.corpus import Corpus, build_corpus
+from kds_example.load_test.process_pool import (
+    SharedCounters, FakeClientFactory, run_process_load_test,
+)
+from kds_example.load_test.generator import (
+    LoadTestConfig, RecordFactory, ProducerStats, run_load_test, compare_reports,
+)
+
+
+def test_histogram():
+    rng = random.Random(1)
+    values = sorted(int(rng.expovariate(1 / 5000)) for _ in range(20000))
+    histogram = Histogram()
+    for value in values[:10000]:
+        histogram.record(value)
+    other = Histogram()
+    for value in values[10000:]:
+        other.record(value)
+    histogram.merge(other)
+
+    assert histogram.total_count == len(values)
+    assert histogram.max == values[-1]
+    for q in [50, 90, 99]:
+        expected = values[int(q / 100 * len(values)) - 1]
+        assert abs(histogram.percentile(q) - expected) <= expected * 0.01 + 1
+    assert Histogram.from_dict(histogram.to_dict()).percentile(99) == histogram.percentile(99)
+
+
+def test_record_factory_size():
+    config = LoadTestConfig(stream_name="s", record_size_mean=500)
+    factory = RecordFactory(config, random.Random(1))
+    assert len(factory.make_kinesis_record()["Data"]) == 500
+
+
+def test_record_factory_id_salt():
+    def make_records(config):
+        factory = RecordFactory(config, random.Random(1))
+        return [json.loads(factory.make_kinesis_record()["Data"]) for _ in range(5)]
+
+    config = LoadTestConfig(stream_name="s", record_size_distribution="uniform")
+    run_1, run_2 = make_records(config), make_records(LoadTestConfig(stream_name="s", record_size_distribution="uniform"))
+    # a new salt per run: new ids, the same sizes and fields
+    assert not {r["id"] for r in run_1} & {r["id"] for r in run_2}
+    for r1, r2 in zip(run_1, run_2):
+        assert len(json.dumps(r1)) == len(json.dumps(r2))
+        assert dict(r1, id=None) == dict(r2, id=None)
+    # the salt of a previous run sends the same records again
+    assert make_records(config) == run_1
+
+
+def make_client(n_shards: int) -> FakeKinesisClient:
+    client = FakeKinesisClient(enforce_shard_limits=True, latency=0.001)
+    client.create_stream(StreamName="s", ShardCount=n_shards)
+    return client
+
+
+def test_run_load_test():
+    config = LoadTestConfig(
+        stream_name="s", target_rate=2000, n_producers=4, duration=1,
+        records_per_request=50,
+    )
+    report = run_load_test(make_client(n_shards=10), config)
+    assert report["records"]["sent"] == 2000
+    assert report["records"]["ok"] == 2000
+    assert report["records"]["throttled"] == 0
+    assert report["latency_us"]["put_records"]["count"] == 40
+
+    # one shard can't take 5000 records in half a second, even if the run is
+    # slowed down and spread over a few seconds
+    throttled_config = LoadTestConfig(
+        stream_name="s", target_rate=10000, n_producers=4, duration=0.5,
+        records_per_request=250,
+    )
+    throttled_report = run_load_test(make_client(n_shards=1), throttled_config)
+    assert throttled_report["records"]["throttled"] > 0
+    assert throttled_report["requests"]["retries"] > 0
+
+    comparison = compare_reports(report, throttled_report)
+    assert comparison["throttle_rate"]["current"] > 0
+
+
+def test_corpus(tmp_path):
+    path_1, path_2 = str(tmp_path / "c1.ndjson"), str(tmp_path / "c2.ndjson")
+    build_corpus(path_1, n_records=100, seed=7)
+    build_corpus(path_2, n_records=100, seed=7)
+    with open(path_1, "rb") as f1, open(path_2, "rb") as f2:
+        assert f1.read() == f2.read()
+
+    with Corpus(path_1) as corpus:
+        assert len(corpus) == 100
+        lines = open(path_1, "rb").read().splitlines(keepends=True)
+        assert corpus.data(42) == lines[42]
+        assert bytes(corpus.view(42)) == lines[42]
+        assert corpus.partition_key(42) == json.loads(lines[42])["id"]
+
+        # wraps around the end
+        kin_records = corpus.kinesis_records(start=95, n=10)
+        assert [r["Data"] for r in kin_records] == lines[95:] + lines[:5]
+
+        assert corpus.start_of(producer_id=3, n_producers=4) == 75
+        make_kinesis_record = corpus.record_factory(start=99)
+        assert make_kinesis_record()["Data"] == lines[99]
+        assert make_kinesis_record()["Data"] == lines[0]
+
+        # salted ids: same size and fields, new ids per salt and per lap
+        salted = corpus.kinesis_records(start=95, n=110, salt="run-1")
+        assert [len(r["Data"]) for r in salted[:10]] == [len(line) for line in lines[95:] + lines[:5]]
+        for record, line in zip(salted[:10], lines[95:] + lines[:5]):
+            dct, original = json.loads(record["Data"]), json.loads(line)
+            assert dct["id"] == record["PartitionKey"] != original["id"]
+            assert {k: v for k, v in dct.items() if k != "id"} == {k: v for k, v in original.items() if k != "id"}
+        assert salted[0]["Data"] == corpus.kinesis_records(start=95, n=1, salt="run-1")[0]["Data"]
+        assert salted[5]["PartitionKey"] != salted[105]["PartitionKey"]
+        other_run = corpus.kinesis_records(start=95, n=110, salt="run-2")
+        assert not {r["PartitionKey"] for r in salted} & {r["PartitionKey"] for r in other_run}
+        make_kinesis_record = corpus.record_factory(start=99, salt="run-1")
+        assert make_kinesis_record()["Data"] == salted[4]["Data"]
+        assert make_kinesis_record()["Data"] == salted[5]["Data"]
+
+
+def test_run_load_test_with_corpus(tmp_path):
+    path = str(tmp_path / "corpus.ndjson")
+    build_corpus(path, n_records=1000)
+    config = LoadTestConfig(
+        stream_name="s", target_rate=2000, n_producers=2, duration=0.5,
+        records_per_request=50, corpus_path=path,
+    )
+    report = run_load_test(make_client(n_shards=4), config)
+    assert report["records"]["ok"] == 1000
+
+
+def test_shared_counters():
+    counters = SharedCounters(n_slots=3)
+    stats = ProducerStats(requests=2, records_sent=200, records_ok=190)
+    counters.publish(0, stats)
+    counters.publish(2, stats)
+    assert counters.read(1)["requests"] == 0
+    total = counters.total()
+    assert total["requests"] == 4
+    assert total["records_ok"] == 380
+
+
+def test_run_process_load_test():
+    config = LoadTestConfig(
+        stream_name="s", target_rate=2000, n_producers=2, duration=1,
+        records_per_request=50,
+    )
+    progress = list()
+    report = run_process_load_test(
+        config,
+        client_factory=FakeClientFactory(stream_name="s", n_shards=4),
+        progress=lambda elapsed, total: progress.append(total),
+        progress_interval=0.2,
+    )
+    assert report["records"]["sent"] == 2000
+    assert report["records"]["ok"] == 2000
+    assert report["latency_us"]["put_records"]["count"] == 40
+    assert progress and progress[-1]["records_ok"] <= 2000
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import io
+import csv
+import gzip
+import json
+from datetime import datetime, timezone
+
+import pytest
+from kds_example.manifest import parse_firehose_key, ManifestIndex
+
+PREFIX = "to-s3/01-backup/"
+
+
+def make_key(prefix: str, dt: datetime, i: int) -> str:
+    return (
+        f"{prefix}{dt:%Y/%m/%d/%H}/"
+        f"kds-example-to-s3-1-{dt:%Y-%m-%d-%H-%M-%S}-"
+        f"00000000-0000-0000-0000-{i:012d}"
+    )
+
+
+class StubS3Client:
+    """
+    Only the ``list_objects_v2`` paginator and ``get_object`` calls used by
+    the manifest index.
+    """
+
+    def __init__(self):
+        self.objects = dict()
+        self.n_list_calls = 0
+
+    def put(self, key: str, body: bytes):
+        self.objects[key] = body
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix, PaginationConfig, StartAfter="", Delimiter=None):
+        page_size = PaginationConfig["PageSize"]
+        keys = sorted(k for k in self.objects if k.startswith(Prefix) and k > StartAfter)
+        if Delimiter is not None:
+            self.n_list_calls += 1
+            folders = {
+                Prefix + k[len(Prefix):].split(Delimiter, 1)[0] + Delimiter
+                for k in keys if Delimiter in k[len(Prefix):]
+            }
+            yield {
+                "Contents": [{"Key": k, "Size": len(self.objects[k])} for k in keys if k[len(Prefix):].count(Delimiter) == 0],
+                "CommonPrefixes": [{"Prefix": folder} for folder in sorted(folders)],
+            }
+            return
+        for i in range(0, len(keys), page_size):
+            self.n_list_calls += 1
+            yield {
+                "Contents": [
+                    {
+                        "Key": key,
+                        "Size": len(self.objects[key]),
+                        "LastModified": datetime(2022, 4, 15, tzinfo=timezone.utc),
+                    }
+                    for key in keys[i:i + page_size]
+                ]
+            }
+
+
+def test_parse_firehose_key():
+    dt = datetime(2022, 4, 15, 10, 30, 5)
+    stream, created_at = parse_firehose_key(make_key(PREFIX, dt, 1))
+    assert stream == "kds-example-to-s3"
+    assert created_at == int(dt.replace(tzinfo=timezone.utc).timestamp())
+    assert parse_firehose_key("to-s3/01-backup/readme.txt") is None
+
+
+def test_sync_incremental():
+    s3 = StubS3Client()
+    for minute in range(0, 60, 10):
+        s3.put(make_key(PREFIX, datetime(2022, 4, 15, 10, minute), minute), b"x" * 10)
+    s3.put("to-s3/03-success/other", b"")
+
+    index = ManifestIndex()
+    assert index.sync(s3, "bucket", PREFIX, page_size=4) == 6
+    assert index.count(PREFIX) == 6
+    assert index.total_size(PREFIX) == 60
+
+    # only the new objects are listed
+    for minute in range(0, 60, 20):
+        s3.put(make_key(PREFIX, datetime(2022, 4, 15, 11, minute), minute), b"x")
+    s3.n_list_calls = 0
+    assert index.sync(s3, "bucket", PREFIX, page_size=4) == 3
+    # one call to find the sub folders, the hour of the last key and after
+    # are listed again, in 3 pages
+    assert s3.n_list_calls == 4
+    assert index.sync(s3, "bucket", PREFIX) == 0
+
+    start = datetime(2022, 4, 15, 10, 30, tzinfo=timezone.utc)
+    end = datetime(2022, 4, 15, 11, 20, tzinfo=timezone.utc)
+    keys = index.list_keys(PREFIX, start, end)
+    assert len(keys) == 4
+    assert index.count(PREFIX, start, end) == 4
+    assert index.count_by_hour(PREFIX) == [
+        ("2022-04-15 10:00", 6, 60),
+        ("2022-04-15 11:00", 3, 3),
+    ]
+
+
+def test_sync_persisted(tmp_path):
+    s3 = StubS3Client()
+    s3.put(make_key(PREFIX, datetime(2022, 4, 15, 10), 1), b"x")
+    path = str(tmp_path / "manifest.sqlite")
+    index = ManifestIndex(path)
+    index.sync(s3, "bucket", PREFIX)
+    index.close()
+
+    s3.put(make_key(PREFIX, datetime(2022, 4, 15, 11), 2), b"x")
+    index = ManifestIndex(path)
+    assert index.sync(s3, "bucket", PREFIX) == 1
+    assert index.count(PREFIX) == 2
+
+
+def test_sync_out_of_order():
+    s3 = StubS3Client()
+    prefix = "to-s3/03-success/"
+    s3.put(make_key(prefix + "00/", datetime(2022, 4, 15, 10, 5), 1), b"x")
+    s3.put(make_key(prefix + "01/", datetime(2022, 4, 15, 10, 5), 2), b"x")
+    index = ManifestIndex()
+    assert index.sync(s3, "bucket", prefix) == 2
+    assert sorted(index.sub_prefix_cursors(prefix)) == [prefix + "00/", prefix + "01/"]
+
+    # a new object in the fan-out folder 00/ sorts before the last key in 01/,
+    # a late buffer lands in the folder of the previous hour
+    s3.put(make_key(prefix + "00/", datetime(2022, 4, 15, 10, 7), 3), b"x")
+    s3.put(make_key(prefix + "01/", datetime(2022, 4, 15, 11, 1), 4), b"x")
+    assert index.sync(s3, "bucket", prefix) == 2
+    s3.put(make_key(prefix + "01/", datetime(2022, 4, 15, 10, 59), 5), b"x")
+    # a new fan-out folder
+    s3.put(make_key(prefix + "02/", datetime(2022, 4, 15, 11, 2), 6), b"x")
+    assert index.sync(s3, "bucket", prefix) == 2
+    assert index.sync(s3, "bucket", prefix) == 0
+    assert index.count(prefix) == 6
+    assert index.last_key(prefix) == make_key(prefix + "02/", datetime(2022, 4, 15, 11, 2), 6)
+
+
+def test_sync_from_inventory():
+    s3 = StubS3Client()
+    keys = [make_key(PREFIX, datetime(2022, 4, 15, 10, i), i) for i in range(3)]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for key in keys:
+        writer.writerow(["bucket", key.replace("/", "%2F"), "100", "2022-04-15T10:10:00.000Z"])
+    writer.writerow(["bucket", "to-oss/01-backup/x", "1", "2022-04-15T10:10:00.000Z"])
+    s3.put("inventory/data/1.csv.gz", gzip.compress(buffer.getvalue().encode("utf-8")))
+    s3.put("inventory/manifest.json", json.dumps({
+        "fileFormat": "CSV",
+        "fileSchema": "Bucket, Key, Size, LastModifiedDate",
+        "files": [{"key": "inventory/data/1.csv.gz"}],
+    }).encode("utf-8"))
+
+    index = ManifestIndex()
+    assert index.sync_from_inventory(s3, "bucket", "inventory/manifest.json", [PREFIX]) == 3
+    assert index.list_keys(PREFIX) == keys
+    assert index.total_size(PREFIX) == 300
+    # a later sync continues after the inventory
+    assert index.last_key(PREFIX) == keys[-1]
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from kds_example import oss_utils
+from kds_example.schema import bank_account_index_body
+
+
+class FakeIndices:
+    def __init__(self):
+        self.docs = dict()  # index -> {id: doc}
+        self.settings = dict()
+        self.aliases = dict()  # alias -> {index: is_write_index}
+        self.write_index_settings = list()  # settings of an index made write index
+
+    def create(self, index, body):
+        assert index not in self.docs
+        self.docs[index] = dict()
+        self.settings[index] = oss_utils.flat_index_settings(body.get("settings", {}))
+        for alias, options in body.get("aliases", {}).items():
+            self.aliases.setdefault(alias, dict())[index] = options.get("is_write_index", False)
+
+    def delete(self, index, ignore=None):
+        self.docs.pop(index, None)
+        for indices in self.aliases.values():
+            indices.pop(index, None)
+
+    def exists_alias(self, name):
+        return bool(self.aliases.get(name))
+
+    def get_alias(self, name):
+        return {
+            index: {"aliases": {name: {"is_write_index": is_write}}}
+            for index, is_write in self.aliases[name].items()
+        }
+
+    def update_aliases(self, body):
+        for action in body["actions"]:
+            (op, params), = action.items()
+            if op == "add":
+                self.aliases.setdefault(params["alias"], dict())[params["index"]] = params["is_write_index"]
+                if params["is_write_index"]:
+                    self.write_index_settings.append(dict(self.settings[params["index"]]))
+            elif op == "remove":
+                del self.aliases[params["alias"]][params["index"]]
+            elif op == "remove_index":
+                self.delete(params["index"])
+
+    def put_settings(self, index, body):
+        self.settings[index].update(oss_utils.flat_index_settings(body))
+
+    def refresh(self, index):
+        pass
+
+
+class FakeTasks:
+    def __init__(self):
+        self.tasks = dict()
+
+    def get(self, task_id):
+        task = self.tasks[task_id]
+        task["polls"] -= 1
+        if task["polls"] > 0:
+            return {"completed": False, "task": {"status": {"created": 0}}}
+        return {"completed": True, "task": {"status": task["response"]}, "response": task["response"]}
+
+
+class FakeOpenSearchClient:
+    def __init__(self):
+        self.indices = FakeIndices()
+        self.tasks = FakeTasks()
+        self.searches = list()
+
+    def resolve(self, name: str, write: bool = False):
+        if name in self.indices.aliases:
+            indices = self.indices.aliases[name]
+            if write:
+                return [index for index, is_write in indices.items() if is_write]
+            return list(indices)
+        return name.split(",")
+
+    def index(self, index, id, body):
+        target, = self.resolve(index, write=True)
+        self.indices.docs[target][id] = body
+
+    def count(self, index):
+        return sum(len(self.indices.docs[name]) for name in self.resolve(index))
+
+    def reindex(self, body, slices, wait_for_completion):
+        assert wait_for_completion is False
+        dest = self.indices.docs[body["dest"]["index"]]
+        created = 0
+        for source in body["source"]["index"].split(","):
+            for id, doc in self.indices.docs[source].items():
+                if body["dest"]["op_type"] == "create" and id in dest:
+                    continue
+                dest[id] = doc
+                created += 1
+        task_id = f"node:{len(self.tasks.tasks)}"
+        self.tasks.tasks[task_id] = {"polls": 3, "response": {"created": created, "failures": []}}
+        return {"task": task_id}
+
+    def search(self, index, body, routing=None):
+        self.searches.append({"index": index, "body": body, "routing": routing})
+        return {"hits": {"hits": []}}
+
+
+def test_flat_index_settings():
+    assert oss_utils.flat_index_settings({
+        "number_of_replicas": 2,
+        "index.default_pipeline": "p",
+        "index": {"refresh_interval": "1s", "blocks": {"write": True}},
+    }) == {
+        "index.number_of_replicas": 2,
+        "index.default_pipeline": "p",
+        "index.refresh_interval": "1s",
+        "index.blocks.write": True,
+    }
+
+
+def test_reset_index():
+    oss = FakeOpenSearchClient()
+    first = oss_utils.create_index_with_alias(oss, "bank_account", bank_account_index_body)
+    assert first.startswith("bank_account-")
+    for i in range(10):
+        oss.index(index="bank_account", id=str(i), body={"id": str(i)})
+    assert oss.count("bank_account") == 10
+
+    index, old_indices, thread = oss_utils.reset_index(oss, "bank_account", bank_account_index_body)
+    thread.join()
+    assert old_indices == [first]
+    assert oss_utils.get_alias_indices(oss, "bank_account") == [index]
+    assert oss.count("bank_account") == 0
+    assert first not in oss.indices.docs
+
+
+def test_reindex_to_new_index():
+    oss = FakeOpenSearchClient()
+    first = oss_utils.create_index_with_alias(oss, "bank_account", bank_account_index_body)
+    for i in range(10):
+        oss.index(index="bank_account", id=str(i), body={"id": str(i), "v": 1})
+
+    sleeps = list()
+    statuses = list()
+    index, old_indices, thread = oss_utils.reindex_to_new_index(
+        oss, "bank_account", bank_account_index_body,
+        poll_interval=2, progress=statuses.append, sleep=sleeps.append,
+    )
+    thread.join()
+    assert old_indices == [first]
+    assert sleeps == [2, 2]
+    assert statuses[-1]["created"] == 10
+    assert oss.count("bank_account") == 10
+    # the new index takes the live writes with its replicas and refresh
+    for settings in [oss.indices.write_index_settings[-1], oss.indices.settings[index]]:
+        assert settings["index.number_of_replicas"] == 2
+        assert "index.refresh_interval" not in settings
+        assert settings["index.default_pipeline"] == bank_account_index_body["settings"]["index.default_pipeline"]
+
+    assert oss_utils.get_write_index(oss, "bank_account") == index
+    assert oss_utils.get_write_index(oss, index) == index
+
+
+def test_wait_for_task_timeout():
+    oss = FakeOpenSearchClient()
+    oss.tasks.tasks["t"] = {"polls": 10, "response": {}}
+    with pytest.raises(TimeoutError):
+        oss_utils.wait_for_task(oss, "t", poll_interval=1, timeout=3, sleep=lambda _: None)
+
+
+def test_convert_index_to_alias():
+    oss = FakeOpenSearchClient()
+    oss.indices.create(index="bank_account", body={})
+    oss.indices.docs["bank_account"]["1"] = {"id": "1"}
+    new_index = oss_utils.convert_index_to_alias(oss, "bank_account", bank_account_index_body, sleep=lambda _: None)
+    assert "bank_account" not in oss.indices.docs
+    assert oss_utils.get_alias_indices(oss, "bank_account") == [new_index]
+    assert oss.count("bank_account") == 1
+
+
+def test_search_by_key():
+    oss = FakeOpenSearchClient()
+    oss_utils.search_by_key(oss, "bank_account", "id", "a1")
+    oss_utils.search_by_key(oss, "bank_account", "id", ["b2", "a1", "b2"], size=10)
+    oss_utils.search_by_key(oss, "bank_account", "id", "a1", routing=False)
+    first, second, third = oss.searches
+    assert first["routing"] == "a1"
+    assert first["body"]["query"] == {"bool": {"filter": [{"term": {"id": "a1"}}]}}
+    assert second["routing"] == "a1,b2"
+    assert second["body"]["size"] == 10
+    assert second["body"]["query"]["bool"]["filter"] == [{"terms": {"id": ["b2", "a1", "b2"]}}]
+    assert third["routing"] is None
+
+
+def test_aggregate_by_key():
+    oss = FakeOpenSearchClient()
+    aggs = {"balance": {"sum": {"field": "balance"}}}
+    oss_utils.aggregate_by_key(oss, "bank_account", "id", "a1", aggs)
+    search, = oss.searches
+    assert search["routing"] == "a1"
+    assert search["body"]["size"] == 0
+    assert search["body"]["aggs"] == aggs
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import pytest
+from kds_example.lbd import to_s3
+from kds_example.power_tuning import (
+    MB, make_event, cpu_share, Measurement, evaluate, recommend, combine, run_power_tuning,
+)
+
+
+def test_make_event():
+    event = make_event(0.05, seed=1)
+    size = sum(len(base64.b64decode(record["data"])) for record in event["records"])
+    assert 0.05 * MB <= size < 0.05 * MB + 10000
+    assert event["records"][0]["kinesisRecordMetadata"]["shardId"] == "shardId-000000000000"
+    response = to_s3.handler(event, None)
+    assert {record["result"] for record in response["records"]} == {"Ok"}
+
+
+def test_evaluate():
+    assert cpu_share(1769) == cpu_share(3008) == 1.0
+    measurement = Measurement(
+        handler_name="h", buffer_size_in_mb=3, n_records=10000,
+        cpu_seconds=0.5, wall_seconds=0.5, peak_memory_mb=100,
+    )
+    r128, r1769, r3008 = [evaluate(measurement, memory_mb) for memory_mb in [128, 1769, 3008]]
+    assert r1769.duration_seconds == pytest.approx(0.5)
+    assert r128.duration_seconds == pytest.approx(0.5 * 1769 / 128)
+    # no more CPU above 1769 MB, same duration, higher cost
+    assert r3008.duration_seconds == r1769.duration_seconds
+    assert r3008.cost_per_gb > r1769.cost_per_gb
+    assert not r128.fits
+    assert recommend([r128, r1769, r3008]) is r1769
+    assert recommend([r128], max_duration_seconds=1) is None
+
+    combined = combine([r1769, evaluate(measurement, 1769)])
+    assert len(combined) == 1
+    assert combined[0].cost_per_gb == pytest.approx(2 * r1769.cost_per_gb)
+
+
+def test_run_power_tuning():
+    results = run_power_tuning(
+        {"to_s3": to_s3.handler},
+        memory_sizes=[256, 1024],
+        buffer_sizes=[0.02, 0.05],
+        repeat=1,
+        pin=False,
+    )
+    assert [(r.memory_mb, r.buffer_size_in_mb) for r in results] == [
+        (256, 0.02), (1024, 0.02), (256, 0.05), (1024, 0.05),
+    ]
+    assert recommend(results) is not None
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
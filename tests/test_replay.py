@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pytest
+from kds_example.fake_kinesis import FakeKinesisClient
+from kds_example.kds_helper import RateLimiter, iter_put_records_batches
+from kds_example.lbd.common import build_pipeline
+from kds_example.object_store import InMemoryObjectStore
+from kds_example.simulator import (
+    SimClock, BufferingHints, S3Destination, DeliveryStreamSimulator, PipelineSimulator,
+)
+from kds_example.replay import KeyCheckpoint, KinesisSink, ReplayEngine, make_replay_pipeline
+
+
+def test_rate_limiter():
+    now = [0.0]
+    sleeps = list()
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    limiter = RateLimiter(rate=100, clock=lambda: now[0], sleep=sleep)
+    limiter.acquire(100)  # the initial burst
+    assert sleeps == []
+    limiter.acquire(50)
+    assert sleeps == [pytest.approx(0.5)]
+
+
+def test_iter_put_records_batches():
+    kin_records = [{"Data": b"x" * 100, "PartitionKey": "k"} for _ in range(1200)]
+    assert [len(batch) for batch in iter_put_records_batches(kin_records)] == [500, 500, 200]
+    assert [len(batch) for batch in iter_put_records_batches(kin_records, max_bytes=1010 * 100)] == [500, 500, 200]
+    assert len(list(iter_put_records_batches(kin_records, max_bytes=101 * 100))) == 12
+
+
+def make_failed_objects(store: InMemoryObjectStore, n_records: int, make_record=None):
+    """
+    Run records through a delivery stream whose lambda always fails.
+    """
+    make_record = make_record or (lambda i: {"id": str(i)})
+    clock = SimClock(start=1650000000)
+    client = FakeKinesisClient(clock=clock)
+    client.create_stream(StreamName="s", ShardCount=1)
+    client.put_records(StreamName="s", Records=[
+        {"Data": (json.dumps(make_record(i)) + "\n").encode("utf-8"), "PartitionKey": str(i)}
+        for i in range(n_records)
+    ])
+
+    def broken_handler(event, context):
+        raise RuntimeError("bug")
+
+    delivery_stream = DeliveryStreamSimulator(
+        name="to-s3",
+        destination=S3Destination(store, "to-s3/03-success/", "to-s3/04-failed/", BufferingHints(0.001, 60)),
+        processor=broken_handler,
+        processor_hints=BufferingHints(0.001, 60),
+    )
+    PipelineSimulator(client, "s", [delivery_stream], clock).drain()
+
+
+def test_replay_to_kinesis(tmp_path):
+    store = InMemoryObjectStore()
+    make_failed_objects(store, n_records=300)
+    keys = store.list_keys("to-s3/04-failed/")
+    assert len(keys) > 1
+
+    target = FakeKinesisClient()
+    target.create_stream(StreamName="target", ShardCount=2)
+    checkpoint_path = str(tmp_path / "checkpoint.txt")
+
+    def transform(dct):
+        dct["replayed"] = True
+        return dct
+
+    engine = ReplayEngine(
+        store=store,
+        pipeline=build_pipeline(transform),
+        sink=KinesisSink(target, "target", rate=100000),
+        checkpoint=KeyCheckpoint(checkpoint_path),
+        n_workers=4,
+        max_in_flight=2,
+    )
+    stats = engine.run_prefix("to-s3/04-failed/")
+    assert stats.objects == len(keys)
+    assert stats.records == 300
+    assert stats.records_written == 300
+
+    replayed = list()
+    for shard in target.list_shards(StreamName="target")["Shards"]:
+        iterator = target.get_shard_iterator(
+            StreamName="target", ShardId=shard["ShardId"], ShardIteratorType="TRIM_HORIZON",
+        )["ShardIterator"]
+        replayed.extend(json.loads(r["Data"]) for r in target.get_records(ShardIterator=iterator)["Records"])
+    assert sorted(int(r["id"]) for r in replayed) == list(range(300))
+    assert all(r["replayed"] for r in replayed)
+
+    # a rerun skips everything
+    engine = ReplayEngine(
+        store=store,
+        pipeline=build_pipeline(transform),
+        sink=KinesisSink(target, "target", rate=100000),
+        checkpoint=KeyCheckpoint(checkpoint_path),
+    )
+    stats = engine.run_prefix("to-s3/04-failed/")
+    assert stats.objects_skipped == len(keys)
+    assert stats.records == 0
+
+
+def read_all(client, stream_name: str) -> list:
+    records = list()
+    for shard in client.list_shards(StreamName=stream_name)["Shards"]:
+        iterator = client.get_shard_iterator(
+            StreamName=stream_name, ShardId=shard["ShardId"], ShardIteratorType="TRIM_HORIZON",
+        )["ShardIterator"]
+        records.extend(json.loads(r["Data"]) for r in client.get_records(ShardIterator=iterator)["Records"])
+    return records
+
+
+def test_replay_traced_records():
+    # the replayed items have no firehose event record to stamp the trace from
+    store = InMemoryObjectStore()
+    trace = {"id": "t", "produced_at": 1650000000000}
+    make_failed_objects(store, n_records=20, make_record=lambda i: {"id": str(i), "trace": trace})
+    for pipeline in [make_replay_pipeline("kinesis"), build_pipeline(lambda dct: dct)]:
+        target = FakeKinesisClient()
+        target.create_stream(StreamName="target", ShardCount=1)
+        engine = ReplayEngine(
+            store=store,
+            pipeline=pipeline,
+            sink=KinesisSink(target, "target", rate=100000),
+        )
+        stats = engine.run_prefix("to-s3/04-failed/")
+        assert stats.records_written == 20
+        replayed = read_all(target, "target")
+        assert sorted(int(r["id"]) for r in replayed) == list(range(20))
+        # the original trace is kept as is
+        assert all(r["trace"] == trace for r in replayed)
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
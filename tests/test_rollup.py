@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+from kds_example.object_store import InMemoryObjectStore
+from kds_example.manifest import ManifestIndex
+from kds_example.rollup import (
+    HOUR_MS,
+    segment_of,
+    Bucket,
+    RollupState,
+    RollupJob,
+    can_use_rollup,
+    balance_totals,
+)
+
+# 2022-01-01 00:00:00 UTC
+T0 = 1640995200
+
+
+def firehose_key(hour: int, minute: int, n: int) -> str:
+    return (
+        f"to-s3/03-success/2022/01/01/{hour:02d}/"
+        f"kds-to-s3-1-2022-01-01-{hour:02d}-{minute:02d}-00-"
+        f"{n:08d}-0000-0000-0000-000000000000"
+    )
+
+
+def ndjson(balances) -> bytes:
+    return "".join(json.dumps({"id": str(i), "balance": b}) + "\n" for i, b in enumerate(balances)).encode("utf-8")
+
+
+class FakeSink:
+    def __init__(self):
+        self.docs = dict()
+        self.watermark = None
+
+    def write(self, buckets):
+        for bucket in buckets:
+            self.docs[bucket.id] = bucket.to_doc()
+        return 0
+
+    def set_watermark(self, watermark):
+        self.watermark = watermark
+
+
+def test_segment_of():
+    assert segment_of(-1) == "overdrawn"
+    assert segment_of(0) == "standard"
+    assert segment_of(10000) == "premium"
+    assert segment_of(100000) == "private"
+
+
+def test_rollup_job(tmp_path):
+    store = InMemoryObjectStore()
+    store.put_object(firehose_key(0, 10, 1), ndjson([100, 200, -5]))
+    store.put_object(firehose_key(0, 40, 2), ndjson([300, 20000]))
+    store.put_object("to-s3/03-success/not-a-firehose-object", b"")
+    sink = FakeSink()
+    path = str(tmp_path / "state.json")
+    stats = RollupJob(store, sink, RollupState(path), batch_size=1).run()
+    assert stats.objects == 2
+    assert stats.objects_skipped == 1
+    assert stats.records == 5
+    hour = T0 * 1000
+    assert sink.docs[f"{hour}-standard"] == {
+        "id": f"{hour}-standard", "hour": hour, "segment": "standard",
+        "count": 3, "balance_sum": 600, "balance_min": 100, "balance_max": 300,
+    }
+    assert sink.docs[f"{hour}-overdrawn"]["count"] == 1
+    # the newest object is 00:40, the hour 00 may still get objects
+    assert sink.watermark == hour
+
+    # incremental, only the new object is read and its buckets rewritten
+    store.put_object(firehose_key(1, 20, 3), ndjson([400]))
+    store.put_object(firehose_key(0, 50, 4), ndjson([50]))
+    sink = FakeSink()
+    stats = RollupJob(store, sink, RollupState(path)).run()
+    assert stats.objects == 2
+    assert stats.objects_skipped == 3
+    assert set(sink.docs) == {f"{hour}-standard", f"{hour + HOUR_MS}-standard"}
+    assert sink.docs[f"{hour}-standard"]["count"] == 4
+    assert sink.docs[f"{hour}-standard"]["balance_min"] == 50
+    assert sink.watermark == hour + HOUR_MS
+    # the done keys before the watermark are pruned
+    state = RollupState(path)
+    assert state.done == {firehose_key(1, 20, 3)}
+
+    # the objects before the watermark are skipped even if not done
+    store.put_object(firehose_key(0, 55, 5), ndjson([60]))
+    sink = FakeSink()
+    stats = RollupJob(store, sink, state).run()
+    assert stats.objects == 0
+    assert sink.docs == dict()
+
+
+def test_rollup_job_manifest():
+    store = InMemoryObjectStore()
+    manifest = ManifestIndex()
+
+    def put_object(key, body):
+        store.put_object(key, body)
+        manifest.add_objects("to-s3/03-success/", [(key, len(body), None)])
+
+    # fan-out sub folders, listed in key order 00/ is before 01/
+    put_object(firehose_key(0, 10, 1).replace("success/", "success/01/"), ndjson([100]))
+    put_object(firehose_key(1, 30, 2).replace("success/", "success/00/"), ndjson([200]))
+    put_object(firehose_key(2, 20, 3).replace("success/", "success/00/"), ndjson([300]))
+    sink = FakeSink()
+    state = RollupState()
+    job = RollupJob(store, sink, state, batch_size=1, manifest=manifest)
+    stats = job.run()
+    assert stats.objects == 3
+    assert state.watermark == T0 * 1000 + 2 * HOUR_MS
+    assert state.done == {firehose_key(2, 20, 3).replace("success/", "success/00/")}
+
+    # only the objects since the watermark are read from the manifest
+    put_object(firehose_key(2, 40, 4).replace("success/", "success/01/"), ndjson([400]))
+    assert len(job.list_keys()) == 2
+    stats = job.run()
+    assert (stats.objects, stats.objects_skipped) == (1, 1)
+    assert sink.docs[f"{T0 * 1000 + 2 * HOUR_MS}-standard"]["count"] == 2
+
+
+def test_bucket_merge():
+    bucket = Bucket(0, "standard")
+    other = Bucket(0, "standard")
+    bucket.merge(other)
+    assert bucket.balance_min is None
+    other.add(5)
+    other.add(7)
+    bucket.merge(other)
+    assert (bucket.count, bucket.balance_sum, bucket.balance_min, bucket.balance_max) == (2, 12, 5, 7)
+
+
+def test_can_use_rollup():
+    watermark = 10 * HOUR_MS
+    assert can_use_rollup(2 * HOUR_MS, 5 * HOUR_MS, watermark) is True
+    assert can_use_rollup(None, watermark, watermark) is True
+    assert can_use_rollup(2 * HOUR_MS, 11 * HOUR_MS, watermark) is False
+    assert can_use_rollup(2 * HOUR_MS + 1, 5 * HOUR_MS, watermark) is False
+    assert can_use_rollup(2 * HOUR_MS, None, watermark) is False
+    assert can_use_rollup(2 * HOUR_MS, 5 * HOUR_MS, None) is False
+
+
+class FakeIndices:
+    def get_mapping(self, index):
+        return {"rollup-1": {"mappings": {"_meta": {"watermark": 10 * HOUR_MS}}}}
+
+
+class FakeOpenSearchClient:
+    def __init__(self):
+        self.indices = FakeIndices()
+        self.searches = list()
+
+    def search(self, index, body):
+        self.searches.append(index)
+        if index == "raw":
+            return {"aggregations": {"segment": {"buckets": {
+                "overdrawn": {"doc_count": 0, "balance": {"sum": 0, "min": None, "max": None}},
+                "standard": {"doc_count": 2, "balance": {"sum": 30.0, "min": 10.0, "max": 20.0}},
+            }}}}
+        return {"aggregations": {"segment": {"buckets": [
+            {
+                "key": "standard",
+                "count": {"value": 2.0},
+                "balance_sum": {"value": 30.0},
+                "balance_min": {"value": 10.0},
+                "balance_max": {"value": 20.0},
+            },
+        ]}}}
+
+
+def test_balance_totals():
+    oss = FakeOpenSearchClient()
+    expected = {"standard": {"count": 2, "balance_sum": 30, "balance_min": 10.0, "balance_max": 20.0}}
+    totals = balance_totals(oss, "raw", "rollup", start=0, end=5 * HOUR_MS)
+    assert totals.source == "rollup"
+    assert totals.segments == expected
+    totals = balance_totals(oss, "raw", "rollup")
+    assert totals.source == "raw"
+    assert totals.segments == expected
+    assert oss.searches == ["rollup", "raw"]
+    with pytest.raises(ValueError):
+        balance_totals(oss, "raw", "rollup", start=0, end=11 * HOUR_MS)
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
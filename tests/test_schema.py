@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from kds_example.schema import (
+    Field,
+    MappingProfile,
+    to_mapping,
+    make_index_body,
+    bank_account_schema,
+    bank_account_index_body,
+    bank_account_id_pipeline_body,
+    bank_account_routed_index_body,
+    bank_account_routing_pipeline_body,
+    DOCUMENT_ID_PIPELINE_NAME,
+    ROUTING_PIPELINE_NAME,
+)
+from kds_example.tracing import TRACE_FIELD, TRACE_PIPELINE_NAME
+
+
+def test_to_mapping():
+    assert to_mapping(bank_account_schema) == {
+        "properties": {
+            "id": {"type": "keyword"},
+            "firstname": {"type": "keyword"},
+            "lastname": {"type": "keyword"},
+            "balance": {"type": "integer"},
+            "description": {"type": "text"},
+        }
+    }
+
+    mapping = to_mapping(
+        bank_account_schema,
+        MappingProfile(routing_field="id", aggregation_only=["balance"], no_scoring=["description"]),
+    )
+    assert mapping["_routing"] == {"required": True}
+    assert mapping["properties"]["balance"] == {"type": "integer", "index": False}
+    assert mapping["properties"]["description"] == {"type": "text", "norms": False}
+    assert mapping["properties"]["id"] == {"type": "keyword"}
+
+    schema = {"id": Field("keyword"), "description": Field("text")}
+    with pytest.raises(ValueError):
+        to_mapping(schema, MappingProfile(aggregation_only=["description"]))
+    with pytest.raises(ValueError):
+        to_mapping(schema, MappingProfile(no_scoring=["id"]))
+    with pytest.raises(ValueError):
+        to_mapping(schema, MappingProfile(routing_field="account_id"))
+    with pytest.raises(ValueError):
+        to_mapping(schema, MappingProfile(id_field="record_id"))
+
+
+def test_make_index_body():
+    body = make_index_body(bank_account_schema, number_of_shards=3, number_of_replicas=0)
+    assert body["settings"] == {
+        "number_of_shards": 3,
+        "number_of_replicas": 0,
+        "index.default_pipeline": TRACE_PIPELINE_NAME,
+    }
+    assert TRACE_FIELD in body["mappings"]["properties"]
+
+    # the firehose documents get the record id as _id
+    assert bank_account_index_body["settings"]["index.final_pipeline"] == DOCUMENT_ID_PIPELINE_NAME
+    assert bank_account_id_pipeline_body["processors"] == [
+        {"set": {"field": "_id", "value": "{{{id}}}"}},
+    ]
+
+    settings = bank_account_routed_index_body["settings"]
+    assert settings["index.default_pipeline"] == TRACE_PIPELINE_NAME
+    assert settings["index.final_pipeline"] == ROUTING_PIPELINE_NAME
+    assert bank_account_routing_pipeline_body["processors"] == [
+        {"set": {"field": "_id", "value": "{{{id}}}"}},
+        {"set": {"field": "_routing", "value": "{{{id}}}"}},
+    ]
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import pytest
+from kds_example.avro import compile_encoder, compile_decoder
+from kds_example.codec import compress
+from kds_example.schema import bank_account_schema
+from kds_example.schema_registry import (
+    SchemaRegistry, get_default_registry, to_avro_schema, is_binary, loads,
+)
+from kds_example.lbd.pipeline import decode
+
+
+def test_avro():
+    schema = {
+        "type": "record",
+        "name": "r",
+        "fields": [
+            {"name": "a", "type": "long"},
+            {"name": "b", "type": "double"},
+            {"name": "c", "type": "boolean"},
+            {"name": "d", "type": ["null", "string"]},
+            {"name": "e", "type": "bytes"},
+            {"name": "f", "type": "int"},
+        ],
+    }
+    encode, decode_ = compile_encoder(schema), compile_decoder(schema)
+    for a in [0, -1, 1, 63, -64, 64, 2 ** 40, -2 ** 63]:
+        record = {"a": a, "b": 1.5, "c": True, "d": "中文", "e": b"\x00\x01", "f": 2 ** 31 - 1}
+        assert decode_(encode(record)) == record
+    # the avro spec examples, zigzag varint
+    assert encode({"a": -64, "b": 0.0, "c": False, "e": b"", "f": 0})[:1] == b"\x7f"
+    # missing optional fields are decoded as None, like the JSON records
+    assert decode_(encode({"a": 1, "b": 0.0, "c": False, "e": b"", "f": -2 ** 31})) == {
+        "a": 1, "b": 0.0, "c": False, "d": None, "e": b"", "f": -2 ** 31,
+    }
+
+    with pytest.raises(ValueError):
+        encode({"a": 1, "b": 0.0, "c": False, "e": b"", "f": 0, "unknown": 1})
+    with pytest.raises(ValueError):
+        encode({"a": "1", "b": 0.0, "c": False, "e": b"", "f": 0})
+    # int is 32 bits, long is 64 bits
+    for f in [2 ** 31, -2 ** 31 - 1, 2 ** 40]:
+        with pytest.raises(ValueError):
+            encode({"a": 1, "b": 0.0, "c": False, "e": b"", "f": f})
+    with pytest.raises(ValueError):
+        encode({"a": 2 ** 63, "b": 0.0, "c": False, "e": b"", "f": 0})
+
+
+def test_registry(tmp_path):
+    registry = SchemaRegistry(root=tmp_path)
+    v1 = registry.register("bank_account", to_avro_schema("bank_account", bank_account_schema))
+    assert (v1.id, v1.version) == (1, 1)
+    # same schema, same version
+    assert registry.register("bank_account", v1.avro_schema) is v1
+    v2_schema = to_avro_schema("bank_account", bank_account_schema)
+    v2_schema["fields"].append({"name": "vip", "type": ["null", "boolean"], "default": None})
+    v2 = registry.register("bank_account", v2_schema)
+    assert (v2.id, v2.version) == (2, 2)
+
+    # reload from the files
+    registry = SchemaRegistry(root=tmp_path)
+    assert registry.versions("bank_account") == [1, 2]
+    assert registry.get("bank_account").id == 2
+    record = {"id": "a", "firstname": "f", "lastname": "l", "balance": -10}
+    data_v1 = registry.encode(record, "bank_account", version=1)
+    data_v2 = registry.encode(dict(record, vip=True), "bank_account")
+    assert is_binary(data_v1)
+    # old versions still decode
+    # the optional fields not sent are None
+    assert registry.decode(data_v1) == dict(record, description=None, trace=None)
+    assert registry.decode(data_v2) == dict(record, description=None, trace=None, vip=True)
+    with pytest.raises(KeyError):
+        registry.get("bank_account", version=3)
+
+
+def test_default_registry():
+    # register a new version after changing kds_example/schema.py, run
+    # python -m kds_example.schema_registry
+    registered = get_default_registry().get("bank_account")
+    assert registered.avro_schema == to_avro_schema("bank_account", bank_account_schema)
+
+    record = {
+        "id": "7e9a9a5c-4f3a-4a55-9d4e-7a2f2e1c3b6d",
+        "firstname": "Jerry",
+        "lastname": "Snyder",
+        "description": "Mrs air in wife financial within live pull artist back.",
+        "balance": 1000,
+        "trace": {"id": "abc", "produced_at": 1650000000000},
+    }
+    data = registered.encode(record)
+    assert loads(data) == record
+    assert loads(b'{"id": "1"}\n') == {"id": "1"}
+    # the pipeline decode stage takes binary records, compressed or not
+    assert decode(base64.b64encode(data).decode("utf-8")) == record
+    assert decode(base64.b64encode(compress(data)).decode("utf-8")) == record
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pytest
+from kds_example.fake_kinesis import FakeKinesisClient
+from kds_example.kds_helper import make_fan_out_client
+from kds_example.fan_out import fan_out_names
+from kds_example.lbd.to_s3 import handler as to_s3_handler
+from kds_example.object_store import InMemoryObjectStore, LocalObjectStore
+from kds_example.simulator import (
+    SimClock, BufferingHints, FakeOpenSearch,
+    S3Destination, DeliveryStreamSimulator, PipelineSimulator, build_stack_simulator,
+)
+
+
+def make_stream(clock, n_shards=4):
+    client = FakeKinesisClient(clock=clock)
+    client.create_stream(StreamName="s", ShardCount=n_shards)
+    return client
+
+
+def put(client, records):
+    client.put_records(
+        StreamName="s",
+        Records=[
+            {"Data": (json.dumps(record) + "\n").encode("utf-8"), "PartitionKey": str(i)}
+            for i, record in enumerate(records)
+        ],
+    )
+
+
+def count_lines(store, prefix):
+    return sum(store.get_object(key).count(b"\n") for key in store.list_keys(prefix))
+
+
+def test_stack_simulator():
+    clock = SimClock(start=1650000000)
+    client = make_stream(clock)
+    store = InMemoryObjectStore()
+    oss = FakeOpenSearch()
+    sim = build_stack_simulator(client, "s", store, oss, clock)
+
+    valid = [
+        {"id": f"id-{i}", "firstname": "A", "lastname": "B", "balance": i}
+        for i in range(100)
+    ]
+    invalid = [{"id": f"bad-{i}", "balance": i} for i in range(5)]
+    put(client, valid + invalid)
+
+    # nothing is delivered before the 60 sec buffer interval
+    sim.advance(30)
+    assert store.list_keys() == []
+    assert oss.count("bank_account") == 0
+
+    # lambda buffer flushes at 60 sec, the destination buffer 60 sec later
+    sim.advance(130)
+    assert count_lines(store, "to-s3/01-backup/") == 105
+    assert count_lines(store, "to-s3/03-success/") == 105
+    assert count_lines(store, "to-s3/04-failed/") == 0
+    assert oss.count("bank_account") == 100
+    assert count_lines(store, "to-oss/01-backup/") == 100
+    assert count_lines(store, "to-oss/02-backup-failed/processing-failed/") == 5
+
+    key = store.list_keys("to-s3/03-success/")[0]
+    assert key.startswith("to-s3/03-success/2022/04/15/")
+    assert key.split("/")[-1].startswith("to-s3-1-2022-04-15-")
+
+    summary = sim.summary()
+    assert summary["to-oss"]["records_processing_failed"] == 5
+    assert summary["to-oss"]["docs_indexed"] == 100
+
+
+def test_stack_simulator_fan_out():
+    clock = SimClock(start=1650000000)
+    client = FakeKinesisClient(clock=clock)
+    for name in fan_out_names("s", 3):
+        client.create_stream(StreamName=name, ShardCount=2)
+    store = InMemoryObjectStore()
+    oss = FakeOpenSearch()
+    sim = build_stack_simulator(client, "s", store, oss, clock, fan_out=3)
+    put(make_fan_out_client(client, 3), [
+        {"id": f"id-{i}", "firstname": "A", "lastname": "B", "balance": i}
+        for i in range(200)
+    ])
+    sim.drain()
+
+    # every record is routed to one data stream and delivered once
+    assert count_lines(store, "to-s3/03-success/") == 200
+    assert count_lines(store, "to-s3/01-backup/") == 200
+    assert oss.count("bank_account") == 200
+    assert count_lines(store, "to-oss/01-backup/") == 200
+    summary = sim.summary()
+    assert sorted(summary) == [
+        "to-oss-00of03", "to-oss-01of03", "to-oss-02of03",
+        "to-s3-00of03", "to-s3-01of03", "to-s3-02of03",
+    ]
+    for i in range(3):
+        n_lines = count_lines(store, f"to-s3/03-success/{i:02d}/")
+        assert 0 < n_lines < 200
+        assert count_lines(store, f"to-s3/01-backup/{i:02d}/") == n_lines
+
+
+def test_retries_and_failed_invocations(tmp_path):
+    clock = SimClock(start=1650000000)
+    client = make_stream(clock, n_shards=1)
+    store = LocalObjectStore(str(tmp_path))
+    calls = list()
+
+    def flaky_handler(event, context):
+        calls.append(len(event["records"]))
+        if len(calls) == 1:
+            raise RuntimeError("cold start failure")
+        return to_s3_handler(event, context)
+
+    def broken_handler(event, context):
+        raise RuntimeError("always fails")
+
+    def make_delivery_stream(name, handler):
+        return DeliveryStreamSimulator(
+            name=name,
+            destination=S3Destination(store, f"{name}/ok/", f"{name}/failed/", BufferingHints(1, 10)),
+            processor=handler,
+            processor_hints=BufferingHints(1, 10),
+            number_of_retries=1,
+        )
+
+    sim = PipelineSimulator(
+        client, "s",
+        [make_delivery_stream("flaky", flaky_handler), make_delivery_stream("broken", broken_handler)],
+        clock,
+    )
+    put(client, [{"id": i} for i in range(10)])
+    sim.drain()
+
+    assert calls == [10, 10]
+    assert count_lines(store, "flaky/ok/") == 10
+    assert count_lines(store, "broken/ok/") == 0
+    failed_keys = store.list_keys("broken/failed/processing-failed/")
+    error_records = [json.loads(line) for line in store.get_object(failed_keys[0]).splitlines()]
+    assert len(error_records) == 10
+    assert error_records[0]["errorCode"] == "Lambda.FunctionError"
+    assert error_records[0]["attemptsMade"] == 2
+    summary = sim.summary()
+    assert summary["broken"]["invocation_errors"] == 2
+
+
+def test_buffer_size_flush():
+    clock = SimClock(start=1650000000)
+    client = make_stream(clock, n_shards=2)
+    store = InMemoryObjectStore()
+    delivery_stream = DeliveryStreamSimulator(
+        name="d",
+        destination=S3Destination(store, "ok/", "failed/", BufferingHints(size_in_mb=0.01, interval_in_sec=900)),
+    )
+    sim = PipelineSimulator(client, "s", [delivery_stream], clock)
+    put(client, [{"id": i, "description": "x" * 1000} for i in range(50)])
+    sim.poll()
+    # about 50 KB with a 10 KB buffer, flushed by size without waiting
+    assert 4 <= len(store.list_keys("ok/")) <= 5
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import json
+import base64
+import pytest
+from kds_example import tracing
+from kds_example.lbd.common import build_pipeline
+
+
+def test_stamp_data():
+    data = (json.dumps({"id": "a", "balance": 1}) + "\n").encode("utf-8")
+    stamped = tracing.stamp_data(data, trace_id="t1", now=1000)
+    assert stamped.endswith(b"}\n")
+    record = json.loads(stamped)
+    assert record["id"] == "a"
+    assert record["trace"] == {"id": "t1", "produced_at": 1000}
+
+
+def test_pipeline_stamps_traced_records():
+    records = [
+        tracing.stamp({"id": "a", "balance": 1}, trace_id="t1", now=1000),
+        {"id": "b", "balance": 1},
+    ]
+    event = {
+        "records": [
+            {
+                "recordId": str(i),
+                "approximateArrivalTimestamp": 1500,
+                "kinesisRecordMetadata": {"approximateArrivalTimestamp": 1100},
+                "data": base64.b64encode(json.dumps(record).encode("utf-8")).decode("utf-8"),
+            }
+            for i, record in enumerate(records)
+        ]
+    }
+    res = build_pipeline(lambda dct: dct).handle(event)
+    outputs = [json.loads(base64.b64decode(record["data"])) for record in res["records"]]
+    trace = outputs[0]["trace"]
+    assert trace["arrived_at"] == 1100
+    assert trace["read_at"] == 1500
+    assert trace["transformed_at"] >= 1500
+    assert "trace" not in outputs[1]
+
+
+def test_summarize():
+    traces = [
+        {
+            "produced_at": 1000 + i,
+            "arrived_at": 1010 + i,
+            "read_at": 1050 + i,
+            "transformed_at": 1100 + i,
+            "delivered_at": 1100 + i + 10 * i,
+        }
+        for i in range(100)
+    ]
+    # a trace without delivery only counts in the first hops
+    traces.append({"produced_at": 0, "arrived_at": 10})
+    summary = tracing.summarize(traces)
+    assert summary["producer_to_stream"]["count"] == 101
+    assert summary["producer_to_stream"]["max"] == 10
+    assert summary["stream_to_firehose"]["p50"] == 40
+    assert summary["end_to_end"]["count"] == 100
+    assert summary["end_to_end"]["max"] == 100 + 990
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+Locust load test of the kinesis data stream.
+
+Each simulated user sends ``PutRecords`` requests with the record shape of
+``data_producer/multi_process_producer.py``. On top of the locust request
+statistics it:
+
+- counts the records accepted per shard (``ShardId`` of each result entry),
+  workers send their counts to the master with every stats report.
+- prints p50 / p95 / p99 latency and records / sec per shard at the end.
+- stops the test when the ratio of throttled records over the last
+  ``--throttle-window`` seconds exceeds ``--max-throttle-rate``, which is
+  the saturation point of the stream.
+
+Run it with ``bin/08-run-load-test.sh``, or by hand::
+
+    # single process
+    locust -f tests_load/locustfile.py --headless --users 100 --spawn-rate 10
+
+    # distributed, one master and one worker per CPU on every load gen node
+    locust -f tests_load/locustfile.py --master --headless --users 500 --spawn-rate 20 --expect-workers 8
+    locust -f tests_load/locustfile.py --worker --master-host 10.0.0.1
+"""
+
+import json
+import time
+import uuid
+from collections import deque
+
+import gevent
+from faker import Faker
+from locust import User, task, events, constant_pacing
+from locust.runners import MasterRunner, WorkerRunner
+
+THROTTLE_ERROR_CODE = "ProvisionedThroughputExceededException"
+
+# counters of this process, reset after each report to the master
+local_counts = {"shards": dict(), "sent": 0, "throttled": 0}
+# aggregated counters, on the master or in a single process run
+total_counts = {"shards": dict(), "sent": 0, "throttled": 0}
+# (timestamp, sent, throttled) samples for the sliding throttle rate
+samples = deque()
+started_at = None
+
+
+@events.init_command_line_parser.add_listener
+def _(parser):
+    parser.add_argument("--stream-name", type=str, default="", help="default to the stack's data stream")
+    parser.add_argument("--records-per-request", type=int, default=100)
+    parser.add_argument("--request-interval", type=float, default=1.0, help="seconds between two requests of a user")
+    parser.add_argument("--max-throttle-rate", type=float, default=0.05, help="stop when exceeded")
+    parser.add_argument("--throttle-window", type=float, default=30.0, help="seconds")
+
+
+def add_counts(target: dict, counts: dict):
+    for shard_id, n in counts["shards"].items():
+        target["shards"][shard_id] = target["shards"].get(shard_id, 0) + n
+    target["sent"] += counts["sent"]
+    target["throttled"] += counts["throttled"]
+
+
+def reset_counts(counts: dict):
+    counts["shards"] = dict()
+    counts["sent"] = 0
+    counts["throttled"] = 0
+
+
+class KinesisUser(User):
+    wait_time = constant_pacing(1)
+
+    def on_start(self):
+        from kds_example.boto_ses import boto_ses
+
+        options = self.environment.parsed_options
+        self.k_client = boto_ses.client("kinesis")
+        if options.stream_name:
+            self.stream_name = options.stream_name
+        else:
+            from kds_example.iac.s2_app import stack
+            from kds_example.kds_helper import make_fan_out_client
+
+            self.stream_name = stack.kinesis_data_stream_name
+            self.k_client = make_fan_out_client(self.k_client, stack.fan_out)
+        self.records_per_request = options.records_per_request
+        self.wait_time = constant_pacing(options.request_interval)
+        self.fake = Faker()
+
+    def make_records(self) -> list:
+        fake = self.fake
+        return [
+            dict(
+                Data=(json.dumps(raw_record) + "\n").encode("utf-8"),
+                PartitionKey=raw_record["id"],
+            )
+            for raw_record in [
+                {
+                    "id": str(uuid.uuid4()),
+                    "firstname": fake.first_name(),
+                    "lastname": fake.last_name(),
+                    "description": fake.sentence(nb_words=10),
+                    "balance": 0,
+                }
+                for _ in range(self.records_per_request)
+            ]
+        ]
+
+    @task
+    def put_records(self):
+        kin_records = self.make_records()
+        st = time.perf_counter()
+        exception = None
+        response = None
+        try:
+            response = self.k_client.put_records(Records=kin_records, StreamName=self.stream_name)
+        except Exception as e:
+            exception = e
+        response_time = (time.perf_counter() - st) * 1000
+
+        n_throttled = 0
+        if response is not None:
+            for result in response["Records"]:
+                if "ErrorCode" in result:
+                    if result["ErrorCode"] == THROTTLE_ERROR_CODE:
+                        n_throttled += 1
+                else:
+                    shard_id = result["ShardId"]
+                    local_counts["shards"][shard_id] = local_counts["shards"].get(shard_id, 0) + 1
+            if response["FailedRecordCount"] and exception is None:
+                exception = Exception(f"{response['FailedRecordCount']} records failed")
+        local_counts["sent"] += len(kin_records)
+        local_counts["throttled"] += n_throttled
+
+        events.request.fire(
+            request_type="kinesis",
+            name="PutRecords",
+            response_time=response_time,
+            response_length=sum(len(r["Data"]) for r in kin_records),
+            exception=exception,
+            context={},
+        )
+
+
+@events.report_to_master.add_listener
+def on_report_to_master(client_id, data):
+    data["kinesis_counts"] = {
+        "shards": dict(local_counts["shards"]),
+        "sent": local_counts["sent"],
+        "throttled": local_counts["throttled"],
+    }
+    reset_counts(local_counts)
+
+
+@events.worker_report.add_listener
+def on_worker_report(client_id, data):
+    if "kinesis_counts" in data:
+        add_counts(total_counts, data["kinesis_counts"])
+
+
+def throttle_monitor(environment, interval: float = 2.0):
+    """
+    Stop the test when the throttle rate over the sliding window is too high.
+    """
+    options = environment.parsed_options
+    while True:
+        gevent.sleep(interval)
+        if not isinstance(environment.runner, MasterRunner):
+            add_counts(total_counts, local_counts)
+            reset_counts(local_counts)
+        now = time.time()
+        samples.append((now, total_counts["sent"], total_counts["throttled"]))
+        while samples and samples[0][0] < now - options.throttle_window:
+            samples.popleft()
+        _, sent_0, throttled_0 = samples[0]
+        n_sent = total_counts["sent"] - sent_0
+        n_throttled = total_counts["throttled"] - throttled_0
+        if n_sent and n_throttled / n_sent > options.max_throttle_rate:
+            print(
+                f"throttle rate {n_throttled / n_sent:.2%} over the last "
+                f"{options.throttle_window:.0f} sec exceeds {options.max_throttle_rate:.2%}, "
+                f"stream is saturated at {environment.runner.user_count} users, stopping"
+            )
+            environment.runner.quit()
+            return
+
+
+@events.test_start.add_listener
+def on_test_start(environment, **kwargs):
+    global started_at
+    started_at = time.time()
+    reset_counts(total_counts)
+    samples.clear()
+    if not isinstance(environment.runner, WorkerRunner):
+        gevent.spawn(throttle_monitor, environment)
+
+
+@events.quitting.add_listener
+def on_quitting(environment, **kwargs):
+    if isinstance(environment.runner, WorkerRunner) or started_at is None:
+        return
+    add_counts(total_counts, local_counts)
+    elapsed = time.time() - started_at
+    stats = environment.stats.get("PutRecords", "kinesis")
+    print("PutRecords latency: " + ", ".join([
+        f"p{int(q * 100)} = {stats.get_response_time_percentile(q):.0f} ms"
+        for q in [0.5, 0.95, 0.99]
+    ]))
+    print(f"throttled records: {total_counts['throttled']} / {total_counts['sent']}")
+    for shard_id, n in sorted(total_counts["shards"].items()):
+        print(f"{shard_id}: {n / elapsed:.1f} records / sec")
+    print(f"total: {sum(total_counts['shards'].values()) / elapsed:.1f} records / sec")